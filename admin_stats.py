@@ -162,14 +162,15 @@ def calculate_streak(dates_set):
 def get_moments_data_for_user(user_id):
     """获取特定用户的朋友圈数据"""
     user_configs = os.path.join(USERS_ROOT, str(user_id), "configs")
-    moments_path = os.path.join(user_configs, "moments_data.json")
-    if os.path.exists(moments_path):
-        try:
-            with open(moments_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
+    # 朋友圈已迁入 moments.db（首次访问时自动导入 moments_data.json）；两者都没有就不建库
+    if not os.path.exists(os.path.join(user_configs, "moments.db")) and \
+            not os.path.exists(os.path.join(user_configs, "moments_data.json")):
+        return []
+    try:
+        from services.moments_store import iter_all_moments
+        return iter_all_moments(user_id)
+    except Exception:
+        return []
 
 def generate_admin_stats():
     users = get_all_users()
@@ -8,7 +8,6 @@ import random
 import threading
 import uuid
 import mimetypes
-import requests
 from datetime import datetime, timedelta, time as dt_time, date
 from flask import Flask, request, jsonify, send_from_directory, send_file, render_template, session, redirect, url_for, make_response
 from dotenv import load_dotenv
@@ -22,21 +21,29 @@ from email.mime.text import MIMEText
 from email.header import Header
 from contextvars import ContextVar
 from email.utils import formataddr
-from cos_utils import upload_to_cos, get_cos_list # <--- 新增这个导入
+from cos_utils import upload_to_cos # <--- 新增这个导入
+from core.http_client import http_get, http_post
+from core.tracing import install_request_tracing, traced
+from core.chat_schema import ensure_chat_db
+from services.memory_store import (
+    get_short_events, has_short_events, append_short_events, SOURCE_GROUP, SOURCE_MOMENT,
+)
 import tempfile # <--- 记得在最上面加这个 import
 import io
 from urllib.parse import quote as url_quote, urlparse
 from werkzeug.security import generate_password_hash, check_password_hash
-import pykakasi
 from PIL import Image, ImageOps
 from agent_utils import process_agent_actions # <--- 新增动作标签处理导入
 
 # AI services (extracted from app.py)
-from services.ai_client import log_full_prompt, log_api_error, record_token_usage, get_relay_provider, call_openrouter, call_gemini, get_model_config, _get_usage_log_file
+from services.ai_client import log_full_prompt, log_api_error, record_token_usage, get_relay_provider, call_openrouter, call_gemini, get_model_config
 from services.prompt_builder import get_ai_language, get_char_name, get_char_age, _get_char_chat_mode, get_user_age, _get_sticker_allowed_descriptions
 from services.prompt_builder import build_system_prompt_v2, build_system_prompt, build_messages_for_chat_v2, build_group_relationship_prompt
 from services.prompt_builder import select_relevant_long_memory, extract_long_memory_with_timeline_ts, extract_medium_memory_with_timeline_ts, extract_short_memory_with_timeline_ts, extract_recent_messages_with_labels, build_timeline_section
 from services.memory import call_ai_to_summarize, update_short_memory_for_date
+from services import memory_sync
+from services.event_bus import notify_message
+from services.sticker_index import find_sticker_paths, resolve_sticker_content, list_official_packs, list_pack_stickers, get_pack_cover, search_stickers
 
 # Core utilities re-exported for blueprint compatibility
 from core.circuit_breaker import get_circuit_breaker_info, is_user_frozen
@@ -44,98 +51,9 @@ from core.utils import (
     load_character_positions, save_character_positions,
     load_locations, save_locations, load_user_position,
     calc_distance, get_location_by_id, get_location_at_coord,
-    get_group_dir,
-)
-
-# 初始化 kakasi (用于日语注音)
-kks = pykakasi.kakasi()
-# 常见 emoji / 表情符号范围（用于避免 pykakasi 误分词）
-EMOJI_SPLIT_RE = re.compile(
-    r'('
-    r'[\U0001F1E6-\U0001F1FF]'     # flags
-    r'|[\U0001F300-\U0001FAFF]'    # symbols & pictographs
-    r'|[\u2600-\u26FF]'            # misc symbols
-    r'|[\u2700-\u27BF]'            # dingbats
-    r'|[\uFE0F]'                   # variation selector
-    r')+'
+    get_group_dir, load_json_cached, _copy_dict,
 )
 
-def _add_furigana_to_japanese(text: str) -> str:
-    """给日语文本中的汉字注音。跳过 [表情]、[图片] 等功能性标签，保留 emoji。"""
-    if not text: return text
-    # 跳过特定的标签段落
-    pattern = r'(\[表情\][^\s/]+|\[图片\]\([^)]+\)\([\s\S]*?\)|\[recall\])'
-    parts = re.split(pattern, text)
-
-    out = ""
-    for i, part in enumerate(parts):
-        if i % 2 == 1:
-            # tag 保持原样
-            out += part
-        else:
-            # 用占位符替换 emoji，避免 pykakasi 误处理
-            emoji_map = {}
-            def replace_emoji(match):
-                emoji_key = f"__EMOJI_{len(emoji_map)}__"
-                emoji_map[emoji_key] = match.group(0)
-                return emoji_key
-
-            part_with_placeholders = re.sub(EMOJI_SPLIT_RE, replace_emoji, part)
-
-            # 按换行拆分再注音
-            line_parts = re.split(r'(\r\n|\n|\r)', part_with_placeholders)
-            for line_part in line_parts:
-                if not line_part or line_part in ("\r\n", "\n", "\r"):
-                    out += line_part
-                    continue
-
-                # 普通文本进行分词和注音
-                result = kks.convert(line_part)
-
-                # 如果分词结果拼接起来不等于原字符串，说明 pykakasi 漏掉了一些字符（常见于中文或特殊符号）
-                # 此时我们采用保守策略：如果分词结果不全，则直接原样显示
-                joined_orig = "".join((it.get("orig") or "") for it in result)
-                if joined_orig != line_part:
-                    out += line_part
-                    continue
-
-                for item in result:
-                    orig = item['orig']
-                    hira = item['hira']
-
-                    # 如果不含汉字，直接追加
-                    if not re.search(r'[\u4e00-\u9fff\u3400-\u4dbf]', orig):
-                        out += orig
-                        continue
-
-                    # 去除末尾相同的假名
-                    suf = ''
-                    while orig and hira and orig[-1] == hira[-1]:
-                        suf = orig[-1] + suf
-                        orig = orig[:-1]
-                        hira = hira[:-1]
-
-                    # 去除开头相同的假名
-                    pre = ''
-                    while orig and hira and orig[0] == hira[0]:
-                        pre += orig[0]
-                        orig = orig[1:]
-                        hira = hira[1:]
-
-                    # 如果中间有汉字，加 <ruby> 注音。
-                    # 如果 hira 为空、或与 orig 相同、或 hira 中仍包含汉字，则按原样显示
-                    has_kanji_reading = re.search(r'[\u4e00-\u9fff\u3400-\u4dbf]', hira)
-                    if orig and hira and orig != hira and not has_kanji_reading:
-                        out += f"{pre}<ruby>{orig}<rt>{hira}</rt></ruby>{suf}"
-                    else:
-                        out += pre + orig + suf
-
-            # 【新增】把 emoji 占位符替换回原始 emoji
-            for emoji_key, emoji_char in emoji_map.items():
-                out = out.replace(emoji_key, emoji_char)
-
-    return out
-
 load_dotenv()  # 从 .env 读取环境变量
 
 GEMINI_KEY = os.getenv("GEMINI_API_KEY", "")
@@ -155,9 +73,6 @@ COS_BUCKET = os.getenv('COS_BUCKET')
 COS_REGION = os.getenv('COS_REGION')
 COS_BASE_URL = f"https://{COS_BUCKET}.cos.{COS_REGION}.myqcloud.com" if COS_BUCKET and COS_REGION else ""
 
-# 表情包元数据缓存
-CACHED_OFFICIAL_PACKS = None
-
 app = Flask(__name__, static_folder='static', template_folder='templates')
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
 
@@ -172,6 +87,7 @@ from blueprints.group import group_bp
 from blueprints.views import views_bp
 from blueprints.chat import chat_bp
 from blueprints.forum import forum_bp
+from blueprints.events import events_bp
 app.register_blueprint(admin_bp)
 app.register_blueprint(map_bp)
 app.register_blueprint(media_bp)
@@ -182,6 +98,8 @@ app.register_blueprint(group_bp)
 app.register_blueprint(views_bp)
 app.register_blueprint(chat_bp)
 app.register_blueprint(forum_bp)
+app.register_blueprint(events_bp)
+install_request_tracing(app)
 
 @app.context_processor
 def inject_cos_vars():
@@ -490,38 +408,18 @@ def get_all_char_ids_for_current_user() -> list:
 
 def get_characters_config_for_current_user() -> dict:
     """返回当前用户 characters.json 的完整配置（供定时任务用）"""
-    cfg = _get_characters_config_file()
-    if not os.path.exists(cfg):
-        return {}
-    try:
-        with open(cfg, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+    return _copy_dict(load_json_cached(_get_characters_config_file(), {}))
 
 
 def get_groups_config_for_current_user() -> dict:
     """返回当前用户 groups.json 的完整配置（供定时任务用）"""
-    cfg = _get_groups_config_file()
-    if not os.path.exists(cfg):
-        return {}
-    try:
-        with open(cfg, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+    return _copy_dict(load_json_cached(_get_groups_config_file(), {}))
 
 
 def get_all_group_ids_for_current_user() -> list:
     """返回当前用户 groups.json 中的群聊 ID 列表（供定时任务用）"""
-    cfg = _get_groups_config_file()
-    if not os.path.exists(cfg):
-        return []
-    try:
-        with open(cfg, "r", encoding="utf-8") as f:
-            return list(json.load(f).keys())
-    except Exception:
-        return []
+    data = load_json_cached(_get_groups_config_file(), {})
+    return list(data.keys()) if isinstance(data, dict) else []
 MOMENTS_DATA_FILE = os.path.join(BASE_DIR, "configs", "moments_data.json")
 MOMENTS_LAST_POST_FILE = os.path.join(BASE_DIR, "configs", "moments_last_post.json")
 ACTIVE_MOMENTS_ENABLED_FILE = os.path.join(BASE_DIR, "configs", "active_moments_enabled.json")
@@ -610,36 +508,16 @@ def _sticker_content_for_ai(content: str) -> str:
 
 
 def _resolve_sticker_name_to_path(name: str) -> str:
-    """【写时随机】仅用于 LLM 输出入库前：检索名称含有该关键词的表情（如「开心」匹配 开心、开心（1）、开心一 等），在匹配结果中随机选一个 path 写入 DB。"""
-    name = (name or "").strip()
-    items = _search_stickers(name)  # 已为包含匹配：q in s["name"].lower()
-    if not items:
-        return ""
-    return random.choice(items)["path"]
+    """【写时随机】仅用于 LLM 输出入库前：在内存名称索引里找名称含有该关键词的表情（如「开心」匹配 开心、开心（1）、开心一 等），随机选一个 path 写入 DB。"""
+    paths = find_sticker_paths(name)
+    return random.choice(paths) if paths else ""
 
 
 def _sticker_content_from_ai(content: str) -> str:
-    """【写时随机】拦截 LLM 文本，将 [表情]纯名称 随机替换为 [表情]精确 path；已为 path 则放行。使用非贪婪+先行断言，避免吞掉 ' / ' 后文字。"""
-    if not content:
-        return content
-
-    # --- 【拦截器顺序调整】先处理多媒体标签，再处理表情 ---
-    # 原因：AI 回复格式如果是 "[GENERATE_IMAGE:...] / 表情"
-    # 本地表情正则 pattern = r"\[表情\](.*?)(?=\s*/\s*|$)" 可能会因为那个斜杠而误伤或导致逻辑复杂化
-    # 统一先处理自定义多媒体标签，将其转换为标准的 [图片](...) 格式
-    # 注意：这个函数内部已经实现了对 char_id 的引用，但作为全局工具函数，我们在这里无法直接获取 char_id
-    # 所以在 chat/chat_v2 路由里显式按顺序调用更安全。
-
-    if "[表情]" not in content:
-        return content
-    pattern = r"\[表情\](.*?)(?=\s*/\s*|$)"
-    def repl(m):
-        name_or_path = (m.group(1) or "").strip()
-        if name_or_path.startswith("official:") or name_or_path.startswith("user:"):
-            return m.group(0)
-        path = _resolve_sticker_name_to_path(name_or_path)
-        return f"[表情]{path}" if path else m.group(0)
-    return re.sub(pattern, repl, content)
+    """【写时随机】拦截 LLM 文本，将 [表情]纯名称 随机替换为 [表情]精确 path；已为 path 则放行。
+    多媒体标签需在此之前处理（表情正则以 ' / ' 为终止符），chat/chat_v2 路由里显式按顺序调用。
+    一条回复里的所有表情名称由 services.sticker_index 批量解析，每个名称只查一次索引。"""
+    return resolve_sticker_content(content)
 
 
 def _get_quick_phrases_file() -> str:
@@ -921,6 +799,23 @@ def init_user_workspace(user_id: int) -> None:
 init_users_db()
 init_square_db()
 migrate_single_user_data_to_default_user()
+
+# 预加载 Janome / jieba 词典（后台线程，避免首个请求承担词典加载耗时）
+from core.config import TOKENIZER_WARMUP
+if TOKENIZER_WARMUP:
+    from services.tokenizer import warm_up_tokenizers
+    warm_up_tokenizers(background=True)
+
+# 为已有 chat.db 回填聊天记录全文索引（后台线程，已建索引的库直接跳过）
+from core.config import MESSAGE_SEARCH_BACKFILL
+if MESSAGE_SEARCH_BACKFILL:
+    from services.message_search import backfill_search_indexes
+    backfill_search_indexes(background=True)
+# 旧消息里的 [表情]名称 一次性改写为 path（历史接口不再边读边写）
+from core.config import STICKER_ROW_MIGRATION
+if STICKER_ROW_MIGRATION:
+    from services.sticker_index import migrate_sticker_rows
+    migrate_sticker_rows(background=True)
 # --- 用户级配置辅助函数（API Key / 邮箱等） ---
 def _get_user_settings_file() -> str:
     """
@@ -937,16 +832,8 @@ def _get_user_settings_file() -> str:
 
 
 def _load_user_settings() -> dict:
-    """读取当前用户的设置文件，出错时返回空 dict。"""
-    path = _get_user_settings_file()
-    data: dict = {}
-    if os.path.exists(path):
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except Exception:
-            data = {}
-    return data
+    """读取当前用户的设置文件（带 mtime 缓存），出错时返回空 dict。"""
+    return _copy_dict(load_json_cached(_get_user_settings_file(), {}))
 
 
 def _save_user_settings(data: dict):
@@ -1178,14 +1065,14 @@ def _call_siliconflow_gen(prompt, char_id, user_id=None):
     }
 
     try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=60)
+        resp = http_post(url, route="image_gen", json=payload, headers=headers)
         if resp.status_code == 200:
             result = resp.json()
             temp_url = result.get("images", [{}])[0].get("url")
             if temp_url:
                 # 5. 下载并上传到 COS (持久化)
                 try:
-                    img_resp = requests.get(temp_url, timeout=30)
+                    img_resp = http_get(temp_url, route="image_download")
                     if img_resp.status_code == 200:
                         img_data = img_resp.content
                         filename = f"gen_{uuid.uuid4().hex[:8]}.jpg"
@@ -1313,7 +1200,7 @@ def _call_google_imagen_gen(prompt, char_id, user_id=None):
     headers = {"Content-Type": "application/json"}
 
     try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=90)
+        resp = http_post(url, route="imagen", json=payload, headers=headers)
         if resp.status_code == 200:
             result = resp.json()
             img_b64 = None
@@ -1383,7 +1270,7 @@ def _call_serper_search(keyword, cos_prefix="chat_images", user_id=None):
     payload = {"q": keyword, "num": 5}
 
     try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=15)
+        resp = http_post(url, route="image_search", json=payload, headers=headers)
         if resp.status_code == 200:
             images = resp.json().get("images", [])
             if images:
@@ -1398,7 +1285,7 @@ def _call_serper_search(keyword, cos_prefix="chat_images", user_id=None):
                             download_headers = {
                                 "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
                             }
-                            img_resp = requests.get(temp_url, headers=download_headers, timeout=15)
+                            img_resp = http_get(temp_url, route="image_download", headers=download_headers, timeout=15)
                             if img_resp.status_code == 200:
                                 img_data = img_resp.content
                                 filename = f"search_{uuid.uuid4().hex[:8]}.jpg"
@@ -1553,9 +1440,12 @@ def get_paths(char_id, user_id=None):
                     dst = os.path.join(char_dir, name)
                     if os.path.isdir(src):
                         if not os.path.exists(dst):
-                            shutil.copytree(src, dst)
+                            # 模板目录下的记忆库可能正被打开（WAL），不直接复制文件，下面用 backup 复制
+                            shutil.copytree(src, dst, ignore=shutil.ignore_patterns("memory.db*"))
                     else:
                         shutil.copy2(src, dst)
+                from services.memory_store import copy_memory_db
+                copy_memory_db(os.path.join(template_dir, "prompts"), os.path.join(char_dir, "prompts"))
             except Exception as e:
                 print(f"[Users] 拷贝角色模板失败 {char_id}: {e}")
     else:
@@ -1584,6 +1474,7 @@ def init_char_db(char_id):
     """)
     conn.commit()
     conn.close()
+    ensure_chat_db(db_path)
 
 from typing import Tuple
 
@@ -1650,6 +1541,7 @@ def ensure_directive_chat(directive, initiator_id):
     """)
     conn.commit()
     conn.close()
+    ensure_chat_db(db_path)
 
     memory_path = os.path.join(target_group_dir, "memory_short.json")
     with open(memory_path, "w", encoding="utf-8") as f:
@@ -1789,11 +1681,6 @@ def get_short_memory_text_for_rai(char_id, include_yesterday=True):
     """
     try:
         _, prompts_dir = get_paths(char_id)
-        short_file = os.path.join(prompts_dir, "6_memory_short.json")
-        if not os.path.exists(short_file):
-            return []
-        with open(short_file, "r", encoding="utf-8-sig") as f:
-            data = json.load(f)
         now = datetime.now()
         today_str = now.strftime("%Y-%m-%d")
         dates = [today_str]
@@ -1801,13 +1688,7 @@ def get_short_memory_text_for_rai(char_id, include_yesterday=True):
             yesterday_str = (now - timedelta(days=1)).strftime("%Y-%m-%d")
             dates.insert(0, yesterday_str)
         lines = []
-        for date_str in dates:
-            day_data = data.get(date_str)
-            events = []
-            if isinstance(day_data, list):
-                events = day_data
-            elif isinstance(day_data, dict):
-                events = day_data.get("events", [])
+        for date_str, events in get_short_events(prompts_dir, dates).items():
             for e in events:
                 t = e.get("time", "")
                 ev = e.get("event", "")
@@ -1842,45 +1723,12 @@ def should_use_prompt_v2(char_id=None) -> bool:
 
 
 def append_short_memory_event(char_id, event_content, date_str, time_str):
-    """往 6_memory_short.json 中追加一条短期记忆。"""
+    """往短期记忆（memory.db）中追加一条事件。"""
     try:
         _, prompts_dir = get_paths(char_id)
-        short_mem_path = os.path.join(prompts_dir, "6_memory_short.json")
-
-        # 1. 加载现有数据
-        current_data = {}
-        if os.path.exists(short_mem_path):
-            with open(short_mem_path, "r", encoding="utf-8-sig") as f:
-                try:
-                    current_data = json.load(f) or {}
-                except:
-                    pass
-
-        # 2. 格式化数据结构 (兼容 list/dict)
-        day_data = current_data.get(date_str, {})
-        existing_events = []
-        last_id = 0
 
-        if isinstance(day_data, list):
-            existing_events = day_data
-        elif isinstance(day_data, dict):
-            existing_events = day_data.get("events", [])
-            last_id = day_data.get("last_id", 0)
-
-        # 3. 追加新事件 (去重: 如果同一时间有相同的内容，则不添加)
-        is_duplicate = any(e.get("time") == time_str and e.get("event") == event_content for e in existing_events)
-        if not is_duplicate:
-            existing_events.append({
-                "time": time_str,
-                "event": event_content
-            })
-            # 按时间排序
-            existing_events.sort(key=lambda x: x.get("time", ""))
-
-            # 4. 写回文件
-            current_data[date_str] = {"events": existing_events, "last_id": last_id}
-            with open(short_mem_path, "w", encoding="utf-8") as f:
-                json.dump(current_data, f, ensure_ascii=False, indent=2)
+        # 去重: 如果同一时间有相同的内容，则不添加
+        if append_short_events(prompts_dir, date_str, [{"time": time_str, "event": event_content}]):
             print(f"[DEBUG] append_short_memory: 已保存事件到 {char_id} 的短期记忆")
         else:
             print(f"[DEBUG] append_short_memory: 事件重复，跳过写入")
@@ -1907,7 +1755,7 @@ def append_short_memory_event(char_id, event_content, date_str, time_str):
 # --- 【修正版】分发群聊记忆给成员 ---
 def distribute_group_memory(group_id, group_name, members, new_events, date_str):
     """
-    将群聊新生成的事件，追加到每个成员的 6_memory_group_log.json 中
+    将群聊新生成的事件，追加到每个成员的短期记忆（memory.db）中
     """
     if not new_events:
         print("   [Distribute] 没有新事件需要分发")
@@ -1915,67 +1763,21 @@ def distribute_group_memory(group_id, group_name, members, new_events, date_str)
 
     print(f"   [Distribute] 正在分发 {len(new_events)} 条事件给成员: {members}")
 
+    # 格式化内容：[群聊:群名] 事件
+    # 【修改】这里确保 event['event'] 是纯文本，不包含奇怪的 AI 生成头信息
+    formatted = [{
+        "time": event['time'],
+        "event": f"[群聊:{group_name}] {event['event'].replace('AI生成信息发送的内容', '').strip()}",
+    } for event in new_events]
+
     for char_id in members:
         if char_id == "user": continue # 跳过用户
 
         try:
-            # 1. 找到该角色的文件路径
             _, prompts_dir = get_paths(char_id)
-            # 【修改】目标文件改为 6_memory_short.json
-            short_file = os.path.join(prompts_dir, "6_memory_short.json")
-
-            # 2. 读取现有数据
-            current_data = {}
-            if os.path.exists(short_file):
-                with open(short_file, "r", encoding="utf-8") as f:
-                    try: current_data = json.load(f)
-                    except: pass
-
-            # 兼容新旧格式 (获取当天的 dict)
-            day_data = current_data.get(date_str, {})
-            # 如果是旧格式列表，转为字典结构
-            if isinstance(day_data, list):
-                existing_events = day_data
-                last_id = 0
-            else:
-                existing_events = day_data.get("events", [])
-                last_id = day_data.get("last_id", 0)
-
-            # 3. 追加新事件 (格式化一下，标明来源)
-            count_added = 0
-            for event in new_events:
-                # 格式化内容：[群聊:群名] 事件
-                # 【修改】这里确保 event['event'] 是纯文本，不包含奇怪的 AI 生成头信息
-                clean_event_text = event['event'].replace('AI生成信息发送的内容', '').strip()
-                event_content = f"[群聊:{group_name}] {clean_event_text}"
-
-                # 简单去重
-                is_duplicate = False
-                for old in existing_events:
-                    if old['time'] == event['time'] and event_content in old['event']:
-                        is_duplicate = True
-                        break
-
-                if not is_duplicate:
-                    existing_events.append({
-                        "time": event['time'],
-                        "event": event_content
-                    })
-                    count_added += 1
-
+            # 只插入新事件行（同一时间相同内容视为重复），last_id 不变，因为这些群聊消息不属于私聊数据库
+            count_added = append_short_events(prompts_dir, date_str, formatted, source=SOURCE_GROUP)
             if count_added > 0:
-                # 按时间重新排序 (保证群聊和私聊按时间穿插)
-                existing_events.sort(key=lambda x: x['time'])
-
-                # 保存回文件 (保持 last_id 不变，因为这些群聊消息不属于私聊数据库)
-                current_data[date_str] = {
-                    "events": existing_events,
-                    "last_id": last_id
-                }
-
-                with open(short_file, "w", encoding="utf-8") as f:
-                    json.dump(current_data, f, ensure_ascii=False, indent=2)
-
                 print(f"     -> [{char_id}] 合并成功 (+{count_added}条)")
 
         except Exception as e:
@@ -1999,33 +1801,10 @@ def append_moment_event_to_short_memory(char_id, context_text):
         if not line:
             return
         _, prompts_dir = get_paths(char_id)
-        short_file = os.path.join(prompts_dir, "6_memory_short.json")
         date_str = datetime.now().strftime("%Y-%m-%d")
         time_str = datetime.now().strftime("%H:%M")
-
-        current_data = {}
-        if os.path.exists(short_file):
-            with open(short_file, "r", encoding="utf-8") as f:
-                try:
-                    current_data = json.load(f)
-                except Exception:
-                    pass
-
-        day_data = current_data.get(date_str, {})
-        if isinstance(day_data, list):
-            existing_events = list(day_data)
-            last_id = 0
-        else:
-            existing_events = list(day_data.get("events", []))
-            last_id = day_data.get("last_id", 0)
-
-        existing_events.append({"time": time_str, "event": line})
-        existing_events.sort(key=lambda x: x["time"])
-
-        current_data[date_str] = {"events": existing_events, "last_id": last_id}
-        os.makedirs(os.path.dirname(short_file), exist_ok=True)
-        with open(short_file, "w", encoding="utf-8") as f:
-            json.dump(current_data, f, ensure_ascii=False, indent=2)
+        append_short_events(prompts_dir, date_str, [{"time": time_str, "event": line}],
+                            source=SOURCE_MOMENT, dedupe=False)
     except Exception as e:
         print(f"   [Moments] 写入短期记忆失败 [{char_id}]: {e}")
 
@@ -2081,40 +1860,34 @@ def check_co_encounters(char_id, x, y, location_id):
     return encounters
 
 
-def sync_memory_before_single_chat(char_id, user_id=None):
+@traced("memory.sync_single")
+def sync_memory_before_single_chat(char_id, user_id=None, wait=True):
     """
-    单聊前，先总结该角色所在所有群聊的短期记忆，追加到 6_memory_short 中。
+    单聊前，先总结该角色所在所有群聊的短期记忆，追加到短期记忆（memory.db）中。
+    总结在后台 worker 中执行（services.memory_sync）；wait=False 时只等待超出陈旧上限的部分，
+    聊天请求不再排队等每个群的 LLM 总结。
     返回 (success: bool, error_msg: str|None)
     """
-    now = datetime.now()
-    today_str = now.strftime("%Y-%m-%d")
-    dates = [today_str]
-    if now.hour < 4:
-        yesterday_str = (now - timedelta(days=1)).strftime("%Y-%m-%d")
-        dates.insert(0, yesterday_str)
-
     group_ids = _get_groups_for_char(char_id, user_id=user_id)
     if not group_ids:
         return True, None
+    if user_id is None:
+        user_id = get_current_user_id()
 
     try:
-        for gid in group_ids:
-            for d in dates:
-                try:
-                    update_group_short_memory(gid, d)
-                except Exception as e:
-                    print(f"   [Sync] 群聊 {gid} 日期 {d} 同步失败: {e}")
-                    return False, f"群聊记忆同步失败: {e}"
-        return True, None
+        dates = memory_sync.sync_dates()
+        keys = [(memory_sync.KIND_GROUP, gid, d) for gid in group_ids for d in dates]
+        return memory_sync.sync_memory(keys, user_id, wait=wait)
     except Exception as e:
         print(f"   [Sync] 单聊前记忆同步失败: {e}")
         return False, str(e)
 
 
-def sync_memory_before_group_chat(group_id):
+@traced("memory.sync_group")
+def sync_memory_before_group_chat(group_id, wait=True):
     """
     群聊前：总结群成员的单聊 + 群成员参与的其他群聊（跳过当前群）的短期记忆。
-    不包含本群群聊记忆。
+    不包含本群群聊记忆。总结在后台 worker 中执行，wait 含义同 sync_memory_before_single_chat。
     返回 (success: bool, error_msg: str|None)
     """
     groups_cfg = _get_groups_config_file()
@@ -2127,40 +1900,21 @@ def sync_memory_before_group_chat(group_id):
     except Exception:
         members = []
 
-    now = datetime.now()
-    today_str = now.strftime("%Y-%m-%d")
-    dates = [today_str]
-    if now.hour < 4:
-        yesterday_str = (now - timedelta(days=1)).strftime("%Y-%m-%d")
-        dates.insert(0, yesterday_str)
-
     try:
+        dates = memory_sync.sync_dates()
         # 1. 各成员单聊记忆
-        for char_id in members:
-            for d in dates:
-                try:
-                    update_short_memory_for_date(char_id, d)
-                except Exception as e:
-                    print(f"   [Sync] 成员 {char_id} 单聊日期 {d} 同步失败: {e}")
-                    return False, f"成员单聊记忆同步失败: {e}"
+        keys = [(memory_sync.KIND_SINGLE, char_id, d) for char_id in members for d in dates]
 
         # 2. 群成员参与的其他群聊记忆（跳过当前群），汇总后通过 distribute 写入各成员短期记忆
         other_group_ids_seen = set()
         for char_id in members:
             for gid in _get_groups_for_char(char_id):
-                if gid == group_id:
-                    continue
-                if gid in other_group_ids_seen:
+                if gid == group_id or gid in other_group_ids_seen:
                     continue
                 other_group_ids_seen.add(gid)
-                for d in dates:
-                    try:
-                        update_group_short_memory(gid, d)
-                    except Exception as e:
-                        print(f"   [Sync] 成员参与的其他群 {gid} 日期 {d} 同步失败: {e}")
-                        return False, f"其他群聊记忆同步失败: {e}"
+                keys.extend((memory_sync.KIND_GROUP, gid, d) for d in dates)
 
-        return True, None
+        return memory_sync.sync_memory(keys, get_current_user_id(), wait=wait)
     except Exception as e:
         print(f"   [Sync] 群聊前记忆同步失败: {e}")
         return False, str(e)
@@ -2439,26 +2193,12 @@ def _background_generate_moment_reactions(user_id, char_id, post_ts_str, post_co
                 print(f"✅ [Moments Background] No new reactions generated for post {post_ts_str}, worker finished.")
                 return
 
-            # 回填到文件
-            moments_path, _ = get_moments_paths()
-            if os.path.exists(moments_path):
-                with open(moments_path, "r", encoding="utf-8-sig") as f:
-                    data = json.load(f)
-
-                # 寻找匹配的帖子
-                found = False
-                for post in data:
-                    if post.get("char_id") == char_id and post.get("timestamp") == post_ts_str:
-                        post.setdefault("likers", []).extend(new_likers)
-                        post.setdefault("comments", []).extend(new_comments)
-                        found = True
-                        break
-
-                if found:
-                    safe_save_json(moments_path, data)
-                    print(f"✅ [Moments Background] Successfully saved {len(new_likers)} likes and {len(new_comments)} comments for post {post_ts_str}.")
-                else:
-                    print(f"❌ [Moments Background] Could not find post with ts {post_ts_str} to save reactions.")
+            # 回填到朋友圈库（只追加这一条的点赞/评论）
+            from services import moments_store
+            if moments_store.add_reactions(char_id, post_ts_str, likers=new_likers, comments=new_comments):
+                print(f"✅ [Moments Background] Successfully saved {len(new_likers)} likes and {len(new_comments)} comments for post {post_ts_str}.")
+            else:
+                print(f"❌ [Moments Background] Could not find post with ts {post_ts_str} to save reactions.")
 
         except Exception as e:
             print(f"❌ [Moments Background] An unexpected error occurred in worker: {e}")
@@ -2482,134 +2222,85 @@ def _generate_random_ts_within_24h(base_ts_str):
 
 @app.route("/api/contacts", methods=["GET"])
 def get_contacts():
-    """获取所有联系人列表，包含最后一条消息、未读数、置顶状态。"""
+    """获取所有联系人列表，包含最后一条消息、未读数、置顶状态。
+
+    最后一条消息和未读数来自会话摘要表（services/conversation_summary），只有 chat.db 有变化的会话才重算。
+    """
+    from services.conversation_summary import get_conversation_summaries, KIND_SINGLE, KIND_GROUP
     user_id = get_current_user_id()
     if not user_id:
         return jsonify([]), 401
 
     contact_list = []
+    chars_config = load_json_cached(_get_characters_config_file(), {}) or {}
+    groups_config = load_json_cached(_get_groups_config_file(), {}) or {}
 
-    # 获取已读状态
-    read_status = {}
-    status_file = _get_read_status_file()
-    if os.path.exists(status_file):
-        try:
-            with open(status_file, "r", encoding="utf-8") as f:
-                read_status = json.load(f)
-        except: pass
+    try:
+        summaries = get_conversation_summaries(
+            [(KIND_SINGLE, cid) for cid in chars_config] + [(KIND_GROUP, gid) for gid in groups_config],
+            user_id=user_id,
+        )
+    except Exception as e:
+        print(f"Error loading conversation summaries: {e}")
+        summaries = {}
 
-    # --- A. 处理单聊 (characters.json) ---
-    chars_cfg = _get_characters_config_file()
-    if os.path.exists(chars_cfg):
-        try:
-            with open(chars_cfg, "r", encoding="utf-8") as f:
-                chars_config = json.load(f)
+    today = datetime.now().date()
 
-            for char_id, info in chars_config.items():
-                db_path, _ = get_paths(char_id)
-                last_msg = ""
-                last_time = ""
-                timestamp_val = 0
-                unread_count = 0
+    def _last(kind, target_id):
+        row = summaries.get((kind, target_id)) or {}
+        last_msg, last_time, timestamp_val = row.get("last_content") or "", "", 0
+        if row.get("last_ts"):
+            try:
+                dt = datetime.strptime(row["last_ts"], '%Y-%m-%d %H:%M:%S')
+                timestamp_val = dt.timestamp()
+                last_time = dt.strftime('%H:%M') if dt.date() == today else dt.strftime('%m-%d')
+            except Exception:
+                pass
+        return last_msg, last_time, timestamp_val, row.get("unread", 0)
 
-                if os.path.exists(db_path):
-                    try:
-                        conn = sqlite3.connect(db_path)
-                        cursor = conn.cursor()
-                        cursor.execute("SELECT content, timestamp FROM messages ORDER BY id DESC LIMIT 1")
-                        row = cursor.fetchone()
-                        if row:
-                            last_msg = row[0]
-                            timestamp_val = datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S').timestamp()
-                            dt = datetime.fromtimestamp(timestamp_val)
-                            if dt.date() == datetime.now().date():
-                                last_time = dt.strftime('%H:%M')
-                            else:
-                                last_time = dt.strftime('%m-%d')
-
-                        last_read = read_status.get(char_id, "2000-01-01 00:00:00")
-                        cursor.execute("SELECT COUNT(*) FROM messages WHERE timestamp > ? AND role != 'user'", (last_read,))
-                        unread_count = cursor.fetchone()[0]
-                        conn.close()
-                    except: pass
-
-                contact_list.append({
-                    "type": "chat",
-                    "id": char_id,
-                    "avatar": info.get("avatar") or "/static/default_avatar.png",
-                    "name": info.get("name"),
-                    "remark": info.get("remark") or info.get("name"),
-                    "last_msg": last_msg,
-                    "last_time": last_time,
-                    "timestamp": timestamp_val,
-                    "pinned": info.get("pinned", False),
-                    "unread": unread_count,
-                    "age": info.get("age"),
-                    "no_age_increase": info.get("no_age_increase", False),
-                    "light_sleep": info.get("light_sleep", True),
-                    "deep_sleep": info.get("deep_sleep", False),
-                    "ds_start": info.get("ds_start", "23:00"),
-                    "ds_end": info.get("ds_end", "07:00"),
-                    "bedtime_diary_enabled": info.get("bedtime_diary_enabled", True) is not False
-                })
-        except Exception as e:
-            print(f"Error loading contacts: {e}")
+    # --- A. 处理单聊 (characters.json) ---
+    for char_id, info in chars_config.items():
+        last_msg, last_time, timestamp_val, unread_count = _last(KIND_SINGLE, char_id)
+        contact_list.append({
+            "type": "chat",
+            "id": char_id,
+            "avatar": info.get("avatar") or "/static/default_avatar.png",
+            "name": info.get("name"),
+            "remark": info.get("remark") or info.get("name"),
+            "last_msg": last_msg,
+            "last_time": last_time,
+            "timestamp": timestamp_val,
+            "pinned": info.get("pinned", False),
+            "unread": unread_count,
+            "age": info.get("age"),
+            "no_age_increase": info.get("no_age_increase", False),
+            "light_sleep": info.get("light_sleep", True),
+            "deep_sleep": info.get("deep_sleep", False),
+            "ds_start": info.get("ds_start", "23:00"),
+            "ds_end": info.get("ds_end", "07:00"),
+            "bedtime_diary_enabled": info.get("bedtime_diary_enabled", True) is not False
+        })
 
     # --- B. 处理群聊 (groups.json) ---
-    groups_cfg = _get_groups_config_file()
-    if os.path.exists(groups_cfg):
-        try:
-            with open(groups_cfg, "r", encoding="utf-8") as f:
-                groups_config = json.load(f)
-
-            for group_id, info in groups_config.items():
-                group_dir = get_group_dir(group_id)
-                db_path = os.path.join(group_dir, "chat.db")
-                last_msg = ""
-                last_time = ""
-                timestamp_val = 0
-                unread_count = 0
-
-                if os.path.exists(db_path):
-                    try:
-                        conn = sqlite3.connect(db_path)
-                        cursor = conn.cursor()
-                        cursor.execute("SELECT content, timestamp FROM messages ORDER BY id DESC LIMIT 1")
-                        row = cursor.fetchone()
-                        if row:
-                            last_msg = row[0]
-                            timestamp_val = datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S').timestamp()
-                            dt = datetime.fromtimestamp(timestamp_val)
-                            if dt.date() == datetime.now().date():
-                                last_time = dt.strftime('%H:%M')
-                            else:
-                                last_time = dt.strftime('%m-%d')
-
-                        last_read = read_status.get(group_id, "2000-01-01 00:00:00")
-                        cursor.execute("SELECT COUNT(*) FROM messages WHERE timestamp > ? AND role != 'user'", (last_read,))
-                        unread_count = cursor.fetchone()[0]
-                        conn.close()
-                    except: pass
-
-                avatar = info.get("avatar")
-                if not avatar or avatar == "/static/default_avatar.png":
-                    avatar = "/static/default_group.png"
-
-                contact_list.append({
-                    "type": "group",
-                    "id": group_id,
-                    "avatar": avatar,
-                    "name": info.get("name"),
-                    "remark": info.get("name"),
-                    "last_msg": last_msg,
-                    "last_time": last_time,
-                    "timestamp": timestamp_val,
-                    "pinned": info.get("pinned", False),
-                    "members": info.get("members", []),
-                    "unread": unread_count
-                })
-        except Exception as e:
-            print(f"Error loading groups: {e}")
+    for group_id, info in groups_config.items():
+        last_msg, last_time, timestamp_val, unread_count = _last(KIND_GROUP, group_id)
+        avatar = info.get("avatar")
+        if not avatar or avatar == "/static/default_avatar.png":
+            avatar = "/static/default_group.png"
+
+        contact_list.append({
+            "type": "group",
+            "id": group_id,
+            "avatar": avatar,
+            "name": info.get("name"),
+            "remark": info.get("name"),
+            "last_msg": last_msg,
+            "last_time": last_time,
+            "timestamp": timestamp_val,
+            "pinned": info.get("pinned", False),
+            "members": info.get("members", []),
+            "unread": unread_count
+        })
 
     # 4. 统一排序
     contact_list.sort(key=lambda x: (1 if x['pinned'] else 0, x['timestamp']), reverse=True)
@@ -3257,6 +2948,7 @@ def update_group_short_memory(group_id, target_date_str):
     # 4. 查询群数据库
     if not os.path.exists(db_path): return 0, []
 
+    ensure_chat_db(db_path)
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     start_time = f"{target_date_str} 00:00:00"
@@ -3372,19 +3064,8 @@ def handle_quick_phrases():
 
 # --- 表情库 API ---
 def _list_official_packs():
-    """从 COS 获取 stickers/ 下的子目录名列表 (带缓存)"""
-    global CACHED_OFFICIAL_PACKS
-    if CACHED_OFFICIAL_PACKS is not None:
-        return CACHED_OFFICIAL_PACKS
-
-    try:
-        # 调用 cos_utils.get_cos_list 获取文件夹列表
-        folders = get_cos_list("stickers/", get_folders=True)
-        CACHED_OFFICIAL_PACKS = folders
-        return CACHED_OFFICIAL_PACKS
-    except Exception as e:
-        print(f"   [COS Error] Failed to list official packs: {e}")
-        return []
+    """官方表情包 ID 列表（内存目录，见 services.sticker_index）"""
+    return list_official_packs()
 
 
 COVER_BASENAME = "cover"
@@ -3407,77 +3088,22 @@ def _get_pack_meta(pack_id):
 
 
 def _get_pack_cover_url(pack_id):
-    """从 COS 获取某表情包目录下名为 cover 的封面图 URL"""
+    """表情包封面 URL（内存目录）"""
     if ".." in pack_id or "/" in pack_id or "\\" in pack_id:
         return None
-
-    try:
-        files = get_cos_list(f"stickers/{pack_id}/")
-        for s in files:
-            name_no_ext = os.path.splitext(s["name"])[0].lower()
-            if name_no_ext == COVER_BASENAME:
-                return s["url"]
-    except Exception:
-        pass
-    return None
+    return get_pack_cover(pack_id)
 
 
 def _list_pack_stickers(pack_id):
-    """从 COS 获取某表情包下的表情文件，返回 [{path, name, url}]（排除 cover）"""
+    """某表情包下的表情，返回 [{path, name, url}]（排除 cover）"""
     if ".." in pack_id or "/" in pack_id or "\\" in pack_id:
         return []
-
-    out = []
-    try:
-        files = get_cos_list(f"stickers/{pack_id}/")
-        for s in files:
-            filename = s["name"]
-            name_no_ext, ext = os.path.splitext(filename)
-
-            # 过滤逻辑：排除掉名字里包含 cover 的文件（封面不出现在详情列表）
-            if COVER_BASENAME in name_no_ext.lower():
-                continue
-
-            if ext.lower() in STICKER_IMAGE_EXT:
-                path = f"official:{pack_id}:{filename}"
-                out.append({
-                    "path": path,
-                    "name": name_no_ext,
-                    "url": s["url"]  # 直接返回 COS 完整链接
-                })
-    except Exception as e:
-        print(f"   [COS Error] Failed to list stickers for {pack_id}: {e}")
-
-    return out
+    return list_pack_stickers(pack_id)
 
 
 def _search_stickers(q):
     """按名称搜索：官方库 + 当前用户个人上传。返回 [{path, name, url, pack_name}]"""
-    q = (q or "").strip().lower()
-    out = []
-    # 官方库
-    for pack_id in _list_official_packs():
-        for s in _list_pack_stickers(pack_id):
-            if q in s["name"].lower():
-                s = dict(s)
-                s["pack_name"] = pack_id
-                out.append(s)
-    # 用户上传
-    uid = get_current_user_id()
-    if uid:
-        cos_prefix = f"users/{uid}/sticker_uploads/"
-        user_stickers = get_cos_list(cos_prefix)
-        for s in user_stickers:
-            name = s["name"]
-            if q in name.lower():
-                path = f"user:{name}"
-                out.append({
-                    "path": path,
-                    "name": os.path.splitext(name)[0],
-                    "url": s["url"],
-                    "pack_name": "个人上传"
-                })
-    return out
+    return search_stickers(q)
 
 
 def _load_favorites():
@@ -3770,14 +3396,11 @@ def add_character():
         init_char_db(new_id)
 
         # 6. 创建默认的空 Prompt 文件 (防止进入记忆页面报错)
-        # 这些文件是必须存在的
+        # 这些文件是必须存在的；分级记忆在首次写入时由 services/memory_store 建库
         default_files = [
             "1_base_persona.md",
             "2_relationship.json",
             "3_user_persona.md", # 虽然有全局的，但局部文件最好也占个位
-            "4_memory_long.json",
-            "5_memory_medium.json",
-            "6_memory_short.json",
             "7_schedule.json"
         ]
 
@@ -4305,17 +3928,36 @@ def scheduled_maintenance():
 # --- 【新增】获取账单接口（多用户版） ---
 @app.route("/api/usage_logs")
 def get_usage_logs():
-    usage_file = _get_usage_log_file()
-    if not os.path.exists(usage_file):
-        return jsonify([])
+    """最近的调用记录（最新的在前面），默认 50 条，可用 limit / offset 翻页。"""
+    from services.usage_ledger import recent_usage
     try:
-        with open(usage_file, "r", encoding="utf-8") as f:
-            # 倒序返回，最新的在前面
-            logs = json.load(f)
-            return jsonify(logs[::-1])
-    except:
+        limit = min(max(int(request.args.get("limit", 50)), 1), 500)
+        offset = max(int(request.args.get("offset", 0)), 0)
+    except ValueError:
+        limit, offset = 50, 0
+    try:
+        return jsonify(recent_usage(get_current_user_id(), limit=limit, offset=offset))
+    except Exception as e:
+        print(f"[Usage] 查询失败: {e}")
         return jsonify([])
 
+
+@app.route("/api/usage_summary")
+def get_usage_summary():
+    """用量汇总：group_by=day|char|model|task，days=最近天数（默认 30）。"""
+    from services.usage_ledger import usage_rollup
+    group_by = request.args.get("group_by", "day")
+    try:
+        days = min(max(int(request.args.get("days", 30)), 1), 3650)
+    except ValueError:
+        days = 30
+    try:
+        return jsonify(usage_rollup(get_current_user_id(), group_by=group_by, days=days))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 # --- 【朋友圈】关系图谱候选（除用户外，用于点赞/评论抽样）---
 def _get_moments_relationship_candidates(char_id):
     """从角色的 2_relationship.json 中取出除用户外的 (char_id, score) 列表。关系 key 为名字，需映射到 char_id。"""
@@ -4541,11 +4183,13 @@ def _execute_directive(directive, char_id, message_text):
             s_clean, _, _ = process_agent_actions(char_id, s_clean, get_current_user_id())
 
             if s_clean:
+                s_clean = resolve_sticker_content(s_clean, user_id=user_id)
                 s_conn2 = sqlite3.connect(s_db_path)
                 s_cursor2 = s_conn2.cursor()
                 s_cursor2.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", ("assistant", s_clean, now_dt.strftime('%Y-%m-%d %H:%M:%S')))
                 s_conn2.commit()
                 s_conn2.close()
+                notify_message("single", char_id, user_id=user_id)
                 print(f"  💬 {char_name}: {s_clean}", flush=True)
             print(f"  ✅ [Directive→User] {char_name} 切换到单聊", flush=True)
             return
@@ -4660,11 +4304,13 @@ def _execute_directive(directive, char_id, message_text):
         print(f"  💬 FIRST MESSAGE: {init_reply}")
 
         if init_reply:
+            init_reply = resolve_sticker_content(init_reply, user_id=user_id)
             d_conn = sqlite3.connect(d_db_path)
             d_cursor = d_conn.cursor()
             d_cursor.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", (char_id, init_reply, init_now.strftime('%Y-%m-%d %H:%M:%S')))
             d_conn.commit()
             d_conn.close()
+            notify_message("group", d_group_id, user_id=user_id, role=char_id)
         print(f"{'~'*50}")
 
         # --- 其他成员多轮自动回复 ---
@@ -4744,11 +4390,13 @@ def _execute_directive(directive, char_id, message_text):
                                 should_stop = True
                                 break
 
+                            d_clean = resolve_sticker_content(d_clean, user_id=user_id)
                             d_conn3 = sqlite3.connect(d_db_path)
                             d_cursor3 = d_conn3.cursor()
                             d_cursor3.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", (d_speaker_id, d_clean, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
                             d_conn3.commit()
                             d_conn3.close()
+                            notify_message("group", d_group_id, user_id=user_id, role=d_speaker_id)
                             print(f"  💬 {d_speaker_name}: {d_clean}")
 
                             prev_last_speaker = d_speaker_id
@@ -4905,6 +4553,7 @@ def trigger_active_chat(char_id, user_id=None):
                        ("assistant", cleaned_reply, ai_ts))
         conn.commit()
         conn.close()
+        notify_message("single", char_id, user_id=user_id)
 
         print(f"💓 [Active] 发送成功: {cleaned_reply}")
 
@@ -4943,17 +4592,7 @@ def trigger_active_chat(char_id, user_id=None):
 def _has_short_memory_events_for_date(char_id, target_date_str, user_id=None):
     try:
         _, prompts_dir = get_paths(char_id, user_id=user_id)
-        short_mem_path = os.path.join(prompts_dir, "6_memory_short.json")
-        if not os.path.exists(short_mem_path):
-            return False
-        with open(short_mem_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        day_data = data.get(target_date_str)
-        if isinstance(day_data, list):
-            return len(day_data) > 0
-        if isinstance(day_data, dict):
-            events = day_data.get("events", [])
-            return isinstance(events, list) and len(events) > 0
+        return has_short_events(prompts_dir, target_date_str)
     except Exception as e:
         print(f"🌙 [Diary] 检查短期记忆失败: {e}")
     return False
@@ -5120,12 +4759,14 @@ def trigger_bedtime_diary(char_id, user_id=None):
 
         # 5. 存库
         ai_ts = now.strftime('%Y-%m-%d %H:%M:%S')
+        cleaned_reply = resolve_sticker_content(cleaned_reply, user_id=effective_user_id)
         conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
         cursor.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)",
                        ("assistant", cleaned_reply, ai_ts))
         conn.commit()
         conn.close()
+        notify_message("single", char_id, user_id=effective_user_id)
 
         _set_bedtime_diary_status("success")
 
@@ -5333,6 +4974,7 @@ def trigger_group_active_chat(group_id, user_id=None):
                                (speaker_id, cleaned_reply, ai_ts))
                 conn.commit()
                 conn.close()
+                notify_message("group", group_id, user_id=user_id, role=speaker_id)
 
                 context_buffer.append({"role_id": speaker_id, "display_name": speaker_name, "content": cleaned_reply})
                 prev_last_speaker = speaker_id
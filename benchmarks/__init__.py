@@ -0,0 +1 @@
+"""聊天请求链路的端到端基准测试（不会被 pytest 收集，手动运行：python -m benchmarks.run_bench）。"""
@@ -0,0 +1,80 @@
+"""
+本地 LLM 桩：替换 call_openrouter / call_gemini，按配置的延迟返回固定格式的回复，不发任何网络请求。
+
+各模块通过 `from services.ai_client import call_openrouter` 或 `from app import call_openrouter`
+拿到的都是同一个函数对象，patch 时扫描 sys.modules 把所有引用一起换掉，restore 时换回。
+"""
+import random
+import sys
+import threading
+import time
+
+DEFAULT_REPLY = "嗯，我在呢/今天过得怎么样？[NONE]"
+
+
+def replace_everywhere(original, replacement) -> list:
+    """把所有已加载模块里指向 original 的属性换成 replacement，返回 [(module, name)] 供还原。"""
+    replaced = []
+    for mod in list(sys.modules.values()):
+        d = getattr(mod, "__dict__", None)
+        if not d:
+            continue
+        for name, value in list(d.items()):
+            if value is original:
+                setattr(mod, name, replacement)
+                replaced.append((mod, name))
+    return replaced
+
+
+class FakeLLM:
+    """延迟 = latency_ms ± jitter_ms（均匀分布），可选 error_rate 的概率返回系统提示式的失败文本。"""
+
+    def __init__(self, latency_ms=800.0, jitter_ms=200.0, reply=DEFAULT_REPLY, error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.reply = reply
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._patched = []
+        self.calls = 0
+        self.on_call = None  # 可选回调 on_call(seconds)，用于记录 llm 阶段耗时
+
+    def _next_call(self):
+        """返回 (本次延迟秒数, 是否模拟失败)。"""
+        with self._lock:
+            jitter = self._rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+            fail = self.error_rate and self._rng.random() < self.error_rate
+            self.calls += 1
+        return max(0.0, (self.latency_ms + jitter) / 1000.0), fail
+
+    def __call__(self, messages, char_id="unknown", model_name="", user_id=None, **kwargs):
+        seconds, fail = self._next_call()
+        time.sleep(seconds)
+        if self.on_call:
+            self.on_call(seconds)
+        if fail:
+            return "（系统提示：模拟的上游错误）"
+        return self.reply
+
+    def patch(self):
+        from services import ai_client
+        if self._patched:
+            return self
+        for name in ("call_openrouter", "call_gemini"):
+            original = getattr(ai_client, name)
+            self._patched.append((original, replace_everywhere(original, self)))
+        return self
+
+    def restore(self):
+        for original, places in self._patched:
+            for mod, name in places:
+                setattr(mod, name, original)
+        self._patched = []
+
+    def __enter__(self):
+        return self.patch()
+
+    def __exit__(self, *exc):
+        self.restore()
+        return False
@@ -0,0 +1,205 @@
+"""
+聊天请求链路基准测试：用合成工作区 + 本地 LLM 桩跑 chat_v2 / group_chat / regenerate / get_moments，
+输出每个接口的端到端耗时和链路各阶段耗时（p50 / p95 / p99）。
+
+用法（在项目根目录）：
+    python -m benchmarks.run_bench
+    python -m benchmarks.run_bench --characters 20 --messages 5000 --memory-weeks 104 --llm-latency 1200
+    python -m benchmarks.run_bench --endpoints chat_v2,moments --iterations 50 --concurrency 4 --json out.json
+    python -m benchmarks.run_bench --baseline out.json --max-regression 20   # p95 变慢超过 20% 时退出码为 1
+
+说明：
+- LLM 调用全部走 FakeLLM（固定延迟 ± 抖动），不访问网络；"llm" 阶段即桩的耗时，端到端减去它就是本地开销；
+- 阶段之间可以嵌套（例如 prompt.messages_v2 内部包含 prompt.build_v2），不能直接相加；
+- 工作区建在 users/<user-id>/ 下，结束后删除（--keep 保留以便排查）。
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_llm import FakeLLM
+from benchmarks.stages import StageRecorder, summarize
+from benchmarks.workspace import WorkspaceSpec, build_workspace, remove_workspace, _sentence
+
+ENDPOINTS = ("chat_v2", "group_chat", "regenerate", "moments")
+
+
+def _make_request(name, ws, rng):
+    """返回 (method, url, json_body)。"""
+    if name == "chat_v2":
+        return "POST", f"/api/{rng.choice(ws['char_ids'])}/chat_v2", {"message": _sentence(rng)}
+    if name == "group_chat":
+        return "POST", f"/api/group/{rng.choice(ws['group_ids'])}/chat", {"message": _sentence(rng)}
+    if name == "regenerate":
+        return "POST", f"/api/{rng.choice(ws['char_ids'])}/regenerate", {}
+    if name == "moments":
+        return "GET", f"/api/moments?page={rng.randint(1, 5)}", None
+    raise ValueError(f"未知接口: {name}")
+
+
+def _client(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+        sess["logged_in"] = True
+    return client
+
+
+def run_endpoint(app, name, ws, recorder, iterations, warmup, concurrency, seed):
+    """对一个接口先预热 warmup 次，再正式跑 iterations 次，返回 {latency, stages, status}。"""
+    if name == "group_chat" and not ws["group_ids"]:
+        return None
+    if name in ("chat_v2", "regenerate") and not ws["char_ids"]:
+        return None
+
+    def one(i):
+        rng = random.Random(seed * 100003 + i)
+        client = _client(app, ws["user_id"])
+        method, url, body = _make_request(name, ws, rng)
+        t0 = time.perf_counter()
+        resp = client.open(url, method=method, json=body)
+        return (time.perf_counter() - t0) * 1000, resp.status_code
+
+    for i in range(warmup):
+        one(-1 - i)
+    recorder.reset()
+
+    t0 = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"bench-{name}") as pool:
+            results = list(pool.map(one, range(iterations)))
+    else:
+        results = [one(i) for i in range(iterations)]
+    wall = time.perf_counter() - t0
+
+    status = {}
+    for _, code in results:
+        status[str(code)] = status.get(str(code), 0) + 1
+    return {
+        "latency": summarize([ms for ms, _ in results]),
+        "throughput_rps": len(results) / wall if wall > 0 else 0.0,
+        "status": status,
+        "stages": recorder.report(),
+    }
+
+
+def _fmt_row(name, s):
+    return (f"  {name:<34} {s['count']:>6} {s['mean']:>9.1f} {s['p50']:>9.1f} "
+            f"{s['p95']:>9.1f} {s['p99']:>9.1f} {s['max']:>9.1f}")
+
+
+def print_report(results, out=sys.stdout):
+    header = f"  {'stage':<34} {'count':>6} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}"
+    for name, r in results["endpoints"].items():
+        print(f"\n=== {name}  ({r['throughput_rps']:.2f} req/s, status {r['status']}) — 单位 ms ===", file=out)
+        print(header, file=out)
+        print(_fmt_row("[end-to-end]", r["latency"]), file=out)
+        for stage, s in r["stages"].items():
+            print(_fmt_row(stage, s), file=out)
+
+
+def compare_with_baseline(results, baseline, max_regression) -> list:
+    """对比各接口端到端 p95，返回超出阈值（百分比）的 [(接口, 基线, 当前)]。"""
+    regressions = []
+    for name, r in results["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(name)
+        if not base or not base["latency"]["p95"]:
+            continue
+        old, new = base["latency"]["p95"], r["latency"]["p95"]
+        if (new - old) / old * 100 > max_regression:
+            regressions.append((name, old, new))
+    return regressions
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="聊天请求链路基准测试（本地 LLM 桩）")
+    p.add_argument("--endpoints", default=",".join(ENDPOINTS), help=f"逗号分隔，可选 {', '.join(ENDPOINTS)}")
+    p.add_argument("--iterations", type=int, default=30)
+    p.add_argument("--warmup", type=int, default=3)
+    p.add_argument("--concurrency", type=int, default=1)
+    p.add_argument("--characters", type=int, default=5)
+    p.add_argument("--groups", type=int, default=2)
+    p.add_argument("--group-size", type=int, default=3)
+    p.add_argument("--messages", type=int, default=500, help="每个单聊 / 群聊的历史消息条数")
+    p.add_argument("--memory-weeks", type=int, default=52, help="每个角色的长期记忆周数")
+    p.add_argument("--moments", type=int, default=200)
+    p.add_argument("--llm-latency", type=float, default=800.0, help="LLM 桩平均延迟（ms）")
+    p.add_argument("--llm-jitter", type=float, default=200.0, help="LLM 桩延迟抖动（± ms）")
+    p.add_argument("--llm-error-rate", type=float, default=0.0)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--user-id", type=int, default=990001, help="合成工作区使用的用户 id（users/<id>/）")
+    p.add_argument("--keep", action="store_true", help="结束后保留合成工作区")
+    p.add_argument("--json", dest="json_out", help="把结果写入 JSON 文件")
+    p.add_argument("--baseline", help="与之前 --json 的结果对比端到端 p95")
+    p.add_argument("--max-regression", type=float, default=20.0, help="p95 允许变慢的百分比")
+    p.add_argument("--verbose", action="store_true", help="不屏蔽应用自身的日志输出")
+    return p.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = [e for e in endpoints if e not in ENDPOINTS]
+    if unknown:
+        print(f"未知接口: {unknown}", file=sys.stderr)
+        return 2
+
+    spec = WorkspaceSpec(characters=args.characters, groups=args.groups, group_size=args.group_size,
+                         messages=args.messages, memory_weeks=args.memory_weeks, moments=args.moments,
+                         seed=args.seed)
+    real_stdout = sys.stdout
+    quiet = open(os.devnull, "w") if not args.verbose else None
+    results = {"params": vars(args), "endpoints": {}}
+    fake = FakeLLM(args.llm_latency, args.llm_jitter, error_rate=args.llm_error_rate, seed=args.seed)
+    recorder = StageRecorder()
+    fake.on_call = lambda seconds: recorder.record("llm", seconds * 1000)
+
+    with (contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext()):
+        from app import app
+        app.config["TESTING"] = True
+        t0 = time.perf_counter()
+        ws = build_workspace(args.user_id, spec)
+        print(f"[Bench] 工作区生成 {time.perf_counter() - t0:.1f}s: {ws['root']}", file=real_stdout)
+        fake.patch()
+        recorder.install()
+        try:
+            for name in endpoints:
+                print(f"[Bench] {name} ×{args.iterations}（并发 {args.concurrency}）...", file=real_stdout)
+                r = run_endpoint(app, name, ws, recorder, args.iterations, args.warmup, args.concurrency, args.seed)
+                if r is not None:
+                    results["endpoints"][name] = r
+        finally:
+            recorder.uninstall()
+            fake.restore()
+            if not args.keep:
+                remove_workspace(args.user_id)
+    if quiet:
+        quiet.close()
+
+    results["llm_calls"] = fake.calls
+    print_report(results)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n[Bench] 结果已写入 {args.json_out}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.max_regression)
+        for name, old, new in regressions:
+            print(f"[Bench] ⚠️ {name} p95 {old:.1f}ms → {new:.1f}ms（超过 {args.max_regression:.0f}%）")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+阶段计时：把链路上的关键函数临时包一层计时，按阶段名汇总耗时样本，最后输出 p50 / p95 / p99。
+
+包装方式与 fake_llm.replace_everywhere 相同：替换所有模块里对原函数的引用，
+所以 `from app import build_system_prompt_v2` 这类函数内延迟导入也会走到包装后的版本。
+"""
+import functools
+import importlib
+import threading
+import time
+
+from benchmarks.fake_llm import replace_everywhere
+
+# (阶段名, 模块, 函数名)
+DEFAULT_STAGES = [
+    ("prepare_turn", "blueprints.chat", "_prepare_chat_v2_turn"),
+    ("memory_sync.single", "app", "sync_memory_before_single_chat"),
+    ("memory_sync.group", "blueprints.group", "sync_memory_before_group_chat"),
+    ("memory_query.prefetch", "services.prompt_builder", "prefetch_long_memory_query"),
+    ("prompt.build_v2", "services.prompt_builder", "build_system_prompt_v2"),
+    ("prompt.messages_v2", "services.prompt_builder", "build_messages_for_chat_v2"),
+    ("agent_actions", "agent_utils", "process_agent_actions"),
+    ("media_tags", "app", "process_ai_media_tags"),
+    ("stickers", "app", "_sticker_content_from_ai"),
+    ("furigana", "core.utils", "add_furigana_batch"),
+    ("moments.list", "services.moments_store", "list_moments"),
+]
+
+
+def percentile(samples, p) -> float:
+    """线性插值百分位，samples 为空时返回 0。"""
+    if not samples:
+        return 0.0
+    xs = sorted(samples)
+    k = (len(xs) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(xs) - 1)
+    return xs[lo] + (xs[hi] - xs[lo]) * (k - lo)
+
+
+def summarize(samples) -> dict:
+    """毫秒样本 → {count, mean, p50, p95, p99, max}。"""
+    if not samples:
+        return {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    return {
+        "count": len(samples),
+        "mean": sum(samples) / len(samples),
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "max": max(samples),
+    }
+
+
+class StageRecorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}   # {stage: [ms, ...]}
+        self._patched = []
+
+    def record(self, stage, ms):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(ms)
+
+    def reset(self):
+        with self._lock:
+            self.samples = {}
+
+    def _wrap(self, stage, fn):
+        recorder = self
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                recorder.record(stage, (time.perf_counter() - t0) * 1000)
+        return timed
+
+    def _wrap_prompt_section(self, fn):
+        """prompt_builder._run_section(name, provider, ctx)：按分段名分别记录。"""
+        recorder = self
+
+        @functools.wraps(fn)
+        def timed(name, provider, ctx):
+            result, ms = fn(name, provider, ctx)
+            recorder.record(f"prompt.section.{name}", ms)
+            return result, ms
+        return timed
+
+    def install(self, stages=None):
+        for stage, module_name, attr in (stages or DEFAULT_STAGES):
+            try:
+                original = getattr(importlib.import_module(module_name), attr)
+            except Exception as e:
+                print(f"[Bench] 跳过阶段 {stage}（{module_name}.{attr} 不可用: {e}）")
+                continue
+            self._patched.append((original, replace_everywhere(original, self._wrap(stage, original))))
+        try:
+            from services import prompt_builder
+            original = prompt_builder._run_section
+            self._patched.append((original, replace_everywhere(original, self._wrap_prompt_section(original))))
+        except Exception as e:
+            print(f"[Bench] 跳过 prompt 分段计时: {e}")
+        return self
+
+    def uninstall(self):
+        for original, places in self._patched:
+            for mod, name in places:
+                setattr(mod, name, original)
+        self._patched = []
+
+    def report(self) -> dict:
+        with self._lock:
+            return {stage: summarize(xs) for stage, xs in sorted(self.samples.items())}
@@ -0,0 +1,145 @@
+"""
+合成用户工作区：在 users/<user_id>/ 下按与线上相同的目录结构生成角色、群聊、聊天记录、分级记忆和朋友圈，
+跑完基准后整体删除。所有内容由 seed 决定，同一组参数两次生成的数据一致。
+"""
+import json
+import os
+import random
+import shutil
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from core.config import USERS_ROOT
+
+_TOPICS = [
+    "图书馆", "足球比赛", "樱花", "居酒屋", "咖啡店", "期末考试", "海边", "烟花", "便利店", "电影",
+    "训练", "生日", "下雨", "火锅", "猫", "游戏", "演唱会", "夜跑", "早餐", "旅行",
+]
+_TEMPLATES = [
+    "今天去了{t}，感觉还不错", "你还记得上次的{t}吗", "想和你一起去{t}", "{t}那天真的好开心",
+    "我有点累了，{t}之后就回家了", "明天要不要聊聊{t}", "刚才路过{t}想起你", "{t}？听起来很有意思",
+]
+
+
+@dataclass
+class WorkspaceSpec:
+    characters: int = 5
+    groups: int = 2
+    group_size: int = 3
+    messages: int = 500          # 每个单聊 / 群聊的消息条数
+    memory_weeks: int = 52       # 长期记忆周数
+    moments: int = 200
+    seed: int = 42
+
+
+def _sentence(rng) -> str:
+    return rng.choice(_TEMPLATES).format(t=rng.choice(_TOPICS))
+
+
+def _create_chat_db(db_path, rows):
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.executemany("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def _message_rows(rng, roles, n, now):
+    """n 条消息均匀分布在过去 14 天，最后几条落在今天。"""
+    start = now - timedelta(days=14)
+    step = (now - start) / max(1, n)
+    rows = []
+    for i in range(n):
+        ts = (start + step * i).strftime("%Y-%m-%d %H:%M:%S")
+        rows.append((roles[i % len(roles)], "/".join(_sentence(rng) for _ in range(rng.randint(1, 3))), ts))
+    return rows
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def _write_memories(rng, prompts_dir, name, spec, now):
+    from services import memory_store
+    os.makedirs(prompts_dir, exist_ok=True)
+    with open(os.path.join(prompts_dir, "1_base_persona.md"), "w", encoding="utf-8") as f:
+        f.write(f"# {name}\n\n你是{name}，性格温和，喜欢" + "、".join(rng.sample(_TOPICS, 4)) + "。\n")
+
+    long_mem = {}
+    for w in range(spec.memory_weeks, 0, -1):
+        day = now - timedelta(weeks=w)
+        key = f"{day.year}-{day.month:02d}-Week{min(5, (day.day - 1) // 7 + 1)}"
+        long_mem[key] = "\n".join(f"- {_sentence(rng)}" for _ in range(rng.randint(3, 8)))
+    memory_store.import_tier(prompts_dir, memory_store.TIER_LONG, long_mem)
+
+    medium = {(now - timedelta(days=d)).strftime("%Y-%m-%d"): "\n".join(f"- {_sentence(rng)}" for _ in range(4))
+              for d in range(1, 8)}
+    memory_store.import_tier(prompts_dir, memory_store.TIER_MEDIUM, medium)
+
+    today = now.strftime("%Y-%m-%d")
+    short = {today: [{"time": f"{h:02d}:00", "event": _sentence(rng)} for h in range(8, min(now.hour, 20) + 1)]}
+    memory_store.import_tier(prompts_dir, memory_store.TIER_SHORT, short)
+
+
+def build_workspace(user_id, spec: WorkspaceSpec) -> dict:
+    """生成工作区，返回 {"user_id", "root", "char_ids", "group_ids"}。目标目录已存在时先清空。"""
+    rng = random.Random(spec.seed)
+    now = datetime.now()
+    root = os.path.join(USERS_ROOT, str(user_id))
+    remove_workspace(user_id)
+
+    char_ids = [f"bench_char_{i}" for i in range(spec.characters)]
+    chars_cfg = {}
+    for i, cid in enumerate(char_ids):
+        name = f"角色{i}"
+        chars_cfg[cid] = {"name": name, "remark": f"备注{i}", "chat_mode": "online", "deep_sleep": False}
+        char_dir = os.path.join(root, "characters", cid)
+        _create_chat_db(os.path.join(char_dir, "chat.db"), _message_rows(rng, ["user", "assistant"], spec.messages, now))
+        _write_memories(rng, os.path.join(char_dir, "prompts"), name, spec, now)
+    _write_json(os.path.join(root, "configs", "characters.json"), chars_cfg)
+
+    group_ids = [f"bench_group_{i}" for i in range(spec.groups)]
+    groups_cfg = {}
+    for i, gid in enumerate(group_ids):
+        members = rng.sample(char_ids, min(spec.group_size, len(char_ids)))
+        groups_cfg[gid] = {"name": f"群聊{i}", "members": ["user"] + members}
+        _create_chat_db(os.path.join(root, "groups", gid, "chat.db"),
+                        _message_rows(rng, ["user"] + members, spec.messages, now))
+    _write_json(os.path.join(root, "configs", "groups.json"), groups_cfg)
+
+    if spec.moments and char_ids:
+        from services import moments_store
+        for i in range(spec.moments):
+            ts = now - timedelta(hours=i * 3 + 1)
+            likers = rng.sample(char_ids, rng.randint(0, min(3, len(char_ids))))
+            moments_store.add_moment({
+                "char_id": rng.choice(char_ids),
+                "content": _sentence(rng),
+                "timestamp": ts.strftime("%Y-%m-%d %H:%M:%S"),
+                "likers": [{"liker_id": cid, "timestamp": ts.strftime("%Y-%m-%d %H:%M:%S")} for cid in likers],
+                "comments": [{"commenter_id": rng.choice(char_ids), "content": _sentence(rng),
+                              "timestamp": ts.strftime("%Y-%m-%d %H:%M:%S")} for _ in range(rng.randint(0, 3))],
+            }, user_id=user_id)
+
+    return {"user_id": user_id, "root": root, "char_ids": char_ids, "group_ids": group_ids}
+
+
+def remove_workspace(user_id):
+    from core.db import close_dir
+    root = os.path.join(USERS_ROOT, str(user_id))
+    try:
+        close_dir(root)
+    except Exception as e:
+        print(f"[Bench] 关闭连接池失败: {e}")
+    shutil.rmtree(root, ignore_errors=True)
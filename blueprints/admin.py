@@ -82,13 +82,47 @@ def api_admin_stats():
         return jsonify({"error": str(e)}), 500
 
 
+@admin_bp.route("/api/admin/http_stats")
+def api_admin_http_stats():
+    """出站 HTTP 连接池统计（按 host 的请求数、握手次数、复用率）、SQLite 连接池统计、API 日志写入队列统计、事件推送统计以及 LLM 调度排队统计。"""
+    if str(session.get("user_id")) != "1":
+        return jsonify({"error": "Forbidden"}), 403
+    try:
+        from core.http_client import get_http_stats
+        from core.db import get_pool_stats
+        from services.api_log import get_api_log_stats
+        from services.event_bus import get_event_bus_stats
+        from services.llm_scheduler import get_scheduler_stats
+        return jsonify({"http": get_http_stats(), "sqlite": get_pool_stats(), "api_log": get_api_log_stats(),
+                        "events": get_event_bus_stats(), "llm_scheduler": get_scheduler_stats()})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@admin_bp.route("/api/admin/trace_stats")
+def api_admin_trace_stats():
+    """请求追踪汇总：各阶段耗时分位数与平均 prompt 大小、按接口的耗时、缓存命中率、最近请求明细。reset=1 时清空。"""
+    if str(session.get("user_id")) != "1":
+        return jsonify({"error": "Forbidden"}), 403
+    try:
+        from core.tracing import get_trace_stats, reset_trace_stats
+        stats = get_trace_stats()
+        if request.args.get("reset") in ("1", "true"):
+            reset_trace_stats()
+        return jsonify(stats)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @admin_bp.route("/api/admin/refresh_stickers", methods=["GET"])
 def api_admin_refresh_stickers():
     if str(session.get("user_id")) != "1":
         return jsonify({"status": "error", "message": "Admin only"}), 403
     try:
-        core.config.CACHED_OFFICIAL_PACKS = None
-        return jsonify({"status": "success", "message": "Sticker cache cleared"})
+        from services.sticker_index import refresh_sticker_catalog, get_sticker_index_stats
+        if not refresh_sticker_catalog():
+            return jsonify({"status": "error", "message": "Sticker catalog refresh failed"}), 502
+        return jsonify({"status": "success", "message": "Sticker catalog refreshed", "stats": get_sticker_index_stats()})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
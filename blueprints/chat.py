@@ -11,21 +11,32 @@ from datetime import datetime, timedelta
 
 from flask import (
     Blueprint, request, jsonify, session, redirect, send_from_directory,
+    Response, stream_with_context,
 )
 from PIL import Image
 
 from core.config import COS_BASE_URL, CHARACTERS_DIR, USERS_ROOT, DATABASE_FILE
 from core.context import get_current_user_id, set_background_user
 from core.circuit_breaker import get_circuit_breaker_info
+from core.db import pooled_conn, close_dir
 from core.utils import (
-    get_paths, safe_save_json, _add_furigana_to_japanese,
-    _get_characters_config_file, _get_read_status_file,
+    get_paths, safe_save_json, _add_furigana_to_japanese, add_furigana_batch,
+    _get_characters_config_file, _get_read_status_file, _get_groups_config_file, load_json_cached,
 )
 from services import (
     call_gemini, call_openrouter, get_model_config, build_system_prompt_v2,
     call_ai_to_summarize, update_short_memory_for_date,
 )
-from services.prompt_builder import build_messages_for_chat_v2, get_ai_language
+from services.prompt_builder import build_messages_for_chat_v2, get_ai_language, prefetch_long_memory_query
+from services.memory_index import rebuild_long_memory_index
+from services.memory_store import (
+    get_short_day, get_daily_summaries, set_daily_summary, set_weekly_summary, export_tier, import_tier,
+    TIER_SHORT, TIER_MEDIUM, TIER_LONG,
+)
+from services.message_search import search_messages_in_db
+from services.chat_history import build_history_v2, language_config_files
+from services.event_bus import notify_message
+from services.conversation_summary import touch_conversation, mark_conversation_read, KIND_SINGLE, KIND_GROUP
 from agent_utils import process_agent_actions
 from cos_utils import upload_to_cos, get_cos_list
 
@@ -68,6 +79,9 @@ def mark_char_as_read(char_id):
         with open(status_file, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
     except: pass
+    # 会话摘要表里的未读数清零（群聊与单聊共用这个接口，按群聊配置区分）
+    groups = load_json_cached(_get_groups_config_file(), {}) or {}
+    mark_conversation_read(KIND_GROUP if char_id in groups else KIND_SINGLE, char_id)
 
 
 @chat_bp.route("/api/<char_id>/mark_read", methods=["POST"])
@@ -79,7 +93,7 @@ def mark_read_api(char_id):
 
 @chat_bp.route("/api/<char_id>/history", methods=["GET"])
 def get_history(char_id):
-    from app import init_char_db, _sticker_content_from_ai
+    from app import init_char_db
     user_id = get_current_user_id()
     limit = request.args.get('limit', 20, type=int)
     target_id = request.args.get('target_id', type=int)
@@ -89,56 +103,48 @@ def get_history(char_id):
     db_path, _ = get_paths(char_id, user_id=user_id)
     if not os.path.exists(db_path): init_char_db(char_id)
 
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    with pooled_conn(db_path, row_factory=sqlite3.Row) as conn:
+        cursor = conn.cursor()
 
-    messages = []
-
-    # A. 向上滚动 (锚点模式)
-    if before_id:
-        cursor.execute("SELECT id, role, content, timestamp FROM messages WHERE id < ? ORDER BY id DESC LIMIT ?", (before_id, limit))
-        messages = [dict(row) for row in cursor.fetchall()][::-1]
-
-    # B. 向下轮询 (轮询模式)
-    elif after_id:
-        cursor.execute("SELECT id, role, content, timestamp FROM messages WHERE id > ? ORDER BY id ASC LIMIT ?", (after_id, limit))
-        messages = [dict(row) for row in cursor.fetchall()]
-
-    # C. 跳转定位 (精准窗口模式: 上5条 + 目标 + 下5条 = 最多11条)
-    elif target_id:
-        before_msgs = []
-        target_msgs = []
-        after_msgs = []
-        cursor.execute("SELECT id, role, content, timestamp FROM messages WHERE id < ? ORDER BY id DESC LIMIT 5", (target_id,))
-        before_msgs = [dict(row) for row in cursor.fetchall()][::-1]
-        cursor.execute("SELECT id, role, content, timestamp FROM messages WHERE id = ?", (target_id,))
-        target_msgs = [dict(row) for row in cursor.fetchall()]
-        cursor.execute("SELECT id, role, content, timestamp FROM messages WHERE id > ? ORDER BY id ASC LIMIT 5", (target_id,))
-        after_msgs = [dict(row) for row in cursor.fetchall()]
-        messages = before_msgs + target_msgs + after_msgs
-
-    # C. 默认加载
-    else:
-        cursor.execute("SELECT id, role, content, timestamp FROM messages ORDER BY id DESC LIMIT ?", (limit,))
-        messages = [dict(row) for row in cursor.fetchall()][::-1]
-
-    # 将 [表情]名称 解析为 [表情]path（搜索含该名称的表情→随机选一个地址）并写回 DB，刷新后不变，打开编辑时看到的也是改好的 path
-    for m in messages:
-        new_content = _sticker_content_from_ai(m["content"])
-        if new_content != m["content"]:
-            cursor.execute("UPDATE messages SET content = ? WHERE id = ?", (new_content, m["id"]))
-            m["content"] = new_content
-    conn.commit()
+        messages = []
+
+        # A. 向上滚动 (锚点模式)
+        if before_id:
+            cursor.execute("SELECT id, role, content, timestamp FROM messages WHERE id < ? ORDER BY id DESC LIMIT ?", (before_id, limit))
+            messages = [dict(row) for row in cursor.fetchall()][::-1]
+
+        # B. 向下轮询 (轮询模式)
+        elif after_id:
+            cursor.execute("SELECT id, role, content, timestamp FROM messages WHERE id > ? ORDER BY id ASC LIMIT ?", (after_id, limit))
+            messages = [dict(row) for row in cursor.fetchall()]
+
+        # C. 跳转定位 (精准窗口模式: 上5条 + 目标 + 下5条 = 最多11条)
+        elif target_id:
+            before_msgs = []
+            target_msgs = []
+            after_msgs = []
+            cursor.execute("SELECT id, role, content, timestamp FROM messages WHERE id < ? ORDER BY id DESC LIMIT 5", (target_id,))
+            before_msgs = [dict(row) for row in cursor.fetchall()][::-1]
+            cursor.execute("SELECT id, role, content, timestamp FROM messages WHERE id = ?", (target_id,))
+            target_msgs = [dict(row) for row in cursor.fetchall()]
+            cursor.execute("SELECT id, role, content, timestamp FROM messages WHERE id > ? ORDER BY id ASC LIMIT 5", (target_id,))
+            after_msgs = [dict(row) for row in cursor.fetchall()]
+            messages = before_msgs + target_msgs + after_msgs
+
+        # C. 默认加载
+        else:
+            cursor.execute("SELECT id, role, content, timestamp FROM messages ORDER BY id DESC LIMIT ?", (limit,))
+            messages = [dict(row) for row in cursor.fetchall()][::-1]
 
-    cursor.execute("SELECT COUNT(id) FROM messages")
-    total_messages = cursor.fetchone()[0]
-    conn.close()
+        # [表情]名称 已在入库时解析为 path（旧数据由 services.sticker_index.migrate_sticker_rows 迁移），这里只读不写
+
+        cursor.execute("SELECT COUNT(id) FROM messages")
+        total_messages = cursor.fetchone()[0]
 
     # 日语注音处理（不写回DB）
     if get_ai_language(char_id, user_id=user_id) == "ja":
-        for m in messages:
-            m["content"] = _add_furigana_to_japanese(m["content"])
+        for m, converted in zip(messages, add_furigana_batch([m["content"] for m in messages])):
+            m["content"] = converted
 
     return jsonify({
         "messages": messages,
@@ -146,6 +152,36 @@ def get_history(char_id):
     })
 
 
+@chat_bp.route("/api/<char_id>/history/v2", methods=["GET"])
+def get_history_v2(char_id):
+    """
+    聊天记录 v2（见 services/chat_history.py）：
+    - before / after：keyset 游标（消息 id），limit 最大 HISTORY_V2_MAX_LIMIT；
+    - total=1 时才返回总条数；返回列式 columns + has_more + cursor；
+    - 支持 If-None-Match（无变化返回 304）和 after + wait=N 长轮询。
+    """
+    from app import init_char_db
+    user_id = get_current_user_id()
+    db_path, _ = get_paths(char_id, user_id=user_id)
+    if not os.path.exists(db_path): init_char_db(char_id)
+
+    def annotate(messages):
+        # 日语注音处理（不写回DB）
+        if get_ai_language(char_id, user_id=user_id) == "ja":
+            for m, converted in zip(messages, add_furigana_batch([m["content"] for m in messages])):
+                m["content"] = converted
+
+    status, body, etag = build_history_v2(
+        db_path, request.args, request.headers.get("If-None-Match"),
+        annotate=annotate, extra_files=language_config_files(user_id),
+    )
+    resp = Response(status=304) if status == 304 else jsonify(body)
+    if etag:
+        resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
 @chat_bp.route("/api/<char_id>/chat", methods=["POST"])
 def chat(char_id):
     from app import init_char_db, sync_memory_before_single_chat, process_ai_media_tags, _execute_directive, _check_consecutive_tickle, _strip_consecutive_tickle, _extract_tickle_target, _sticker_content_from_ai
@@ -200,6 +236,7 @@ def chat(char_id):
 
     conn.commit()
     conn.close()
+    touch_conversation(KIND_SINGLE, char_id)
 
     # --- 5. 如果在深睡眠，直接返回空回复，不调 AI ---
     if is_deep_sleep:
@@ -217,7 +254,7 @@ def chat(char_id):
     # --- 5.5 单聊前自动同步：总结该角色参与的群聊短期记忆 ---
     memory_sync_warning = None
     try:
-        ok, err = sync_memory_before_single_chat(char_id, user_id=user_id)
+        ok, err = sync_memory_before_single_chat(char_id, user_id=user_id, wait=False)
         if not ok:
             memory_sync_warning = f"记忆同步失败：{err}，本次对话可能缺少部分群聊上下文"
             print(f"   ⚠️ {memory_sync_warning}")
@@ -366,11 +403,13 @@ def chat(char_id):
 
         conn.commit()
         conn.close()
+        notify_message("single", char_id, user_id=user_id, role="assistant")
+        touch_conversation(KIND_SINGLE, char_id, user_id=user_id)
 
         reply_bubbles = list(filter(None, [part.strip() for part in cleaned_reply_text.split('/')]))
 
         if get_ai_language(char_id, user_id=user_id) == "ja":
-            reply_bubbles = [_add_furigana_to_japanese(b) for b in reply_bubbles]
+            reply_bubbles = add_furigana_batch(reply_bubbles)
 
         # 【重点】把 ID 返回给前端；记忆同步失败时附带提示
         resp = {
@@ -393,22 +432,12 @@ def chat(char_id):
 
 
 
-@chat_bp.route("/api/<char_id>/chat_v2", methods=["POST"])
-def chat_v2(char_id):
-    from app import init_char_db, sync_memory_before_single_chat, process_ai_media_tags, _execute_directive, _strip_consecutive_tickle, _sticker_content_from_ai
-    """【测试版】使用新的时间线聚合System Prompt v2版本的聊天接口。"""
-    user_id = get_current_user_id()
-    # 1. 路径准备
-    db_path, prompts_dir = get_paths(char_id, user_id=user_id)
-    if not os.path.exists(db_path):
-        init_char_db(char_id)
-
-    # 2. 获取用户输入
-    data = request.json or {}
-    user_msg_raw = data.get("message", "").strip()
-    if not user_msg_raw:
-        return jsonify({"error": "empty message"}), 400
+def _prepare_chat_v2_turn(char_id, user_id, db_path, user_msg_raw):
+    """chat_v2 / chat_stream 共用的前置流程：存入用户消息、Agent 转交、深睡眠、记忆同步、构建 v2 消息。
 
+    返回 (early_resp, ctx)：early_resp 不为 None 时直接作为响应返回（无需调用 AI）。
+    """
+    from app import sync_memory_before_single_chat
     # 3. 检查深睡眠状态
     is_deep_sleep = False
     chat_mode = "online"
@@ -427,14 +456,12 @@ def chat_v2(char_id):
         is_deep_sleep = False
 
     # 4. 存入用户消息
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
     now = datetime.now()
     user_ts = now.strftime('%Y-%m-%d %H:%M:%S')
-    cursor.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", ("user", user_msg_raw, user_ts))
-    user_msg_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    with pooled_conn(db_path) as conn:
+        cursor = conn.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", ("user", user_msg_raw, user_ts))
+        user_msg_id = cursor.lastrowid
+    touch_conversation(KIND_SINGLE, char_id, user_id=user_id)
 
     # 【Agent】若该用户的浏览器 Agent 正在等待用户回复（[ASK]/[WAIT] 暂停中），
     # 则把本条消息作为 Agent 回复写入 IPC 唤醒它，由 Agent 重新截取页面快照后续跑，
@@ -451,28 +478,29 @@ def chat_v2(char_id):
                     with open(_get_agent_input_path(user_id), "w", encoding="utf-8") as f:
                         json.dump({"command": "reply", "message": user_msg_raw}, f, ensure_ascii=False)
                     print(f"--- [Chat v2] Agent 等待中，已将回复转交 Agent (user={user_id}) ---")
-                    return jsonify({
+                    return {
                         "replies": [],
                         "id": None,
                         "user_id": user_msg_id,
                         "agent_forwarded": True
-                    })
+                    }, None
         except Exception as e:
             print(f"[Chat v2] Agent 转交检查失败: {e}")
 
     # 5. 检查深睡眠
     if is_deep_sleep:
         print(f"--- [Deep Sleep v2] {char_id} 正在熟睡，不回复消息 ---")
-        return jsonify({
+        return {
             "replies": [],
             "id": None,
             "user_id": user_msg_id
-        })
+        }, None
 
-    # 6. 同步记忆
+    # 6. 同步记忆（长期记忆检索的 query 分析先在后台启动，与同步并发）
+    prefetch_long_memory_query(char_id, user_msg_raw, user_id=user_id)
     memory_sync_warning = None
     try:
-        ok, err = sync_memory_before_single_chat(char_id, user_id=user_id)
+        ok, err = sync_memory_before_single_chat(char_id, user_id=user_id, wait=False)
         if not ok:
             memory_sync_warning = f"记忆同步失败：{err}，本次对话可能缺少部分群聊上下文"
             print(f"   ⚠️ {memory_sync_warning}")
@@ -482,12 +510,9 @@ def chat_v2(char_id):
 
     # ===== 【v2核心】使用新的时间线聚合系统提示 =====
     # 读取最近消息用于RAI过滤
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT role, content FROM messages ORDER BY timestamp DESC LIMIT 21")
-    recent_messages_rows = [dict(row) for row in cursor.fetchall()][::-1]
-    conn.close()
+    with pooled_conn(db_path, row_factory=sqlite3.Row) as conn:
+        cursor = conn.execute("SELECT role, content FROM messages ORDER BY timestamp DESC LIMIT 21")
+        recent_messages_rows = [dict(row) for row in cursor.fetchall()][::-1]
     recent_texts = [r["content"] for r in recent_messages_rows] if recent_messages_rows else []
 
     # 构建v2版消息（只包含system + 最新user）
@@ -543,6 +568,40 @@ def chat_v2(char_id):
 
     messages.append({"role": "system", "content": system_hint})
 
+    return None, {
+        "user_msg_id": user_msg_id,
+        "now": now,
+        "messages": messages,
+        "lang": lang,
+        "memory_sync_warning": memory_sync_warning,
+    }
+
+
+@chat_bp.route("/api/<char_id>/chat_v2", methods=["POST"])
+def chat_v2(char_id):
+    from app import init_char_db, process_ai_media_tags, _execute_directive, _strip_consecutive_tickle, _sticker_content_from_ai
+    """【测试版】使用新的时间线聚合System Prompt v2版本的聊天接口。"""
+    user_id = get_current_user_id()
+    # 1. 路径准备
+    db_path, prompts_dir = get_paths(char_id, user_id=user_id)
+    if not os.path.exists(db_path):
+        init_char_db(char_id)
+
+    # 2. 获取用户输入
+    data = request.json or {}
+    user_msg_raw = data.get("message", "").strip()
+    if not user_msg_raw:
+        return jsonify({"error": "empty message"}), 400
+
+    # 3~6. 存入用户消息、深睡眠/Agent 检查、同步记忆、构建消息
+    early_resp, ctx = _prepare_chat_v2_turn(char_id, user_id, db_path, user_msg_raw)
+    if early_resp is not None:
+        return jsonify(early_resp)
+    user_msg_id = ctx["user_msg_id"]
+    now = ctx["now"]
+    messages = ctx["messages"]
+    memory_sync_warning = ctx["memory_sync_warning"]
+
     # 7. 调用AI
     route, current_model = get_model_config("chat", user_id=user_id)
     print(f"--- [Chat v2] char_id: {char_id}, route: {route}, model: {current_model} ---")
@@ -594,17 +653,16 @@ def chat_v2(char_id):
         cleaned_reply = _sticker_content_from_ai(cleaned_reply)
 
         # 存入AI回复
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
         ai_ts = (now + timedelta(seconds=1)).strftime('%Y-%m-%d %H:%M:%S')
-        cursor.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", ("assistant", cleaned_reply, ai_ts))
-        ai_msg_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with pooled_conn(db_path) as conn:
+            cursor = conn.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", ("assistant", cleaned_reply, ai_ts))
+            ai_msg_id = cursor.lastrowid
+        notify_message("single", char_id, user_id=user_id, role="assistant")
+        touch_conversation(KIND_SINGLE, char_id, user_id=user_id)
 
         reply_bubbles = list(filter(None, [part.strip() for part in cleaned_reply.split('/')]))
         if get_ai_language(char_id, user_id=user_id) == "ja" and "[WEB_CRUISE:" not in user_msg_raw:
-            reply_bubbles = [_add_furigana_to_japanese(b) for b in reply_bubbles]
+            reply_bubbles = add_furigana_batch(reply_bubbles)
 
         resp = {
             "replies": [{"content": b, "id": ai_msg_id} for b in reply_bubbles],
@@ -631,6 +689,230 @@ def chat_v2(char_id):
         return jsonify({"error": str(e)}), 500
 
 
+def _iter_stream_bubbles(chunks):
+    """把流式文本块按 '/' 切成气泡：每凑齐一段就 yield 一次。
+
+    方括号（[] / 【】）内部的 '/' 不算分隔符，避免把 [GOTO:https://...] 之类的标签拆断。
+    """
+    buf = []
+    depth = 0
+    for chunk in chunks:
+        for ch in chunk:
+            if ch in "[【":
+                depth += 1
+            elif ch in "]】" and depth > 0:
+                depth -= 1
+            if ch == "/" and depth == 0:
+                yield "".join(buf)
+                buf = []
+                continue
+            buf.append(ch)
+    if buf:
+        yield "".join(buf)
+
+
+def _sse(payload: dict) -> str:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def _estimate_tokens(text) -> int:
+    """服务商没有返回用量时的粗略估算：中日韩字符约 1 token/字，其余约 4 字符/token。"""
+    if not text:
+        return 0
+    cjk = len(re.findall(r'[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]', text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+@chat_bp.route("/api/<char_id>/chat_stream", methods=["POST"])
+def chat_stream(char_id):
+    """chat_v2 的 SSE 流式版本：每生成完一个 '/' 分隔的气泡就推给前端，最终回复只入库一次。
+
+    事件格式（data: JSON）：
+      {"type": "start", "user_id": ...}
+      {"type": "bubble", "index": n, "content": "..."}
+      {"type": "done", "id": ..., "user_id": ..., "model": ..., ...}
+        上游在已推送部分气泡后中断时，已推送的部分照常入库，done 里带 "truncated": true 与 "error"
+      {"type": "error", "error": "..."} / {"type": "done", "circuit_breaker": {...}}
+    """
+    from app import (
+        init_char_db, process_ai_media_tags, _execute_directive,
+        _extract_tickle_target, _sticker_content_from_ai,
+    )
+    from blueprints.forum import stream_gemini_chunks, stream_openrouter_chunks
+    from core.circuit_breaker import check_circuit_breaker, check_relay_global_pause, reset_route_success
+    from services.ai_client import log_full_prompt, record_token_usage
+
+    user_id = get_current_user_id()
+    db_path, _ = get_paths(char_id, user_id=user_id)
+    if not os.path.exists(db_path):
+        init_char_db(char_id)
+
+    data = request.json or {}
+    user_msg_raw = data.get("message", "").strip()
+    if not user_msg_raw:
+        return jsonify({"error": "empty message"}), 400
+
+    early_resp, ctx = _prepare_chat_v2_turn(char_id, user_id, db_path, user_msg_raw)
+    if early_resp is not None:
+        # 无需调用 AI（深睡眠 / Agent 转交），直接以单个 done 事件结束
+        early_resp["type"] = "done"
+        return Response(_sse(early_resp), mimetype='text/event-stream')
+
+    user_msg_id = ctx["user_msg_id"]
+    now = ctx["now"]
+    messages = ctx["messages"]
+    memory_sync_warning = ctx["memory_sync_warning"]
+    use_furigana = ctx["lang"] == "ja" and "[WEB_CRUISE:" not in user_msg_raw
+
+    route, current_model = get_model_config("chat", user_id=user_id)
+    print(f"--- [Chat Stream] char_id: {char_id}, route: {route}, model: {current_model} ---")
+
+    timestamp_pattern = r'\[(?:(?:\d{2}-\d{2}\s+)?\d{1,2}:\d{2})\]\s*'
+
+    def generate():
+        yield _sse({"type": "start", "user_id": user_msg_id, "model": current_model})
+
+        # 流式接口不经过 call_openrouter / call_gemini，这里先手动检查熔断
+        cb = check_relay_global_pause() if route == "relay" else None
+        if not cb and user_id:
+            cb = check_circuit_breaker(user_id, "relay" if route == "relay" else "gemini")
+        if cb:
+            yield _sse({"type": "done", "id": None, "user_id": user_msg_id, "replies": [], "circuit_breaker": cb})
+            return
+
+        usage = {}
+        if route == "relay":
+            chunks = stream_openrouter_chunks(messages, current_model, user_id=user_id, max_tokens=4096, usage=usage)
+        else:
+            chunks = stream_gemini_chunks(messages, current_model, user_id=user_id, usage=usage)
+
+        raw_parts = []
+        stored_bubbles = []
+        state = {"affinity": 0.0, "has_affinity": False, "directive": None, "last_tickle": None,
+                 "fallback": False, "truncated": False}
+
+        def _tee(source):
+            for c in source:
+                raw_parts.append(c)
+                yield c
+
+        def _handle_bubble(raw_bubble):
+            """对单个气泡做与 chat_v2 相同的后处理，返回前端展示内容；被过滤掉时返回 None。"""
+            bubble = re.sub(timestamp_pattern, '', raw_bubble).strip()
+            if not bubble:
+                return None
+            bubble, delta, directive = process_agent_actions(char_id, bubble, user_id)
+            if delta:
+                state["affinity"] += delta
+                state["has_affinity"] = True
+            if directive and state["directive"] is None:
+                state["directive"] = directive
+            bubble = (bubble or "").strip()
+            if not bubble:
+                return None
+
+            # 与 _strip_consecutive_tickle 一致：同目标连续拍一拍只保留第一个
+            is_t, tgt = _extract_tickle_target(bubble)
+            if is_t:
+                norm = "self" if tgt in ("assistant", "self") else tgt
+                if norm == state["last_tickle"]:
+                    return None
+                state["last_tickle"] = norm
+            else:
+                state["last_tickle"] = None
+
+            bubble = process_ai_media_tags(bubble, char_id, user_id=user_id)
+            bubble = _sticker_content_from_ai(bubble)
+            stored_bubbles.append(bubble)
+            return _add_furigana_to_japanese(bubble) if use_furigana else bubble
+
+        try:
+            for raw_bubble in _iter_stream_bubbles(_tee(chunks)):
+                shown = _handle_bubble(raw_bubble)
+                if shown is not None:
+                    yield _sse({"type": "bubble", "index": len(stored_bubbles) - 1, "content": shown})
+        except Exception as e:
+            print(f"Chat Stream Error: {e}")
+            if stored_bubbles:
+                # 已推送部分气泡后上游中断：保留已推送的部分，但告诉前端回复不完整
+                state["truncated"] = True
+            else:
+                # 流式请求失败且还没推送任何气泡：回退到阻塞调用，复用其错误提示、熔断与用量记录
+                state["fallback"] = True
+                raw_parts.clear()
+                if route == "relay":
+                    reply_text_raw = call_openrouter(messages, char_id=char_id, model_name=current_model, user_id=user_id)
+                else:
+                    reply_text_raw = call_gemini(messages, char_id=char_id, model_name=current_model, user_id=user_id)
+                cb_info = get_circuit_breaker_info()
+                if cb_info:
+                    yield _sse({"type": "done", "id": None, "user_id": user_msg_id, "replies": [], "circuit_breaker": cb_info})
+                    return
+                raw_parts.append(reply_text_raw or "")
+                for raw_bubble in _iter_stream_bubbles([reply_text_raw or ""]):
+                    shown = _handle_bubble(raw_bubble)
+                    if shown is not None:
+                        yield _sse({"type": "bubble", "index": len(stored_bubbles) - 1, "content": shown})
+
+        if not stored_bubbles:
+            yield _sse({"type": "error", "error": "AI 返回为空", "user_id": user_msg_id})
+            return
+
+        cleaned_reply = "/".join(stored_bubbles)
+        if not state["fallback"]:
+            raw_reply = "".join(raw_parts)
+            log_full_prompt(f"Stream ({current_model})", messages, response_text=raw_reply)
+            if not usage:
+                # 中转不支持 stream_options 或流中断时拿不到用量，按字数估算
+                in_tokens = sum(_estimate_tokens(m.get("content") if isinstance(m.get("content"), str) else "") for m in messages)
+                out_tokens = _estimate_tokens(raw_reply)
+                usage.update(input_tokens=in_tokens, output_tokens=out_tokens, total_tokens=in_tokens + out_tokens)
+            record_token_usage(char_id, current_model, usage["input_tokens"], usage["output_tokens"], usage["total_tokens"])
+            if user_id and not state["truncated"]:
+                reset_route_success(user_id, "relay" if route == "relay" else "gemini")
+
+        ai_ts = (now + timedelta(seconds=1)).strftime('%Y-%m-%d %H:%M:%S')
+        with pooled_conn(db_path) as conn:
+            cursor = conn.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", ("assistant", cleaned_reply, ai_ts))
+            ai_msg_id = cursor.lastrowid
+        notify_message("single", char_id, user_id=user_id, role="assistant")
+        touch_conversation(KIND_SINGLE, char_id, user_id=user_id)
+
+        first_directive = state["directive"]
+        if first_directive and first_directive.get("type") != "user":
+            print(f"  🔄 [Directive] {char_id} 发出转向指令: {first_directive}", flush=True)
+            _ddir, _ctxt = first_directive, cleaned_reply
+
+            def _bg_exec():
+                set_background_user(user_id)
+                try:
+                    _execute_directive(_ddir, char_id, _ctxt)
+                except Exception as e:
+                    print(f"  ❌ [Directive BG] 指令执行失败: {e}", flush=True)
+            threading.Thread(target=_bg_exec, daemon=True).start()
+
+        done = {"type": "done", "id": ai_msg_id, "user_id": user_msg_id, "model": current_model, "count": len(stored_bubbles)}
+        if "[WEB_CRUISE:" in user_msg_raw:
+            done["full_reply"] = cleaned_reply
+        if state["has_affinity"] and state["affinity"]:
+            done["affinity_delta"] = state["affinity"]
+        if memory_sync_warning:
+            done["memory_sync_warning"] = memory_sync_warning
+        if state["truncated"]:
+            done["truncated"] = True
+            done["error"] = "AI 回复中途中断，只收到了部分内容"
+        yield _sse(done)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            'Connection': 'keep-alive',
+        }
+    )
+
 
 @chat_bp.route("/api/<char_id>/regenerate", methods=["POST"])
 def regenerate_message(char_id):
@@ -641,30 +923,25 @@ def regenerate_message(char_id):
     if not os.path.exists(db_path): return jsonify({"error": "DB not found"}), 404
 
     try:
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with pooled_conn(db_path, row_factory=sqlite3.Row) as conn:
+            cursor = conn.cursor()
 
-        # 2. 检查最后一条是否为 assistant (安全检查)
-        cursor.execute("SELECT id, role, content FROM messages ORDER BY id DESC LIMIT 1")
-        last_row = cursor.fetchone()
+            # 2. 检查最后一条是否为 assistant (安全检查)
+            cursor.execute("SELECT id, role, content FROM messages ORDER BY id DESC LIMIT 1")
+            last_row = cursor.fetchone()
 
-        if not last_row:
-            conn.close()
-            return jsonify({"error": "No messages"}), 400
+            if not last_row:
+                return jsonify({"error": "No messages"}), 400
 
-        if last_row['role'] != 'assistant':
-            conn.close()
-            return jsonify({"error": "Last message is not from assistant"}), 400
+            if last_row['role'] != 'assistant':
+                return jsonify({"error": "Last message is not from assistant"}), 400
 
-        # 3. 删除这条消息
-        cursor.execute("DELETE FROM messages WHERE id = ?", (last_row['id'],))
-        conn.commit()
+            # 3. 删除这条消息
+            cursor.execute("DELETE FROM messages WHERE id = ?", (last_row['id'],))
 
-        # 4. 先读取历史记录，再构建 System Prompt（便于长期记忆 RAI）
-        cursor.execute("SELECT role, content, timestamp FROM messages ORDER BY timestamp DESC LIMIT 20")
-        history_rows = [dict(row) for row in cursor.fetchall()][::-1]
-        conn.close()
+            # 4. 先读取历史记录，再构建 System Prompt（便于长期记忆 RAI）
+            cursor.execute("SELECT role, content, timestamp FROM messages ORDER BY timestamp DESC LIMIT 20")
+            history_rows = [dict(row) for row in cursor.fetchall()][::-1]
 
         recent_texts = [r["content"] for r in history_rows] if history_rows else []
         user_latest = next((r["content"] for r in reversed(history_rows) if r["role"] == "user"), None)
@@ -798,18 +1075,17 @@ def regenerate_message(char_id):
 
         ai_ts = (datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
 
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)",
-                       ("assistant", cleaned_reply_text, ai_ts))
-        new_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with pooled_conn(db_path) as conn:
+            cursor = conn.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)",
+                                  ("assistant", cleaned_reply_text, ai_ts))
+            new_id = cursor.lastrowid
+        notify_message("single", char_id, user_id=user_id, role="assistant")
+        touch_conversation(KIND_SINGLE, char_id, user_id=user_id)
 
         reply_bubbles = list(filter(None, [part.strip() for part in cleaned_reply_text.split('/')]))
 
         if get_ai_language(char_id, user_id=user_id) == "ja":
-            reply_bubbles = [_add_furigana_to_japanese(b) for b in reply_bubbles]
+            reply_bubbles = add_furigana_batch(reply_bubbles)
 
         resp_data = {
             "status": "success",
@@ -848,6 +1124,7 @@ def delete_message(char_id, msg_id):
 
         conn.commit()
         conn.close()
+        touch_conversation(KIND_SINGLE, char_id)
 
         if rows_affected > 0:
             print(f"   ✅ 删除成功，影响行数: {rows_affected}")
@@ -883,6 +1160,7 @@ def edit_message(char_id, msg_id):  # <--- 1. 必须加上 char_id 参数
         cursor.execute("UPDATE messages SET content = ? WHERE id = ?", (new_content, msg_id))
         conn.commit()
         conn.close()
+        touch_conversation(KIND_SINGLE, char_id)
 
         print(f"   ✅ 编辑保存成功")
         return jsonify({"status": "success", "content": new_content})
@@ -1055,20 +1333,10 @@ def regenerate_medium_memory(char_id):
     if not target_date: return jsonify({"error": "日期不能为空"}), 400
 
     _, prompts_dir = get_paths(char_id)
-    short_file = os.path.join(prompts_dir, "6_memory_short.json")
-    medium_file = os.path.join(prompts_dir, "5_memory_medium.json")
 
     try:
         # 1. 读取短期记忆作为素材
-        if not os.path.exists(short_file): return jsonify({"error": "短期记忆文件不存在"}), 404
-        with open(short_file, "r", encoding="utf-8") as f:
-            short_data = json.load(f)
-
-        # 兼容格式
-        day_data = short_data.get(target_date)
-        events = []
-        if isinstance(day_data, list): events = day_data
-        elif isinstance(day_data, dict): events = day_data.get("events", [])
+        events, _ = get_short_day(prompts_dir, target_date)
 
         if not events:
             return jsonify({"error": f"{target_date} 没有短期记忆素材，无法总结"}), 400
@@ -1080,17 +1348,8 @@ def regenerate_medium_memory(char_id):
         summary = call_ai_to_summarize(text_to_summarize, "medium", char_id)
         if not summary: return jsonify({"error": "AI 生成失败"}), 500
 
-        # 4. 更新 Medium 文件
-        medium_data = {}
-        if os.path.exists(medium_file):
-            with open(medium_file, "r", encoding="utf-8") as f:
-                try: medium_data = json.load(f)
-                except: pass
-
-        medium_data[target_date] = summary
-
-        with open(medium_file, "w", encoding="utf-8") as f:
-            json.dump(medium_data, f, ensure_ascii=False, indent=2)
+        # 4. 更新 Medium
+        set_daily_summary(prompts_dir, target_date, summary)
 
         return jsonify({"status": "success", "content": summary})
 
@@ -1105,8 +1364,6 @@ def regenerate_long_memory(char_id):
     if not week_key: return jsonify({"error": "Week Key 不能为空"}), 400
 
     _, prompts_dir = get_paths(char_id)
-    medium_file = os.path.join(prompts_dir, "5_memory_medium.json")
-    long_file = os.path.join(prompts_dir, "4_memory_long.json")
 
     try:
         # 1. 解析周 Key 对应的日期范围
@@ -1135,9 +1392,7 @@ def regenerate_long_memory(char_id):
             return jsonify({"error": "Week Key 格式无法解析"}), 400
 
         # 2. 读取中期记忆作为素材
-        if not os.path.exists(medium_file): return jsonify({"error": "中期记忆文件不存在"}), 404
-        with open(medium_file, "r", encoding="utf-8") as f:
-            medium_data = json.load(f)
+        medium_data = get_daily_summaries(prompts_dir, target_dates)
 
         summary_buffer = []
         for d_str in target_dates:
@@ -1153,17 +1408,9 @@ def regenerate_long_memory(char_id):
         long_summary = call_ai_to_summarize(full_text, "long", char_id)
         if not long_summary: return jsonify({"error": "AI 生成失败"}), 500
 
-        # 4. 更新 Long 文件
-        long_data = {}
-        if os.path.exists(long_file):
-            with open(long_file, "r", encoding="utf-8") as f:
-                try: long_data = json.load(f)
-                except: pass
-
-        long_data[week_key] = long_summary
-
-        with open(long_file, "w", encoding="utf-8") as f:
-            json.dump(long_data, f, ensure_ascii=False, indent=2)
+        # 4. 更新 Long
+        set_weekly_summary(prompts_dir, week_key, long_summary)
+        rebuild_long_memory_index(prompts_dir)
 
         return jsonify({"status": "success", "content": long_summary})
 
@@ -1189,9 +1436,6 @@ def get_prompts_data(char_id):
     files = {
         "base": ["1_base_persona.json", "1_base_persona.md"],
         "relation": "2_relationship.json",
-        "long": "4_memory_long.json",
-        "medium": "5_memory_medium.json",
-        "short": "6_memory_short.json",
         "schedule": "7_schedule.json"
     }
 
@@ -1250,6 +1494,13 @@ def get_prompts_data(char_id):
 
         data[key] = content
 
+    # 4. 分级记忆从 memory.db 按原 JSON 结构导出
+    for tier in (TIER_LONG, TIER_MEDIUM, TIER_SHORT):
+        try:
+            data[tier] = export_tier(prompts_dir, tier)
+        except Exception as e:
+            data[tier] = f"读取出错: {e}"
+
     return jsonify(data)
 
 
@@ -1420,6 +1671,9 @@ def save_prompt_file(char_id):
                 json.dump(old_data, f, ensure_ascii=False, indent=2)
             return jsonify({"status": "success"})
 
+        if key in (TIER_LONG, TIER_MEDIUM, TIER_SHORT) and not isinstance(new_content, dict):
+            return jsonify({"status": "error", "message": "记忆内容必须是 JSON 对象"}), 400
+
         # --- 【核心新增】如果是保存短期记忆，自动校准 last_id ---
         if key == "short" and isinstance(new_content, dict):
             conn = sqlite3.connect(DATABASE_FILE)
@@ -1466,6 +1720,12 @@ def save_prompt_file(char_id):
             conn.close()
         # ----------------------------------------------------
 
+        if key in (TIER_LONG, TIER_MEDIUM, TIER_SHORT):
+            import_tier(prompts_dir, key, new_content)
+            if key == TIER_LONG:
+                rebuild_long_memory_index(prompts_dir)
+            return jsonify({"status": "success"})
+
         with open(path, "w", encoding="utf-8") as f:
             if filename.endswith(".json") and isinstance(new_content, (dict, list)):
                 json.dump(new_content, f, ensure_ascii=False, indent=2)
@@ -1478,34 +1738,23 @@ def save_prompt_file(char_id):
 
 @chat_bp.route("/api/<char_id>/search", methods=["POST"])
 def search_messages(char_id):
-    keyword = request.json.get("keyword", "").strip()
+    """聊天记录搜索（FTS5 全文索引）。可选参数：limit / offset 分页（不传返回全部），order=time|rank，match=phrase|all。"""
+    data = request.json or {}
+    keyword = data.get("keyword", "").strip()
     if not keyword: return jsonify([])
 
-    # 1. 使用 get_paths 获取 per-user 数据库路径
+    # 使用 get_paths 获取 per-user 数据库路径
     db_path, _ = get_paths(char_id)
-
-    print(f"\n--- [Debug] 正在搜索: {keyword} ---")
-    print(f"   -> 目标数据库: {db_path}")
-
     if not os.path.exists(db_path):
-        print(f"   ❌ 数据库文件不存在！")
         return jsonify([])
 
     try:
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        # 2. 模糊搜索
-        cursor.execute("SELECT id, role, content, timestamp FROM messages WHERE content LIKE ? ORDER BY timestamp DESC", (f"%{keyword}%",))
-        rows = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-
-        print(f"   ✅ 搜索完成，找到 {len(rows)} 条结果")
+        rows = search_messages_in_db(db_path, keyword, limit=data.get("limit"),
+                                     offset=data.get("offset", 0), order=data.get("order", "time"),
+                                     match=data.get("match", "phrase"))
         return jsonify(rows)
-
     except Exception as e:
-        print(f"   ❌ 数据库查询报错: {e}")
+        print(f"   ❌ [Search] 数据库查询报错: {e}")
         return jsonify([])
 
 
@@ -1793,6 +2042,7 @@ def delete_character_api(char_id):
 
         db_path, _ = get_paths(char_id)
         char_dir = os.path.dirname(db_path)
+        close_dir(char_dir)
         if os.path.exists(char_dir):
             shutil.rmtree(char_dir)
         return jsonify({"status": "success"})
@@ -1816,14 +2066,9 @@ def regenerate_short_memory_api(char_id):
         count, events = update_short_memory_for_date(char_id, target_date, force_reset=force)
 
         # 为了前端方便，返回最新的完整数据（因为update函数只返回了新增的）
-        # 我们重新读一次文件返回给前端刷新
         _, prompts_dir = get_paths(char_id)
-        short_mem_path = os.path.join(prompts_dir, "6_memory_short.json")
-        with open(short_mem_path, "r", encoding="utf-8") as f:
-            full_data = json.load(f)
-            day_data = full_data.get(target_date, {})
-            # 统一返回 dict 格式
-            if isinstance(day_data, list): day_data = {"events": day_data, "last_id": 0}
+        events, last_id = get_short_day(prompts_dir, target_date)
+        day_data = {"events": events, "last_id": last_id}
 
         return jsonify({
             "status": "success",
@@ -1908,6 +2153,8 @@ def agent_notify_user():
         msg_id = cursor.lastrowid
         conn.commit()
         conn.close()
+        notify_message("single", char_id, user_id=user_id, role="assistant")
+        touch_conversation(KIND_SINGLE, char_id, user_id=user_id)
         return jsonify({"status": "ok", "id": msg_id})
     except Exception as e:
         print(f"Agent Notify Error: {e}")
@@ -1950,6 +2197,7 @@ def agent_reply():
             cursor.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", ("user", message, user_ts))
             conn.commit()
             conn.close()
+            touch_conversation(KIND_SINGLE, char_id, user_id=user_id)
         except Exception as e:
             print(f"Agent reply save user msg error: {e}")
 
@@ -0,0 +1,50 @@
+import time
+
+from flask import Blueprint, request, Response, stream_with_context
+
+from core.config import EVENT_STREAM_HEARTBEAT, EVENT_STREAM_MAX_SECONDS
+from core.context import get_current_user_id
+from services.event_bus import subscribe, unsubscribe, format_sse
+
+events_bp = Blueprint('events', __name__)
+
+
+@events_bp.route("/api/events", methods=["GET"])
+def api_events():
+    """
+    当前用户的事件推送（SSE）：message / moment / memory / resync。
+    浏览器 EventSource 断线后自动重连并带上 Last-Event-ID，服务端补发漏掉的事件；
+    连接保持 EVENT_STREAM_MAX_SECONDS 秒后主动结束，避免长期占用工作线程。
+    """
+    user_id = get_current_user_id()
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    sub = subscribe(user_id, last_event_id)
+
+    def generate():
+        deadline = time.time() + EVENT_STREAM_MAX_SECONDS
+        try:
+            # retry 告诉浏览器断线后多久重连
+            yield "retry: 3000\n\n"
+            while time.time() < deadline:
+                event = sub.get(timeout=min(EVENT_STREAM_HEARTBEAT, max(0.1, deadline - time.time())))
+                if event is None:
+                    yield ": ping\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            unsubscribe(sub)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            'Connection': 'keep-alive',
+        }
+    )
+
@@ -5,7 +5,6 @@ import json
 import sqlite3
 import threading
 import uuid
-import requests
 from datetime import datetime
 
 from flask import Blueprint, request, jsonify, render_template, Response, stream_with_context
@@ -13,7 +12,9 @@ from flask import Blueprint, request, jsonify, render_template, Response, stream
 from core.config import BASE_DIR, OPENROUTER_BASE_URL, OPENROUTER_BASE_URL_OLD
 from core.context import get_current_user_id
 from core.utils import get_effective_gemini_key, get_effective_openrouter_key
+from core.http_client import http_post
 from services.ai_client import call_gemini, call_openrouter, get_model_config, get_relay_provider
+from services.llm_scheduler import llm_slot
 
 forum_bp = Blueprint('forum', __name__)
 
@@ -218,7 +219,8 @@ def build_forum_generation_prompt(chat_segments, forum_type, custom_type_descrip
 
 # ==================== Streaming Helpers ====================
 
-def stream_gemini_chunks(messages, model_name, user_id=None):
+def stream_gemini_chunks(messages, model_name, user_id=None, usage=None):
+    """usage 传入 dict 时，流结束后填入 input_tokens / output_tokens / total_tokens。"""
     base_url = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com")
     api_key = get_effective_gemini_key(user_id=user_id)
     url = f"{base_url}/v1beta/models/{model_name}:streamGenerateContent?key={api_key}&alt=sse"
@@ -254,31 +256,39 @@ def stream_gemini_chunks(messages, model_name, user_id=None):
         "User-Agent": "Mozilla/5.0"
     }
 
-    r = requests.post(url, json=payload, headers=headers, stream=True, timeout=300)
-    r.raise_for_status()
-
-    for line in r.iter_lines():
-        if not line:
-            continue
-        line = line.decode('utf-8', errors='replace')
-        if line.startswith('data: '):
-            data_str = line[6:]
-            if data_str == '[DONE]':
-                break
-            try:
-                data = json.loads(data_str)
-                candidates = data.get('candidates', [])
-                if candidates:
-                    parts = candidates[0].get('content', {}).get('parts', [])
-                    for part in parts:
-                        text = part.get('text', '')
-                        if text:
-                            yield text
-            except json.JSONDecodeError:
-                pass
-
-
-def stream_openrouter_chunks(messages, model_name, user_id=None, max_tokens=8192):
+    # 名额在整个流式输出期间都占用，生成器结束 / 被关闭时释放
+    with llm_slot(base_url, user_id):
+        r = http_post(url, route="llm", json=payload, headers=headers, stream=True)
+        r.raise_for_status()
+
+        for line in r.iter_lines():
+            if not line:
+                continue
+            line = line.decode('utf-8', errors='replace')
+            if line.startswith('data: '):
+                data_str = line[6:]
+                if data_str == '[DONE]':
+                    break
+                try:
+                    data = json.loads(data_str)
+                    meta = data.get('usageMetadata')
+                    if usage is not None and meta:
+                        usage.update(input_tokens=meta.get('promptTokenCount', 0),
+                                     output_tokens=meta.get('candidatesTokenCount', 0),
+                                     total_tokens=meta.get('totalTokenCount', 0))
+                    candidates = data.get('candidates', [])
+                    if candidates:
+                        parts = candidates[0].get('content', {}).get('parts', [])
+                        for part in parts:
+                            text = part.get('text', '')
+                            if text:
+                                yield text
+                except json.JSONDecodeError:
+                    pass
+
+
+def stream_openrouter_chunks(messages, model_name, user_id=None, max_tokens=8192, usage=None):
+    """usage 传入 dict 时请求中转在最后一个 chunk 带上用量，并填入 input_tokens / output_tokens / total_tokens。"""
     relay_provider = get_relay_provider(user_id)
     if relay_provider.startswith("http://") or relay_provider.startswith("https://"):
         base_url = relay_provider
@@ -312,28 +322,36 @@ def stream_openrouter_chunks(messages, model_name, user_id=None, max_tokens=8192
         "max_tokens": max_tokens,
         "stream": True
     }
-
-    r = requests.post(url, json=payload, headers=headers, stream=True, timeout=300)
-    r.raise_for_status()
-
-    for line in r.iter_lines():
-        if not line:
-            continue
-        line = line.decode('utf-8', errors='replace')
-        if line.startswith('data: '):
-            data_str = line[6:]
-            if data_str.strip() == '[DONE]':
-                break
-            try:
-                data = json.loads(data_str)
-                choices = data.get('choices', [])
-                if choices:
-                    delta = choices[0].get('delta', {})
-                    content = delta.get('content', '')
-                    if content:
-                        yield content
-            except json.JSONDecodeError:
-                pass
+    if usage is not None:
+        payload["stream_options"] = {"include_usage": True}
+
+    with llm_slot(base_url, user_id):
+        r = http_post(url, route="llm", json=payload, headers=headers, stream=True)
+        r.raise_for_status()
+
+        for line in r.iter_lines():
+            if not line:
+                continue
+            line = line.decode('utf-8', errors='replace')
+            if line.startswith('data: '):
+                data_str = line[6:]
+                if data_str.strip() == '[DONE]':
+                    break
+                try:
+                    data = json.loads(data_str)
+                    u = data.get('usage')
+                    if usage is not None and u:
+                        usage.update(input_tokens=u.get('prompt_tokens', 0),
+                                     output_tokens=u.get('completion_tokens', 0),
+                                     total_tokens=u.get('total_tokens', 0))
+                    choices = data.get('choices', [])
+                    if choices:
+                        delta = choices[0].get('delta', {})
+                        content = delta.get('content', '')
+                        if content:
+                            yield content
+                except json.JSONDecodeError:
+                    pass
 
 
 def stream_ai_call(messages, user_id=None, task_type="forum", max_tokens=8192):
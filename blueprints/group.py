@@ -1,31 +1,43 @@
 import os
 import time
+import contextvars
 import json
 import re
 import random
 import shutil
 import sqlite3
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 from flask import (
     Blueprint, request, jsonify, session, redirect,
-    render_template, send_from_directory,
+    render_template, send_from_directory, Response, stream_with_context,
 )
 from PIL import Image
 
 from agent_utils import process_agent_actions
 from cos_utils import upload_to_cos
-from core.config import GROUPS_DIR, USERS_ROOT, BASE_DIR
+from core.config import GROUPS_DIR, USERS_ROOT, BASE_DIR, GROUP_PIPELINE, GROUP_PIPELINE_WORKERS, GROUP_PIPELINE_AHEAD
 from core.context import get_current_user_id, set_background_user
 from core.circuit_breaker import get_circuit_breaker_info
+from core.db import pooled_conn, close_dir
+from core.chat_schema import ensure_chat_db
+from core.tracing import traced
 from core.utils import (
     get_paths,
     safe_save_json,
     _get_characters_config_file,
     _get_groups_config_file,
     _add_furigana_to_japanese,
+    add_furigana_batch,
 )
+from services.message_search import search_messages_in_db
+from services.chat_history import build_history_v2, language_config_files
+from services import memory_sync
+from services.event_bus import notify_message
+from services.conversation_summary import touch_conversation, KIND_GROUP
+from services.memory_store import append_short_events, SOURCE_GROUP
 
 group_bp = Blueprint('group', __name__)
 
@@ -47,6 +59,90 @@ def _group_circuit_breaker_response(user_msg_id=None, memory_sync_warning=None,
     return jsonify(resp)
 
 
+# ==================== 群聊多人回复流水线 ====================
+_pipeline_executor = None
+_pipeline_executor_lock = threading.Lock()
+
+
+def _get_pipeline_executor() -> ThreadPoolExecutor:
+    global _pipeline_executor
+    if _pipeline_executor is None:
+        with _pipeline_executor_lock:
+            if _pipeline_executor is None:
+                _pipeline_executor = ThreadPoolExecutor(max_workers=GROUP_PIPELINE_WORKERS, thread_name_prefix="group-pipeline")
+    return _pipeline_executor
+
+
+def _iter_pipelined(items, prepare):
+    """按 items 原顺序 yield (item, prepared)，后面几项的 prepare(item) 提前在线程池里并发执行。
+
+    调用方逐个消费（调模型、入库）时，后面各项的准备工作与之重叠。
+    第一项在当前线程现场准备，不排在别的请求提交的任务后面；之后最多提前提交 GROUP_PIPELINE_AHEAD 项，
+    避免一个请求占满共用线程池。
+    prepare 抛异常或 GROUP_PIPELINE 关闭时 prepared 为 None，由调用方现场构建；提前结束迭代时取消未开始的任务。
+    """
+    if not GROUP_PIPELINE:
+        for item in items:
+            yield item, None
+        return
+    items = list(items)
+    executor = _get_pipeline_executor()
+    ahead = max(0, GROUP_PIPELINE_AHEAD)
+    futures = {}
+    next_idx = 1
+
+    try:
+        for i, item in enumerate(items):
+            while next_idx < len(items) and next_idx <= i + ahead:
+                # 每个任务各自拷贝 contextvars（Flask 请求上下文 / 后台用户）
+                futures[next_idx] = executor.submit(contextvars.copy_context().run, prepare, items[next_idx])
+                next_idx += 1
+            try:
+                prepared = futures.pop(i).result() if i in futures else prepare(item)
+            except Exception as e:
+                print(f"[GroupPipeline] {item} 提前准备失败，改为现场构建: {e}")
+                prepared = None
+            yield item, prepared
+    finally:
+        for fut in futures.values():
+            fut.cancel()
+
+
+def _group_mode_prompt(lang, group_mode, include_user) -> str:
+    """群聊线上 / 线下模式与用户是否在场的说明（按发言者语言）。"""
+    if lang == "ja":
+        mode_str = "今はオンラインチャットです" if group_mode == "online" else "今はオフラインで一緒に過ごしています"
+        if include_user:
+            mode_str += "。ユーザーも同席しています"
+        else:
+            mode_str += "。ユーザーは不在です"
+        if group_mode == "online":
+            mode_str += "。括弧（）で動作を描写することを禁止する。特殊メッセージ形式（音声・ファイル・絵文字等）は使用可能"
+        else:
+            mode_str += "。特殊メッセージ形式（音声・ファイル・絵文字等）の使用を禁止する。括弧（）で動作を描写できる"
+    elif lang == "en":
+        mode_str = "You are chatting online" if group_mode == "online" else "You are spending time together offline"
+        if include_user:
+            mode_str += ". User is also present"
+        else:
+            mode_str += ". User is not present"
+        if group_mode == "online":
+            mode_str += ". Do NOT use parentheses to describe actions. Special message formats (voice, files, emojis, etc.) are allowed"
+        else:
+            mode_str += ". Do NOT use any special message formats. You CAN use parentheses to describe actions"
+    else:
+        mode_str = "现在你们是线上聊天" if group_mode == "online" else "现在你们在线下相处"
+        if include_user:
+            mode_str += "。用户也在"
+        else:
+            mode_str += "。用户不在"
+        if group_mode == "online":
+            mode_str += "。禁止用括号描述动作；可以使用特殊消息格式（语音、文件、表情等）"
+        else:
+            mode_str += "。禁止使用任何特殊消息格式；可用括号描述动作"
+    return mode_str
+
+
 # ==================== 群聊路径与辅助函数 ====================
 
 def get_group_dir(group_id: str) -> str:
@@ -171,7 +267,7 @@ def build_group_relationship_prompt(current_char_id, other_member_ids):
 
 def distribute_group_memory(group_id, group_name, members, new_events, date_str):
     """
-    将群聊新生成的事件，追加到每个成员的 6_memory_group_log.json 中
+    将群聊新生成的事件，追加到每个成员的短期记忆（memory.db）中
     """
     if not new_events:
         print("   [Distribute] 没有新事件需要分发")
@@ -179,67 +275,21 @@ def distribute_group_memory(group_id, group_name, members, new_events, date_str)
 
     print(f"   [Distribute] 正在分发 {len(new_events)} 条事件给成员: {members}")
 
+    # 格式化内容：[群聊:群名] 事件
+    # 【修改】这里确保 event['event'] 是纯文本，不包含奇怪的 AI 生成头信息
+    formatted = [{
+        "time": event['time'],
+        "event": f"[群聊:{group_name}] {event['event'].replace('AI生成信息发送的内容', '').strip()}",
+    } for event in new_events]
+
     for char_id in members:
         if char_id == "user": continue # 跳过用户
 
         try:
-            # 1. 找到该角色的文件路径
             _, prompts_dir = get_paths(char_id)
-            # 【修改】目标文件改为 6_memory_short.json
-            short_file = os.path.join(prompts_dir, "6_memory_short.json")
-
-            # 2. 读取现有数据
-            current_data = {}
-            if os.path.exists(short_file):
-                with open(short_file, "r", encoding="utf-8") as f:
-                    try: current_data = json.load(f)
-                    except: pass
-
-            # 兼容新旧格式 (获取当天的 dict)
-            day_data = current_data.get(date_str, {})
-            # 如果是旧格式列表，转为字典结构
-            if isinstance(day_data, list):
-                existing_events = day_data
-                last_id = 0
-            else:
-                existing_events = day_data.get("events", [])
-                last_id = day_data.get("last_id", 0)
-
-            # 3. 追加新事件 (格式化一下，标明来源)
-            count_added = 0
-            for event in new_events:
-                # 格式化内容：[群聊:群名] 事件
-                # 【修改】这里确保 event['event'] 是纯文本，不包含奇怪的 AI 生成头信息
-                clean_event_text = event['event'].replace('AI生成信息发送的内容', '').strip()
-                event_content = f"[群聊:{group_name}] {clean_event_text}"
-
-                # 简单去重
-                is_duplicate = False
-                for old in existing_events:
-                    if old['time'] == event['time'] and event_content in old['event']:
-                        is_duplicate = True
-                        break
-
-                if not is_duplicate:
-                    existing_events.append({
-                        "time": event['time'],
-                        "event": event_content
-                    })
-                    count_added += 1
-
+            # 只插入新事件行（同一时间相同内容视为重复），last_id 不变，因为这些群聊消息不属于私聊数据库
+            count_added = append_short_events(prompts_dir, date_str, formatted, source=SOURCE_GROUP)
             if count_added > 0:
-                # 按时间重新排序 (保证群聊和私聊按时间穿插)
-                existing_events.sort(key=lambda x: x['time'])
-
-                # 保存回文件 (保持 last_id 不变，因为这些群聊消息不属于私聊数据库)
-                current_data[date_str] = {
-                    "events": existing_events,
-                    "last_id": last_id
-                }
-
-                with open(short_file, "w", encoding="utf-8") as f:
-                    json.dump(current_data, f, ensure_ascii=False, indent=2)
-
                 print(f"     -> [{char_id}] 合并成功 (+{count_added}条)")
 
         except Exception as e:
@@ -259,14 +309,14 @@ def _get_groups_for_char(char_id):
         return []
 
 
-def sync_memory_before_group_chat(group_id):
+@traced("memory.sync_group")
+def sync_memory_before_group_chat(group_id, wait=True):
     """
     群聊前：总结群成员的单聊 + 群成员参与的其他群聊（跳过当前群）的短期记忆。
-    不包含本群群聊记忆。
+    不包含本群群聊记忆。总结在后台 worker 中执行（services.memory_sync），
+    wait=False 时只等待超出陈旧上限的部分。
     返回 (success: bool, error_msg: str|None)
     """
-    from app import update_short_memory_for_date
-
     groups_cfg = _get_groups_config_file()
     if not os.path.exists(groups_cfg):
         return True, None
@@ -277,40 +327,21 @@ def sync_memory_before_group_chat(group_id):
     except Exception:
         members = []
 
-    now = datetime.now()
-    today_str = now.strftime("%Y-%m-%d")
-    dates = [today_str]
-    if now.hour < 4:
-        yesterday_str = (now - timedelta(days=1)).strftime("%Y-%m-%d")
-        dates.insert(0, yesterday_str)
-
     try:
+        dates = memory_sync.sync_dates()
         # 1. 各成员单聊记忆
-        for char_id in members:
-            for d in dates:
-                try:
-                    update_short_memory_for_date(char_id, d)
-                except Exception as e:
-                    print(f"   [Sync] 成员 {char_id} 单聊日期 {d} 同步失败: {e}")
-                    return False, f"成员单聊记忆同步失败: {e}"
+        keys = [(memory_sync.KIND_SINGLE, char_id, d) for char_id in members for d in dates]
 
         # 2. 群成员参与的其他群聊记忆（跳过当前群），汇总后通过 distribute 写入各成员短期记忆
         other_group_ids_seen = set()
         for char_id in members:
             for gid in _get_groups_for_char(char_id):
-                if gid == group_id:
-                    continue
-                if gid in other_group_ids_seen:
+                if gid == group_id or gid in other_group_ids_seen:
                     continue
                 other_group_ids_seen.add(gid)
-                for d in dates:
-                    try:
-                        update_group_short_memory(gid, d)
-                    except Exception as e:
-                        print(f"   [Sync] 成员参与的其他群 {gid} 日期 {d} 同步失败: {e}")
-                        return False, f"其他群聊记忆同步失败: {e}"
+                keys.extend((memory_sync.KIND_GROUP, gid, d) for d in dates)
 
-        return True, None
+        return memory_sync.sync_memory(keys, get_current_user_id(), wait=wait)
     except Exception as e:
         print(f"   [Sync] 群聊前记忆同步失败: {e}")
         return False, str(e)
@@ -386,6 +417,7 @@ def update_group_short_memory(group_id, target_date_str):
     # 4. 查询群数据库
     if not os.path.exists(db_path): return 0, []
 
+    ensure_chat_db(db_path)
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     start_time = f"{target_date_str} 00:00:00"
@@ -475,8 +507,6 @@ def group_memory_view(group_id):
 
 @group_bp.route("/api/group/<group_id>/history", methods=["GET"])
 def get_group_history(group_id):
-    from app import _sticker_content_from_ai, get_ai_language
-
     limit = request.args.get('limit', 20, type=int)
     target_id = request.args.get('target_id', type=int)
     before_id = request.args.get('before_id', type=int)
@@ -522,34 +552,57 @@ def get_group_history(group_id):
         cursor.execute("SELECT id, role, content, timestamp FROM messages ORDER BY id DESC LIMIT ?", (limit,))
         messages = [dict(row) for row in cursor.fetchall()][::-1]
 
-    # 将 [表情]名称 解析为 [表情]path（搜索含该名称的表情→随机选一个地址）并写回 DB，刷新后不变，打开编辑时看到的也是改好的 path
-    for m in messages:
-        new_content = _sticker_content_from_ai(m["content"])
-        if new_content != m["content"]:
-            cursor.execute("UPDATE messages SET content = ? WHERE id = ?", (new_content, m["id"]))
-            m["content"] = new_content
-    conn.commit()
+    # [表情]名称 已在入库时解析为 path（旧数据由 services.sticker_index.migrate_sticker_rows 迁移），这里只读不写
 
     cursor.execute("SELECT COUNT(id) FROM messages")
     total = cursor.fetchone()[0]
     conn.close()
 
-    # 日语注音处理（不写回DB）
+    _annotate_group_furigana(group_id, messages)
+
+    return jsonify({"messages": messages, "total": total})
+
+
+def _annotate_group_furigana(group_id, messages):
+    """群聊日语注音（不写回DB）：按发言角色判断语言，同一角色只判断一次。"""
+    from app import get_ai_language
+    ja_roles = {}
+    ja_msgs = []
     for m in messages:
         sender_role = m.get("role")
         if sender_role and sender_role != "user":
-            if get_ai_language(sender_role, group_id=group_id) == "ja":
-                m["content"] = _add_furigana_to_japanese(m["content"])
-
-    return jsonify({"messages": messages, "total": total})
+            if sender_role not in ja_roles:
+                ja_roles[sender_role] = get_ai_language(sender_role, group_id=group_id) == "ja"
+            if ja_roles[sender_role]:
+                ja_msgs.append(m)
+    for m, converted in zip(ja_msgs, add_furigana_batch([m["content"] for m in ja_msgs])):
+        m["content"] = converted
+
+
+@group_bp.route("/api/group/<group_id>/history/v2", methods=["GET"])
+def get_group_history_v2(group_id):
+    """群聊记录 v2：参数与返回格式同单聊 /api/<char_id>/history/v2。"""
+    db_path = os.path.join(get_group_dir(group_id), "chat.db")
+    if not os.path.exists(db_path):
+        return jsonify({"columns": {"id": [], "role": [], "content": [], "timestamp": []}, "count": 0,
+                        "has_more": False, "cursor": {"before": None, "after": None}})
+    status, body, etag = build_history_v2(
+        db_path, request.args, request.headers.get("If-None-Match"),
+        annotate=lambda messages: _annotate_group_furigana(group_id, messages),
+        extra_files=language_config_files(get_current_user_id()),
+    )
+    resp = Response(status=304) if status == 304 else jsonify(body)
+    if etag:
+        resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
 
 
-# --- 【修正版】群聊核心接口 (完整逻辑：@解析 + 串行 + 变量修复) ---
+# --- 【修正版】群聊核心接口 (完整逻辑：@解析 + 流水线 + 可选流式) ---
 @group_bp.route("/api/group/<group_id>/chat", methods=["POST"])
 def group_chat(group_id):
     from app import (
         _memory_context_changed,
-        build_system_prompt_v2,
         get_ai_language,
         get_model_config,
         call_openrouter,
@@ -562,6 +615,8 @@ def group_chat(group_id):
         _sticker_content_for_ai,
         _execute_directive,
     )
+    from services.prompt_builder import prepare_system_prompt_v2, finish_system_prompt_v2
+    from blueprints.chat import _sse
 
     # 1. 基础准备
     data = request.json
@@ -574,7 +629,7 @@ def group_chat(group_id):
     memory_sync_warning = None
     if _memory_context_changed(user_id, f"group:{group_id}"):
         try:
-            ok, err = sync_memory_before_group_chat(group_id)
+            ok, err = sync_memory_before_group_chat(group_id, wait=False)
             if not ok:
                 memory_sync_warning = f"记忆同步失败：{err}，本次对话可能缺少部分单聊上下文"
                 print(f"   ⚠️ {memory_sync_warning}")
@@ -599,10 +654,6 @@ def group_chat(group_id):
     ai_members_all = [m for m in all_members if m != "user"]
     if not ai_members_all: return jsonify({"error": "No AI members"}), 404
 
-    # --- 【关键修正 1】提前初始化变量 ---
-    replies_for_frontend = []
-    group_affinity_delta = 0.0
-
     # --- 【关键步骤】获取在线成员 (过滤掉深睡眠的) ---
     # 需要读取 characters.json 查看 deep_sleep 状态 (使用 per-user 配置)
     id_to_name = {}
@@ -647,29 +698,25 @@ def group_chat(group_id):
     if not online_ai_members:
         print("--- [GroupChat] 全员睡眠中，无人回复 ---")
         # 依然要存用户消息
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
         now = datetime.now()
         user_ts = now.strftime('%Y-%m-%d %H:%M:%S')
-        cursor.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", ("user", user_msg, user_ts))
-        conn.commit()
-        conn.close()
+        with pooled_conn(db_path) as conn:
+            conn.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", ("user", user_msg, user_ts))
+        touch_conversation(KIND_GROUP, group_id, user_id=user_id)
         resp = {"replies": []}
         if memory_sync_warning:
             resp["memory_sync_warning"] = memory_sync_warning
         return jsonify(resp)
 
     # 3. 存入用户消息
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
     now = datetime.now()
     user_ts = now.strftime('%Y-%m-%d %H:%M:%S')
 
-    cursor.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)",
-                   ("user", user_msg, user_ts))
-    user_msg_id = cursor.lastrowid # 【新增】获取刚存入的用户消息 ID
-    conn.commit()
-    conn.close()
+    with pooled_conn(db_path) as conn:
+        cursor = conn.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)",
+                              ("user", user_msg, user_ts))
+        user_msg_id = cursor.lastrowid # 【新增】获取刚存入的用户消息 ID
+    touch_conversation(KIND_GROUP, group_id, user_id=user_id)
 
     # 4. 决定回复顺序 (智能 @ 逻辑)
     responder_ids = []
@@ -718,224 +765,254 @@ def group_chat(group_id):
 
     # 5. 预加载历史记录 (Context Buffer)
     context_buffer = []
+    current_group_cfg = (group_conf or {}).get(group_id, {})
+    group_mode = current_group_cfg.get("group_chat_mode", "online")
+    include_user = current_group_cfg.get("include_user", True)
+
+    def _read_history():
+        with pooled_conn(db_path, row_factory=sqlite3.Row) as conn:
+            cursor = conn.execute("SELECT role, content, timestamp FROM messages ORDER BY timestamp DESC LIMIT 20")
+            return [dict(row) for row in cursor.fetchall()][::-1]
+
+    def _prepare_speaker(speaker_id, recent_texts, user_latest, defer_live_sections=True):
+        """构建某个发言者与最新聊天记录无关的 prompt 部分：v2 各分段 + 群聊关系 + 模式说明。"""
+        prepared = prepare_system_prompt_v2(speaker_id, include_global_format=True, recent_messages=recent_texts,
+                                            user_latest_input=user_latest, group_id=group_id, user_id=user_id,
+                                            defer_live_sections=defer_live_sections)
+        other_members = [m for m in all_members if m != speaker_id]
+        rel_prompt = build_group_relationship_prompt(speaker_id, other_members)
+        lang = get_ai_language(speaker_id, group_id=group_id)
+        suffix = ("\n\n" + rel_prompt + "\n【Current Situation】\n当前是在群聊中。"
+                  + _group_mode_prompt(lang, group_mode, include_user) + "。请注意上下文，与其他成员自然互动。")
+        return prepared, suffix
+
+    # 流水线：所有发言者回应的都是用户这条消息，长期记忆 RAI 统一以此刻的上下文为准，
+    # 各发言者的 prompt 在线程池里提前并发准备，与前面发言者的模型调用重叠；轮到谁时再补读最新记录
+    trigger_rows = _read_history()
+    trigger_texts = [r["content"] for r in trigger_rows]
+    trigger_latest = trigger_rows[-1]["content"] if trigger_rows and trigger_rows[-1]["role"] == "user" else None
+    state = {"affinity": 0.0, "circuit_breaker": False}
+
+    def _prepare_ahead(speaker_id):
+        # 在流水线线程里执行（已拷贝请求上下文），带上当前用户
+        set_background_user(user_id)
+        return _prepare_speaker(speaker_id, trigger_texts, trigger_latest)
+
+    def _generate_replies():
+        """按 responder_ids 顺序逐个调用模型并入库，每条回复入库后立即 yield。"""
+        pipeline = _iter_pipelined(responder_ids, _prepare_ahead)
+        try:
+            yield from _speak_in_order(pipeline)
+        finally:
+            pipeline.close()
 
-    # 6. 串行循环生成
-    # 【注意】这里遍历的是确定的 responder_ids 列表
-    for i, speaker_id in enumerate(responder_ids):
+    def _speak_in_order(pipeline):
+        # 6. 串行生成（发言顺序与入库顺序一致，后面的人能看到前面的回复）
+        for i, (speaker_id, prepared) in enumerate(pipeline):
 
-        speaker_name = id_to_name.get(speaker_id, speaker_id)
-        print(f"   -> 第 {i+1} 轮: 由 [{speaker_name}] 发言")
+            speaker_name = id_to_name.get(speaker_id, speaker_id)
+            print(f"   -> 第 {i+1} 轮: 由 [{speaker_name}] 发言")
 
-        # --- B. 先读取群聊历史，再构建 Prompt（便于长期记忆 RAI）---
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT role, content, timestamp FROM messages ORDER BY timestamp DESC LIMIT 20")
-        history_rows = [dict(row) for row in cursor.fetchall()][::-1]
-        conn.close()
+            # --- B. 读取最新群聊历史（含前面发言者刚入库的回复），补齐 Prompt ---
+            history_rows = _read_history()
 
-        recent_texts = [r["content"] for r in history_rows] if history_rows else []
-        user_latest = history_rows[-1]["content"] if history_rows and history_rows[-1]["role"] == "user" else None
+            if prepared is None:
+                # 未启用流水线 / 提前准备失败：按当前记录现场构建
+                recent_texts = [r["content"] for r in history_rows] if history_rows else []
+                user_latest = history_rows[-1]["content"] if history_rows and history_rows[-1]["role"] == "user" else None
+                prepared = _prepare_speaker(speaker_id, recent_texts, user_latest, defer_live_sections=False)
+            sys_prompt_prepared, suffix = prepared
 
-        # 【全局采用 v2】直接使用v2系统提示
-        sys_prompt = build_system_prompt_v2(speaker_id, include_global_format=True, recent_messages=recent_texts, user_latest_input=user_latest, group_id=group_id)
+            # 【全局采用 v2】直接使用v2系统提示
+            full_sys_prompt = finish_system_prompt_v2(sys_prompt_prepared) + suffix
 
-        other_members = [m for m in all_members if m != speaker_id]
-        rel_prompt = build_group_relationship_prompt(speaker_id, other_members)
+            messages = [{"role": "system", "content": full_sys_prompt}]
 
-        full_sys_prompt = sys_prompt + "\n\n" + rel_prompt + "\n【Current Situation】\n当前是在群聊中。"
+            # --- C. 处理历史记录 (智能时间戳 + 名字标签) ---
 
-        # 注入群聊线上线下模式上下文
-        current_group_cfg = (group_conf or {}).get(group_id, {})
-        group_mode = current_group_cfg.get("group_chat_mode", "online")
-        include_user = current_group_cfg.get("include_user", True)
-        lang = get_ai_language(speaker_id, group_id=group_id)
-        if lang == "ja":
-            mode_str = "今はオンラインチャットです" if group_mode == "online" else "今はオフラインで一緒に過ごしています"
-            if include_user:
-                mode_str += "。ユーザーも同席しています"
-            else:
-                mode_str += "。ユーザーは不在です"
-            if group_mode == "online":
-                mode_str += "。括弧（）で動作を描写することを禁止する。特殊メッセージ形式（音声・ファイル・絵文字等）は使用可能"
-            else:
-                mode_str += "。特殊メッセージ形式（音声・ファイル・絵文字等）の使用を禁止する。括弧（）で動作を描写できる"
-        elif lang == "en":
-            mode_str = "You are chatting online" if group_mode == "online" else "You are spending time together offline"
-            if include_user:
-                mode_str += ". User is also present"
-            else:
-                mode_str += ". User is not present"
-            if group_mode == "online":
-                mode_str += ". Do NOT use parentheses to describe actions. Special message formats (voice, files, emojis, etc.) are allowed"
-            else:
-                mode_str += ". Do NOT use any special message formats. You CAN use parentheses to describe actions"
-        else:
-            mode_str = "现在你们是线上聊天" if group_mode == "online" else "现在你们在线下相处"
-            if include_user:
-                mode_str += "。用户也在"
-            else:
-                mode_str += "。用户不在"
-            if group_mode == "online":
-                mode_str += "。禁止用括号描述动作；可以使用特殊消息格式（语音、文件、表情等）"
-            else:
-                mode_str += "。禁止使用任何特殊消息格式；可用括号描述动作"
-        full_sys_prompt += mode_str + "。请注意上下文，与其他成员自然互动。"
-
-        messages = [{"role": "system", "content": full_sys_prompt}]
+            # 1. 判断时间跨度 (是否跨天)
+            show_full_date = False
+            now_dt = datetime.now() # 获取当前时间用于比较
+            if history_rows:
+                try:
+                    first_ts = datetime.strptime(history_rows[0]['timestamp'], '%Y-%m-%d %H:%M:%S')
+                    if first_ts.date() != now_dt.date():
+                        show_full_date = True
+                except: pass
+
+            # 2. 时间线已包含最近群聊消息，此处仅追加最后1条作为触发
+            if history_rows:
+                row = history_rows[-1]
+                # a. 处理时间戳格式
+                try:
+                    dt_obj = datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M:%S')
+                    if show_full_date:
+                        ts_str = dt_obj.strftime('[%m-%d %H:%M]')
+                    else:
+                        ts_str = dt_obj.strftime('[%H:%M]')
+                except:
+                    ts_str = ""
 
-        # --- C. 处理历史记录 (智能时间戳 + 名字标签) ---
+                # b. 处理名字
+                r_id = row['role']
+                d_name = "User" if r_id == "user" else id_to_name.get(r_id, r_id)
 
-        # 1. 判断时间跨度 (是否跨天)
-        show_full_date = False
-        now_dt = datetime.now() # 获取当前时间用于比较
-        if history_rows:
-            try:
-                first_ts = datetime.strptime(history_rows[0]['timestamp'], '%Y-%m-%d %H:%M:%S')
-                if first_ts.date() != now_dt.date():
-                    show_full_date = True
-            except: pass
+                # c. 组合 Content
+                msg_role = "user"
+                content_for_ai = _sticker_content_for_ai(row['content'])
+                content_with_tag = f"{ts_str} [{d_name}]: {content_for_ai}"
 
-        # 2. 时间线已包含最近群聊消息，此处仅追加最后1条作为触发
-        if history_rows:
-            row = history_rows[-1]
-            # a. 处理时间戳格式
-            try:
-                dt_obj = datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M:%S')
-                if show_full_date:
-                    ts_str = dt_obj.strftime('[%m-%d %H:%M]')
-                else:
-                    ts_str = dt_obj.strftime('[%H:%M]')
-            except:
-                ts_str = ""
+                messages.append({"role": msg_role, "content": content_with_tag})
 
-            # b. 处理名字
-            r_id = row['role']
-            d_name = "User" if r_id == "user" else id_to_name.get(r_id, r_id)
+            # 1. 获取当前配置
+            route, current_model = get_model_config("chat", user_id=user_id) # 任务类型是 chat
 
-            # c. 组合 Content
-            msg_role = "user"
-            content_for_ai = _sticker_content_for_ai(row['content'])
-            content_with_tag = f"{ts_str} [{d_name}]: {content_for_ai}"
+            print(f"--- [Dispatch] Route: {route}, Model: {current_model} ---")
 
-            messages.append({"role": msg_role, "content": content_with_tag})
-
-        # 1. 获取当前配置
-        route, current_model = get_model_config("chat", user_id=user_id) # 任务类型是 chat
-
-        print(f"--- [Dispatch] Route: {route}, Model: {current_model} ---")
+            try:
+                if route == "relay":
+                    reply_text = call_openrouter(messages, char_id=speaker_id, model_name=current_model, user_id=user_id)
+                else:
+                    reply_text = call_gemini(messages, char_id=speaker_id, model_name=current_model, user_id=user_id)
+
+                if get_circuit_breaker_info():
+                    state["circuit_breaker"] = True
+                    return
+
+                timestamp_pattern = r'\[(?:(?:\d{2}-\d{2}\s+)?\d{1,2}:\d{2})\]\s*'
+                cleaned_reply = re.sub(timestamp_pattern, '', reply_text).strip()
+
+                # --- 【新增】拦截动作标签 (Emotion/Affinity等) ---
+                cleaned_reply, delta, dir_d = process_agent_actions(speaker_id, cleaned_reply, get_current_user_id())
+                if delta:
+                    state["affinity"] += delta
+                print(f"  [DEBUG] dir_d = {repr(dir_d)}, type={type(dir_d).__name__}", flush=True)
+
+                # --- 【转向指令】处理 DIRECT_TO_GROUP / DIRECT_TO_USER ---
+                if dir_d:
+                    skip = False
+                    if dir_d.get("type") == "group":
+                        # 检查是否会转向同一个群：计算目标群成员，若与当前群成员一致则跳过
+                        target_members = set([speaker_id] + dir_d.get("member_ids", []))
+                        current_members = set(m for m in all_members if m != "user")
+                        if target_members == current_members:
+                            print(f"  ⚠️ [Directive] 目标群与当前群成员相同，忽略 DIRECT_TO_GROUP", flush=True)
+                            skip = True
+                    if not skip:
+                        print(f"", flush=True)
+                        print(f"{'='*50}", flush=True)
+                        print(f"  🔄 [Directive] 群聊中 {speaker_name} 发出转向指令: {dir_d}", flush=True)
+                        uid = get_current_user_id()
+                        _ddir, _sid, _ctxt = dir_d, speaker_id, cleaned_reply
+                        def _bg_exec():
+                            set_background_user(uid)
+                            try:
+                                _execute_directive(_ddir, _sid, _ctxt)
+                            except Exception as e:
+                                print(f"  ❌ [Directive BG] 指令执行失败: {e}", flush=True)
+                                import traceback
+                                traceback.print_exc()
+                        threading.Thread(target=_bg_exec, daemon=True).start()
+                        print(f"{'='*50}", flush=True)
+
+                cleaned_reply = _strip_consecutive_tickle(cleaned_reply)
+
+                # 去除 AI 自带的名字前缀
+                name_pattern = f"^\\[{speaker_name}\\][:：]\\s*"
+                cleaned_reply = re.sub(name_pattern, '', cleaned_reply).strip()
+
+                # --- 【关键修复】拦截器顺序调整 ---
+                cleaned_reply = process_ai_media_tags(cleaned_reply, speaker_id)
+                # 把 [表情]name 转成 [表情]path 再入库
+                cleaned_reply = _sticker_content_from_ai(cleaned_reply)
+
+                if not cleaned_reply: continue
+
+                # --- D. 存档 ---
+                ai_ts = (datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
+
+                with pooled_conn(db_path) as conn:
+                    cursor = conn.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)",
+                                          (speaker_id, cleaned_reply, ai_ts))
+                    # 【关键修复】获取刚刚插入的这条消息的 ID
+                    new_msg_id = cursor.lastrowid
+                notify_message("group", group_id, user_id=user_id, role=speaker_id)
+                touch_conversation(KIND_GROUP, group_id, user_id=user_id)
+
+                # 更新 Buffer (供下一个人看)
+                context_buffer.append({
+                    "role_id": speaker_id,
+                    "display_name": speaker_name,
+                    "content": cleaned_reply
+                })
+
+                # 注音处理（只影响返回给前端的内容，入库的是原文）
+                shown = cleaned_reply
+                if get_ai_language(speaker_id, group_id=group_id) == "ja":
+                    shown = _add_furigana_to_japanese(shown)
+
+                # 【关键修正 3】交给调用方：一次性返回或逐条推送
+                yield {
+                    "id": new_msg_id,
+                    "char_id": speaker_id,
+                    "name": speaker_name,
+                    "content": shown,
+                    "timestamp": ai_ts
+                }
 
-        try:
-            if route == "relay":
-                reply_text = call_openrouter(messages, char_id=speaker_id, model_name=current_model, user_id=user_id)
-            else:
-                reply_text = call_gemini(messages, char_id=speaker_id, model_name=current_model, user_id=user_id)
-
-            cb_resp = _group_circuit_breaker_response(
-                user_msg_id=user_msg_id,
-                memory_sync_warning=memory_sync_warning,
-                affinity_delta=group_affinity_delta,
-            )
-            if cb_resp:
-                return cb_resp
-
-            timestamp_pattern = r'\[(?:(?:\d{2}-\d{2}\s+)?\d{1,2}:\d{2})\]\s*'
-            cleaned_reply = re.sub(timestamp_pattern, '', reply_text).strip()
-
-            # --- 【新增】拦截动作标签 (Emotion/Affinity等) ---
-            cleaned_reply, delta, dir_d = process_agent_actions(speaker_id, cleaned_reply, get_current_user_id())
-            if delta:
-                group_affinity_delta += delta
-            print(f"  [DEBUG] dir_d = {repr(dir_d)}, type={type(dir_d).__name__}", flush=True)
-
-            # --- 【转向指令】处理 DIRECT_TO_GROUP / DIRECT_TO_USER ---
-            if dir_d:
-                skip = False
-                if dir_d.get("type") == "group":
-                    # 检查是否会转向同一个群：计算目标群成员，若与当前群成员一致则跳过
-                    target_members = set([speaker_id] + dir_d.get("member_ids", []))
-                    current_members = set(m for m in all_members if m != "user")
-                    if target_members == current_members:
-                        print(f"  ⚠️ [Directive] 目标群与当前群成员相同，忽略 DIRECT_TO_GROUP", flush=True)
-                        skip = True
-                if not skip:
-                    print(f"", flush=True)
-                    print(f"{'='*50}", flush=True)
-                    print(f"  🔄 [Directive] 群聊中 {speaker_name} 发出转向指令: {dir_d}", flush=True)
-                    uid = get_current_user_id()
-                    _ddir, _sid, _ctxt = dir_d, speaker_id, cleaned_reply
-                    def _bg_exec():
-                        set_background_user(uid)
-                        try:
-                            _execute_directive(_ddir, _sid, _ctxt)
-                        except Exception as e:
-                            print(f"  ❌ [Directive BG] 指令执行失败: {e}", flush=True)
-                            import traceback
-                            traceback.print_exc()
-                    threading.Thread(target=_bg_exec, daemon=True).start()
-                    print(f"{'='*50}", flush=True)
-
-            cleaned_reply = _strip_consecutive_tickle(cleaned_reply)
-
-            # 去除 AI 自带的名字前缀
-            name_pattern = f"^\\[{speaker_name}\\][:：]\\s*"
-            cleaned_reply = re.sub(name_pattern, '', cleaned_reply).strip()
-
-            # --- 【关键修复】拦截器顺序调整 ---
-            cleaned_reply = process_ai_media_tags(cleaned_reply, speaker_id)
-            # 把 [表情]name 转成 [表情]path 再入库
-            cleaned_reply = _sticker_content_from_ai(cleaned_reply)
-
-            if not cleaned_reply: continue
-
-            # --- D. 存档 ---
-            ai_ts = (datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
-
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)",
-                           (speaker_id, cleaned_reply, ai_ts))
-            # 【关键修复】获取刚刚插入的这条消息的 ID
-            new_msg_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
-
-            # 更新 Buffer (供下一个人看)
-            context_buffer.append({
-                "role_id": speaker_id,
-                "display_name": speaker_name,
-                "content": cleaned_reply
-            })
+            except Exception as e:
+                print(f"Group Chat Error ({speaker_id}): {e}")
 
-            # 【关键修正 3】添加到返回列表
-            replies_for_frontend.append({
-                "id": new_msg_id,
-                "char_id": speaker_id,
-                "name": speaker_name,
-                "content": cleaned_reply,
-                "timestamp": ai_ts
-            })
+    def _final_resp(replies):
+        # 7. 最终返回；记忆同步失败时附带提示
+        resp = {"replies": replies, "user_id": user_msg_id}
+        if state["affinity"]:
+            resp["affinity_delta"] = round(state["affinity"], 2)
+        if memory_sync_warning:
+            resp["memory_sync_warning"] = memory_sync_warning
+        cb_info = get_circuit_breaker_info()
+        if cb_info:
+            resp["circuit_breaker"] = cb_info
+        return resp
+
+    if data.get("stream"):
+        # 流式：每位发言者的回复一入库就推给前端，顺序与入库顺序一致
+        #   {"type": "start", "user_id": ...} / {"type": "reply", ...回复} / {"type": "done", ...同非流式返回}
+        def generate():
+            yield _sse({"type": "start", "user_id": user_msg_id, "count": len(responder_ids)})
+            replies = []
+            for rep in _generate_replies():
+                replies.append(rep)
+                yield _sse({"type": "reply", **rep})
+            if state["circuit_breaker"]:
+                # 与非流式一致：熔断时不再继续，已推送的回复保留
+                done = {"type": "done", "replies": [], "user_id": user_msg_id, "circuit_breaker": get_circuit_breaker_info()}
+                if state["affinity"]:
+                    done["affinity_delta"] = round(state["affinity"], 2)
+                if memory_sync_warning:
+                    done["memory_sync_warning"] = memory_sync_warning
+                yield _sse(done)
+                return
+            yield _sse({"type": "done", **_final_resp(replies)})
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no',
+                'Connection': 'keep-alive',
+            }
+        )
 
-        except Exception as e:
-            print(f"Group Chat Error ({speaker_id}): {e}")
-
-    # 注音处理
-    for rep in replies_for_frontend:
-        # group chat 返回的是单个 string 还是分段？其实分段在前端分，这里 content 是 string
-        s_id = rep.get("char_id")
-        if s_id and get_ai_language(s_id, group_id=group_id) == "ja":
-                rep["content"] = _add_furigana_to_japanese(rep["content"])
-
-    # 7. 最终返回；记忆同步失败时附带提示
-    resp = {"replies": replies_for_frontend, "user_id": user_msg_id}
-    if group_affinity_delta:
-        resp["affinity_delta"] = round(group_affinity_delta, 2)
-    if memory_sync_warning:
-        resp["memory_sync_warning"] = memory_sync_warning
-    cb_info = get_circuit_breaker_info()
-    if cb_info:
-        resp["circuit_breaker"] = cb_info
-    return jsonify(resp)
+    replies_for_frontend = list(_generate_replies())
+    if state["circuit_breaker"]:
+        return _group_circuit_breaker_response(
+            user_msg_id=user_msg_id,
+            memory_sync_warning=memory_sync_warning,
+            affinity_delta=state["affinity"],
+        )
+    return jsonify(_final_resp(replies_for_frontend))
 
 
 # --- 【新增】群聊消息删除接口 ---
@@ -960,6 +1037,7 @@ def delete_group_message(group_id, msg_id):
 
         conn.commit()
         conn.close()
+        touch_conversation(KIND_GROUP, group_id)
 
         if rows_affected > 0:
             print(f"   ✅ 群消息删除成功")
@@ -997,6 +1075,7 @@ def edit_group_message(group_id, msg_id):
         cursor.execute("UPDATE messages SET content = ? WHERE id = ?", (new_content, msg_id))
         conn.commit()
         conn.close()
+        touch_conversation(KIND_GROUP, group_id)
 
         print(f"   ✅ 群消息编辑成功")
         return jsonify({"status": "success", "content": new_content})
@@ -1258,21 +1337,23 @@ def update_group_meta(group_id):
 # --- 【新增】群聊搜索接口 ---
 @group_bp.route("/api/group/<group_id>/search", methods=["POST"])
 def search_group_messages(group_id):
-    keyword = request.json.get("keyword", "").strip()
+    """群聊记录搜索（FTS5 全文索引）。可选参数：limit / offset 分页（不传返回全部），order=time|rank，match=phrase|all。"""
+    data = request.json or {}
+    keyword = data.get("keyword", "").strip()
     if not keyword: return jsonify([])
 
     group_dir = get_group_dir(group_id)
     db_path = os.path.join(group_dir, "chat.db")
     if not os.path.exists(db_path): return jsonify([])
 
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, role, content, timestamp FROM messages WHERE content LIKE ? ORDER BY timestamp DESC", (f"%{keyword}%",))
-    rows = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-
-    return jsonify(rows)
+    try:
+        rows = search_messages_in_db(db_path, keyword, limit=data.get("limit"),
+                                     offset=data.get("offset", 0), order=data.get("order", "time"),
+                                     match=data.get("match", "phrase"))
+        return jsonify(rows)
+    except Exception as e:
+        print(f"[Group Search] 数据库查询报错: {e}")
+        return jsonify([])
 
 
 # ==================== 群聊配置 / 头像 / 增删 ====================
@@ -1459,6 +1540,7 @@ def add_group():
         """)
         conn.commit()
         conn.close()
+        ensure_chat_db(db_path)
 
         # 5. 更新配置（写入当前用户 groups.json）
         groups_config[new_id] = {
@@ -1497,6 +1579,7 @@ def delete_group_api(group_id):
             json.dump(groups_config, f, ensure_ascii=False, indent=2)
 
         group_dir = get_group_dir(group_id)
+        close_dir(group_dir)
         if os.path.exists(group_dir):
             shutil.rmtree(group_dir)
         return jsonify({"status": "success"})
@@ -20,7 +20,13 @@ from core.utils import (
     _add_furigana_to_japanese, get_paths, get_current_username,
     _get_characters_config_file, get_effective_gemini_key,
 )
-from cos_utils import upload_to_cos, get_cos_list
+from core.http_client import http_post
+from services.sticker_index import (
+    find_sticker_paths, resolve_sticker_content, list_official_packs, list_pack_stickers, get_pack_cover,
+    search_stickers, add_user_sticker, add_official_sticker,
+)
+from services.event_bus import notify_message
+from cos_utils import upload_to_cos
 from agent_utils import parse_music_tags
 import music_api
 import music_manager
@@ -166,11 +172,8 @@ def _sticker_content_for_ai(content: str) -> str:
 
 
 def _resolve_sticker_name_to_path(name: str) -> str:
-    name = (name or "").strip()
-    items = _search_stickers(name)
-    if not items:
-        return ""
-    return random.choice(items)["path"]
+    paths = find_sticker_paths(name)
+    return random.choice(paths) if paths else ""
 
 
 def _resolve_sticker_name_to_path_deterministic(name: str) -> str:
@@ -186,34 +189,13 @@ def _resolve_sticker_name_to_path_deterministic(name: str) -> str:
 
 
 def _sticker_content_from_ai(content: str) -> str:
-    if not content:
-        return content
-
-    if "[表情]" not in content:
-        return content
-    pattern = r"\[表情\](.*?)(?=\s*/\s*|$)"
-    def repl(m):
-        name_or_path = (m.group(1) or "").strip()
-        if name_or_path.startswith("official:") or name_or_path.startswith("user:"):
-            return m.group(0)
-        path = _resolve_sticker_name_to_path(name_or_path)
-        return f"[表情]{path}" if path else m.group(0)
-    return re.sub(pattern, repl, content)
+    return resolve_sticker_content(content)
 
 
 # ==================== Sticker API 基础设施 ====================
 
 def _list_official_packs():
-    if core.config.CACHED_OFFICIAL_PACKS is not None:
-        return core.config.CACHED_OFFICIAL_PACKS
-
-    try:
-        folders = get_cos_list("stickers/", get_folders=True)
-        core.config.CACHED_OFFICIAL_PACKS = folders
-        return core.config.CACHED_OFFICIAL_PACKS
-    except Exception as e:
-        print(f"   [COS Error] Failed to list official packs: {e}")
-        return []
+    return list_official_packs()
 
 
 COVER_BASENAME = "cover"
@@ -236,69 +218,17 @@ def _get_pack_meta(pack_id):
 def _get_pack_cover_url(pack_id):
     if ".." in pack_id or "/" in pack_id or "\\" in pack_id:
         return None
-
-    try:
-        files = get_cos_list(f"stickers/{pack_id}/")
-        for s in files:
-            name_no_ext = os.path.splitext(s["name"])[0].lower()
-            if name_no_ext == COVER_BASENAME:
-                return s["url"]
-    except Exception:
-        pass
-    return None
+    return get_pack_cover(pack_id)
 
 
 def _list_pack_stickers(pack_id):
     if ".." in pack_id or "/" in pack_id or "\\" in pack_id:
         return []
-
-    out = []
-    try:
-        files = get_cos_list(f"stickers/{pack_id}/")
-        for s in files:
-            filename = s["name"]
-            name_no_ext, ext = os.path.splitext(filename)
-
-            if COVER_BASENAME in name_no_ext.lower():
-                continue
-
-            if ext.lower() in STICKER_IMAGE_EXT:
-                path = f"official:{pack_id}:{filename}"
-                out.append({
-                    "path": path,
-                    "name": name_no_ext,
-                    "url": s["url"]
-                })
-    except Exception as e:
-        print(f"   [COS Error] Failed to list stickers for {pack_id}: {e}")
-
-    return out
+    return list_pack_stickers(pack_id)
 
 
 def _search_stickers(q):
-    q = (q or "").strip().lower()
-    out = []
-    for pack_id in _list_official_packs():
-        for s in _list_pack_stickers(pack_id):
-            if q in s["name"].lower():
-                s = dict(s)
-                s["pack_name"] = pack_id
-                out.append(s)
-    uid = get_current_user_id()
-    if uid:
-        cos_prefix = f"users/{uid}/sticker_uploads/"
-        user_stickers = get_cos_list(cos_prefix)
-        for s in user_stickers:
-            name = s["name"]
-            if q in name.lower():
-                path = f"user:{name}"
-                out.append({
-                    "path": path,
-                    "name": os.path.splitext(name)[0],
-                    "url": s["url"],
-                    "pack_name": "个人上传"
-                })
-    return out
+    return search_stickers(q)
 
 
 def _load_favorites():
@@ -495,9 +425,11 @@ def api_stickers_upload():
         user_id = get_current_user_id()
         if user_id:
             cos_path = f"users/{user_id}/sticker_uploads/{safe_name}"
-            upload_to_cos(dest, cos_path)
+            url = upload_to_cos(dest, cos_path)
             if os.path.exists(dest):
                 os.remove(dest)
+            if url:
+                add_user_sticker(user_id, safe_name, url)
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
     path = f"user:{safe_name}"
@@ -543,7 +475,9 @@ def api_stickers_packs_upload():
 
     cover_local_path = os.path.join(pack_dir, COVER_BASENAME + cover_ext)
     cover.save(cover_local_path)
-    upload_to_cos(cover_local_path, f"stickers/{pack_id}/{COVER_BASENAME + cover_ext}")
+    cover_url = upload_to_cos(cover_local_path, f"stickers/{pack_id}/{COVER_BASENAME + cover_ext}")
+    if cover_url:
+        add_official_sticker(pack_id, COVER_BASENAME + cover_ext, cover_url)
 
     sticker_count = 0
     i = 0
@@ -572,7 +506,9 @@ def api_stickers_packs_upload():
             safe_name = f"{base}_{idx}{ext}"
             dest = os.path.join(pack_dir, safe_name)
         f.save(dest)
-        upload_to_cos(dest, f"stickers/{pack_id}/{safe_name}")
+        url = upload_to_cos(dest, f"stickers/{pack_id}/{safe_name}")
+        if url:
+            add_official_sticker(pack_id, safe_name, url)
 
         sticker_count += 1
         i += 1
@@ -980,6 +916,7 @@ def _start_music_auto_continue(char_id, user_id, result_content):
 
             db_path, _ = get_paths(char_id)
             if db_path:
+                cleaned_reply = resolve_sticker_content(cleaned_reply, user_id=user_id)
                 conn = sqlite3.connect(db_path)
                 cur = conn.cursor()
                 now_ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -987,6 +924,7 @@ def _start_music_auto_continue(char_id, user_id, result_content):
                            ("assistant", cleaned_reply, now_ts))
                 conn.commit()
                 conn.close()
+                notify_message("single", char_id, user_id=user_id, role="assistant")
 
             print(f"[MusicAuto] auto-continue 完成: char={char_id}")
         except Exception as e:
@@ -1035,6 +973,7 @@ def _handle_music_tag_in_chat(char_id, user_id, tag):
                     for i, s in enumerate(pl.get("songs", []))
                 )
                 result = f"[MUSIC_RESULT:{json.dumps({'type': 'playlist_view', 'playlist': pl}, ensure_ascii=False)}]"
+                result = resolve_sticker_content(result, user_id=user_id)
                 conn = sqlite3.connect(db_path)
                 cur = conn.cursor()
                 cur.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)",
@@ -1049,6 +988,7 @@ def _handle_music_tag_in_chat(char_id, user_id, tag):
         db_path, _ = get_paths(char_id)
         if db_path:
             result = f"[MUSIC_RESULT:{json.dumps({'type': 'playlist_created', 'playlist': pl}, ensure_ascii=False)}]"
+            result = resolve_sticker_content(result, user_id=user_id)
             conn = sqlite3.connect(db_path)
             cur = conn.cursor()
             cur.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)",
@@ -1090,6 +1030,7 @@ def _start_music_search_and_continue(char_id, user_id, music_tags):
                     "songs": songs
                 }
                 result_msg = f"[MUSIC_RESULT:{json.dumps(result_data, ensure_ascii=False)}]"
+                result_msg = resolve_sticker_content(result_msg, user_id=user_id)
 
                 conn = sqlite3.connect(db_path)
                 cur = conn.cursor()
@@ -1098,6 +1039,7 @@ def _start_music_search_and_continue(char_id, user_id, music_tags):
                            ("system", result_msg, result_ts))
                 conn.commit()
                 conn.close()
+                notify_message("single", char_id, user_id=user_id, role="system")
 
                 time.sleep(0.8)
 
@@ -1243,8 +1185,9 @@ def char_tts(char_id):
     print(f"[TTS] char={char_id} emotion={voice_emotion!r} stability={stability} similarity={similarity_boost} style={style}")
 
     try:
-        resp = requests.post(
+        resp = http_post(
             f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
+            route="tts",
             headers={
                 "xi-api-key": ELEVENLABS_API_KEY,
                 "Content-Type": "application/json"
@@ -1258,7 +1201,6 @@ def char_tts(char_id):
                     "style": style
                 }
             },
-            timeout=30
         )
         if resp.status_code != 200:
             return jsonify({"error": f"ElevenLabs TTS failed: {resp.text}"}), resp.status_code
@@ -1303,8 +1245,9 @@ def char_tts_voice(char_id):
     print(f"[TTS_VOICE] char={char_id} text={text[:50]}...")
 
     try:
-        resp = requests.post(
+        resp = http_post(
             f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
+            route="tts",
             headers={
                 "xi-api-key": ELEVENLABS_API_KEY,
                 "Content-Type": "application/json"
@@ -1318,7 +1261,6 @@ def char_tts_voice(char_id):
                     "style": 0.0
                 }
             },
-            timeout=30
         )
         if resp.status_code != 200:
             return jsonify({"error": f"ElevenLabs TTS failed: {resp.text}"}), resp.status_code
@@ -1501,7 +1443,7 @@ def vision_upload():
                     {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"}
                 ]
             }
-            r = requests.post(url, json=payload, timeout=100)
+            r = http_post(url, route="gemini_vision", json=payload)
             if r.status_code != 200:
                 raise RuntimeError(f"[Gemini Vision Error {r.status_code}] {r.text}")
             result = r.json()
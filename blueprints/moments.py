@@ -20,6 +20,10 @@ from core.utils import (
     get_characters_config_for_current_user, get_current_username,
     _load_user_settings, _get_groups_config_file,
 )
+from services import moments_store
+from services.event_bus import notify_message
+from services.sticker_index import resolve_sticker_content
+from services.memory_store import append_short_events, SOURCE_MOMENT
 
 # --- Fallback constants (redefined in blueprint scope) ---
 MOMENTS_DATA_FILE = os.path.join(BASE_DIR, "configs", "moments_data.json")
@@ -139,12 +143,12 @@ def _get_moments_name_to_id(user_id=None):
     return mapping
 
 
-def _find_moment_post(raw, char_id, timestamp_str):
-    """在 raw 列表中找到 char_id + timestamp 匹配的一条，返回 (index, post) 或 (None, None)。"""
-    for i, post in enumerate(raw):
-        if post.get("char_id") == char_id and post.get("timestamp") == timestamp_str:
-            return i, post
-    return None, None
+def _find_moment_post(char_id, timestamp_str, user_id=None):
+    """按 char_id + timestamp 取一条朋友圈，返回 (id, post) 或 (None, None)。"""
+    post = moments_store.get_moment(char_id, timestamp_str, user_id=user_id)
+    if post is None:
+        return None, None
+    return post["id"], post
 
 
 def process_moments_media_tags(text, char_id, user_id=None):
@@ -208,33 +212,10 @@ def append_moment_event_to_short_memory(char_id, context_text, user_id=None):
         if not line:
             return
         _, prompts_dir = get_paths(char_id)
-        short_file = os.path.join(prompts_dir, "6_memory_short.json")
         date_str = datetime.now().strftime("%Y-%m-%d")
         time_str = datetime.now().strftime("%H:%M")
-
-        current_data = {}
-        if os.path.exists(short_file):
-            with open(short_file, "r", encoding="utf-8") as f:
-                try:
-                    current_data = json.load(f)
-                except Exception:
-                    pass
-
-        day_data = current_data.get(date_str, {})
-        if isinstance(day_data, list):
-            existing_events = list(day_data)
-            last_id = 0
-        else:
-            existing_events = list(day_data.get("events", []))
-            last_id = day_data.get("last_id", 0)
-
-        existing_events.append({"time": time_str, "event": line})
-        existing_events.sort(key=lambda x: x["time"])
-
-        current_data[date_str] = {"events": existing_events, "last_id": last_id}
-        os.makedirs(os.path.dirname(short_file), exist_ok=True)
-        with open(short_file, "w", encoding="utf-8") as f:
-            json.dump(current_data, f, ensure_ascii=False, indent=2)
+        append_short_events(prompts_dir, date_str, [{"time": time_str, "event": line}],
+                            source=SOURCE_MOMENT, dedupe=False)
     except Exception as e:
         print(f"   [Moments] 写入短期记忆失败 [{char_id}]: {e}")
 
@@ -637,11 +618,13 @@ def _execute_directive(directive, char_id, message_text):
             s_clean, _, _ = process_agent_actions(char_id, s_clean, user_id)
 
             if s_clean:
+                s_clean = resolve_sticker_content(s_clean, user_id=user_id)
                 s_conn2 = sqlite3.connect(s_db_path)
                 s_cursor2 = s_conn2.cursor()
                 s_cursor2.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", ("assistant", s_clean, now_dt.strftime('%Y-%m-%d %H:%M:%S')))
                 s_conn2.commit()
                 s_conn2.close()
+                notify_message("single", char_id, user_id=user_id, role="assistant")
                 print(f"  {char_name}: {s_clean}", flush=True)
             print(f"  [_execute_directive] {char_name} 切换到单聊", flush=True)
             return
@@ -756,11 +739,13 @@ def _execute_directive(directive, char_id, message_text):
         print(f"  FIRST MESSAGE: {init_reply}")
 
         if init_reply:
+            init_reply = resolve_sticker_content(init_reply, user_id=user_id)
             d_conn = sqlite3.connect(d_db_path)
             d_cursor = d_conn.cursor()
             d_cursor.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", (char_id, init_reply, init_now.strftime('%Y-%m-%d %H:%M:%S')))
             d_conn.commit()
             d_conn.close()
+            notify_message("group", d_group_id, user_id=user_id, role=char_id)
         print(f"{'~'*50}")
 
         # --- 其他成员多轮自动回复 ---
@@ -845,11 +830,13 @@ def _execute_directive(directive, char_id, message_text):
                                 should_stop = True
                                 break
 
+                            d_clean = resolve_sticker_content(d_clean, user_id=user_id)
                             d_conn3 = sqlite3.connect(d_db_path)
                             d_cursor3 = d_conn3.cursor()
                             d_cursor3.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", (d_speaker_id, d_clean, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
                             d_conn3.commit()
                             d_conn3.close()
+                            notify_message("group", d_group_id, user_id=user_id, role=d_speaker_id)
                             print(f"  {d_speaker_name}: {d_clean}")
 
                             prev_last_speaker = d_speaker_id
@@ -1148,26 +1135,11 @@ def _background_generate_moment_reactions(user_id, char_id, post_ts_str, post_co
                 print(f"  [Moments Background] No new reactions generated for post {post_ts_str}, worker finished.")
                 return
 
-            # 回填到文件
-            moments_path, _ = get_moments_paths(user_id=user_id)
-            if os.path.exists(moments_path):
-                with open(moments_path, "r", encoding="utf-8-sig") as f:
-                    data = json.load(f)
-
-                # 寻找匹配的帖子
-                found = False
-                for post in data:
-                    if post.get("char_id") == char_id and post.get("timestamp") == post_ts_str:
-                        post.setdefault("likers", []).extend(new_likers)
-                        post.setdefault("comments", []).extend(new_comments)
-                        found = True
-                        break
-
-                if found:
-                    safe_save_json(moments_path, data)
-                    print(f"  [Moments Background] Successfully saved {len(new_likers)} likes and {len(new_comments)} comments for post {post_ts_str}.")
-                else:
-                    print(f"  [Moments Background] Could not find post with ts {post_ts_str} to save reactions.")
+            # 回填到朋友圈库（只追加这一条的点赞/评论）
+            if moments_store.add_reactions(char_id, post_ts_str, likers=new_likers, comments=new_comments, user_id=user_id):
+                print(f"  [Moments Background] Successfully saved {len(new_likers)} likes and {len(new_comments)} comments for post {post_ts_str}.")
+            else:
+                print(f"  [Moments Background] Could not find post with ts {post_ts_str} to save reactions.")
 
         except Exception as e:
             print(f"  [Moments Background] An unexpected error occurred in worker: {e}")
@@ -1404,15 +1376,8 @@ def trigger_active_moments(char_id, user_id=None, instruction=None):
         new_post["instruction"] = instruction.strip()
 
     # 保存帖子
-    moments_path, last_post_path = get_moments_paths(user_id=user_id)
-    raw = []
-    if os.path.exists(moments_path):
-        try:
-            with open(moments_path, "r", encoding="utf-8-sig") as f:
-                raw = json.load(f)
-        except: raw = []
-    raw.append(new_post)
-    safe_save_json(moments_path, raw)
+    _, last_post_path = get_moments_paths(user_id=user_id)
+    moments_store.add_moment(new_post, user_id=user_id)
 
     # 记录发帖者记忆
     ctx = f"你发了一条朋友圈，内容：「{(content or '')[:300]}」。"
@@ -1550,9 +1515,12 @@ def get_moments_related_characters():
 
 @moments_bp.route("/api/moments", methods=["GET"])
 def get_moments():
-    """朋友圈列表。数据格式：char_id, content, timestamp, liker_ids, comments (commenter_id, content, timestamp)。评论时间大于当前时间的不返回。"""
+    """朋友圈列表。数据格式：id, char_id, content, timestamp, liker_ids, comments (commenter_id, content, timestamp)。评论时间大于当前时间的不返回。
+
+    分页：page（第几页，每页 10 条）；或 before_id=上一页最后一条的 id（游标分页，翻到很深也不变慢）。
+    """
     user_id = get_current_user_id()
-    now = datetime.now()
+    now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     # 分页参数：默认第 1 页，每页 10 条
     try:
         page = int(request.args.get("page", 1))
@@ -1560,63 +1528,48 @@ def get_moments():
         page = 1
     if page < 1: page = 1
     page_size = 10
+    try:
+        before_id = int(request.args["before_id"]) if request.args.get("before_id") else None
+    except (TypeError, ValueError):
+        before_id = None
 
     filter_char_id = request.args.get("filter_char_id", "all")
 
     avatars, remarks = _get_moments_id_display()
-    moments = []
-    moments_path, _ = get_moments_paths(user_id=user_id)
-    if not os.path.exists(moments_path):
-        return jsonify(moments)
     try:
-        with open(moments_path, "r", encoding="utf-8-sig") as f:
-            raw = json.load(f)
+        posts = moments_store.list_moments(
+            user_id=user_id, limit=page_size, offset=(page - 1) * page_size, before_id=before_id,
+            char_id=None if filter_char_id == "all" else filter_char_id, visible_before=now_str,
+        )
     except Exception as e:
-        print(f"moments_data.json load error: {e}")
-        return jsonify(moments)
-    for post in raw:
-        char_id = post.get("char_id", "")
-        # 角色筛选逻辑
-        if filter_char_id != "all":
-            if filter_char_id == "user":
-                if char_id != "user": continue
-            elif char_id != filter_char_id:
-                continue
+        print(f"moments store load error: {e}")
+        return jsonify([])
 
+    moments = []
+    for post in posts:
+        char_id = post.get("char_id", "")
         comments_ok = []
-        for src_idx, c in enumerate(post.get("comments", [])):
-            try:
-                ts = datetime.strptime(c["timestamp"], "%Y-%m-%d %H:%M:%S")
-                if ts <= now:
-                    reply_to_id = c.get("reply_to")
-                    reply_to_remark = remarks.get(reply_to_id, reply_to_id or "") if reply_to_id else ""
-                    comments_ok.append({
-                        "comment_index": src_idx,
-                        "commenter_id": c.get("commenter_id", ""),
-                        "content": clean_moments_agent_instructions(c.get("content", "")),
-                        "timestamp": c.get("timestamp", ""),
-                        "avatar": avatars.get(c.get("commenter_id"), "/static/default_avatar.png"),
-                        "remark": remarks.get(c.get("commenter_id"), c.get("commenter_id", "")),
-                        "reply_to": reply_to_id,
-                        "reply_to_remark": reply_to_remark
-                    })
-            except: pass
-        # 支持新格式 likers: [{liker_id, timestamp}] 与旧格式 liker_ids: []
-        liker_ids_raw = post.get("liker_ids", [])
-        likers_with_ts = post.get("likers", [])
-        if likers_with_ts:
-            liker_ids_ok = []
-            for like in likers_with_ts:
-                try:
-                    ts = datetime.strptime(like.get("timestamp", ""), "%Y-%m-%d %H:%M:%S")
-                    if ts <= now:
-                        liker_ids_ok.append(like.get("liker_id", ""))
-                except: pass
-            liker_remarks = [remarks.get(lid, lid) for lid in liker_ids_ok]
+        for c in post.get("comments", []):
+            reply_to_id = c.get("reply_to")
+            reply_to_remark = remarks.get(reply_to_id, reply_to_id or "") if reply_to_id else ""
+            comments_ok.append({
+                "comment_index": c["comment_index"],
+                "commenter_id": c.get("commenter_id", ""),
+                "content": clean_moments_agent_instructions(c.get("content", "")),
+                "timestamp": c.get("timestamp", ""),
+                "avatar": avatars.get(c.get("commenter_id"), "/static/default_avatar.png"),
+                "remark": remarks.get(c.get("commenter_id"), c.get("commenter_id", "")),
+                "reply_to": reply_to_id,
+                "reply_to_remark": reply_to_remark
+            })
+        # 新格式 likers: [{liker_id, timestamp}]（已按时间过滤）优先，否则用旧格式 liker_ids: []
+        if post.get("likers"):
+            liker_ids_ok = [l.get("liker_id", "") for l in post["likers"]]
         else:
-            liker_ids_ok = liker_ids_raw
-            liker_remarks = [remarks.get(lid, lid) for lid in liker_ids_ok]
+            liker_ids_ok = post.get("liker_ids", [])
+        liker_remarks = [remarks.get(lid, lid) for lid in liker_ids_ok]
         moments.append({
+            "id": post["id"],
             "char_id": char_id,
             "content": clean_moments_agent_instructions(post.get("content", "")),
             "timestamp": post.get("timestamp", ""),
@@ -1626,13 +1579,7 @@ def get_moments():
             "liker_remarks": liker_remarks,
             "comments": comments_ok
         })
-    moments.sort(key=lambda x: x["timestamp"], reverse=True)
-
-    # 分页截取
-    start = (page - 1) * page_size
-    end = start + page_size
-    paged = moments[start:end]
-    return jsonify(paged)
+    return jsonify(moments)
 
 
 @moments_bp.route("/api/moments/like", methods=["POST"])
@@ -1645,16 +1592,7 @@ def moments_like():
     if not char_id or not timestamp_str:
         return jsonify({"error": "缺少 char_id 或 timestamp"}), 400
 
-    moments_path, _ = get_moments_paths(user_id=user_id)
-    if not os.path.exists(moments_path):
-        return jsonify({"error": "暂无朋友圈数据"}), 404
-    try:
-        with open(moments_path, "r", encoding="utf-8-sig") as f:
-            raw = json.load(f)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-    idx, post = _find_moment_post(raw, char_id, timestamp_str)
+    idx, post = _find_moment_post(char_id, timestamp_str, user_id=user_id)
     if idx is None:
         return jsonify({"error": "未找到该条朋友圈"}), 404
 
@@ -1664,8 +1602,7 @@ def moments_like():
     if not already_liked:
         likers.append({"liker_id": "user", "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
         post["likers"] = likers
-        raw[idx] = post
-        safe_save_json(moments_path, raw)
+        moments_store.save_moment(post, user_id=user_id)
 
     return jsonify({"status": "success", "liked": True})
 
@@ -1680,16 +1617,7 @@ def moments_unlike():
     if not char_id or not timestamp_str:
         return jsonify({"error": "缺少 char_id 或 timestamp"}), 400
 
-    moments_path, _ = get_moments_paths(user_id=user_id)
-    if not os.path.exists(moments_path):
-        return jsonify({"error": "暂无朋友圈数据"}), 404
-    try:
-        with open(moments_path, "r", encoding="utf-8-sig") as f:
-            raw = json.load(f)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-    idx, post = _find_moment_post(raw, char_id, timestamp_str)
+    idx, post = _find_moment_post(char_id, timestamp_str, user_id=user_id)
     if idx is None:
         return jsonify({"error": "未找到该条朋友圈"}), 404
 
@@ -1707,8 +1635,7 @@ def moments_unlike():
 
     if changed:
         post["likers"] = new_likers
-        raw[idx] = post
-        safe_save_json(moments_path, raw)
+        moments_store.save_moment(post, user_id=user_id)
 
     return jsonify({"status": "success", "liked": False})
 
@@ -1728,15 +1655,6 @@ def moments_comment():
     if len(content) > 500:
         return jsonify({"error": "评论内容不得超过500字"}), 400
 
-    moments_path, _ = get_moments_paths(user_id=user_id)
-    if not os.path.exists(moments_path):
-        return jsonify({"error": "暂无朋友圈数据"}), 404
-    try:
-        with open(moments_path, "r", encoding="utf-8-sig") as f:
-            raw = json.load(f)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
     chars_config = {}
     cfg_file = _get_characters_config_file(user_id=user_id)
     if os.path.exists(cfg_file):
@@ -1746,7 +1664,7 @@ def moments_comment():
         except Exception:
             pass
 
-    idx, post = _find_moment_post(raw, char_id, timestamp_str)
+    idx, post = _find_moment_post(char_id, timestamp_str, user_id=user_id)
     if idx is None:
         return jsonify({"error": "未找到该条朋友圈"}), 404
 
@@ -1754,8 +1672,7 @@ def moments_comment():
     comments = post.get("comments", [])
     comments.append({"commenter_id": "user", "content": content, "timestamp": now})
     post["comments"] = comments
-    raw[idx] = post
-    safe_save_json(moments_path, raw)
+    moments_store.save_moment(post, user_id=user_id)
 
     # 仅当评论的不是用户自己的朋友圈时，才由作者生成回复和记忆
     author_char_id = char_id
@@ -1768,8 +1685,7 @@ def moments_comment():
             comments = post.get("comments", [])
             comments.append({"commenter_id": author_char_id, "content": reply_text, "timestamp": now, "reply_to": "user"})
             post["comments"] = comments
-            raw[idx] = post
-            safe_save_json(moments_path, raw)
+            moments_store.save_moment(post, user_id=user_id)
             replied_ids.add(author_char_id)
             # 记录记忆
             ctx = f"你在朋友圈发了内容：「{post_content}」。对于用户的评论「{content}」，你回复说：「{reply_text}」。"
@@ -1792,8 +1708,7 @@ def moments_comment():
                 comments = post.get("comments", [])
                 comments.append({"commenter_id": m_id, "content": ai_comment, "timestamp": now})
                 post["comments"] = comments
-                raw[idx] = post
-                safe_save_json(moments_path, raw)
+                moments_store.save_moment(post, user_id=user_id)
                 replied_ids.add(m_id)
                 # 记录记忆
                 author_name = (chars_config.get(author_char_id, {}).get("remark") or chars_config.get(author_char_id, {}).get("name") or author_char_id) if author_char_id != "user" else "用户"
@@ -1822,16 +1737,7 @@ def moments_comment_regenerate():
     if not char_id or not timestamp_str:
         return jsonify({"error": "缺少 char_id 或 timestamp"}), 400
 
-    moments_path, _ = get_moments_paths(user_id=user_id)
-    if not os.path.exists(moments_path):
-        return jsonify({"error": "暂无朋友圈数据"}), 404
-    try:
-        with open(moments_path, "r", encoding="utf-8-sig") as f:
-            raw = json.load(f)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-    idx, post = _find_moment_post(raw, char_id, timestamp_str)
+    idx, post = _find_moment_post(char_id, timestamp_str, user_id=user_id)
     if idx is None:
         return jsonify({"error": "未找到该条朋友圈"}), 404
 
@@ -1870,8 +1776,7 @@ def moments_comment_regenerate():
     old_comment["timestamp"] = old_ts
     comments[comment_index] = old_comment
     post["comments"] = comments
-    raw[idx] = post
-    safe_save_json(moments_path, raw)
+    moments_store.save_moment(post, user_id=user_id)
 
     return jsonify({"status": "success"})
 
@@ -1895,16 +1800,7 @@ def moments_memory_regenerate():
     if not char_id or not timestamp_str:
         return jsonify({"error": "缺少 char_id 或 timestamp"}), 400
 
-    moments_path, _ = get_moments_paths(user_id=user_id)
-    if not os.path.exists(moments_path):
-        return jsonify({"error": "暂无朋友圈数据"}), 404
-    try:
-        with open(moments_path, "r", encoding="utf-8-sig") as f:
-            raw = json.load(f)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-    idx, post = _find_moment_post(raw, char_id, timestamp_str)
+    idx, post = _find_moment_post(char_id, timestamp_str, user_id=user_id)
     if idx is None:
         return jsonify({"error": "未找到该条朋友圈"}), 404
 
@@ -1994,17 +1890,7 @@ def moments_ai_comment_to_post():
     if not all([post_char_id, timestamp_str, commenter_id]):
         return jsonify({"error": "缺少必要参数"}), 400
 
-    moments_path, _ = get_moments_paths(user_id=user_id)
-    if not os.path.exists(moments_path):
-        return jsonify({"error": "暂无朋友圈数据"}), 404
-
-    try:
-        with open(moments_path, "r", encoding="utf-8-sig") as f:
-            raw = json.load(f)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-    idx, post = _find_moment_post(raw, post_char_id, timestamp_str)
+    idx, post = _find_moment_post(post_char_id, timestamp_str, user_id=user_id)
     if idx is None:
         return jsonify({"error": "未找到该条朋友圈"}), 404
 
@@ -2018,8 +1904,7 @@ def moments_ai_comment_to_post():
             "timestamp": timestamp_str
         })
         post["comments"] = comments
-        raw[idx] = post
-        safe_save_json(moments_path, raw)
+        moments_store.save_moment(post, user_id=user_id)
         return jsonify({"status": "success", "comment": comments[-1]})
     else:
         return jsonify({"error": "AI 评论生成失败"}), 500
@@ -2050,17 +1935,7 @@ def moments_user_reply_to_comment():
     if len(content) > 500:
         return jsonify({"error": "回复内容不得超过500字"}), 400
 
-    moments_path, _ = get_moments_paths(user_id=user_id)
-    if not os.path.exists(moments_path):
-        return jsonify({"error": "暂无朋友圈数据"}), 404
-
-    try:
-        with open(moments_path, "r", encoding="utf-8-sig") as f:
-            raw = json.load(f)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-    idx, post = _find_moment_post(raw, post_char_id, timestamp_str)
+    idx, post = _find_moment_post(post_char_id, timestamp_str, user_id=user_id)
     if idx is None:
         return jsonify({"error": "未找到该条朋友圈"}), 404
 
@@ -2111,8 +1986,7 @@ def moments_user_reply_to_comment():
         append_moment_event_to_short_memory(target_commenter_id, memory_event)
 
     post["comments"] = comments
-    raw[idx] = post
-    safe_save_json(moments_path, raw)
+    moments_store.save_moment(post, user_id=user_id)
 
     return jsonify({"success": True})
 
@@ -2285,16 +2159,7 @@ def moments_user_post():
         "comments": comments
     }
 
-    moments_path, _ = get_moments_paths(user_id=user_id)
-    raw = []
-    if os.path.exists(moments_path):
-        try:
-            with open(moments_path, "r", encoding="utf-8-sig") as f:
-                raw = json.load(f)
-        except Exception:
-            raw = []
-    raw.append(new_post)
-    safe_save_json(moments_path, raw)
+    moments_store.add_moment(new_post, user_id=user_id)
 
     # 触发 AI 角色感知：记录同步回复的短期记忆
     for c in new_post.get("comments", []):
@@ -2327,15 +2192,6 @@ def moments_regenerate():
     if not char_id or not timestamp_str:
         return jsonify({"error": "缺少 char_id 或 timestamp"}), 400
 
-    moments_path, _ = get_moments_paths(user_id=user_id)
-    if not os.path.exists(moments_path):
-        return jsonify({"error": "暂无朋友圈数据"}), 404
-    try:
-        with open(moments_path, "r", encoding="utf-8-sig") as f:
-            raw = json.load(f)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
     remarks = {}
     cfg_file = _get_characters_config_file(user_id=user_id)
     if os.path.exists(cfg_file):
@@ -2349,7 +2205,7 @@ def moments_regenerate():
         except Exception:
             pass
 
-    idx, post = _find_moment_post(raw, char_id, timestamp_str)
+    idx, post = _find_moment_post(char_id, timestamp_str, user_id=user_id)
     if idx is None:
         return jsonify({"error": "未找到该条朋友圈"}), 404
 
@@ -2514,8 +2370,7 @@ def moments_regenerate():
             print(f"  [Moments] 重新生成内容失败: {e}")
             return jsonify({"error": "生成失败"}), 500
 
-        raw[idx] = post
-        safe_save_json(moments_path, raw)
+        moments_store.save_moment(post, user_id=user_id)
     return jsonify({"status": "success"})
 
 
@@ -2528,21 +2383,8 @@ def moments_delete():
     if not char_id or not timestamp_str:
         return jsonify({"error": "缺少 char_id 或 timestamp"}), 400
 
-    moments_path, _ = get_moments_paths(user_id=user_id)
-    if not os.path.exists(moments_path):
-        return jsonify({"error": "暂无朋友圈数据"}), 404
-    try:
-        with open(moments_path, "r", encoding="utf-8-sig") as f:
-            raw = json.load(f)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-    idx, post = _find_moment_post(raw, char_id, timestamp_str)
-    if idx is None:
+    if not moments_store.delete_moment(char_id, timestamp_str, user_id=user_id):
         return jsonify({"error": "未找到该条朋友圈"}), 404
-
-    del raw[idx]
-    safe_save_json(moments_path, raw)
     return jsonify({"status": "success"})
 
 
@@ -2558,22 +2400,12 @@ def moments_edit():
     if len(new_content) > 2000:
         return jsonify({"error": "编辑内容不得超过2000字"}), 400
 
-    moments_path, _ = get_moments_paths(user_id=user_id)
-    if not os.path.exists(moments_path):
-        return jsonify({"error": "暂无朋友圈数据"}), 404
-    try:
-        with open(moments_path, "r", encoding="utf-8-sig") as f:
-            raw = json.load(f)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-    idx, post = _find_moment_post(raw, char_id, timestamp_str)
+    idx, post = _find_moment_post(char_id, timestamp_str, user_id=user_id)
     if idx is None:
         return jsonify({"error": "未找到该条朋友圈"}), 404
 
     post["content"] = clean_moments_agent_instructions(new_content)
-    raw[idx] = post
-    safe_save_json(moments_path, raw)
+    moments_store.save_moment(post, user_id=user_id)
     return jsonify({"status": "success"})
 
 
@@ -2589,16 +2421,7 @@ def moments_comment_delete():
     except:
         return jsonify({"error": "无效的 comment_index"}), 400
 
-    moments_path, _ = get_moments_paths(user_id=user_id)
-    if not os.path.exists(moments_path):
-        return jsonify({"error": "暂无数据"}), 404
-    try:
-        with open(moments_path, "r", encoding="utf-8-sig") as f:
-            raw = json.load(f)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-    idx, post = _find_moment_post(raw, char_id, timestamp_str)
+    idx, post = _find_moment_post(char_id, timestamp_str, user_id=user_id)
     if idx is None:
         return jsonify({"error": "未找到朋友圈"}), 404
 
@@ -2606,8 +2429,7 @@ def moments_comment_delete():
     if 0 <= comment_index < len(comments):
         del comments[comment_index]
         post["comments"] = comments
-        raw[idx] = post
-        safe_save_json(moments_path, raw)
+        moments_store.save_moment(post, user_id=user_id)
         return jsonify({"status": "success"})
     return jsonify({"error": "评论未找到"}), 404
 
@@ -2630,16 +2452,7 @@ def moments_comment_edit():
     if len(new_content) > 500:
         return jsonify({"error": "评论内容不得超过500字"}), 400
 
-    moments_path, _ = get_moments_paths(user_id=user_id)
-    if not os.path.exists(moments_path):
-        return jsonify({"error": "暂无数据"}), 404
-    try:
-        with open(moments_path, "r", encoding="utf-8-sig") as f:
-            raw = json.load(f)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-    idx, post = _find_moment_post(raw, char_id, timestamp_str)
+    idx, post = _find_moment_post(char_id, timestamp_str, user_id=user_id)
     if idx is None:
         return jsonify({"error": "未找到"}), 404
 
@@ -2647,7 +2460,6 @@ def moments_comment_edit():
     if 0 <= comment_index < len(comments):
         comments[comment_index]["content"] = clean_moments_agent_instructions(new_content)
         post["comments"] = comments
-        raw[idx] = post
-        safe_save_json(moments_path, raw)
+        moments_store.save_moment(post, user_id=user_id)
         return jsonify({"status": "success"})
     return jsonify({"error": "评论未找到"}), 404
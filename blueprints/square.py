@@ -678,7 +678,7 @@ def api_square_add_to_local():
         with open(os.path.join(target_prompts_dir, "2_relationship.json"), "w", encoding="utf-8") as f:
             f.write(s["relationship_graph"] or "{}")
 
-        for fn in ["3_user_persona.md", "4_memory_long.json", "5_memory_medium.json", "6_memory_short.json", "7_schedule.json"]:
+        for fn in ["3_user_persona.md", "7_schedule.json"]:
             with open(os.path.join(target_prompts_dir, fn), "w", encoding="utf-8") as f:
                 f.write("{}" if fn.endswith(".json") else "")
 
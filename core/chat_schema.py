@@ -0,0 +1,145 @@
+"""
+chat.db 版本化迁移：用 PRAGMA user_version 记录每个聊天库已应用到的版本。
+
+messages(id, role, content, timestamp) 原本只有主键，而夜间记忆任务（按日期范围扫描）、
+chat_v2 / 主动消息（ORDER BY timestamp DESC LIMIT n）、未读计数等都按 timestamp 过滤或排序，
+每次都是全表扫描。这里按顺序登记迁移：
+- 连接池首次打开某个 chat.db 时自动补齐（core/db.get_db）；
+- 直接 sqlite3.connect 的夜间任务在打开前调用 ensure_chat_db；
+- 也可以用 scripts/migrate_chat_dbs.py 离线批量迁移全部用户的聊天库。
+
+新增迁移时在 CHAT_DB_MIGRATIONS 末尾追加 (版本号, 说明, [SQL...])，版本号递增，已发布的条目不要修改。
+"""
+import glob
+import os
+import sqlite3
+import threading
+
+from core.config import BASE_DIR, USERS_ROOT, CHAT_DB_AUTO_MIGRATE
+
+CHAT_DB_NAME = "chat.db"
+
+CHAT_DB_MIGRATIONS = [
+    (1, "messages.timestamp 索引（按日期范围扫描 / 按时间排序）", [
+        "CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp)",
+    ]),
+    (2, "messages(role, timestamp) 索引（按角色 + 时间过滤）", [
+        "CREATE INDEX IF NOT EXISTS idx_messages_role_ts ON messages(role, timestamp)",
+    ]),
+]
+
+LATEST_VERSION = CHAT_DB_MIGRATIONS[-1][0] if CHAT_DB_MIGRATIONS else 0
+
+# 本进程内已确认是最新版本的库（绝对路径），避免每次打开都查 user_version
+_up_to_date = set()
+_lock = threading.Lock()
+
+
+def get_schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _has_messages_table(conn) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages'"
+    ).fetchone() is not None
+
+
+def migrate_conn(conn) -> list:
+    """把一个已打开的 chat.db 迁移到最新版本，返回本次应用的版本号列表。
+
+    messages 表还不存在（库刚被创建）时不做任何事，也不写 user_version，下次打开再迁移。
+    """
+    if get_schema_version(conn) >= LATEST_VERSION or not _has_messages_table(conn):
+        return []
+    if conn.in_transaction:
+        conn.commit()
+    applied = []
+    # IMMEDIATE：多个进程 / 线程同时打开时只有一个能进入，进入后重新读一次版本
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = get_schema_version(conn)
+        for v, _desc, statements in CHAT_DB_MIGRATIONS:
+            if v <= version:
+                continue
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(f"PRAGMA user_version = {int(v)}")
+            applied.append(v)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return applied
+
+
+def ensure_chat_schema(conn, db_path) -> None:
+    """连接池打开 chat.db 时调用：本进程内每个库只检查一次，失败只打印，不影响请求。"""
+    key = os.path.abspath(db_path)
+    if not CHAT_DB_AUTO_MIGRATE or key in _up_to_date:
+        return
+    try:
+        applied = migrate_conn(conn)
+        if applied:
+            print(f"[ChatDB] {key} 迁移到 v{applied[-1]}")
+        if get_schema_version(conn) >= LATEST_VERSION:
+            with _lock:
+                _up_to_date.add(key)
+    except sqlite3.Error as e:
+        print(f"[ChatDB] 迁移失败 {key}: {e}")
+
+
+def ensure_chat_db(db_path) -> None:
+    """不经过连接池直接打开 chat.db 的代码（夜间记忆任务等）在查询前调用。库不存在时什么也不做。"""
+    key = os.path.abspath(db_path)
+    if not CHAT_DB_AUTO_MIGRATE or key in _up_to_date or not os.path.exists(key):
+        return
+    conn = sqlite3.connect(key, timeout=30)
+    try:
+        ensure_chat_schema(conn, key)
+    finally:
+        conn.close()
+
+
+def iter_chat_dbs(users_root=None, base_dir=None):
+    """列出全部聊天库：users/*/characters/*/chat.db、users/*/groups/*/chat.db，以及全局 characters/ 和 groups/ 下的旧库。"""
+    users_root = users_root or USERS_ROOT
+    base_dir = base_dir or BASE_DIR
+    patterns = [
+        os.path.join(users_root, "*", "characters", "*", CHAT_DB_NAME),
+        os.path.join(users_root, "*", "groups", "*", CHAT_DB_NAME),
+        os.path.join(base_dir, "characters", "*", CHAT_DB_NAME),
+        os.path.join(base_dir, "groups", "*", CHAT_DB_NAME),
+    ]
+    seen = set()
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            if path not in seen:
+                seen.add(path)
+                yield path
+
+
+def migrate_all(paths=None, dry_run=False) -> dict:
+    """批量迁移，返回 {"total", "migrated", "up_to_date", "skipped", "failed": [(path, error)]}。"""
+    result = {"total": 0, "migrated": 0, "up_to_date": 0, "skipped": 0, "failed": []}
+    for path in (paths if paths is not None else iter_chat_dbs()):
+        result["total"] += 1
+        try:
+            conn = sqlite3.connect(path, timeout=30)
+            try:
+                version = get_schema_version(conn)
+                if version >= LATEST_VERSION:
+                    result["up_to_date"] += 1
+                elif not _has_messages_table(conn):
+                    result["skipped"] += 1
+                elif dry_run:
+                    print(f"[ChatDB] 待迁移 v{version} -> v{LATEST_VERSION}: {path}")
+                    result["migrated"] += 1
+                else:
+                    migrate_conn(conn)
+                    result["migrated"] += 1
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            result["failed"].append((path, str(e)))
+    return result
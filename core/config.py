@@ -17,12 +17,119 @@ COS_BUCKET = os.getenv("COS_BUCKET")
 COS_REGION = os.getenv("COS_REGION")
 COS_BASE_URL = f"https://{COS_BUCKET}.cos.{COS_REGION}.myqcloud.com" if COS_BUCKET and COS_REGION else ""
 
-CACHED_OFFICIAL_PACKS = None
-
 # ==================== 应用配置 ====================
 MAX_CONTEXT_LINES = 10
 DATABASE_FILE = "chat_history.db"
 
+# ==================== SQLite 连接池 ====================
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "32"))  # 全进程最多保留的空闲连接数
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "8192"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+CHAT_DB_AUTO_MIGRATE = os.getenv("CHAT_DB_AUTO_MIGRATE", "true").lower() != "false"  # 首次打开 chat.db 时补齐索引等迁移
+
+# ==================== 配置文件读缓存 ====================
+CONFIG_CACHE_SIZE = int(os.getenv("CONFIG_CACHE_SIZE", "1024"))  # 缓存的 JSON 配置文件个数上限
+
+# ==================== 分词 / 关键词缓存 ====================
+KEYWORD_CACHE_SIZE = int(os.getenv("KEYWORD_CACHE_SIZE", "2048"))
+TOKENIZER_WARMUP = os.getenv("TOKENIZER_WARMUP", "true").lower() == "true"
+FURIGANA_CACHE_SIZE = int(os.getenv("FURIGANA_CACHE_SIZE", "8192"))  # 日语注音结果缓存条数
+
+# ==================== 长期记忆检索 query 分析 ====================
+# auto: 本地规则能确定关键词+时间时跳过记忆模型；ai: 总是调用记忆模型；local: 从不调用
+LONG_MEMORY_QUERY_MODE = os.getenv("LONG_MEMORY_QUERY_MODE", "auto").lower()
+LONG_MEMORY_QUERY_ASYNC = os.getenv("LONG_MEMORY_QUERY_ASYNC", "true").lower() == "true"  # 与 prompt 组装并发
+LONG_MEMORY_QUERY_CACHE_SIZE = int(os.getenv("LONG_MEMORY_QUERY_CACHE_SIZE", "512"))
+LONG_MEMORY_QUERY_WORKERS = int(os.getenv("LONG_MEMORY_QUERY_WORKERS", "4"))
+LONG_MEMORY_QUERY_WAIT_TIMEOUT = float(os.getenv("LONG_MEMORY_QUERY_WAIT_TIMEOUT", "30"))
+
+# ==================== 聊天前短期记忆同步 ====================
+MEMORY_SYNC_ASYNC = os.getenv("MEMORY_SYNC_ASYNC", "true").lower() == "true"  # false: 请求线程内同步总结
+MEMORY_SYNC_MAX_STALENESS = float(os.getenv("MEMORY_SYNC_MAX_STALENESS", "600"))  # 聊天可接受的记忆滞后（秒）
+MEMORY_SYNC_WAIT_TIMEOUT = float(os.getenv("MEMORY_SYNC_WAIT_TIMEOUT", "120"))
+MEMORY_SYNC_WORKERS = int(os.getenv("MEMORY_SYNC_WORKERS", "2"))
+
+# ==================== System Prompt 分段并发组装 ====================
+PROMPT_PARALLEL = os.getenv("PROMPT_PARALLEL", "true").lower() == "true"
+PROMPT_ASSEMBLY_WORKERS = int(os.getenv("PROMPT_ASSEMBLY_WORKERS", "16"))
+
+# ==================== 群聊多人回复流水线 ====================
+GROUP_PIPELINE = os.getenv("GROUP_PIPELINE", "true").lower() == "true"  # 关闭后退回逐个现场构建 prompt
+GROUP_PIPELINE_WORKERS = int(os.getenv("GROUP_PIPELINE_WORKERS", "4"))  # 全局准备线程池大小（所有请求共用）
+GROUP_PIPELINE_AHEAD = int(os.getenv("GROUP_PIPELINE_AHEAD", "2"))  # 单个请求最多提前准备后面几位发言者
+
+# ==================== 聊天记录全文检索 (FTS5) ====================
+MESSAGE_SEARCH_MAX_PAGE_SIZE = int(os.getenv("MESSAGE_SEARCH_MAX_PAGE_SIZE", "200"))  # 调用方传 limit 分页时的上限
+MESSAGE_SEARCH_BACKFILL = os.getenv("MESSAGE_SEARCH_BACKFILL", "true").lower() == "true"  # 启动时后台为已有 chat.db 建索引
+
+# ==================== 聊天记录 v2 接口 ====================
+HISTORY_V2_MAX_LIMIT = int(os.getenv("HISTORY_V2_MAX_LIMIT", "200"))  # 单页最多返回条数
+HISTORY_LONGPOLL_MAX = float(os.getenv("HISTORY_LONGPOLL_MAX", "25"))  # after + wait 长轮询最长挂起秒数
+HISTORY_LONGPOLL_INTERVAL = float(os.getenv("HISTORY_LONGPOLL_INTERVAL", "0.5"))
+HISTORY_ETAG_SETTLE = float(os.getenv("HISTORY_ETAG_SETTLE", "1.0"))  # 库文件在这段时间内有改动时不发 ETag（mtime 精度有限）
+
+# ==================== 事件推送 (SSE) ====================
+EVENT_BUS_QUEUE_SIZE = int(os.getenv("EVENT_BUS_QUEUE_SIZE", "256"))  # 每个连接的待发送事件上限，超出后通知客户端重新同步
+EVENT_BUS_BACKLOG = int(os.getenv("EVENT_BUS_BACKLOG", "200"))  # 每个用户保留的最近事件数，断线重连时按 Last-Event-ID 补发
+EVENT_STREAM_HEARTBEAT = float(os.getenv("EVENT_STREAM_HEARTBEAT", "20"))  # 心跳间隔（秒）
+EVENT_STREAM_MAX_SECONDS = float(os.getenv("EVENT_STREAM_MAX_SECONDS", "300"))  # 单个连接最长保持时间，之后由浏览器自动重连
+
+# ==================== 请求追踪 ====================
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() == "true"  # 记录各阶段耗时、prompt 大小与缓存命中
+TRACE_RESPONSE_HEADER = os.getenv("TRACE_RESPONSE_HEADER", "false").lower() == "true"  # 非 debug 模式下也返回 Server-Timing 头
+TRACE_SAMPLE_SIZE = int(os.getenv("TRACE_SAMPLE_SIZE", "500"))  # 每个阶段保留最近多少个耗时样本用于算分位数
+TRACE_RECENT = int(os.getenv("TRACE_RECENT", "50"))  # 管理端展示的最近请求明细条数
+
+# ==================== API 调用日志 ====================
+# 级别：off < error < summary < full。文件默认 full（完整 prompt，去重存储），控制台默认只打摘要
+API_LOG_LEVEL = os.getenv("API_LOG_LEVEL", "full").lower()
+API_LOG_CONSOLE = os.getenv("API_LOG_CONSOLE", "summary").lower()
+API_LOG_MAX_BYTES = int(os.getenv("API_LOG_MAX_BYTES", str(2 * 1024 * 1024)))  # 单个 api.log 轮转阈值
+API_LOG_BACKUPS = int(os.getenv("API_LOG_BACKUPS", "3"))
+API_LOG_DEDUP_MIN_CHARS = int(os.getenv("API_LOG_DEDUP_MIN_CHARS", "512"))  # 超过该长度的消息按哈希存一份
+API_LOG_QUEUE_SIZE = int(os.getenv("API_LOG_QUEUE_SIZE", "10000"))
+
+# ==================== Token 用量账本 ====================
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "1.0"))  # 批量写库间隔（秒）
+USAGE_BATCH_SIZE = int(os.getenv("USAGE_BATCH_SIZE", "200"))
+
+# ==================== 表情名称解析 ====================
+STICKER_INDEX_TTL = int(os.getenv("STICKER_INDEX_TTL", "1800"))  # 表情名称索引过期时间（秒）
+STICKER_ROW_MIGRATION = os.getenv("STICKER_ROW_MIGRATION", "true").lower() == "true"  # 启动时后台把旧消息里的 [表情]名称 改写为 path
+
+# ==================== 出站 HTTP 连接池 ====================
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))  # 每个 host 最多保持的连接数
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5"))
+# 各类出站调用的默认超时（秒）
+HTTP_ROUTE_TIMEOUTS = {
+    "default": 30,
+    "llm": 300,          # 中转 / OpenRouter 兼容接口（含流式）
+    "gemini": 30,
+    "gemini_vision": 100,
+    "image_gen": 60,
+    "imagen": 90,
+    "image_search": 15,
+    "image_download": 30,
+    "tts": 30,
+    "weather": 10,
+    "geocode": 10,
+}
+
+# ==================== LLM 调用调度（按服务商 / 用户限流 + 优先级通道） ====================
+LLM_SCHEDULER_ENABLED = os.getenv("LLM_SCHEDULER_ENABLED", "true").lower() == "true"
+LLM_PROVIDER_MAX_CONCURRENCY = int(os.getenv("LLM_PROVIDER_MAX_CONCURRENCY", "8"))  # 每个服务商同时在途的请求数
+LLM_INTERACTIVE_RESERVED = int(os.getenv("LLM_INTERACTIVE_RESERVED", "2"))  # 其中只留给前台对话的名额
+LLM_PROVIDER_RATE = float(os.getenv("LLM_PROVIDER_RATE", "5"))  # 每个服务商每秒请求数（<=0 不限）
+LLM_PROVIDER_BURST = float(os.getenv("LLM_PROVIDER_BURST", "10"))
+LLM_USER_RATE = float(os.getenv("LLM_USER_RATE", "1"))  # 每个用户每秒请求数（<=0 不限）
+LLM_USER_BURST = float(os.getenv("LLM_USER_BURST", "8"))
+LLM_QUEUE_TIMEOUT_INTERACTIVE = float(os.getenv("LLM_QUEUE_TIMEOUT_INTERACTIVE", "60"))  # 前台排队上限（秒）
+LLM_QUEUE_TIMEOUT_BACKGROUND = float(os.getenv("LLM_QUEUE_TIMEOUT_BACKGROUND", "900"))
+LLM_THROTTLE_COOLDOWN = float(os.getenv("LLM_THROTTLE_COOLDOWN", "30"))  # 服务商返回 429 后后台通道暂停的秒数
+
 # ==================== 目录路径 ====================
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CHARACTERS_DIR = os.path.join(BASE_DIR, "characters")
@@ -33,6 +140,7 @@ GROUPS_DIR = os.path.join(BASE_DIR, "groups")
 USER_SETTINGS_FILE = os.path.join(BASE_DIR, "configs", "user_settings.json")
 USERS_DB = os.path.join(BASE_DIR, "configs", "users.db")
 SQUARE_DB = os.path.join(BASE_DIR, "configs", "square.db")
+USAGE_DB = os.path.join(BASE_DIR, "configs", "usage.db")
 SQUARE_AVATARS_DIR = os.path.join(BASE_DIR, "static", "square_avatars")
 USERS_ROOT = os.path.join(BASE_DIR, "users")
 DEVICE_ACCOUNTS_FILE = os.path.join(BASE_DIR, "configs", "device_accounts.json")
@@ -39,6 +39,18 @@ def get_api_fatal_error() -> dict | None:
         return None
 
 
+# --- 当前 LLM 调用的任务类型（get_model_config 设置，token 账单按它归类） ---
+_usage_task_var: ContextVar[str] = ContextVar("usage_task", default="chat")
+
+
+def set_usage_task(task: str) -> None:
+    _usage_task_var.set(task or "chat")
+
+
+def get_usage_task() -> str:
+    return _usage_task_var.get()
+
+
 # --- 用户/会话相关辅助 ---
 
 def init_users_db():
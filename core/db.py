@@ -0,0 +1,227 @@
+"""
+SQLite 连接池：进程级、按 db 文件路径复用连接（LRU 有界），统一开启 WAL。
+
+聊天热路径（history / chat_v2 / regenerate / search / group_chat）每次请求都会
+多次打开同一个 chat.db，反复 connect + 读 schema 的开销远大于查询本身。
+Flask threaded 模式下每个请求一个线程，所以连接不能绑在线程上：这里维护一个全进程共用的
+空闲连接池，pooled_conn 进入时借出一个连接、退出时归还，后续请求（任意线程）直接复用。
+首次打开时设置 journal_mode=WAL、synchronous=NORMAL、mmap_size、cache_size，
+chat.db 首次打开时顺带应用 core/chat_schema 里的迁移。
+同一线程内嵌套 pooled_conn(同一路径) 共用外层借出的连接，只在最外层退出时 commit / 归还。
+"""
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from core.config import SQLITE_POOL_SIZE, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE_KB, SQLITE_BUSY_TIMEOUT_MS
+from core.chat_schema import CHAT_DB_NAME, ensure_chat_schema
+
+_local = threading.local()
+
+# 空闲连接：{db_path: [conn, ...]}，按最近归还排序，总数不超过 SQLITE_POOL_SIZE
+_idle: OrderedDict[str, list] = OrderedDict()
+_idle_count = 0
+# 全部连接（空闲 + 借出）的登记表：{db_path: set(conn)}，用于删除角色/群聊时统一关闭
+_registry: dict[str, set] = {}
+_registry_lock = threading.Lock()  # 同时保护 _idle / _idle_count / _registry
+
+_stats = {"opened": 0, "reused": 0, "evicted": 0}
+_stats_lock = threading.Lock()
+
+
+def _bump(key: str) -> None:
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def _active() -> dict:
+    """当前线程在 pooled_conn 块内借出的连接：{db_path: [conn, 嵌套深度]}。"""
+    active = getattr(_local, "active", None)
+    if active is None:
+        active = _local.active = {}
+    return active
+
+
+def _apply_pragmas(conn: sqlite3.Connection) -> None:
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+    except sqlite3.Error as e:
+        print(f"[DB Pool] 开启 WAL 失败: {e}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={int(SQLITE_MMAP_SIZE)}")
+    conn.execute(f"PRAGMA cache_size={-int(SQLITE_CACHE_SIZE_KB)}")
+    conn.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}")
+
+
+def _discard(db_path: str, conn: sqlite3.Connection) -> None:
+    with _registry_lock:
+        conns = _registry.get(db_path)
+        if conns is not None:
+            conns.discard(conn)
+            if not conns:
+                _registry.pop(db_path, None)
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _is_open(conn: sqlite3.Connection) -> bool:
+    try:
+        conn.total_changes
+        return True
+    except sqlite3.ProgrammingError:
+        return False
+
+
+def get_db(db_path: str) -> sqlite3.Connection:
+    """从连接池借出 db_path 的一个连接（没有空闲连接则新建并设置 pragma）。
+
+    借出的连接归调用方独占，用完调用 put_db 归还；一般直接用 pooled_conn。
+    """
+    global _idle_count
+    key = os.path.abspath(db_path)
+    while True:
+        with _registry_lock:
+            conns = _idle.get(key)
+            conn = conns.pop() if conns else None
+            if conn is not None:
+                _idle_count -= 1
+                if not conns:
+                    _idle.pop(key, None)
+        if conn is None:
+            break
+        # 文件被删除（如删除角色后重建）时旧连接指向已失效的 inode，需要丢弃；
+        # 被 close_db 关闭的连接也在这里剔除
+        if os.path.exists(key) and _is_open(conn):
+            _bump("reused")
+            return conn
+        _discard(key, conn)
+
+    conn = sqlite3.connect(key, check_same_thread=False)
+    _apply_pragmas(conn)
+    if os.path.basename(key) == CHAT_DB_NAME:
+        ensure_chat_schema(conn, key)
+    with _registry_lock:
+        _registry.setdefault(key, set()).add(conn)
+    _bump("opened")
+    return conn
+
+
+def put_db(db_path: str, conn: sqlite3.Connection) -> None:
+    """归还 get_db 借出的连接；未提交的事务会被回滚，空闲连接超出上限时关闭最久未用的。"""
+    global _idle_count
+    key = os.path.abspath(db_path)
+    if not _is_open(conn):
+        _discard(key, conn)
+        return
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.row_factory = None
+    except sqlite3.Error:
+        _discard(key, conn)
+        return
+    evicted = []
+    with _registry_lock:
+        if conn not in _registry.get(key, ()):
+            # 借出期间被 close_db 关闭 / 移出登记表
+            evicted.append((key, conn))
+        else:
+            _idle.setdefault(key, []).append(conn)
+            _idle.move_to_end(key)
+            _idle_count += 1
+            while _idle_count > SQLITE_POOL_SIZE:
+                old_key, old_conns = next(iter(_idle.items()))
+                evicted.append((old_key, old_conns.pop(0)))
+                _idle_count -= 1
+                if not old_conns:
+                    _idle.pop(old_key)
+    for old_key, old_conn in evicted:
+        _discard(old_key, old_conn)
+        if old_conn is not conn:
+            _bump("evicted")
+
+
+@contextmanager
+def pooled_conn(db_path: str, row_factory=None):
+    """with 语法使用复用连接：正常退出时 commit，异常时 rollback，退出后归还连接池。
+
+    同一线程内嵌套使用同一路径时共用外层的连接，只在最外层退出时 commit / rollback / 归还，
+    内层退出时恢复外层的 row_factory。
+    """
+    key = os.path.abspath(db_path)
+    active = _active()
+    entry = active.get(key)
+    outer = entry is None
+    if outer:
+        entry = active[key] = [get_db(key), 0]
+    conn = entry[0]
+    entry[1] += 1
+    prev_factory = conn.row_factory
+    conn.row_factory = row_factory
+    try:
+        yield conn
+        if outer:
+            conn.commit()
+    except Exception:
+        if outer:
+            conn.rollback()
+        raise
+    finally:
+        entry[1] -= 1
+        if outer:
+            active.pop(key, None)
+            put_db(key, conn)
+        else:
+            conn.row_factory = prev_factory
+
+
+def char_db(char_id, user_id=None, row_factory=None):
+    """按角色获取连接（路径与 get_paths 一致）。"""
+    from core.utils import get_paths
+    db_path, _ = get_paths(char_id, user_id=user_id)
+    return pooled_conn(db_path, row_factory=row_factory)
+
+
+def group_db(group_id, row_factory=None):
+    """按群聊获取连接（路径与 get_group_dir 一致）。"""
+    from core.utils import get_group_dir
+    return pooled_conn(os.path.join(get_group_dir(group_id), "chat.db"), row_factory=row_factory)
+
+
+def close_db(db_path: str) -> None:
+    """关闭所有指向 db_path 的连接（含正被借出的，删除角色/群聊目录前调用）。"""
+    global _idle_count
+    key = os.path.abspath(db_path)
+    with _registry_lock:
+        conns = _registry.pop(key, set())
+        _idle_count -= len(_idle.pop(key, []))
+    for conn in conns:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def close_dir(dir_path: str) -> None:
+    """关闭 dir_path 目录下所有已缓存的连接。"""
+    prefix = os.path.abspath(dir_path) + os.sep
+    with _registry_lock:
+        keys = [k for k in _registry if k.startswith(prefix)]
+    for k in keys:
+        close_db(k)
+
+
+def get_pool_stats() -> dict:
+    with _registry_lock:
+        open_conns = sum(len(v) for v in _registry.values())
+        idle = _idle_count
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["open"] = open_conns
+    stats["idle"] = idle
+    stats["in_use"] = open_conns - idle
+    return stats
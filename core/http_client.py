@@ -0,0 +1,157 @@
+"""
+出站 HTTP 客户端：按 host 复用 requests.Session（keep-alive 连接池），统一重试与超时。
+
+所有对 LLM / TTS / 天气 / 搜图等外部服务的调用都走这里：
+- 每个 scheme://host 一个 Session，连接池大小有界；
+- 连接失败自动重试（指数退避），GET 额外对 502/503/504 重试，POST 不重放以免重复计费；
+- 按 route 取默认超时（见 core.config.HTTP_ROUTE_TIMEOUTS），调用方也可显式传 timeout；
+- 统计每个 host 的请求数、新建连接（握手）次数与握手耗时，供 /api/admin/stats 查看复用率。
+"""
+import time
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from core.config import (
+    HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_MAX_RETRIES,
+    HTTP_BACKOFF_FACTOR, HTTP_ROUTE_TIMEOUTS,
+)
+
+_sessions: dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+# {host: {"requests": n, "handshakes": n, "handshake_ms": total, "errors": n}}
+_stats: dict[str, dict] = {}
+_stats_lock = threading.Lock()
+
+
+def _host_stats(host: str) -> dict:
+    st = _stats.get(host)
+    if st is None:
+        st = {"requests": 0, "handshakes": 0, "handshake_ms": 0.0, "errors": 0}
+        _stats[host] = st
+    return st
+
+
+def _record_handshake(host: str, seconds: float) -> None:
+    with _stats_lock:
+        st = _host_stats(host)
+        st["handshakes"] += 1
+        st["handshake_ms"] += seconds * 1000
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        t0 = time.perf_counter()
+        super().connect()
+        _record_handshake(self.host, time.perf_counter() - t0)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        t0 = time.perf_counter()
+        super().connect()
+        _record_handshake(self.host, time.perf_counter() - t0)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _PooledAdapter(HTTPAdapter):
+    """统计新建连接（TCP+TLS 握手）次数的 HTTPAdapter。"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+def _make_retry() -> Retry:
+    return Retry(
+        total=HTTP_MAX_RETRIES,
+        connect=HTTP_MAX_RETRIES,
+        read=0,
+        status=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        raise_on_status=False,
+    )
+
+
+def _host_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def get_session(url: str) -> requests.Session:
+    """获取 url 所在 host 的共享 Session（首次调用时创建）。"""
+    key = _host_key(url)
+    sess = _sessions.get(key)
+    if sess is not None:
+        return sess
+    with _sessions_lock:
+        sess = _sessions.get(key)
+        if sess is None:
+            sess = requests.Session()
+            adapter = _PooledAdapter(
+                pool_connections=HTTP_POOL_CONNECTIONS,
+                pool_maxsize=HTTP_POOL_MAXSIZE,
+                max_retries=_make_retry(),
+            )
+            sess.mount("http://", adapter)
+            sess.mount("https://", adapter)
+            _sessions[key] = sess
+    return sess
+
+
+def http_request(method: str, url: str, route: str = "default", **kwargs) -> requests.Response:
+    """发起请求；未显式传 timeout 时按 route 取默认超时。异常原样抛出，由调用方处理。"""
+    kwargs.setdefault("timeout", HTTP_ROUTE_TIMEOUTS.get(route, HTTP_ROUTE_TIMEOUTS["default"]))
+    host = urlsplit(url).hostname or ""
+    with _stats_lock:
+        _host_stats(host)["requests"] += 1
+    try:
+        return get_session(url).request(method, url, **kwargs)
+    except requests.RequestException:
+        with _stats_lock:
+            _host_stats(host)["errors"] += 1
+        raise
+
+
+def http_get(url: str, route: str = "default", **kwargs) -> requests.Response:
+    return http_request("GET", url, route=route, **kwargs)
+
+
+def http_post(url: str, route: str = "default", **kwargs) -> requests.Response:
+    return http_request("POST", url, route=route, **kwargs)
+
+
+def get_http_stats() -> dict:
+    """按 host 返回请求数、握手次数、平均握手耗时与连接复用率。"""
+    with _stats_lock:
+        snapshot = {h: dict(st) for h, st in _stats.items()}
+    for st in snapshot.values():
+        reqs = st["requests"]
+        hs = st["handshakes"]
+        st["avg_handshake_ms"] = round(st["handshake_ms"] / hs, 1) if hs else 0.0
+        st["handshake_ms"] = round(st["handshake_ms"], 1)
+        st["reuse_rate"] = round(max(0.0, 1 - hs / reqs), 3) if reqs else 0.0
+    return snapshot
+
+
+def reset_http_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
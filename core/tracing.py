@@ -0,0 +1,296 @@
+"""
+轻量请求追踪：记录每次请求各阶段（prompt 组装、记忆检索 / 同步、LLM 调用……）的耗时、prompt 大小和缓存命中。
+
+- span(name, **attrs) / @traced(name)：计时一个阶段，attrs 可在阶段内用 annotate() 补充（如 prompt_chars、prompt_tokens）；
+- record_cache(name, hit)：记一次缓存命中 / 未命中；
+- 当前请求的 Trace 放在 ContextVar 里（与 core/circuit_breaker 的 _cb_info_var 相同做法），
+  prompt 分段等通过 contextvars.copy_context() 提交到线程池的任务也会记到同一个请求下；
+- 所有阶段同时汇总到进程级统计（最近 TRACE_SAMPLE_SIZE 个样本算分位数），供 /api/admin/trace_stats 查看；
+- debug 模式或 TRACE_RESPONSE_HEADER=true 时，/api/ 响应带 Server-Timing 头（浏览器开发者工具可直接查看）。
+"""
+import functools
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from core.config import TRACE_ENABLED, TRACE_RESPONSE_HEADER, TRACE_SAMPLE_SIZE, TRACE_RECENT
+
+_trace_var: ContextVar = ContextVar("request_trace", default=None)
+_span_var: ContextVar = ContextVar("trace_span", default=None)
+
+_lock = threading.Lock()
+_stages: dict = {}      # {stage: _Agg}
+_endpoints: dict = {}   # {endpoint: _Agg}
+_caches: dict = {}      # {cache: [hits, misses]}
+_recent = deque(maxlen=TRACE_RECENT)
+
+
+def _percentile(xs, p):
+    if not xs:
+        return 0.0
+    k = (len(xs) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(xs) - 1)
+    return xs[lo] + (xs[hi] - xs[lo]) * (k - lo)
+
+
+class _Agg:
+    """一个阶段的累计：次数、总耗时、最大值、最近样本，以及数值型 attrs 的累计（算平均 prompt 大小等）。"""
+
+    __slots__ = ("count", "total_ms", "max_ms", "samples", "attr_sums")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = deque(maxlen=TRACE_SAMPLE_SIZE)
+        self.attr_sums = {}
+
+    def add(self, ms, attrs=None):
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.samples.append(ms)
+        for k, v in (attrs or {}).items():
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                self.attr_sums[k] = self.attr_sums.get(k, 0) + v
+
+    def summary(self) -> dict:
+        xs = sorted(self.samples)
+        out = {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "p50_ms": round(_percentile(xs, 50), 2),
+            "p95_ms": round(_percentile(xs, 95), 2),
+            "p99_ms": round(_percentile(xs, 99), 2),
+            "max_ms": round(self.max_ms, 2),
+        }
+        for k, v in self.attr_sums.items():
+            out[f"avg_{k}"] = round(v / self.count, 1)
+        return out
+
+
+def _hit_rate(hits, misses):
+    total = hits + misses
+    return round(hits / total, 4) if total else None
+
+
+class Trace:
+    """一次请求的追踪记录。"""
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.duration_ms = None
+        self.spans = []     # [{"name", "start_ms", "dur_ms", "parent", "attrs"}]
+        self.caches = {}    # {cache: [hits, misses]}
+        self._lock = threading.Lock()
+
+    def add_span(self, name, t0, ms, parent, attrs):
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "start_ms": round((t0 - self._t0) * 1000, 2),
+                "dur_ms": round(ms, 2),
+                "parent": parent,
+                "attrs": dict(attrs) if attrs else {},
+            })
+
+    def add_cache(self, name, hit):
+        with self._lock:
+            c = self.caches.setdefault(name, [0, 0])
+            c[0 if hit else 1] += 1
+
+    def stage_totals(self) -> dict:
+        """{阶段名: 总耗时 ms}（同名阶段多次出现时累加，按首次出现顺序）。"""
+        totals = {}
+        with self._lock:
+            for s in self.spans:
+                totals[s["name"]] = totals.get(s["name"], 0.0) + s["dur_ms"]
+        return totals
+
+    def summary(self) -> dict:
+        with self._lock:
+            spans = list(self.spans)
+            caches = {k: {"hits": h, "misses": m, "hit_rate": _hit_rate(h, m)} for k, (h, m) in self.caches.items()}
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started": self.started,
+            "duration_ms": self.duration_ms,
+            "spans": spans,
+            "caches": caches,
+        }
+
+
+def current_trace():
+    try:
+        return _trace_var.get()
+    except LookupError:
+        return None
+
+
+def start_trace(name):
+    """开始一次请求追踪并设为当前 Trace；TRACE_ENABLED=false 时返回 None。"""
+    if not TRACE_ENABLED:
+        return None
+    trace = Trace(name)
+    _trace_var.set(trace)
+    _span_var.set(None)
+    return trace
+
+
+def finish_trace():
+    """结束当前 Trace：记入按接口的统计和最近请求列表，返回该 Trace（没有则返回 None）。"""
+    trace = current_trace()
+    if trace is None:
+        return None
+    _trace_var.set(None)
+    trace.duration_ms = round((time.perf_counter() - trace._t0) * 1000, 2)
+    with _lock:
+        agg = _endpoints.get(trace.name)
+        if agg is None:
+            agg = _endpoints[trace.name] = _Agg()
+        agg.add(trace.duration_ms)
+        # 只有经过了被追踪阶段的请求才进最近列表，避免被 history 轮询等刷屏
+        if trace.spans:
+            _recent.append(trace)
+    return trace
+
+
+def record_span(name, ms, attrs=None, t0=None, parent=None):
+    """记一个已经计好时的阶段（如 prompt 分段自己算好的耗时）。"""
+    if not TRACE_ENABLED:
+        return
+    with _lock:
+        agg = _stages.get(name)
+        if agg is None:
+            agg = _stages[name] = _Agg()
+        agg.add(ms, attrs)
+    trace = current_trace()
+    if trace is not None:
+        if parent is None:
+            cur = _span_var.get()
+            parent = cur["name"] if cur else None
+        trace.add_span(name, t0 if t0 is not None else time.perf_counter() - ms / 1000, ms, parent, attrs)
+
+
+@contextmanager
+def span(name, **attrs):
+    """计时一个阶段：with span("llm.gemini", model=m) as attrs: ...；attrs 可在阶段内继续补充。"""
+    if not TRACE_ENABLED:
+        yield attrs
+        return
+    parent = _span_var.get()
+    current = {"name": name, "attrs": attrs}
+    token = _span_var.set(current)
+    t0 = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        try:
+            _span_var.reset(token)
+        except ValueError:
+            # 生成器跨上下文结束（如流式响应）时 token 不属于当前上下文
+            _span_var.set(parent)
+        record_span(name, ms, attrs, t0=t0, parent=parent["name"] if parent else None)
+
+
+def traced(name, attrs=None):
+    """装饰器版 span；attrs(args, kwargs) 可从参数里算出初始属性（如 prompt 字数）。"""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            initial = {}
+            if attrs is not None:
+                try:
+                    initial = attrs(args, kwargs) or {}
+                except Exception:
+                    initial = {}
+            with span(name, **initial):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def annotate(**attrs):
+    """给当前阶段补充属性（如 LLM 返回的 token 用量）。不在任何阶段内时忽略。"""
+    cur = _span_var.get()
+    if cur is not None:
+        cur["attrs"].update(attrs)
+
+
+def record_cache(name, hit):
+    if not TRACE_ENABLED:
+        return
+    with _lock:
+        c = _caches.setdefault(name, [0, 0])
+        c[0 if hit else 1] += 1
+    trace = current_trace()
+    if trace is not None:
+        trace.add_cache(name, hit)
+
+
+_TOKEN_RE = re.compile(r"[^A-Za-z0-9_.\-]")
+
+
+def server_timing_header(trace, limit=30) -> str:
+    """Server-Timing 头：各阶段总耗时 + total。"""
+    parts = []
+    for name, ms in list(trace.stage_totals().items())[:limit]:
+        parts.append(f"{_TOKEN_RE.sub('_', name)};dur={ms:.1f}")
+    for name, (hits, misses) in trace.caches.items():
+        parts.append(f"cache_{_TOKEN_RE.sub('_', name)};desc=\"{hits}/{hits + misses}\"")
+    if trace.duration_ms is not None:
+        parts.append(f"total;dur={trace.duration_ms:.1f}")
+    return ", ".join(parts)
+
+
+def install_request_tracing(app):
+    """给 /api/ 请求挂上追踪：before_request 开始，after_request 结束并按需写 Server-Timing 头。"""
+    from flask import request
+
+    @app.before_request
+    def _trace_begin():
+        if request.path.startswith("/api/") and request.endpoint != "events.api_events":
+            start_trace(f"{request.method} {request.endpoint or request.path}")
+
+    @app.after_request
+    def _trace_end(response):
+        trace = finish_trace()
+        if trace is not None and (app.debug or TRACE_RESPONSE_HEADER):
+            response.headers["Server-Timing"] = server_timing_header(trace)
+            response.headers["X-Trace-Id"] = trace.id
+        return response
+
+    @app.teardown_request
+    def _trace_cleanup(exc=None):
+        # 视图抛异常时 after_request 不会执行，这里兜底清掉
+        if current_trace() is not None:
+            finish_trace()
+
+
+def get_trace_stats() -> dict:
+    with _lock:
+        return {
+            "enabled": TRACE_ENABLED,
+            "stages": {k: v.summary() for k, v in sorted(_stages.items())},
+            "endpoints": {k: v.summary() for k, v in sorted(_endpoints.items(), key=lambda kv: -kv[1].total_ms)},
+            "caches": {k: {"hits": h, "misses": m, "hit_rate": _hit_rate(h, m)} for k, (h, m) in sorted(_caches.items())},
+            "recent": [t.summary() for t in reversed(_recent)],
+        }
+
+
+def reset_trace_stats() -> None:
+    with _lock:
+        _stages.clear()
+        _endpoints.clear()
+        _caches.clear()
+        _recent.clear()
@@ -2,15 +2,20 @@ import os
 import re
 import json
 import shutil
+import hashlib
 import tempfile
+import threading
+from collections import OrderedDict
+
 import pykakasi
 
 from core.config import (
     BASE_DIR, USERS_ROOT, CHARACTERS_DIR, CONFIG_FILE, GROUPS_CONFIG_FILE,
     GROUPS_DIR, USER_SETTINGS_FILE, DEVICE_ACCOUNTS_FILE, QUICK_PHRASES_FILE,
-    READ_STATUS_FILE, GEMINI_KEY, OPENROUTER_KEY,
+    READ_STATUS_FILE, GEMINI_KEY, OPENROUTER_KEY, CONFIG_CACHE_SIZE, FURIGANA_CACHE_SIZE,
 )
 from core.context import get_current_user_id
+from core.tracing import record_cache
 
 
 # --- kakasi 初始化 (日语注音用) ---
@@ -27,7 +32,7 @@ EMOJI_SPLIT_RE = re.compile(
 )
 
 
-def _add_furigana_to_japanese(text: str) -> str:
+def _convert_furigana(text: str) -> str:
     if not text:
         return text
     pattern = r'(\[表情\][^\s/]+|\[图片\]\([^)]+\)\([\s\S]*?\)|\[recall\])'
@@ -92,8 +97,132 @@ def _add_furigana_to_japanese(text: str) -> str:
     return out
 
 
+# --- 注音结果缓存 ---
+# 日语用户会不停轮询 history，每次都要对同样的消息重新跑 pykakasi。
+# 转换结果只取决于文本本身，按内容哈希做 LRU，同一条消息（或同样的回复气泡）只转换一次。
+_furigana_cache: OrderedDict = OrderedDict()  # {md5(text): html}
+_furigana_cache_lock = threading.Lock()
+_furigana_stats = {"hits": 0, "misses": 0}
+
+
+def _furigana_key(text: str) -> bytes:
+    return hashlib.md5(text.encode("utf-8")).digest()
+
+
+def _add_furigana_to_japanese(text: str) -> str:
+    """给日语文本中的汉字注音（<ruby>）。跳过 [表情]、[图片] 等功能性标签，保留 emoji；结果按内容缓存。"""
+    if not text:
+        return text
+    key = _furigana_key(text)
+    with _furigana_cache_lock:
+        hit = _furigana_cache.get(key)
+        if hit is not None:
+            _furigana_cache.move_to_end(key)
+            _furigana_stats["hits"] += 1
+            record_cache("furigana", True)
+            return hit
+        _furigana_stats["misses"] += 1
+    record_cache("furigana", False)
+    out = _convert_furigana(text)
+    with _furigana_cache_lock:
+        _furigana_cache[key] = out
+        while len(_furigana_cache) > FURIGANA_CACHE_SIZE:
+            _furigana_cache.popitem(last=False)
+    return out
+
+
+def add_furigana_batch(texts) -> list:
+    """批量注音（整页 history / 多个回复气泡）：重复文本只查一次缓存，未命中的才调用 pykakasi。"""
+    done = {}
+    out = []
+    for t in texts:
+        if t not in done:
+            done[t] = _add_furigana_to_japanese(t)
+        out.append(done[t])
+    return out
+
+
+def get_furigana_cache_stats() -> dict:
+    with _furigana_cache_lock:
+        return {"size": len(_furigana_cache), **_furigana_stats}
+
+
 # ==================== 路径解析函数 ====================
 
+# --- 配置文件读缓存 ---
+# characters.json / groups.json / user_settings.json / api_settings.json 在一次聊天请求里会被读十几次。
+# 按绝对路径缓存解析结果，用 (mtime_ns, size, inode) 判断文件是否变化；safe_save_json 写入时直接更新缓存。
+_json_cache: OrderedDict = OrderedDict()  # {abspath: (sig, data)}
+_json_cache_lock = threading.Lock()
+_json_cache_stats = {"hits": 0, "misses": 0}
+
+
+def _file_sig(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _json_cache_put(path, data, sig=None):
+    key = os.path.abspath(path)
+    sig = sig or _file_sig(key)
+    if sig is None:
+        return
+    with _json_cache_lock:
+        _json_cache[key] = (sig, data)
+        _json_cache.move_to_end(key)
+        while len(_json_cache) > CONFIG_CACHE_SIZE:
+            _json_cache.popitem(last=False)
+
+
+def load_json_cached(path, default=None):
+    """读取 JSON 文件（带缓存）。文件不存在或解析失败时返回 default。
+
+    返回的对象在所有调用方之间共享，只能读；需要修改后保存的请先复制（见 _copy_dict）。
+    """
+    key = os.path.abspath(path)
+    sig = _file_sig(key)
+    if sig is None:
+        return default
+    with _json_cache_lock:
+        hit = _json_cache.get(key)
+        if hit is not None and hit[0] == sig:
+            _json_cache.move_to_end(key)
+            _json_cache_stats["hits"] += 1
+            record_cache("json_config", True)
+            return hit[1]
+        _json_cache_stats["misses"] += 1
+    record_cache("json_config", False)
+    try:
+        with open(key, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        return default
+    _json_cache_put(key, data, sig)
+    return data
+
+
+def _copy_dict(data) -> dict:
+    """浅拷贝顶层 dict，调用方可以直接改键后 safe_save_json。"""
+    return dict(data) if isinstance(data, dict) else {}
+
+
+def invalidate_json_cache(path=None):
+    """清除某个文件（或全部）的缓存；用于绕过 safe_save_json 直接改写文件的场景。"""
+    with _json_cache_lock:
+        if path is None:
+            _json_cache.clear()
+        else:
+            _json_cache.pop(os.path.abspath(path), None)
+
+
+def get_json_cache_stats() -> dict:
+    with _json_cache_lock:
+        return {"size": len(_json_cache), **_json_cache_stats}
+
+
 def _get_characters_config_file(user_id=None) -> str:
     if user_id is None:
         from core.context import get_current_user_id
@@ -122,36 +251,16 @@ def get_all_char_ids_for_current_user() -> list:
 
 
 def get_characters_config_for_current_user() -> dict:
-    cfg = _get_characters_config_file()
-    if not os.path.exists(cfg):
-        return {}
-    try:
-        with open(cfg, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+    return _copy_dict(load_json_cached(_get_characters_config_file(), {}))
 
 
 def get_groups_config_for_current_user() -> dict:
-    cfg = _get_groups_config_file()
-    if not os.path.exists(cfg):
-        return {}
-    try:
-        with open(cfg, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+    return _copy_dict(load_json_cached(_get_groups_config_file(), {}))
 
 
 def get_all_group_ids_for_current_user() -> list:
-    cfg = _get_groups_config_file()
-    if not os.path.exists(cfg):
-        return []
-    try:
-        with open(cfg, "r", encoding="utf-8") as f:
-            return list(json.load(f).keys())
-    except Exception:
-        return []
+    data = load_json_cached(_get_groups_config_file(), {})
+    return list(data.keys()) if isinstance(data, dict) else []
 
 
 def _get_locations_file() -> str:
@@ -209,15 +318,7 @@ def _get_user_settings_file() -> str:
 
 
 def _load_user_settings() -> dict:
-    path = _get_user_settings_file()
-    data: dict = {}
-    if os.path.exists(path):
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except Exception:
-            data = {}
-    return data
+    return _copy_dict(load_json_cached(_get_user_settings_file(), {}))
 
 
 def _save_user_settings(data: dict):
@@ -229,9 +330,12 @@ def safe_save_json(filepath, data):
     dir_name = os.path.dirname(filepath)
     fd, temp_path = tempfile.mkstemp(dir=dir_name, text=True)
     try:
+        text = json.dumps(data, ensure_ascii=False, indent=2)
         with os.fdopen(fd, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.write(text)
         os.replace(temp_path, filepath)
+        # 写穿：缓存里放一份独立解析的副本，调用方之后继续修改 data 不会污染缓存
+        _json_cache_put(filepath, json.loads(text))
     except Exception as e:
         print(f"Save JSON Error: {e}")
         os.remove(temp_path)
@@ -247,12 +351,7 @@ def get_effective_gemini_key(user_id=None):
     data = _load_user_settings()
     if user_id:
         path = os.path.join(USERS_ROOT, str(user_id), "configs", "user_settings.json")
-        if os.path.exists(path):
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-            except Exception:
-                pass
+        data = load_json_cached(path, data)
     return data.get("gemini_api_key") or GEMINI_KEY
 
 
@@ -260,12 +359,7 @@ def get_effective_openrouter_key(user_id=None):
     data = _load_user_settings()
     if user_id:
         path = os.path.join(USERS_ROOT, str(user_id), "configs", "user_settings.json")
-        if os.path.exists(path):
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-            except Exception:
-                pass
+        data = load_json_cached(path, data)
     return data.get("openrouter_api_key") or OPENROUTER_KEY
 
 
@@ -289,9 +383,12 @@ def get_paths(char_id, user_id=None):
                     dst = os.path.join(char_dir, name)
                     if os.path.isdir(src):
                         if not os.path.exists(dst):
-                            shutil.copytree(src, dst)
+                            # 模板目录下的记忆库可能正被打开（WAL），不直接复制文件，下面用 backup 复制
+                            shutil.copytree(src, dst, ignore=shutil.ignore_patterns("memory.db*"))
                     else:
                         shutil.copy2(src, dst)
+                from services.memory_store import copy_memory_db
+                copy_memory_db(os.path.join(template_dir, "prompts"), os.path.join(char_dir, "prompts"))
             except Exception as e:
                 print(f"[Users] 拷贝角色模板失败 {char_id}: {e}")
     else:
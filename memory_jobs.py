@@ -13,6 +13,8 @@ from concurrent.futures import ThreadPoolExecutor
 import random
 import sqlite3
 
+from services.llm_scheduler import llm_lane, LANE_BULK
+
 import tempfile # <--- 记得在最上面加这个 import
 
 # --- 【新增】安全保存 JSON (防止文件损坏) ---
@@ -42,11 +44,10 @@ def safe_save_json(filepath, data):
 def _process_single_char_daily(char_id, target_date_str, user_id=None):
     """处理单个角色的日结（调用时需已 set_background_user）"""
     from app import call_ai_to_summarize, update_short_memory_for_date, get_paths
+    from services.memory_store import get_short_day, set_daily_summary
     print(f"   > 正在处理角色: [{char_id}]")
 
     _, prompts_dir = get_paths(char_id)
-    short_file = os.path.join(prompts_dir, "6_memory_short.json")
-    medium_file = os.path.join(prompts_dir, "5_memory_medium.json")
 
     # 1. 自动补录 (只补录私聊的，群聊的已经实时进去了)
     try:
@@ -55,17 +56,8 @@ def _process_single_char_daily(char_id, target_date_str, user_id=None):
     except Exception as e: print(f"     ❌ [补录] 出错: {e}")
 
     # 2. 生成日记
-    if not os.path.exists(short_file): return
-
-    with open(short_file, "r", encoding="utf-8") as f:
-        try: short_data = json.load(f)
-        except: return
-
     # 获取事件 (此时这里面已经包含了 私聊 + 群聊 的混合时间线)
-    day_data = short_data.get(target_date_str)
-    events = []
-    if isinstance(day_data, list): events = day_data
-    elif isinstance(day_data, dict): events = day_data.get("events", [])
+    events, _ = get_short_day(prompts_dir, target_date_str)
 
     if not events:
         print(f"     - {target_date_str} 无事件，跳过")
@@ -80,16 +72,7 @@ def _process_single_char_daily(char_id, target_date_str, user_id=None):
     if not summary: return
 
     # 写入 Medium
-    medium_data = {}
-    if os.path.exists(medium_file):
-        with open(medium_file, "r", encoding="utf-8") as f:
-            try: medium_data = json.load(f)
-            except: pass
-
-    medium_data[target_date_str] = summary
-
-    with open(medium_file, "w", encoding="utf-8") as f:
-        json.dump(medium_data, f, ensure_ascii=False, indent=2)
+    set_daily_summary(prompts_dir, target_date_str, summary)
 
     print("     📝 日记写入完成")
 
@@ -103,12 +86,13 @@ def _process_single_user_group_daily_rollovers(user_id, target_date_str):
         for group_id in group_ids:
             print(f"   > 用户 {user_id} 群聊: [{group_id}]")
             try:
-                count, _ = update_group_short_memory(group_id, target_date_str)
+                # 限流交给 LLM 调度器：总结任务走最低优先级通道，不再固定 sleep
+                with llm_lane(LANE_BULK):
+                    count, _ = update_group_short_memory(group_id, target_date_str)
                 if count > 0:
                     print(f"     ✅ 总结并分发了 {count} 条群消息")
                 else:
                     print(f"     - 无新消息")
-                time.sleep(1)
             except Exception as e:
                 print(f"     ❌ 群聊 {group_id} 处理失败: {e}")
     except Exception as e:
@@ -150,8 +134,8 @@ def _process_single_user_daily_rollovers(user_id, target_date_str):
         char_ids = get_all_char_ids_for_current_user()
         for char_id in char_ids:
             try:
-                _process_single_char_daily(char_id, target_date_str, user_id=user_id)
-                time.sleep(2)
+                with llm_lane(LANE_BULK):
+                    _process_single_char_daily(char_id, target_date_str, user_id=user_id)
             except Exception as e:
                 print(f"     ❌ 处理角色 {char_id} 时崩溃: {e}")
     except Exception as e:
@@ -188,25 +172,19 @@ def run_all_daily_rollovers(target_date_str=None):
 def _process_single_char_weekly(char_id, user_id=None):
     """处理单个角色的周结（调用时需已 set_background_user）"""
     from app import call_ai_to_summarize, get_paths
+    from services.memory_store import get_daily_summaries, set_weekly_summary
 
     print(f"   > 正在处理角色: [{char_id}] (周结)")
 
     _, prompts_dir = get_paths(char_id)
-    medium_file = os.path.join(prompts_dir, "5_memory_medium.json")
-    long_file = os.path.join(prompts_dir, "4_memory_long.json")
-
-    if not os.path.exists(medium_file): return
-
-    with open(medium_file, "r", encoding="utf-8") as f:
-        try: medium_data = json.load(f)
-        except: return
 
     today = datetime.datetime.now()
     summary_buffer = []
 
     # 过去7天
-    for i in range(7):
-        d = (today - timedelta(days=i)).strftime('%Y-%m-%d')
+    days = [(today - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(7)]
+    medium_data = get_daily_summaries(prompts_dir, days)
+    for d in days:
         if d in medium_data:
             summary_buffer.append(f"【{d}】: {medium_data[d]}")
 
@@ -225,16 +203,10 @@ def _process_single_char_weekly(char_id, user_id=None):
     week_num = (target_sunday.day - 1) // 7 + 1
     week_key = f"{target_month_str}-Week{week_num}"
 
-    long_data = {}
-    if os.path.exists(long_file):
-        with open(long_file, "r", encoding="utf-8") as f:
-            try: long_data = json.load(f)
-            except: pass
-
-    long_data[week_key] = long_summary
+    set_weekly_summary(prompts_dir, week_key, long_summary)
 
-    with open(long_file, "w", encoding="utf-8") as f:
-        json.dump(long_data, f, ensure_ascii=False, indent=2)
+    from services.memory_index import rebuild_long_memory_index
+    rebuild_long_memory_index(prompts_dir)
 
     print(f"     📜 周报写入完成: {week_key}")
 
@@ -248,8 +220,8 @@ def _process_single_user_weekly_rollovers(user_id):
         char_ids = get_all_char_ids_for_current_user()
         for char_id in char_ids:
             try:
-                _process_single_char_weekly(char_id, user_id=user_id)
-                time.sleep(2)
+                with llm_lane(LANE_BULK):
+                    _process_single_char_weekly(char_id, user_id=user_id)
             except Exception as e:
                 print(f"     ❌ 处理角色 {char_id} 时崩溃: {e}")
     except Exception as e:
@@ -447,19 +419,10 @@ def _update_bedtime_diary_status(cfg_file: str, char_id: str, target_date_str: s
 def _has_short_memory_events_for_date(char_id: str, target_date_str: str, user_id=None) -> bool:
     try:
         from app import get_paths
+        from services.memory_store import has_short_events
 
         _, prompts_dir = get_paths(char_id, user_id=user_id)
-        short_mem_path = os.path.join(prompts_dir, "6_memory_short.json")
-        if not os.path.exists(short_mem_path):
-            return False
-        with open(short_mem_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        day_data = data.get(target_date_str)
-        if isinstance(day_data, list):
-            return len(day_data) > 0
-        if isinstance(day_data, dict):
-            events = day_data.get("events", [])
-            return isinstance(events, list) and len(events) > 0
+        return has_short_events(prompts_dir, target_date_str)
     except Exception as e:
         print(f"🌙 [Diary] 检查短期记忆失败 {char_id}: {e}")
     return False
@@ -798,7 +761,7 @@ def _process_single_user_active_moments(user_id):
         if not chars_config:
             return
 
-        moments_path, last_post_path = get_moments_paths()
+        _, last_post_path = get_moments_paths()
         last_post = {}
         if os.path.exists(last_post_path):
             try:
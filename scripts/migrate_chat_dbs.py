@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线批量迁移全部聊天库（users/*/characters/*/chat.db、users/*/groups/*/chat.db 及全局旧库）到最新版本。
+服务运行时首次打开也会自动迁移；大库建索引较慢，建议升级后在低峰期先跑一遍。
+
+用法（在项目根目录）：
+    python scripts/migrate_chat_dbs.py            # 迁移
+    python scripts/migrate_chat_dbs.py --dry-run  # 只列出待迁移的库
+"""
+import argparse
+import os
+import sys
+import time
+
+# 项目根目录
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from core.chat_schema import LATEST_VERSION, iter_chat_dbs, migrate_all
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="chat.db 批量迁移")
+    p.add_argument("--dry-run", action="store_true", help="只列出待迁移的库，不修改")
+    args = p.parse_args(argv)
+
+    t0 = time.perf_counter()
+    paths = list(iter_chat_dbs())
+    print(f"共 {len(paths)} 个聊天库，目标版本 v{LATEST_VERSION}")
+    result = migrate_all(paths, dry_run=args.dry_run)
+    verb = "待迁移" if args.dry_run else "已迁移"
+    print(f"{verb} {result['migrated']}，已是最新 {result['up_to_date']}，无 messages 表跳过 {result['skipped']}，"
+          f"失败 {len(result['failed'])}，耗时 {time.perf_counter() - t0:.1f}s")
+    for path, err in result["failed"]:
+        print(f"  ❌ {path}: {err}")
+    return 1 if result["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,7 +10,7 @@ from core.config import (
     SILICONFLOW_KEY, USE_OPENROUTER, COS_BASE_URL, BASE_DIR, USERS_ROOT,
 )
 from core.context import (
-    get_current_user_id, mark_api_fatal_error,
+    get_current_user_id, mark_api_fatal_error, set_usage_task, get_usage_task,
     GEMINI_FATAL_CODES, RELAY_FATAL_CODES,
 )
 from core.circuit_breaker import (
@@ -19,46 +19,17 @@ from core.circuit_breaker import (
     check_relay_global_pause, mark_relay_global_pause, _is_cloudflare_block,
     reset_route_success,
 )
-from core.utils import get_effective_gemini_key, get_effective_openrouter_key
+from core.utils import get_effective_gemini_key, get_effective_openrouter_key, load_json_cached
+from core.http_client import http_post
+from services import api_log
+from services.usage_ledger import record_usage
+from core.tracing import traced, annotate
+from services.llm_scheduler import llm_slot, report_throttled, LLMQueueTimeout
 
 API_CONFIG_FILE = os.path.join(BASE_DIR, "configs", "api_settings.json")
 
 
-def _write_user_log(user_id, text):
-    if user_id:
-        log_dir = os.path.join(USERS_ROOT, str(user_id), "logs")
-    else:
-        log_dir = os.path.join(BASE_DIR, "logs")
-    os.makedirs(log_dir, exist_ok=True)
-    log_file = os.path.join(log_dir, "api.log")
-
-    if os.path.exists(log_file):
-        with open(log_file, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-    else:
-        lines = []
-
-    lines.append(text)
-    if len(lines) > 200:
-        lines = lines[-200:]
-
-    with open(log_file, "w", encoding="utf-8") as f:
-        f.writelines(lines)
-
-
-def _get_usage_log_file() -> str:
-    user_id = get_current_user_id()
-    if user_id:
-        base = os.path.join(USERS_ROOT, str(user_id), "logs")
-        os.makedirs(base, exist_ok=True)
-    else:
-        base = os.path.join(BASE_DIR, "logs")
-    return os.path.join(base, "usage_history.json")
-
-
-def log_full_prompt(service_name, messages, response_text=None, usage=None):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
+def _format_full_prompt(timestamp, service_name, messages, response_text, usage):
     log_content = []
     log_content.append(f"\n{'='*20} [{timestamp}] {service_name} {'='*20}")
 
@@ -81,17 +52,39 @@ def log_full_prompt(service_name, messages, response_text=None, usage=None):
         log_content.append(f"   💎 总计(Total):  {total_tokens}")
 
     log_content.append(f"{'='*50}\n")
+    return "\n".join(log_content)
 
-    final_log = "\n".join(log_content)
-
-    print(final_log)
 
+def log_full_prompt(service_name, messages, response_text=None, usage=None):
+    """记录一次 LLM 调用。写文件走 services.api_log 的后台队列；控制台按 API_LOG_CONSOLE 输出全文或摘要。"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    messages = messages or []
+
+    if api_log.level_enabled("full", "console"):
+        print(_format_full_prompt(timestamp, service_name, messages, response_text, usage))
+    elif api_log.level_enabled("summary", "console"):
+        chars = sum(len(str(m.get('content', ''))) for m in messages)
+        reply_preview = (response_text or "").replace("\n", " ")[:80]
+        tokens = f" tokens={usage.get('totalTokenCount', 0)}" if usage else ""
+        print(f"[API] {timestamp} {service_name} messages={len(messages)} chars={chars}{tokens}"
+              + (f" reply={reply_preview}" if reply_preview else ""))
+
+    if not api_log.level_enabled("summary"):
+        return
     try:
-        user_id = get_current_user_id()
-        _write_user_log(user_id, final_log)
+        record = {"time": timestamp, "type": "call", "service": service_name}
+        if api_log.level_enabled("full"):
+            # 浅拷贝：写线程稍后才做哈希去重，调用方可能继续修改 messages
+            record["messages"] = [{"role": m.get("role"), "content": m.get("content", "")} for m in messages]
+        else:
+            record["message_count"] = len(messages)
+        if response_text:
+            record["reply"] = response_text
+        if usage:
+            record["usage"] = usage
+        api_log.submit(get_current_user_id(), record)
     except Exception as e:
         print(f"FAILED TO WRITE API LOG: {e}")
-        pass
 
 
 def log_api_error(service_name, status_code, response_text, messages=None):
@@ -102,49 +95,33 @@ def log_api_error(service_name, status_code, response_text, messages=None):
         f"Status Code: {status_code}",
         f"Response: {response_text}" # 打印完整的原始响应主体（包括长 HTML），供后端详细排查
     ]
+    last_prompt = []
     if messages:
         log_content.append("--- Last Prompt Sent ---")
         for i, m in enumerate(messages[-3:]):
-            log_content.append(f"[{m.get('role')}]: {m.get('content')[:200]}")
+            log_content.append(f"[{m.get('role')}]: {str(m.get('content'))[:200]}")
+            last_prompt.append({"role": m.get("role"), "content": str(m.get("content"))[:200]})
 
-    final_log = "\n".join(log_content) + f"\n{'!'*50}\n"
-    print(final_log)
+    if api_log.level_enabled("error", "console"):
+        print("\n".join(log_content) + f"\n{'!'*50}\n")
 
+    if not api_log.level_enabled("error"):
+        return
     try:
-        user_id = get_current_user_id()
-        _write_user_log(user_id, final_log)
-    except:
+        api_log.submit(get_current_user_id(), {
+            "time": timestamp, "type": "error", "service": service_name,
+            "status_code": status_code, "response": response_text, "last_prompt": last_prompt,
+        })
+    except Exception:
         pass
 
 
 def record_token_usage(char_id, model, input_tokens, output_tokens, total_tokens):
+    """记一笔 token 用量到 SQLite 账本（异步批量写入），任务类型取自最近一次 get_model_config。"""
+    annotate(prompt_tokens=input_tokens or 0, completion_tokens=output_tokens or 0)
     try:
-        usage_file = _get_usage_log_file()
-
-        logs = []
-        if os.path.exists(usage_file):
-            with open(usage_file, "r", encoding="utf-8") as f:
-                try:
-                    logs = json.load(f)
-                except:
-                    logs = []
-
-        new_entry = {
-            "time": datetime.now().strftime("%m-%d %H:%M:%S"),
-            "char_id": char_id,
-            "model": model,
-            "input": input_tokens,
-            "output": output_tokens,
-            "total": total_tokens
-        }
-        logs.append(new_entry)
-
-        if len(logs) > 50:
-            logs = logs[-50:]
-
-        with open(usage_file, "w", encoding="utf-8") as f:
-            json.dump(logs, f, ensure_ascii=False, indent=2)
-
+        record_usage(get_current_user_id(), char_id, model, input_tokens, output_tokens, total_tokens,
+                     task=get_usage_task())
     except Exception as e:
         print(f"Log Usage Error: {e}")
 
@@ -178,6 +155,15 @@ def get_relay_provider(user_id=None):
         return "old"
 
 
+def _llm_span_attrs(args, kwargs) -> dict:
+    """LLM 调用的追踪属性：模型名和 prompt 总字数。"""
+    messages = args[0] if args else kwargs.get("messages") or []
+    model = args[2] if len(args) > 2 else kwargs.get("model_name", "")
+    return {"model": model, "prompt_chars": sum(len(str(m.get("content", ""))) for m in messages),
+            "messages": len(messages)}
+
+
+@traced("llm.openrouter", attrs=_llm_span_attrs)
 def call_openrouter(messages, char_id="unknown", model_name="gpt-3.5-turbo", user_id=None, max_tokens=4096):
     user_agents = [
         "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36",
@@ -249,7 +235,9 @@ def call_openrouter(messages, char_id="unknown", model_name="gpt-3.5-turbo", use
             return f"（系统提示：{cb['message']}）"
 
     try:
-        r = requests.post(url, json=payload, headers=headers, timeout=300)
+        # 按中转地址 / 用户排队限流，前台对话优先于后台任务
+        with llm_slot(base_url, _uid):
+            r = http_post(url, route="llm", json=payload, headers=headers)
 
         if r.status_code != 200:
             log_api_error(f"OpenRouter ({model_name})", r.status_code, r.text, messages=messages)
@@ -292,6 +280,7 @@ def call_openrouter(messages, char_id="unknown", model_name="gpt-3.5-turbo", use
                 pass
 
             if r.status_code == 429:
+                report_throttled(base_url)
                 return "（系统提示：请求过于频繁，AI 累了，请休息一分钟再聊哦。）"
             elif r.status_code >= 500:
                 detail = api_detail or f"AI 服务商目前繁忙（{r.status_code}），请稍后再试。"
@@ -345,6 +334,9 @@ def call_openrouter(messages, char_id="unknown", model_name="gpt-3.5-turbo", use
             reset_route_success(_uid, "relay")
         return content
 
+    except LLMQueueTimeout as e:
+        print(f"[LLM Scheduler] 排队超时: {e}")
+        return "（系统提示：当前请求人数较多，排队超时，请稍后再试。）"
     except requests.exceptions.Timeout:
         return "（系统提示：连接 AI 服务器超时，对方思考得太久了，请稍后重试。）"
     except Exception as e:
@@ -352,6 +344,7 @@ def call_openrouter(messages, char_id="unknown", model_name="gpt-3.5-turbo", use
         return "（系统提示：网络链路不稳定，请稍后再试。）"
 
 
+@traced("llm.gemini", attrs=_llm_span_attrs)
 def call_gemini(messages, char_id="unknown", model_name="gemini-2.0-flash", user_id=None):
     base_url = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com")
     api_key = get_effective_gemini_key(user_id=user_id)
@@ -406,7 +399,8 @@ def call_gemini(messages, char_id="unknown", model_name="gemini-2.0-flash", user
 
     for attempt in range(max_retries):
         try:
-            r = requests.post(url, json=payload, headers=headers, proxies={"http": None, "https": None}, timeout=30)
+            with llm_slot(base_url, _uid):
+                r = http_post(url, route="gemini", json=payload, headers=headers, proxies={"http": None, "https": None})
 
             if r.status_code == 200:
                 break
@@ -434,6 +428,7 @@ def call_gemini(messages, char_id="unknown", model_name="gemini-2.0-flash", user
             elif r.status_code == 403:
                 return "（系统提示：访问被拒绝（403）。请检查是否在【个人主页-账号与通知设置-gemini】中正确填写了 API Key。）"
             elif r.status_code == 429:
+                report_throttled(base_url)
                 return "（系统提示：请求过于频繁（429），谷歌端限制了访问频率，请发慢一点哦。）"
             elif r.status_code in [500, 504]:
                 return f"（系统提示：服务器响应超时或内部错误（{r.status_code}），请尝试精简聊天内容或缩减人设设定。）"
@@ -442,6 +437,9 @@ def call_gemini(messages, char_id="unknown", model_name="gemini-2.0-flash", user
             else:
                 return f"（系统提示：AI 暂时无法连接，错误码: {r.status_code}）"
 
+        except LLMQueueTimeout as e:
+            print(f"[LLM Scheduler] 排队超时: {e}")
+            return "（系统提示：当前请求人数较多，排队超时，请稍后再试。）"
         except requests.exceptions.Timeout as t_err:
             if attempt < max_retries - 1:
                 sleep_time = min(8, 2 ** attempt)
@@ -505,6 +503,8 @@ def call_gemini(messages, char_id="unknown", model_name="gemini-2.0-flash", user
 
 
 def get_model_config(task_type="chat", user_id=None):
+    # 紧随其后的 LLM 调用按该任务类型记账
+    set_usage_task(task_type)
     if user_id is None:
         from core.context import get_current_user_id
         user_id = get_current_user_id()
@@ -521,8 +521,9 @@ def get_model_config(task_type="chat", user_id=None):
         return "relay", "gpt-3.5-turbo"
 
     try:
-        with open(api_cfg_file, "r", encoding="utf-8") as f:
-            config = json.load(f)
+        config = load_json_cached(api_cfg_file)
+        if config is None:
+            raise ValueError(f"无法解析 {api_cfg_file}")
 
         route = config.get("active_route", "gemini")
         models = config.get("routes", {}).get(route, {}).get("models", {})
@@ -0,0 +1,192 @@
+"""
+API 调用日志：每个用户一个 logs/api.log（JSON Lines），只追加，按大小轮转。
+
+原来每次 LLM 调用都要读入整个 api.log、追加、截断到 200 行再整文件重写，并发对话时既慢又会互相覆盖。
+现在：
+- 请求线程只把记录放进队列，由单个后台线程写盘（同一文件只有一个写者）；
+- api.log 超过 API_LOG_MAX_BYTES 时轮转为 api.log.1 … api.log.N；
+- 长消息（主要是 system prompt，几轮之间几乎不变）按 sha1 存到 logs/prompt_blobs/<sha1>.txt，
+  日志行里只记 {"role", "sha1", "chars"}；
+- API_LOG_LEVEL / API_LOG_CONSOLE 分别控制写文件与控制台输出的详细程度。
+"""
+import os
+import json
+import queue
+import hashlib
+import threading
+import time
+
+from core.config import (
+    BASE_DIR, USERS_ROOT,
+    API_LOG_LEVEL, API_LOG_CONSOLE, API_LOG_MAX_BYTES, API_LOG_BACKUPS,
+    API_LOG_DEDUP_MIN_CHARS, API_LOG_QUEUE_SIZE,
+)
+
+LOG_FILENAME = "api.log"
+BLOB_DIRNAME = "prompt_blobs"
+LEVELS = {"off": 0, "error": 1, "summary": 2, "full": 3}
+_BLOB_TOUCH_INTERVAL = 600
+
+_queue: "queue.Queue" = queue.Queue(maxsize=API_LOG_QUEUE_SIZE)
+_writer = None
+_writer_lock = threading.Lock()
+# {blob_path: 上次确认存在/刷新 mtime 的时间}，仅写线程访问
+_blob_seen: dict = {}
+_stats = {"written": 0, "dropped": 0, "rotations": 0, "blobs_written": 0, "blobs_reused": 0}
+
+
+def get_log_dir(user_id) -> str:
+    if user_id:
+        return os.path.join(USERS_ROOT, str(user_id), "logs")
+    return os.path.join(BASE_DIR, "logs")
+
+
+def level_enabled(level, target="file") -> bool:
+    """target="file" 看 API_LOG_LEVEL，"console" 看 API_LOG_CONSOLE。"""
+    configured = API_LOG_LEVEL if target == "file" else API_LOG_CONSOLE
+    return LEVELS.get(configured, LEVELS["full"]) >= LEVELS[level]
+
+
+def _store_blob(log_dir, text) -> str:
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    path = os.path.join(log_dir, BLOB_DIRNAME, digest + ".txt")
+    now = time.time()
+    seen = _blob_seen.get(path)
+    if seen is not None and now - seen < _BLOB_TOUCH_INTERVAL:
+        _stats["blobs_reused"] += 1
+        return digest
+    if os.path.exists(path):
+        os.utime(path, None)  # 刷新 mtime，轮转清理时按 mtime 判断是否仍被引用
+        _stats["blobs_reused"] += 1
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        _stats["blobs_written"] += 1
+    _blob_seen[path] = now
+    return digest
+
+
+def _dedup_messages(log_dir, messages) -> list:
+    out = []
+    for m in messages or []:
+        content = m.get("content", "")
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False)
+        if len(content) >= API_LOG_DEDUP_MIN_CHARS:
+            out.append({"role": m.get("role"), "sha1": _store_blob(log_dir, content), "chars": len(content)})
+        else:
+            out.append({"role": m.get("role"), "content": content})
+    return out
+
+
+def _prune_blobs(log_dir, older_than):
+    blob_dir = os.path.join(log_dir, BLOB_DIRNAME)
+    if not os.path.isdir(blob_dir):
+        return
+    for name in os.listdir(blob_dir):
+        path = os.path.join(blob_dir, name)
+        try:
+            if os.path.getmtime(path) < older_than:
+                os.remove(path)
+                _blob_seen.pop(path, None)
+        except OSError:
+            pass
+
+
+def _rotate_if_needed(log_dir, path):
+    try:
+        if os.path.getsize(path) < API_LOG_MAX_BYTES:
+            return
+    except OSError:
+        return
+    if API_LOG_BACKUPS <= 0:
+        os.remove(path)
+    else:
+        for i in range(API_LOG_BACKUPS - 1, 0, -1):
+            src = f"{path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{path}.{i + 1}")
+        os.replace(path, f"{path}.1")
+    _stats["rotations"] += 1
+    # 最老的备份都不再引用的 prompt 正文可以删掉
+    oldest = f"{path}.{API_LOG_BACKUPS}" if API_LOG_BACKUPS > 0 else None
+    if oldest and os.path.exists(oldest):
+        try:
+            with open(oldest, "r", encoding="utf-8") as f:
+                first = json.loads(f.readline() or "{}")
+            _prune_blobs(log_dir, first.get("epoch", 0) - _BLOB_TOUCH_INTERVAL)
+        except Exception:
+            pass
+    elif not oldest:
+        _prune_blobs(log_dir, time.time())
+
+
+def _write_record(user_id, record):
+    log_dir = get_log_dir(user_id)
+    os.makedirs(log_dir, exist_ok=True)
+    if "messages" in record:
+        record["messages"] = _dedup_messages(log_dir, record["messages"])
+    path = os.path.join(log_dir, LOG_FILENAME)
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line)
+    _stats["written"] += 1
+    _rotate_if_needed(log_dir, path)
+
+
+def _writer_loop():
+    while True:
+        user_id, record = _queue.get()
+        try:
+            _write_record(user_id, record)
+        except Exception as e:
+            print(f"[API Log] 写入失败: {e}")
+        finally:
+            _queue.task_done()
+
+
+def _ensure_writer():
+    global _writer
+    if _writer is not None:
+        return
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_writer_loop, daemon=True, name="api-log-writer")
+            _writer.start()
+
+
+def submit(user_id, record) -> bool:
+    """异步写入一条日志记录；队列满时丢弃（日志不应拖慢对话）。"""
+    _ensure_writer()
+    record.setdefault("epoch", time.time())
+    try:
+        _queue.put_nowait((user_id, record))
+        return True
+    except queue.Full:
+        _stats["dropped"] += 1
+        return False
+
+
+def flush_api_logs(timeout=5.0) -> bool:
+    """等待队列写空（测试 / 退出前使用）。"""
+    deadline = time.time() + timeout
+    while _queue.unfinished_tasks:
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def load_blob(user_id, digest):
+    """按 sha1 取回被去重的消息正文，不存在返回 None。"""
+    path = os.path.join(get_log_dir(user_id), BLOB_DIRNAME, f"{digest}.txt")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def get_api_log_stats() -> dict:
+    return {"queued": _queue.qsize(), "level": API_LOG_LEVEL, "console": API_LOG_CONSOLE, **_stats}
@@ -0,0 +1,140 @@
+"""
+聊天记录 v2 接口（单聊 /api/<char_id>/history/v2、群聊 /api/group/<group_id>/history/v2 共用）。
+
+旧的 history 接口每次（包括每 3 秒一次的 after_id 轮询）都要 COUNT 全表，并返回逐条对象的 JSON。v2：
+- before / after 是消息 id 的 keyset 游标，多取一条判断 has_more，不做 COUNT（total=1 时才计数）；
+- 返回列式紧凑结构 {"columns": {"id": [...], "role": [...], "content": [...], "timestamp": [...]}}；
+- ETag 由 chat.db / chat.db-wal 以及影响展示（注音语言）的配置文件的 mtime+size 和查询参数算出，
+  If-None-Match 命中时直接 304，不打开 SQLite；库文件刚改动过（HISTORY_ETAG_SETTLE 内）时不发 ETag，避免 mtime 精度不足漏掉新消息；
+- after + wait=N 为长轮询：没有新消息时最多挂起 N 秒（≤ HISTORY_LONGPOLL_MAX），只轮询文件状态，库有变化再查。
+"""
+import os
+import time
+import hashlib
+
+from core.config import USERS_ROOT, USER_SETTINGS_FILE
+from core.config import HISTORY_V2_MAX_LIMIT, HISTORY_LONGPOLL_MAX, HISTORY_LONGPOLL_INTERVAL, HISTORY_ETAG_SETTLE
+from core.db import pooled_conn
+
+HISTORY_COLUMNS = ("id", "role", "content", "timestamp")
+_SELECT = "SELECT id, role, content, timestamp FROM messages"
+
+
+def _file_sig(path):
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return 0, 0
+
+
+def db_signature(db_path) -> tuple:
+    """chat.db 及其 WAL 的 (mtime_ns, size)，任何写入都会改变它。"""
+    return _file_sig(db_path) + _file_sig(db_path + "-wal")
+
+
+def history_etag(db_path, query, extra_files=()):
+    """弱 ETag；库文件刚改动过时返回 None（本次不参与 304 判断）。"""
+    sig = db_signature(db_path)
+    newest = max(sig[0], sig[2]) / 1e9
+    if time.time() - newest < HISTORY_ETAG_SETTLE:
+        return None
+    parts = [repr(sig), query] + [repr(_file_sig(p)) for p in extra_files if p]
+    return 'W/"' + hashlib.md5("|".join(parts).encode("utf-8")).hexdigest() + '"'
+
+
+def language_config_files(user_id) -> list:
+    """决定注音语言的配置文件（角色 / 群聊配置、用户设置），任一改动都会让 ETag 失效。"""
+    from core.utils import _get_characters_config_file, _get_groups_config_file
+    settings = os.path.join(USERS_ROOT, str(user_id), "configs", "user_settings.json") if user_id else USER_SETTINGS_FILE
+    return [_get_characters_config_file(user_id=user_id), _get_groups_config_file(user_id=user_id), settings]
+
+
+def etag_matches(etag, if_none_match) -> bool:
+    if not etag or not if_none_match:
+        return False
+    return etag in [t.strip() for t in if_none_match.split(",")] or if_none_match.strip() == "*"
+
+
+def wait_for_change(db_path, since, timeout) -> bool:
+    """等待库文件状态与 since 不同，超时返回 False。"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if db_signature(db_path) != since:
+            return True
+        time.sleep(HISTORY_LONGPOLL_INTERVAL)
+    return db_signature(db_path) != since
+
+
+def query_page(db_path, before=None, after=None, limit=20, with_total=False) -> dict:
+    """按 keyset 游标取一页（id 升序），返回 {"messages", "has_more", "total"?}。
+
+    after：比该 id 新的消息（轮询 / 向下翻）；before：比该 id 旧的消息（向上翻）；都不给时取最新一页。
+    has_more 表示沿翻页方向还有更多。
+    """
+    limit = max(1, min(int(limit or 20), HISTORY_V2_MAX_LIMIT))
+    with pooled_conn(db_path) as conn:
+        if after is not None:
+            rows = conn.execute(f"{_SELECT} WHERE id > ? ORDER BY id ASC LIMIT ?", (after, limit + 1)).fetchall()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+        else:
+            if before is not None:
+                rows = conn.execute(f"{_SELECT} WHERE id < ? ORDER BY id DESC LIMIT ?", (before, limit + 1)).fetchall()
+            else:
+                rows = conn.execute(f"{_SELECT} ORDER BY id DESC LIMIT ?", (limit + 1,)).fetchall()
+            has_more = len(rows) > limit
+            rows = rows[:limit][::-1]
+        page = {"messages": [dict(zip(HISTORY_COLUMNS, r)) for r in rows], "has_more": has_more}
+        if with_total:
+            page["total"] = conn.execute("SELECT COUNT(id) FROM messages").fetchone()[0]
+    return page
+
+
+def to_columns(messages) -> dict:
+    return {col: [m[col] for m in messages] for col in HISTORY_COLUMNS}
+
+
+def build_history_v2(db_path, args, if_none_match=None, annotate=None, extra_files=()):
+    """处理一次 v2 请求，返回 (status, body, etag)；status 为 304 时 body 为 None。
+
+    args 为请求参数（before / after / limit / total / wait），annotate(messages) 可原地改写内容（如日语注音）。
+    """
+    def _int(name):
+        v = args.get(name)
+        try:
+            return int(v) if v not in (None, "") else None
+        except (TypeError, ValueError):
+            return None
+
+    before, after = _int("before"), _int("after")
+    limit = _int("limit") or 20
+    with_total = str(args.get("total", "")).lower() in ("1", "true")
+    wait = 0.0
+    if after is not None:
+        try:
+            wait = max(0.0, min(float(args.get("wait") or 0), HISTORY_LONGPOLL_MAX))
+        except (TypeError, ValueError):
+            wait = 0.0
+    query = f"before={before}&after={after}&limit={limit}&total={int(with_total)}"
+
+    since = db_signature(db_path)
+    etag = history_etag(db_path, query, extra_files)
+    if etag_matches(etag, if_none_match):
+        if not (wait and wait_for_change(db_path, since, wait)):
+            return 304, None, etag
+
+    page = query_page(db_path, before=before, after=after, limit=limit, with_total=with_total)
+    since = db_signature(db_path)  # 查询之后的写入才需要等待（首次打开连接时切换 WAL 也会改动文件）
+    if wait and not page["messages"] and wait_for_change(db_path, since, wait):
+        page = query_page(db_path, before=before, after=after, limit=limit, with_total=with_total)
+    if page["messages"] and annotate:
+        annotate(page["messages"])
+
+    messages = page.pop("messages")
+    body = {"columns": to_columns(messages), "count": len(messages), **page}
+    if messages:
+        body["cursor"] = {"before": messages[0]["id"], "after": messages[-1]["id"]}
+    else:
+        body["cursor"] = {"before": before, "after": after}
+    return 200, body, history_etag(db_path, query, extra_files)
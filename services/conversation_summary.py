@@ -0,0 +1,190 @@
+"""
+会话摘要表：每个用户一个 SQLite（users/<uid>/configs/conversations.db），为联系人列表保存每个单聊 / 群聊的
+最后一条消息和未读数，/api/contacts 不再逐个打开 chat.db、按无索引的 timestamp 计数。
+
+表结构 conversations(kind, target_id, last_id, last_role, last_content, last_ts, read_id, unread, db_sig, updated_at)：
+- 未读数按消息 id 计算（id > read_id 且 role != 'user'，走主键），mark_read 时把 read_id 设为当前最大 id；
+- 聊天 / 群聊接口写入、删除、编辑消息后调用 touch_conversation 刷新对应一行；
+- db_sig 记录计算时 chat.db / chat.db-wal 的 (mtime, size)。后台任务等未接入 touch 的写入路径会让文件状态变化，
+  读取时发现不一致就只重算这一个会话，保证不会显示过期的预览和未读数；
+- 首次建立某个会话的摘要时，从旧的 read_status.json 时间换算 read_id（只在这一次按 timestamp 扫表）。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from core.config import BASE_DIR, USERS_ROOT, GROUPS_DIR, CHARACTERS_DIR
+from core.db import pooled_conn
+
+KIND_SINGLE = "single"
+KIND_GROUP = "group"
+
+SUMMARY_DB_NAME = "conversations.db"
+_DEFAULT_READ_TS = "2000-01-01 00:00:00"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    kind TEXT NOT NULL,
+    target_id TEXT NOT NULL,
+    last_id INTEGER NOT NULL DEFAULT 0,
+    last_role TEXT,
+    last_content TEXT NOT NULL DEFAULT '',
+    last_ts TEXT,
+    read_id INTEGER,
+    unread INTEGER NOT NULL DEFAULT 0,
+    db_sig TEXT,
+    updated_at REAL,
+    PRIMARY KEY (kind, target_id)
+) WITHOUT ROWID;
+"""
+
+_ready_paths = set()
+_ready_lock = threading.Lock()
+
+
+def _resolve_user(user_id):
+    if user_id is None:
+        from core.context import get_current_user_id
+        user_id = get_current_user_id()
+    return user_id
+
+
+def get_summary_db_path(user_id=None) -> str:
+    user_id = _resolve_user(user_id)
+    if user_id:
+        base = os.path.join(USERS_ROOT, str(user_id), "configs")
+    else:
+        base = os.path.join(BASE_DIR, "configs")
+    os.makedirs(base, exist_ok=True)
+    return os.path.join(base, SUMMARY_DB_NAME)
+
+
+def chat_db_path(kind, target_id, user_id=None) -> str:
+    """会话对应的 chat.db 路径（与 get_paths / get_group_dir 一致，但不创建目录、不拷贝模板）。"""
+    user_id = _resolve_user(user_id)
+    if kind == KIND_GROUP:
+        base = os.path.join(USERS_ROOT, str(user_id), "groups") if user_id else GROUPS_DIR
+    else:
+        base = os.path.join(USERS_ROOT, str(user_id), "characters") if user_id else CHARACTERS_DIR
+    return os.path.join(base, target_id, "chat.db")
+
+
+def _db_sig(db_path) -> str:
+    parts = []
+    for p in (db_path, db_path + "-wal"):
+        try:
+            st = os.stat(p)
+            parts.append(f"{st.st_mtime_ns}:{st.st_size}")
+        except OSError:
+            parts.append("0:0")
+    return "|".join(parts)
+
+
+def _summary_conn(user_id):
+    db_path = get_summary_db_path(user_id)
+    if db_path not in _ready_paths or not os.path.exists(db_path):
+        with _ready_lock:
+            with pooled_conn(db_path) as conn:
+                conn.executescript(_SCHEMA)
+            _ready_paths.add(db_path)
+    return pooled_conn(db_path, row_factory=sqlite3.Row)
+
+
+def _legacy_read_ts(target_id, user_id):
+    """旧版 read_status.json 里记录的最后阅读时间。"""
+    user_id = _resolve_user(user_id)
+    if user_id:
+        path = os.path.join(USERS_ROOT, str(user_id), "configs", "read_status.json")
+    else:
+        path = os.path.join(BASE_DIR, "configs", "read_status.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return (json.load(f) or {}).get(target_id) or _DEFAULT_READ_TS
+    except Exception:
+        return _DEFAULT_READ_TS
+
+
+def _compute(kind, target_id, user_id, read_id, mark_read=False) -> dict:
+    """从 chat.db 计算一行摘要（只走主键：最后一条 + id > read_id 的计数）。"""
+    db_path = chat_db_path(kind, target_id, user_id)
+    sig = _db_sig(db_path)
+    row = {"kind": kind, "target_id": target_id, "last_id": 0, "last_role": None, "last_content": "",
+           "last_ts": None, "read_id": read_id or 0, "unread": 0, "db_sig": sig}
+    if not os.path.exists(db_path):
+        return row
+    with pooled_conn(db_path) as conn:
+        last = conn.execute("SELECT id, role, content, timestamp FROM messages ORDER BY id DESC LIMIT 1").fetchone()
+        if last:
+            row.update(last_id=last[0], last_role=last[1], last_content=last[2] or "", last_ts=last[3])
+        if mark_read:
+            read_id = row["last_id"]
+        elif read_id is None:
+            r = conn.execute("SELECT MAX(id) FROM messages WHERE timestamp <= ?",
+                             (_legacy_read_ts(target_id, user_id),)).fetchone()
+            read_id = r[0] or 0
+        row["read_id"] = read_id
+        row["unread"] = conn.execute("SELECT COUNT(*) FROM messages WHERE id > ? AND role != 'user'",
+                                     (read_id,)).fetchone()[0]
+    # 计算期间库又被写过：不记签名，下次读取时重算
+    if _db_sig(db_path) != sig:
+        row["db_sig"] = None
+    return row
+
+
+def _store(conn, row):
+    conn.execute(
+        "INSERT OR REPLACE INTO conversations (kind, target_id, last_id, last_role, last_content, last_ts, read_id, unread, db_sig, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (row["kind"], row["target_id"], row["last_id"], row["last_role"], row["last_content"], row["last_ts"],
+         row["read_id"], row["unread"], row["db_sig"], time.time()),
+    )
+
+
+def refresh_conversation(kind, target_id, user_id=None, mark_read=False) -> dict:
+    """重算并保存一个会话的摘要，返回该行。"""
+    user_id = _resolve_user(user_id)
+    with _summary_conn(user_id) as conn:
+        prev = conn.execute("SELECT read_id FROM conversations WHERE kind = ? AND target_id = ?",
+                            (kind, target_id)).fetchone()
+        row = _compute(kind, target_id, user_id, prev["read_id"] if prev else None, mark_read=mark_read)
+        _store(conn, row)
+    return row
+
+
+def touch_conversation(kind, target_id, user_id=None):
+    """消息写入 / 删除 / 编辑之后调用；失败只打印，不影响聊天本身。"""
+    try:
+        refresh_conversation(kind, target_id, user_id=user_id)
+    except Exception as e:
+        print(f"[Conversations] 刷新会话摘要失败 {kind}:{target_id}: {e}")
+
+
+def mark_conversation_read(kind, target_id, user_id=None):
+    try:
+        refresh_conversation(kind, target_id, user_id=user_id, mark_read=True)
+    except Exception as e:
+        print(f"[Conversations] 标记已读失败 {kind}:{target_id}: {e}")
+
+
+def get_conversation_summaries(targets, user_id=None) -> dict:
+    """批量读取 [(kind, target_id)] 的摘要，返回 {(kind, target_id): row}。
+
+    一次读出该用户的全部摘要；只有缺失或 chat.db 状态已变化的会话才重算。
+    """
+    user_id = _resolve_user(user_id)
+    with _summary_conn(user_id) as conn:
+        stored = {(r["kind"], r["target_id"]): dict(r) for r in conn.execute("SELECT * FROM conversations")}
+    out = {}
+    for kind, target_id in targets:
+        row = stored.get((kind, target_id))
+        if row is None or row["db_sig"] != _db_sig(chat_db_path(kind, target_id, user_id)):
+            try:
+                row = refresh_conversation(kind, target_id, user_id=user_id)
+            except Exception as e:
+                print(f"[Conversations] 重算会话摘要失败 {kind}:{target_id}: {e}")
+                row = row or {"kind": kind, "target_id": target_id, "last_id": 0, "last_content": "",
+                              "last_ts": None, "unread": 0}
+        out[(kind, target_id)] = row
+    return out
@@ -0,0 +1,155 @@
+"""
+按用户的事件总线：后台产生的新内容通过 /api/events（SSE）推给客户端，取代每个聊天各自轮询。
+
+- 事件类型：message（单聊 / 群聊有新消息）、moment（朋友圈动态、点赞、评论变化）、memory（记忆更新完成）；
+- publish 只把事件放进该用户每个连接的有界队列，不阻塞生产者；队列满时丢弃并让该连接收到 resync，
+  客户端据此整体刷新一次；
+- 每个用户保留最近 EVENT_BUS_BACKLOG 条事件，EventSource 断线重连带上 Last-Event-ID 时补发漏掉的事件；
+- 事件只在本进程内分发（应用以单进程多线程方式运行）。
+"""
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+from core.config import EVENT_BUS_QUEUE_SIZE, EVENT_BUS_BACKLOG
+
+EVENT_MESSAGE = "message"
+EVENT_MOMENT = "moment"
+EVENT_MEMORY = "memory"
+EVENT_RESYNC = "resync"
+
+_lock = threading.Lock()
+_subscribers: dict = {}   # {user_key: set(Subscription)}
+_backlogs: dict = {}      # {user_key: deque(event)}
+_next_id = 0
+_stats = {"published": 0, "delivered": 0, "dropped": 0, "subscribers": 0}
+
+
+def _user_key(user_id) -> str:
+    return str(user_id) if user_id else ""
+
+
+class Subscription:
+    """一个 SSE 连接的事件队列。"""
+
+    def __init__(self, user_key):
+        self.user_key = user_key
+        self.queue = queue.Queue(maxsize=EVENT_BUS_QUEUE_SIZE)
+        self.overflowed = False
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+            _stats["delivered"] += 1
+        except queue.Full:
+            self.overflowed = True
+            _stats["dropped"] += 1
+
+    def get(self, timeout=None):
+        """取下一条事件，超时返回 None；之前有事件被丢弃时先返回一条 resync。"""
+        if self.overflowed:
+            self.overflowed = False
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            return {"id": None, "type": EVENT_RESYNC, "ts": time.time()}
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+def publish(user_id, event_type, **data) -> dict:
+    """向某用户的所有连接发布事件，返回事件本身（含自增 id）。"""
+    global _next_id
+    key = _user_key(user_id)
+    with _lock:
+        _next_id += 1
+        event = {"id": _next_id, "type": event_type, "ts": time.time(), **data}
+        backlog = _backlogs.get(key)
+        if backlog is None:
+            backlog = _backlogs[key] = deque(maxlen=EVENT_BUS_BACKLOG)
+        backlog.append(event)
+        subs = list(_subscribers.get(key, ()))
+        _stats["published"] += 1
+    for sub in subs:
+        sub.offer(event)
+    return event
+
+
+def subscribe(user_id, last_event_id=None) -> Subscription:
+    """订阅某用户的事件；给出 last_event_id 时先补发之后的事件（已无法补全时改发一条 resync）。"""
+    key = _user_key(user_id)
+    sub = Subscription(key)
+    with _lock:
+        _subscribers.setdefault(key, set()).add(sub)
+        _stats["subscribers"] += 1
+        if last_event_id is not None:
+            backlog = _backlogs.get(key) or deque()
+            # 进程重启过（id 回退）或 backlog 已滚动过 last_event_id：无法精确补发，让客户端整体刷新
+            if last_event_id > _next_id or (len(backlog) == backlog.maxlen and backlog[0]["id"] > last_event_id):
+                sub.overflowed = True
+            else:
+                for e in backlog:
+                    if e["id"] > last_event_id:
+                        sub.offer(e)
+    return sub
+
+
+def unsubscribe(sub):
+    with _lock:
+        subs = _subscribers.get(sub.user_key)
+        if subs and sub in subs:
+            subs.discard(sub)
+            _stats["subscribers"] -= 1
+            if not subs:
+                _subscribers.pop(sub.user_key, None)
+
+
+def format_sse(event) -> str:
+    lines = []
+    if event.get("id") is not None:
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['type']}")
+    lines.append("data: " + json.dumps(event, ensure_ascii=False, default=str))
+    return "\n".join(lines) + "\n\n"
+
+
+def _current_user(user_id):
+    if user_id is None:
+        from core.context import get_current_user_id
+        user_id = get_current_user_id()
+    return user_id
+
+
+def notify_message(kind, target_id, user_id=None, role=None):
+    """单聊（kind="single"）/ 群聊（kind="group"）有新消息；失败不影响调用方。"""
+    try:
+        publish(_current_user(user_id), EVENT_MESSAGE, kind=kind, target=target_id, role=role)
+    except Exception as e:
+        print(f"[Events] 发布消息事件失败: {e}")
+
+
+def notify_moment(action, user_id=None, moment_id=None, char_id=None):
+    """朋友圈变化：action 为 post / update / delete / reactions。"""
+    try:
+        publish(_current_user(user_id), EVENT_MOMENT, action=action, moment_id=moment_id, char_id=char_id)
+    except Exception as e:
+        print(f"[Events] 发布朋友圈事件失败: {e}")
+
+
+def notify_memory(kind, target_id, user_id=None, date=None):
+    """短期记忆同步 / 日结等记忆更新完成。"""
+    try:
+        publish(_current_user(user_id), EVENT_MEMORY, kind=kind, target=target_id, date=date)
+    except Exception as e:
+        print(f"[Events] 发布记忆事件失败: {e}")
+
+
+def get_event_bus_stats() -> dict:
+    with _lock:
+        return {"users": len(_subscribers), "last_id": _next_id, **_stats}
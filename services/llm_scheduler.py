@@ -0,0 +1,265 @@
+"""
+LLM 调用调度：所有文本模型调用（call_openrouter / call_gemini / 流式接口）发出请求前先在这里排队拿名额。
+
+- 按服务商（中转 base URL / Gemini 地址的 host）限制同时在途的请求数，并用令牌桶限制每秒请求数；
+- 按用户再加一个令牌桶，单个用户的批量任务不会占满整个服务商的额度；
+- 三条优先级通道：interactive（用户正在等的请求）> background（主动消息、朋友圈、论坛等后台生成）
+  > bulk（日结 / 周结等记忆总结）。有高优先级在等服务商名额（并发上限 / 服务商令牌桶 / 429 冷却）时
+  低优先级不出队（只是在等自己用户令牌桶的不算），且后台通道不能占用 LLM_INTERACTIVE_RESERVED 个只留给前台的名额；
+- 服务商返回 429 时调用 report_throttled，之后 LLM_THROTTLE_COOLDOWN 秒内后台通道暂停出队；
+- 统计各通道的排队深度、等待时间与超时次数，供 /api/admin/http_stats 查看。
+
+通道默认按调用环境判断：在 Flask 请求上下文里为 interactive，否则任务类型为 summary 时为 bulk，其余为 background；
+也可以用 with llm_lane(...) 显式指定。
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+
+from core.config import (
+    LLM_SCHEDULER_ENABLED, LLM_PROVIDER_MAX_CONCURRENCY, LLM_INTERACTIVE_RESERVED,
+    LLM_PROVIDER_RATE, LLM_PROVIDER_BURST, LLM_USER_RATE, LLM_USER_BURST,
+    LLM_QUEUE_TIMEOUT_INTERACTIVE, LLM_QUEUE_TIMEOUT_BACKGROUND, LLM_THROTTLE_COOLDOWN,
+)
+from core.context import get_usage_task
+
+LANE_INTERACTIVE = "interactive"
+LANE_BACKGROUND = "background"
+LANE_BULK = "bulk"
+LANES = (LANE_INTERACTIVE, LANE_BACKGROUND, LANE_BULK)
+
+_lane_var: ContextVar[str | None] = ContextVar("llm_lane", default=None)
+
+
+class LLMQueueTimeout(Exception):
+    """排队超过该通道的等待上限仍未拿到名额。"""
+
+
+class TokenBucket:
+    """令牌桶：rate 为每秒补充的令牌数，burst 为桶容量；rate <= 0 表示不限速。调用方负责加锁。"""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now=None) -> float:
+        """还要等多久才有 1 个令牌（秒），0 表示现在就有。"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now=None):
+        if self.rate <= 0:
+            return
+        self._refill(time.monotonic() if now is None else now)
+        self.tokens -= 1
+
+
+class _Provider:
+    def __init__(self, key):
+        self.key = key
+        self.bucket = TokenBucket(LLM_PROVIDER_RATE, LLM_PROVIDER_BURST)
+        self.in_flight = 0
+        self.waiting = {lane: 0 for lane in LANES}
+        self.blocked = {lane: 0 for lane in LANES}  # 其中卡在服务商名额上的排队者
+        self.throttled_until = 0.0
+        self.throttled = 0
+
+
+class LLMScheduler:
+    """按服务商排队的调度器，一个 threading.Condition 管理全部服务商（请求量不大，够用且不易出错）。"""
+
+    def __init__(self, max_concurrency=None, reserved=None):
+        self.max_concurrency = max(1, max_concurrency or LLM_PROVIDER_MAX_CONCURRENCY)
+        self.reserved = min(self.max_concurrency - 1, LLM_INTERACTIVE_RESERVED if reserved is None else reserved)
+        self._cond = threading.Condition()
+        self._providers: dict[str, _Provider] = {}
+        self._users: dict[str, TokenBucket] = {}
+        self._stats = {lane: {"acquired": 0, "wait_ms": 0.0, "max_wait_ms": 0.0, "timeouts": 0} for lane in LANES}
+
+    def _provider(self, key) -> _Provider:
+        p = self._providers.get(key)
+        if p is None:
+            p = self._providers[key] = _Provider(key)
+        return p
+
+    def _user_bucket(self, user_key):
+        if not user_key:
+            return None
+        b = self._users.get(user_key)
+        if b is None:
+            b = self._users[user_key] = TokenBucket(LLM_USER_RATE, LLM_USER_BURST)
+        return b
+
+    def _blocked_by(self, p, lane, now):
+        """当前不能出队时返回原因，可以出队时返回 None。"""
+        rank = LANES.index(lane)
+        if any(p.blocked[l] for l in LANES[:rank]):
+            return "priority"
+        limit = self.max_concurrency if lane == LANE_INTERACTIVE else self.max_concurrency - self.reserved
+        if p.in_flight >= limit:
+            return "concurrency"
+        if lane != LANE_INTERACTIVE and now < p.throttled_until:
+            return "throttled"
+        return None
+
+    def acquire(self, provider_key, user_key=None, lane=LANE_INTERACTIVE, timeout=None) -> float:
+        """排队直到拿到名额，返回等待秒数；超时抛 LLMQueueTimeout。必须与 release 成对调用。"""
+        t0 = time.monotonic()
+        deadline = None if timeout is None else t0 + timeout
+        with self._cond:
+            p = self._provider(provider_key)
+            ub = self._user_bucket(user_key)
+            p.waiting[lane] += 1
+            blocked = False
+            try:
+                while True:
+                    now = time.monotonic()
+                    reason = self._blocked_by(p, lane, now)
+                    sleep_for = None
+                    capacity = reason is not None
+                    if reason is None:
+                        p_wait = p.bucket.wait_time(now)
+                        sleep_for = max(p_wait, ub.wait_time(now) if ub else 0.0)
+                        if sleep_for <= 0:
+                            p.bucket.take(now)
+                            if ub:
+                                ub.take(now)
+                            p.in_flight += 1
+                            break
+                        # 只卡在自己的用户令牌桶上时不挡低优先级通道
+                        capacity = p_wait > 0
+                    elif reason == "throttled":
+                        sleep_for = p.throttled_until - now
+                    if capacity != blocked:
+                        p.blocked[lane] += 1 if capacity else -1
+                        blocked = capacity
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            self._stats[lane]["timeouts"] += 1
+                            raise LLMQueueTimeout(f"{provider_key} {lane} 排队超过 {timeout:.0f}s")
+                        sleep_for = remaining if sleep_for is None else min(sleep_for, remaining)
+                    self._cond.wait(sleep_for)
+            finally:
+                p.waiting[lane] -= 1
+                if blocked:
+                    p.blocked[lane] -= 1
+                # 本通道少了一个排队者，低优先级通道可能可以出队了
+                self._cond.notify_all()
+            waited = time.monotonic() - t0
+            st = self._stats[lane]
+            st["acquired"] += 1
+            st["wait_ms"] += waited * 1000
+            st["max_wait_ms"] = max(st["max_wait_ms"], waited * 1000)
+        return waited
+
+    def release(self, provider_key):
+        with self._cond:
+            p = self._provider(provider_key)
+            p.in_flight = max(0, p.in_flight - 1)
+            self._cond.notify_all()
+
+    def report_throttled(self, provider_key, cooldown=None):
+        """服务商返回 429：清空令牌，并在 cooldown 秒内暂停后台通道。"""
+        with self._cond:
+            p = self._provider(provider_key)
+            p.bucket.tokens = min(p.bucket.tokens, 0.0)
+            p.throttled_until = time.monotonic() + (LLM_THROTTLE_COOLDOWN if cooldown is None else cooldown)
+            p.throttled += 1
+        print(f"[LLM Scheduler] {provider_key} 返回 429，后台调用暂停 {LLM_THROTTLE_COOLDOWN if cooldown is None else cooldown}s")
+
+    def get_stats(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            lanes = {}
+            for lane, st in self._stats.items():
+                lanes[lane] = {
+                    "queued": sum(p.waiting[lane] for p in self._providers.values()),
+                    "acquired": st["acquired"],
+                    "avg_wait_ms": round(st["wait_ms"] / st["acquired"], 1) if st["acquired"] else 0.0,
+                    "max_wait_ms": round(st["max_wait_ms"], 1),
+                    "timeouts": st["timeouts"],
+                }
+            providers = {
+                key: {
+                    "in_flight": p.in_flight,
+                    "waiting": dict(p.waiting),
+                    "blocked": dict(p.blocked),
+                    "throttled": p.throttled,
+                    "throttled_remaining_s": round(max(0.0, p.throttled_until - now), 1),
+                }
+                for key, p in self._providers.items()
+            }
+        return {"enabled": LLM_SCHEDULER_ENABLED, "max_concurrency": self.max_concurrency,
+                "interactive_reserved": self.reserved, "lanes": lanes, "providers": providers}
+
+
+_scheduler = LLMScheduler()
+
+
+def provider_key(base_url) -> str:
+    """服务商标识：base URL 的 host（不同中转地址分别限流）。"""
+    parts = urlsplit(base_url or "")
+    return (parts.netloc or base_url or "unknown").lower()
+
+
+def current_lane() -> str:
+    lane = _lane_var.get()
+    if lane:
+        return lane
+    try:
+        from flask import has_request_context
+        if has_request_context():
+            return LANE_INTERACTIVE
+    except Exception:
+        pass
+    return LANE_BULK if get_usage_task() == "summary" else LANE_BACKGROUND
+
+
+@contextmanager
+def llm_lane(lane):
+    """在 with 块内发出的模型调用都走指定通道。"""
+    token = _lane_var.set(lane)
+    try:
+        yield
+    finally:
+        _lane_var.reset(token)
+
+
+@contextmanager
+def llm_slot(base_url, user_id=None, lane=None):
+    """拿到 base_url 所在服务商的一个名额后执行 with 块；排队超时抛 LLMQueueTimeout。"""
+    if not LLM_SCHEDULER_ENABLED:
+        yield
+        return
+    key = provider_key(base_url)
+    lane = lane or current_lane()
+    timeout = LLM_QUEUE_TIMEOUT_INTERACTIVE if lane == LANE_INTERACTIVE else LLM_QUEUE_TIMEOUT_BACKGROUND
+    waited = _scheduler.acquire(key, str(user_id) if user_id else None, lane, timeout=timeout)
+    if waited >= 1:
+        print(f"[LLM Scheduler] {key} {lane} 排队 {waited:.1f}s")
+    try:
+        yield
+    finally:
+        _scheduler.release(key)
+
+
+def report_throttled(base_url, cooldown=None):
+    if LLM_SCHEDULER_ENABLED:
+        _scheduler.report_throttled(provider_key(base_url), cooldown)
+
+
+def get_scheduler_stats() -> dict:
+    return _scheduler.get_stats()
@@ -7,6 +7,8 @@ from datetime import datetime, timedelta
 from core.config import BASE_DIR, USERS_ROOT, CONFIG_FILE
 from core.context import get_current_user_id
 from core.utils import get_paths
+from core.chat_schema import ensure_chat_db
+from services.memory_store import get_short_day, replace_short_day
 
 from services.ai_client import get_model_config, call_openrouter, call_gemini
 from services.prompt_builder import get_ai_language
@@ -156,33 +158,19 @@ def call_ai_to_summarize(text_content, prompt_type="short", char_id="kunigami",
 
 def update_short_memory_for_date(char_id, target_date_str, force_reset=False, user_id=None):
     db_path, prompts_dir = get_paths(char_id, user_id=user_id)
-    short_mem_path = os.path.join(prompts_dir, "6_memory_short.json")
 
-    current_data = {}
-    if os.path.exists(short_mem_path):
-        with open(short_mem_path, "r", encoding="utf-8") as f:
-            try:
-                current_data = json.load(f)
-            except:
-                pass
-
-    day_data = current_data.get(target_date_str)
     existing_events = []
     last_id = 0
 
     if not force_reset:
-        if isinstance(day_data, list):
-            existing_events = day_data
-            last_id = 0
-        elif isinstance(day_data, dict):
-            existing_events = day_data.get("events", [])
-            last_id = day_data.get("last_id", 0)
+        existing_events, last_id = get_short_day(prompts_dir, target_date_str)
     else:
         print(f"   -> [Force Reset] 强制重置 {target_date_str}，从头开始扫描")
 
     if not os.path.exists(db_path):
         return 0, []
 
+    ensure_chat_db(db_path)
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
 
@@ -247,13 +235,7 @@ def update_short_memory_for_date(char_id, target_date_str, force_reset=False, us
 
         all_events.sort(key=lambda x: x['time'])
 
-        current_data[target_date_str] = {
-            "events": all_events,
-            "last_id": new_max_id
-        }
-
-        with open(short_mem_path, "w", encoding="utf-8") as f:
-            json.dump(current_data, f, ensure_ascii=False, indent=2)
+        replace_short_day(prompts_dir, target_date_str, all_events, last_id=new_max_id)
 
         return len(new_events_raw), new_events_raw
 
@@ -0,0 +1,213 @@
+"""
+长期记忆倒排索引：把长期记忆（memory.db 的 weekly_summaries）预先切分成事件，并建立 二元字串(bigram) → 事件 的倒排表。
+
+select_relevant_long_memory 过去每条消息都要重新 split_events 全部周记，
+再对每个事件做 `kw in ev` 子串扫描。现在：
+- 事件列表、周 key → (年, 月)、每个事件的 bigram 都持久化到 4_memory_long.index.json；
+- 周结 / 记忆编辑器写入长期记忆后调用 rebuild_long_memory_index，只重新切分内容变化的周；
+- 索引是否过期按 memory_store.weekly_signature（库 id + 周报写入次数）判断；
+- 查询时用关键词的 bigram 求交集得到候选事件，再对候选做一次子串校验，
+  结果与原来的 `kw in ev` 完全一致。
+"""
+import os
+import re
+import json
+import hashlib
+import threading
+
+from core.tracing import record_cache
+from services.memory_store import get_weekly_summaries, weekly_signature
+
+INDEX_FILENAME = "4_memory_long.index.json"
+INDEX_VERSION = 1
+
+# {prompts_dir: (source_sig, LongMemoryIndex)}
+_index_cache: dict = {}
+_index_lock = threading.Lock()
+
+
+def split_memory_events(text_block) -> list:
+    """把一周的长期记忆拆成事件列表（有 "- " 列表时按行，否则按句末标点）。"""
+    if not text_block:
+        return []
+    if not isinstance(text_block, str):
+        text_block = str(text_block)
+    lines = text_block.splitlines()
+    has_bullets = any(ln.strip().startswith("- ") for ln in lines)
+    if has_bullets:
+        events = []
+        for ln in lines:
+            s = ln.strip()
+            if not s:
+                continue
+            if s.startswith("- "):
+                s = s[2:].strip()
+            if len(s) >= 2:
+                events.append(s)
+        return events
+    candidates = re.split(r"[。！？!?\n]+", text_block)
+    return [c.strip() for c in candidates if len(c.strip()) >= 4]
+
+
+def parse_memory_key_to_month(key):
+    """"2025-03-Week2" / "2025-03" -> (2025, 3)，无法解析时返回 None。"""
+    key = (key or "").strip()
+    if not key:
+        return None
+    if "-Week" in key:
+        part = key.split("-Week")[0]
+    else:
+        part = key
+    parts = part.split("-")
+    if len(parts) >= 2:
+        try:
+            y, m = int(parts[0]), int(parts[1])
+            if 1 <= m <= 12:
+                return (y, m)
+        except (ValueError, IndexError):
+            pass
+    return None
+
+
+def _bigrams(text: str) -> set:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _text_hash(text) -> str:
+    return hashlib.md5(str(text).encode("utf-8")).hexdigest()
+
+
+def _build_entry(text) -> dict:
+    events = split_memory_events(text)
+    postings = {}
+    for i, ev in enumerate(events):
+        for g in _bigrams(ev):
+            postings.setdefault(g, []).append(i)
+    return {"hash": _text_hash(text), "events": events, "postings": postings}
+
+
+class LongMemoryIndex:
+    """单个角色长期记忆的内存索引。事件以全局下标 idx 引用：self.events[idx] = (week_key, event)。"""
+
+    def __init__(self, entries: dict):
+        self.events = []
+        self.key_month = {}
+        self.postings = {}
+        for key, entry in entries.items():
+            base = len(self.events)
+            self.key_month[key] = parse_memory_key_to_month(key)
+            for ev in entry.get("events", []):
+                self.events.append((key, ev))
+            for g, ids in entry.get("postings", {}).items():
+                bucket = self.postings.get(g)
+                if bucket is None:
+                    bucket = self.postings[g] = set()
+                bucket.update(base + i for i in ids)
+
+    @classmethod
+    def from_memory(cls, long_mem: dict):
+        return cls({k: _build_entry(v) for k, v in (long_mem or {}).items()})
+
+    def month_of(self, key):
+        if key in self.key_month:
+            return self.key_month[key]
+        return parse_memory_key_to_month(key)
+
+    def events_containing(self, kw) -> set:
+        """返回包含子串 kw 的事件下标集合。"""
+        if not kw:
+            return set()
+        if len(kw) < 2:
+            return {i for i, (_, ev) in enumerate(self.events) if kw in ev}
+        grams = sorted(_bigrams(kw), key=lambda g: len(self.postings.get(g, ())))
+        cand = None
+        for g in grams:
+            ids = self.postings.get(g)
+            if not ids:
+                return set()
+            cand = set(ids) if cand is None else cand & ids
+            if not cand:
+                return set()
+        return {i for i in cand if kw in self.events[i][1]}
+
+    def match_counts(self, keywords) -> dict:
+        """{事件下标: 命中的关键词个数}，等价于 sum(1 for kw in keywords if kw in ev)。"""
+        counts = {}
+        for kw in keywords or []:
+            for i in self.events_containing(kw):
+                counts[i] = counts.get(i, 0) + 1
+        return counts
+
+
+def _load_index_file(index_path) -> dict:
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") == INDEX_VERSION:
+            return data
+    except Exception:
+        pass
+    return {}
+
+
+def rebuild_long_memory_index(prompts_dir, long_mem=None):
+    """写入长期记忆后调用：只重新切分内容有变化的周，并持久化索引。返回新的 LongMemoryIndex。"""
+    index_path = os.path.join(prompts_dir, INDEX_FILENAME)
+    if long_mem is None:
+        try:
+            long_mem = get_weekly_summaries(prompts_dir)
+        except Exception:
+            long_mem = {}
+    if not isinstance(long_mem, dict):
+        long_mem = {}
+
+    with _index_lock:
+        old_entries = _load_index_file(index_path).get("entries", {})
+        entries = {}
+        rebuilt = 0
+        for key, text in long_mem.items():
+            old = old_entries.get(key)
+            if old and old.get("hash") == _text_hash(text):
+                entries[key] = old
+            else:
+                entries[key] = _build_entry(text)
+                rebuilt += 1
+
+        sig = weekly_signature(prompts_dir)
+        try:
+            tmp_path = index_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "version": INDEX_VERSION,
+                    "source_sig": sig,
+                    "entries": entries,
+                }, f, ensure_ascii=False)
+            os.replace(tmp_path, index_path)
+        except Exception as e:
+            print(f"[Memory Index] 索引写入失败 {index_path}: {e}")
+
+        index = LongMemoryIndex(entries)
+        _index_cache[prompts_dir] = (sig, index)
+    if rebuilt:
+        print(f"[Memory Index] 重建长期记忆索引: {prompts_dir} (变更 {rebuilt}/{len(entries)} 周)")
+    return index
+
+
+def get_long_memory_index(prompts_dir, long_mem=None):
+    """获取角色长期记忆索引：优先内存缓存，其次磁盘索引，长期记忆有变化时增量重建。"""
+    sig = weekly_signature(prompts_dir)
+    cached = _index_cache.get(prompts_dir)
+    if cached and cached[0] == sig:
+        record_cache("long_memory_index", True)
+        return cached[1]
+    record_cache("long_memory_index", False)
+
+    data = _load_index_file(os.path.join(prompts_dir, INDEX_FILENAME))
+    if data and sig is not None and data.get("source_sig") == sig:
+        index = LongMemoryIndex(data.get("entries", {}))
+        with _index_lock:
+            _index_cache[prompts_dir] = (sig, index)
+        return index
+
+    # 长期记忆被其它途径改写（或索引不存在）：按内容哈希增量重建
+    return rebuild_long_memory_index(prompts_dir, long_mem)
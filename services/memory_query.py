@@ -0,0 +1,505 @@
+"""
+长期记忆检索的 query 分析：关键词 + 时间参考。
+
+过去每条回复前都要串行调用一次记忆模型（get_model_config("summary")），只为抽取关键词和时间参考。
+这里改为：
+- 先用本地规则抽取时间参考（"去年夏天" / "先週" / "last March" 等），再结合分词得到的用户关键词；
+  本地结果足够确定（有关键词且有时间参考，或是 "嗯嗯" / "ok" 这类寒暄）时不再调用模型；
+- 结果按 (用户, 语言, 日期, 归一化文本) 缓存，重复/重试的消息直接命中；
+- prefetch 在后台线程提前发起分析，与 prompt 组装并发，select_relevant_long_memory 取结果时再等待。
+"""
+import re
+import json
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime, timedelta
+
+from core.config import (
+    LONG_MEMORY_QUERY_MODE, LONG_MEMORY_QUERY_CACHE_SIZE,
+    LONG_MEMORY_QUERY_WORKERS, LONG_MEMORY_QUERY_WAIT_TIMEOUT,
+)
+from services.llm_scheduler import llm_lane, current_lane
+
+MAX_TIME_REFS = 5
+
+_cache: OrderedDict = OrderedDict()
+_pending: dict = {}
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "local": 0, "ai": 0, "ai_failed": 0, "prefetched": 0}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=LONG_MEMORY_QUERY_WORKERS, thread_name_prefix="memory-query")
+    return _executor
+
+
+def normalize_query(text) -> str:
+    """全角/半角统一、小写、压缩空白，作为缓存 key。"""
+    s = unicodedata.normalize("NFKC", str(text or "")).lower()
+    return re.sub(r"\s+", " ", s).strip()[:800]
+
+
+# ---------------- 本地时间参考抽取 ----------------
+
+_CN_NUM = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10,
+           "十一": 11, "十二": 12, "两": 2}
+_EN_MONTHS = {
+    "january": 1, "february": 2, "march": 3, "april": 4, "may": 5, "june": 6, "july": 7,
+    "august": 8, "september": 9, "october": 10, "november": 11, "december": 12,
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "jun": 6, "jul": 7, "aug": 8, "sep": 9, "sept": 9,
+    "oct": 10, "nov": 11, "dec": 12,
+}
+_SEASON_MONTHS = {"spring": (3, 4, 5), "summer": (6, 7, 8), "autumn": (9, 10, 11), "winter": (12, 1, 2)}
+_SEASON_WORDS = {
+    "春": "spring", "夏": "summer", "秋": "autumn", "冬": "winter",
+    "spring": "spring", "summer": "summer", "autumn": "autumn", "fall": "autumn", "winter": "winter",
+}
+
+# 年份偏移（相对今年）
+_YEAR_WORDS = [
+    (r"大前年|一昨々年|さきおととし", -3),
+    (r"一昨年|おととし|the year before last", -2),
+    (r"去年|昨年|last year", -1),
+    (r"今年|this year", 0),
+    (r"明年|来年|next year", 1),
+]
+# 中文 "前年" = 前两年；日文 "前年" = 前一年
+_ZH_QIANNIAN = re.compile(r"(?<!大)前年")
+_KANA = re.compile(r"[぀-ヿ]")
+
+_NUM = r"(\d{1,2}|[一二三四五六七八九十两]{1,3})"
+
+
+def _to_int(s):
+    if s.isdigit():
+        return int(s)
+    return _CN_NUM.get(s)
+
+
+def _ym(d) -> str:
+    return f"{d.year}-{d.month:02d}"
+
+
+def _shift_months(now, n):
+    idx = now.year * 12 + (now.month - 1) + n
+    return f"{idx // 12}-{idx % 12 + 1:02d}"
+
+
+def _season_refs(season, year):
+    refs = []
+    for m in _SEASON_MONTHS[season]:
+        # 冬天跨年：12 月属于 year，1/2 月属于 year+1
+        y = year + 1 if season == "winter" and m < 12 else year
+        refs.append(f"{y}-{m:02d}")
+    return refs
+
+
+def extract_local_time_refs(text, now=None) -> list:
+    """
+    规则抽取时间参考，输出与记忆模型一致的格式（"2025" / "2025-03" / "03"）。
+    只覆盖常见的中日英表达，识别不了的交给模型。
+    """
+    if not text:
+        return []
+    now = now or datetime.now()
+    s = unicodedata.normalize("NFKC", str(text)).lower()
+    refs = []
+
+    def add(*items):
+        for it in items:
+            if it and it not in refs:
+                refs.append(it)
+
+    # 相对年份
+    year = None
+    for pat, off in _YEAR_WORDS:
+        if re.search(pat, s):
+            year = now.year + off
+            break
+    if year is None and _ZH_QIANNIAN.search(s):
+        year = now.year - (1 if _KANA.search(s) else 2)
+    m = re.search(r"(\d+)\s*(?:年前|years? ago)", s)
+    if year is None and m:
+        year = now.year - int(m.group(1))
+
+    # 明确的年份 / 年月
+    for m in re.finditer(r"((?:19|20)\d{2})\s*[年/\-.]\s*(\d{1,2})(?:\s*月|(?!\d))", s):
+        mo = int(m.group(2))
+        if 1 <= mo <= 12:
+            add(f"{m.group(1)}-{mo:02d}")
+    explicit_years = re.findall(r"((?:19|20)\d{2})\s*年|\b((?:19|20)\d{2})\b", s)
+    for a, b in explicit_years:
+        y = a or b
+        if year is None:
+            year = int(y)
+        if not any(r.startswith(y) for r in refs):
+            add(y)
+
+    # 季节
+    season = None
+    m = re.search(r"(春|夏|秋|冬)(?:天|季|休み|の頃|頃)|(春|夏|秋|冬)(?=に|は|の)|(暑|寒)假", s)
+    if m:
+        season = _SEASON_WORDS.get(m.group(1) or m.group(2) or "") or ("summer" if m.group(3) == "暑" else "winter")
+    else:
+        m = re.search(r"\b(?:(last|this)\s+)?(spring|summer|autumn|fall|winter)\b", s)
+        if m:
+            season = _SEASON_WORDS[m.group(2)]
+            if year is None and m.group(1) == "this":
+                year = now.year
+            elif year is None and m.group(1) == "last":
+                # 最近一个已经结束的该季节
+                end_month = _SEASON_MONTHS[season][-1]
+                start_year = now.year - 1 if season == "winter" else now.year
+                year = start_year if (now.year, now.month) > (start_year + (1 if season == "winter" else 0), end_month) else start_year - 1
+    if season:
+        if year is not None:
+            add(*_season_refs(season, year))
+        else:
+            add(*(f"{mo:02d}" for mo in _SEASON_MONTHS[season]))
+
+    # 月份："3月" / "三月" / "march" / "last march"
+    months = []
+    for m in re.finditer(_NUM + r"\s*月(?!\s*\d)", s):
+        mo = _to_int(m.group(1))
+        # 排除 "3个月前" / "3ヶ月" 这类时长
+        if mo and 1 <= mo <= 12 and not re.match(r"[个ヶか箇カ]", s[max(0, m.start(1) + len(m.group(1))):m.end()]):
+            months.append(mo)
+    en_month_pat = r"\b(?:(last|this|next)\s+)?(" + "|".join(sorted(_EN_MONTHS, key=len, reverse=True)) + r")\b"
+    for m in re.finditer(en_month_pat, s):
+        name = m.group(2)
+        # "may" 作为情态动词太常见，只有带 last/this/next 或年份时才当月份
+        if name == "may" and not m.group(1) and year is None:
+            continue
+        mo = _EN_MONTHS[name]
+        if m.group(1) == "last" and year is None:
+            y = now.year if mo < now.month else now.year - 1
+            add(f"{y}-{mo:02d}")
+        else:
+            months.append(mo)
+    for mo in months:
+        if year is not None:
+            if not any(r.startswith(f"{year}-") and r.endswith(f"-{mo:02d}") for r in refs):
+                add(f"{year}-{mo:02d}")
+        else:
+            add(f"{mo:02d}")
+
+    # 相对月份 / 周 / 天
+    if re.search(r"上个?月|先月|前の月|last month", s):
+        add(_shift_months(now, -1))
+    if re.search(r"这个?月|本月|今月|this month", s):
+        add(_ym(now))
+    m = re.search(_NUM + r"\s*(?:个月前|ヶ月前|か月前|カ月前|箇月前)|(\d+)\s*months? ago", s)
+    if m:
+        n = _to_int(m.group(1) or m.group(2))
+        if n:
+            add(_shift_months(now, -n))
+    if re.search(r"上个?(?:周|週|星期|礼拜)|先週|前の週|last week", s):
+        add(_ym(now - timedelta(days=7)))
+    if re.search(r"这个?(?:周|週|星期|礼拜)|本周|今週|this week", s):
+        add(_ym(now))
+    if re.search(r"前天|一昨日|おととい|day before yesterday", s):
+        add(_ym(now - timedelta(days=2)))
+    elif re.search(r"昨天|昨日|昨晚|昨夜|yesterday|last night", s):
+        add(_ym(now - timedelta(days=1)))
+    m = re.search(_NUM + r"\s*(?:天前|日前)|(\d+)\s*days? ago", s)
+    if m:
+        n = _to_int(m.group(1) or m.group(2))
+        if n:
+            add(_ym(now - timedelta(days=n)))
+    m = re.search(_NUM + r"\s*(?:周前|週間前|星期前)|(\d+)\s*weeks? ago", s)
+    if m:
+        n = _to_int(m.group(1) or m.group(2))
+        if n:
+            add(_ym(now - timedelta(weeks=n)))
+
+    # 只有年份偏移（"去年"）时输出年份
+    if year is not None and not any(r.startswith(str(year)) for r in refs):
+        add(str(year))
+
+    return refs[:MAX_TIME_REFS]
+
+
+_TRIVIAL = re.compile(
+    r"^(?:[嗯恩哦噢喔啊哈嘿呵好行对是的了呀吧啦嘛呢吗～~]+|ok(?:ay)?|k+|yes|yeah|yep|no|nope|lol|haha+|hmm+|thanks?|thank you|"
+    r"うん+|ええ|はい|そう(?:だね|ですね|か)?|なるほど|ありがと(?:う)?|おけ|りょ(?:うかい)?|w+|草)$"
+)
+
+
+def is_trivial_query(text) -> bool:
+    """寒暄/应答类消息（"嗯嗯" / "ok" / "うん"），不需要检索长期记忆。"""
+    s = normalize_query(text)
+    s = re.sub(r"[\s\W_]+", "", s)
+    if not s:
+        return True
+    return bool(_TRIVIAL.match(s))
+
+
+# ---------------- 记忆模型 ----------------
+
+def _normalize_ai_time_refs(time_list) -> list:
+    """标准化 time_refs：统一为数字格式（YYYY-MM / YYYY / MM）。"""
+    time_refs = []
+    for t in time_list:
+        if not t:
+            continue
+        t = str(t).strip()
+        # "2025-03" 或 "2025-3"
+        m = re.match(r'^(\d{4})-(\d{1,2})$', t)
+        if m:
+            time_refs.append(f"{m.group(1)}-{int(m.group(2)):02d}")
+            continue
+        # "2025"
+        m = re.match(r'^(\d{4})$', t)
+        if m:
+            time_refs.append(m.group(1))
+            continue
+        # "3" 或 "03" (纯月份)
+        m = re.match(r'^(\d{1,2})$', t)
+        if m:
+            time_refs.append(f"{int(m.group(1)):02d}")
+            continue
+        # 兜底：原始值
+        time_refs.append(t)
+    return time_refs[:MAX_TIME_REFS]
+
+
+def call_ai_for_long_memory_query(text: str, char_id: str = None, user_id=None, lang: str = "zh"):
+    """
+    调用 AI 模型分析用户输入，提取用于搜索长期记忆的关键词和时间参考。
+    返回: (keywords: list[str], time_refs: list[str])；调用失败时返回 None（不写缓存）。
+    """
+    if not text or not text.strip():
+        return [], []
+
+    try:
+        from services.ai_client import call_gemini, call_openrouter, get_model_config
+        route, model = get_model_config("summary", user_id=user_id)
+
+        if lang == "ja":
+            prompt = (
+                "あなたは記憶検索アシスタントです。ユーザーの最新のメッセージから、長期記憶を検索するためのキーワードと時間参照を抽出してください。\n"
+                "必ず日本語で返答してください。\n\n"
+                "【ルール】\n"
+                "1. keywords と time_refs を含むJSONオブジェクトを出力してください。\n"
+                "2. keywords: 文字列配列。人物名、場所、重要な出来事、感情のテーマを3〜6個抽出。\n"
+                "3. time_refs: 文字列配列。メッセージ内の時間参照を標準形式で出力：\n"
+                "   - 年のみ: \"2025\"\n"
+                "   - 年-月: \"2025-03\"（月は2桁）\n"
+                "   - 月のみ: \"03\"（2桁）\n"
+                "   - 例: \"去年の夏\" → \"2025-06\" / \"先週\" → 該当なしの場合は空\n"
+                "4. JSONのみを出力し、説明やmarkdownブロック記号は不要。\n"
+                "5. 明確な指示がない場合は {\"keywords\": [], \"time_refs\": []} を出力。\n\n"
+                f"ユーザーメッセージ：\n{text[:500]}\n\nJSON："
+            )
+        elif lang == "en":
+            prompt = (
+                "You are a memory retrieval assistant. Extract keywords and time references from the user's latest message to search long-term memory.\n"
+                "You MUST reply in English.\n\n"
+                "【Rules】\n"
+                "1. Output a JSON object with keywords and time_refs fields.\n"
+                "2. keywords: string array. Extract 3-6 person names, places, key events, emotional themes.\n"
+                "3. time_refs: string array. Output time references in standard format:\n"
+                "   - Year only: \"2025\"\n"
+                "   - Year-Month: \"2025-03\" (month as 2 digits)\n"
+                "   - Month only: \"03\" (2 digits)\n"
+                "   - Example: \"last summer\" → \"2025-06\" / \"last week\" → empty if no specific date\n"
+                "4. Output ONLY the JSON, no explanation or markdown block markers.\n"
+                "5. If no clear direction, output {\"keywords\": [], \"time_refs\": []}.\n\n"
+                f"User message:\n{text[:500]}\n\nJSON:"
+            )
+        else:
+            prompt = (
+                "你是一个记忆检索助手。根据用户最新的消息，提取出可能需要从长期记忆中回顾的关键词和时间范围。\n"
+                "你必须用中文回复。\n\n"
+                "【规则】\n"
+                "1. 输出一个JSON对象，包含 keywords 和 time_refs 两个字段。\n"
+                "2. keywords: 字符串数组，提取人物名称、地点、重要事件、情感主题。3~6个关键词。\n"
+                "3. time_refs: 字符串数组，提取消息中的时间参考，统一为标准格式：\n"
+                "   - 仅年份: \"2025\"\n"
+                "   - 年-月: \"2025-03\"（月份必须两位数）\n"
+                "   - 仅月份: \"03\"（两位数）\n"
+                "   - 例如: \"去年夏天\" → \"2024-07\" / \"上周\" → 无法确定具体日期则不输出\n"
+                "4. 只输出JSON，不要有任何解释或markdown代码块标记。\n"
+                "5. 如果消息没有明确指向，输出 {\"keywords\": [], \"time_refs\": []}。\n\n"
+                f"用户消息：\n{text[:500]}\n\nJSON："
+            )
+
+        messages = [{"role": "user", "content": prompt}]
+        if route == "relay":
+            result = call_openrouter(messages, char_id=char_id or "system", model_name=model, user_id=user_id, max_tokens=200)
+        else:
+            result = call_gemini(messages, char_id=char_id or "system", model_name=model, user_id=user_id)
+
+        if not result:
+            return None
+
+        result = result.strip()
+        if result.startswith("```"):
+            result = re.sub(r'^```\w*\s*', '', result)
+            result = re.sub(r'\s*```$', '', result)
+
+        try:
+            data = json.loads(result)
+        except json.JSONDecodeError:
+            match = re.search(r'\{[^{}]*"keywords"[^{}]*\}', result, re.DOTALL)
+            if not match:
+                return None
+            try:
+                data = json.loads(match.group())
+            except json.JSONDecodeError:
+                return None
+
+        if not isinstance(data, dict):
+            return None
+
+        kw_list = data.get("keywords", [])
+        time_list = data.get("time_refs", [])
+        if not isinstance(kw_list, list):
+            kw_list = [str(kw_list)]
+        if not isinstance(time_list, list):
+            time_list = [str(time_list)]
+
+        keywords = [str(k).strip() for k in kw_list if k and str(k).strip()]
+        time_refs = _normalize_ai_time_refs(time_list)
+
+        print(f"  [AI Memory Query] keywords={keywords}, time_refs={time_refs}")
+        return keywords[:10], time_refs
+    except Exception as e:
+        print(f"  [AI Memory Query] 调用失败: {e}")
+        return None
+
+
+# ---------------- 缓存 + 调度 ----------------
+
+def _cache_key(text, user_id, lang):
+    # 相对时间（"上周" / "去年"）随日期变化，日期也进 key
+    return (str(user_id), lang or "zh", datetime.now().strftime("%Y-%m-%d"), normalize_query(text))
+
+
+def _cache_put(key, value):
+    with _lock:
+        _cache[key] = value
+        _cache.move_to_end(key)
+        while len(_cache) > LONG_MEMORY_QUERY_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _analyze(text, char_id, user_id, lang, local_keywords):
+    local_keywords = list(local_keywords or [])
+    local_refs = extract_local_time_refs(text)
+    mode = LONG_MEMORY_QUERY_MODE
+
+    if mode != "ai":
+        if is_trivial_query(text) and not local_refs:
+            with _lock:
+                _stats["local"] += 1
+            return ([], []), True
+        if mode == "local" or (local_keywords and local_refs):
+            with _lock:
+                _stats["local"] += 1
+            print(f"  [Memory Query] 本地规则: keywords={local_keywords}, time_refs={local_refs}")
+            return (local_keywords[:10], local_refs), True
+
+    ai = call_ai_for_long_memory_query(text, char_id=char_id, user_id=user_id, lang=lang)
+    with _lock:
+        _stats["ai" if ai is not None else "ai_failed"] += 1
+    if ai is None:
+        # 模型失败：退回本地结果，不缓存，下次再试
+        return (local_keywords[:10], local_refs), False
+    keywords, time_refs = ai
+    time_refs = list(dict.fromkeys(time_refs + local_refs))[:MAX_TIME_REFS]
+    return (keywords, time_refs), True
+
+
+def _run(key, fut, text, char_id, user_id, lang, local_keywords, lane=None):
+    """执行分析并把结果写入 fut；结束时只移除自己登记的 _pending 项，不动后来者的。"""
+    try:
+        with llm_lane(lane):
+            result, cacheable = _analyze(text, char_id, user_id, lang, local_keywords)
+        if cacheable:
+            _cache_put(key, result)
+        fut.set_result(result)
+        return result
+    except Exception as e:
+        fut.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            if _pending.get(key) is fut:
+                _pending.pop(key)
+
+
+def prefetch_long_memory_query(text, char_id=None, user_id=None, lang="zh", local_keywords=None) -> None:
+    """在后台线程提前分析 text（已缓存或已在分析中则跳过），之后 analyze_long_memory_query 直接取结果。"""
+    if not text or not str(text).strip():
+        return
+    key = _cache_key(text, user_id, lang)
+    fut = Future()
+    with _lock:
+        if key in _cache or key in _pending:
+            return
+        _stats["prefetched"] += 1
+        # 先登记 Future 再提交：并发的 analyze 拿到的一定是可等待的 Future，不会自己再调一次模型
+        _pending[key] = fut
+    try:
+        # 预取在请求的关键路径上：沿用发起方的调度通道，前台请求的分析仍按 interactive 排队
+        _get_executor().submit(_run, key, fut, text, char_id, user_id, lang, local_keywords, current_lane())
+    except RuntimeError as e:
+        with _lock:
+            if _pending.get(key) is fut:
+                _pending.pop(key)
+        fut.set_exception(e)
+        print(f"  [Memory Query] 预取提交失败: {e}")
+
+
+def analyze_long_memory_query(text, char_id=None, user_id=None, lang="zh", local_keywords=None):
+    """
+    返回 (keywords, time_refs)。顺序：缓存 → 等待进行中的预取 → 当前线程分析。
+    """
+    if not text or not str(text).strip():
+        return [], []
+    key = _cache_key(text, user_id, lang)
+    with _lock:
+        hit = _cache.get(key)
+        if hit is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return list(hit[0]), list(hit[1])
+        fut = _pending.get(key)
+        _stats["misses"] += 1
+    if fut is not None:
+        try:
+            keywords, time_refs = fut.result(timeout=LONG_MEMORY_QUERY_WAIT_TIMEOUT)
+            return list(keywords), list(time_refs)
+        except FutureTimeoutError:
+            print(f"  [Memory Query] 等待预取超时 ({LONG_MEMORY_QUERY_WAIT_TIMEOUT}s)，改用本地结果")
+            return list(local_keywords or [])[:10], extract_local_time_refs(text)
+        except Exception as e:
+            print(f"  [Memory Query] 预取失败，改为同步分析: {e}")
+    own = Future()
+    with _lock:
+        # 同步分析也登记，同一条消息的其他调用方等这一次的结果
+        _pending.setdefault(key, own)
+    return _run(key, own, text, char_id, user_id, lang, local_keywords)
+
+
+def get_memory_query_stats() -> dict:
+    with _lock:
+        return {"size": len(_cache), "pending": len(_pending), **_stats}
+
+
+def clear_memory_query_cache():
+    with _lock:
+        _cache.clear()
+        for k in _stats:
+            _stats[k] = 0
@@ -0,0 +1,386 @@
+"""
+分级记忆存储：每个角色一个 SQLite（prompts/memory.db），替代整文件读写的
+6_memory_short.json / 5_memory_medium.json / 4_memory_long.json。
+
+表结构：
+- events(id, date, time, source, text, extra)：短期记忆事件，一行一条；source 为 chat / group / moment，
+  extra 存事件里除 time / event 以外的字段（JSON）。按 (date, time, id) 建索引，同一天内的顺序与原来按 time 排序一致；
+- days(date, last_id)：每天已总结到的私聊消息 id（原 {"events": [...], "last_id": n} 里的 last_id）；
+- daily_summaries(date, content)：中期记忆（日记）；
+- weekly_summaries(week_key, content)：长期记忆（周报），每次写入递增 meta.weekly_rev，供长期记忆索引判断是否过期。
+
+追加一条事件、写一天的日记只改对应的行，群聊分发给多个成员时不再各自重写整个 JSON。
+export_tier / import_tier 按原 JSON 结构整体导出 / 导入，记忆面板的读写接口保持不变。
+首次打开时自动导入已有的 JSON 文件，原文件改名为 *.migrated 备份（空文件直接删除）；
+新建 memory.db 时目录里只有 *.migrated（从已迁移的模板角色复制来的目录）则从备份导入。
+新用户从模板复制角色时用 copy_memory_db 复制模板的 memory.db。
+"""
+import os
+import json
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+
+from core.db import pooled_conn
+
+MEMORY_DB_NAME = "memory.db"
+
+TIER_SHORT = "short"
+TIER_MEDIUM = "medium"
+TIER_LONG = "long"
+
+TIER_JSON_FILES = {
+    TIER_SHORT: "6_memory_short.json",
+    TIER_MEDIUM: "5_memory_medium.json",
+    TIER_LONG: "4_memory_long.json",
+}
+
+SOURCE_CHAT = "chat"
+SOURCE_GROUP = "group"
+SOURCE_MOMENT = "moment"
+
+_EVENT_KEYS = ("time", "event")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT NOT NULL,
+    time TEXT NOT NULL DEFAULT '',
+    source TEXT NOT NULL DEFAULT 'chat',
+    text TEXT NOT NULL DEFAULT '',
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_date ON events(date, time, id);
+
+CREATE TABLE IF NOT EXISTS days (
+    date TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS daily_summaries (
+    date TEXT PRIMARY KEY,
+    content TEXT NOT NULL DEFAULT '',
+    updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS weekly_summaries (
+    week_key TEXT PRIMARY KEY,
+    content TEXT NOT NULL DEFAULT '',
+    updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_ready_paths = set()
+_ready_lock = threading.Lock()
+
+
+def get_memory_db_path(prompts_dir) -> str:
+    return os.path.join(prompts_dir, MEMORY_DB_NAME)
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _infer_source(text) -> str:
+    return SOURCE_GROUP if str(text).startswith("[群聊:") else SOURCE_CHAT
+
+
+def _day_events(day_data) -> tuple:
+    """旧 JSON 里一天的数据（list 或 {"events", "last_id"}）→ (events, last_id)。"""
+    if isinstance(day_data, list):
+        return day_data, 0
+    if isinstance(day_data, dict):
+        return day_data.get("events", []) or [], day_data.get("last_id", 0) or 0
+    return [], 0
+
+
+def _insert_events(conn, date_str, events, source=None):
+    for e in events:
+        if not isinstance(e, dict):
+            continue
+        text = str(e.get("event", ""))
+        extra = {k: v for k, v in e.items() if k not in _EVENT_KEYS}
+        conn.execute(
+            "INSERT INTO events (date, time, source, text, extra) VALUES (?, ?, ?, ?, ?)",
+            (date_str, str(e.get("time", "")), source or _infer_source(text), text,
+             json.dumps(extra, ensure_ascii=False) if extra else None),
+        )
+
+
+def _bump_weekly_rev(conn):
+    conn.execute("INSERT INTO meta (key, value) VALUES ('weekly_rev', '1') "
+                 "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+
+
+def _import(conn, tier, data, replace=False):
+    """按旧 JSON 结构写入一个层级；replace=True 时先清空该层级（记忆面板整体保存）。"""
+    if not isinstance(data, dict):
+        data = {}
+    if tier == TIER_SHORT:
+        if replace:
+            conn.execute("DELETE FROM events")
+            conn.execute("DELETE FROM days")
+        for date_str, day_data in data.items():
+            events, last_id = _day_events(day_data)
+            conn.execute("DELETE FROM events WHERE date = ?", (date_str,))
+            _insert_events(conn, date_str, events)
+            conn.execute("INSERT OR REPLACE INTO days (date, last_id) VALUES (?, ?)", (date_str, int(last_id or 0)))
+    elif tier == TIER_MEDIUM:
+        if replace:
+            conn.execute("DELETE FROM daily_summaries")
+        conn.executemany("INSERT OR REPLACE INTO daily_summaries (date, content, updated_at) VALUES (?, ?, ?)",
+                         [(k, str(v), _now()) for k, v in data.items()])
+    elif tier == TIER_LONG:
+        if replace:
+            conn.execute("DELETE FROM weekly_summaries")
+        conn.executemany("INSERT INTO weekly_summaries (week_key, content, updated_at) VALUES (?, ?, ?) "
+                         "ON CONFLICT(week_key) DO UPDATE SET content = excluded.content, updated_at = excluded.updated_at",
+                         [(k, str(v), _now()) for k, v in data.items()])
+        _bump_weekly_rev(conn)
+    else:
+        raise ValueError(f"未知记忆层级: {tier}")
+
+
+def _migrate_json(conn, prompts_dir, fresh=False):
+    """导入旧 JSON；fresh=True（memory.db 刚新建）时没有 JSON 的层级改从 *.migrated 备份导入，备份保留不动。"""
+    for tier, filename in TIER_JSON_FILES.items():
+        json_path = os.path.join(prompts_dir, filename)
+        if not os.path.exists(json_path):
+            backup = json_path + ".migrated"
+            if fresh and os.path.exists(backup):
+                try:
+                    with open(backup, "r", encoding="utf-8-sig") as f:
+                        raw = f.read()
+                    data = json.loads(raw) if raw.strip() else {}
+                except Exception as e:
+                    print(f"[Memory Store] 跳过无法解析的 {backup}: {e}")
+                    continue
+                _import(conn, tier, data)
+                conn.commit()
+                print(f"[Memory Store] 已从备份 {backup} 导入 {len(data)} 项")
+            continue
+        try:
+            with open(json_path, "r", encoding="utf-8-sig") as f:
+                raw = f.read()
+            data = json.loads(raw) if raw.strip() else {}
+        except Exception as e:
+            print(f"[Memory Store] 跳过无法解析的 {json_path}: {e}")
+            continue
+        _import(conn, tier, data)
+        conn.commit()
+        if data:
+            os.replace(json_path, json_path + ".migrated")
+            print(f"[Memory Store] 已从 {json_path} 导入 {len(data)} 项")
+        else:
+            os.remove(json_path)
+
+
+def _ensure_ready(prompts_dir, create=True):
+    """返回 memory.db 路径（首次打开时建表并导入旧 JSON）；create=False 且没有任何记忆数据时返回 None。"""
+    db_path = get_memory_db_path(prompts_dir)
+    if db_path in _ready_paths and os.path.exists(db_path):
+        return db_path
+    if not create and not os.path.exists(db_path) and not any(
+            os.path.exists(os.path.join(prompts_dir, f + suffix))
+            for f in TIER_JSON_FILES.values() for suffix in ("", ".migrated")):
+        return None
+    with _ready_lock:
+        if db_path in _ready_paths and os.path.exists(db_path):
+            return db_path
+        os.makedirs(prompts_dir, exist_ok=True)
+        fresh = not os.path.exists(db_path)
+        with pooled_conn(db_path) as conn:
+            conn.executescript(_SCHEMA)
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('db_id', ?)", (uuid.uuid4().hex[:12],))
+            conn.commit()
+            _migrate_json(conn, prompts_dir, fresh=fresh)
+        _ready_paths.add(db_path)
+    return db_path
+
+
+def copy_memory_db(src_prompts_dir, dst_prompts_dir) -> bool:
+    """把模板角色的 memory.db 复制到新角色目录（SQLite backup，模板库正被打开 / 有 WAL 时也是一致快照）。
+
+    目标已有 memory.db 或模板没有时返回 False；复制后换一个新的 db_id，长期记忆索引不会与模板混用。
+    """
+    src = get_memory_db_path(src_prompts_dir)
+    dst = get_memory_db_path(dst_prompts_dir)
+    if not os.path.exists(src) or os.path.exists(dst):
+        return False
+    os.makedirs(dst_prompts_dir, exist_ok=True)
+    with pooled_conn(src) as src_conn:
+        dst_conn = sqlite3.connect(dst)
+        try:
+            src_conn.backup(dst_conn)
+            dst_conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('db_id', ?)", (uuid.uuid4().hex[:12],))
+            dst_conn.commit()
+        finally:
+            dst_conn.close()
+    return True
+
+
+def memory_conn(prompts_dir, row_factory=None):
+    """获取角色记忆库的连接（首次调用时建表并迁移 JSON）。"""
+    return pooled_conn(_ensure_ready(prompts_dir), row_factory=row_factory)
+
+
+def _rows_to_events(rows) -> list:
+    out = []
+    for time_str, text, extra in rows:
+        e = {"time": time_str, "event": text}
+        if extra:
+            try:
+                e.update(json.loads(extra))
+            except Exception:
+                pass
+        out.append(e)
+    return out
+
+
+# ---------------------- 短期记忆 ----------------------
+
+def get_short_day(prompts_dir, date_str) -> tuple:
+    """某一天的 (events, last_id)；没有数据时返回 ([], 0)。"""
+    db_path = _ensure_ready(prompts_dir, create=False)
+    if db_path is None:
+        return [], 0
+    with pooled_conn(db_path) as conn:
+        rows = conn.execute("SELECT time, text, extra FROM events WHERE date = ? ORDER BY time, id",
+                            (date_str,)).fetchall()
+        day = conn.execute("SELECT last_id FROM days WHERE date = ?", (date_str,)).fetchone()
+    return _rows_to_events(rows), (day[0] if day else 0)
+
+
+def get_short_events(prompts_dir, dates) -> dict:
+    """{date: events}，只包含有事件的日期，顺序与 dates 一致。"""
+    out = {}
+    for d in dates:
+        events, _ = get_short_day(prompts_dir, d)
+        if events:
+            out[d] = events
+    return out
+
+
+def has_short_events(prompts_dir, date_str) -> bool:
+    db_path = _ensure_ready(prompts_dir, create=False)
+    if db_path is None:
+        return False
+    with pooled_conn(db_path) as conn:
+        return conn.execute("SELECT 1 FROM events WHERE date = ? LIMIT 1", (date_str,)).fetchone() is not None
+
+
+def append_short_events(prompts_dir, date_str, events, source=None, dedupe=True) -> int:
+    """追加事件（只插入新行），返回实际写入条数。dedupe=True 时跳过同一天同一时间内容相同的事件。"""
+    added = 0
+    with memory_conn(prompts_dir) as conn:
+        for e in events:
+            if dedupe and conn.execute(
+                    "SELECT 1 FROM events WHERE date = ? AND time = ? AND text = ? LIMIT 1",
+                    (date_str, str(e.get("time", "")), str(e.get("event", "")))).fetchone():
+                continue
+            _insert_events(conn, date_str, [e], source=source)
+            added += 1
+        conn.execute("INSERT OR IGNORE INTO days (date, last_id) VALUES (?, 0)", (date_str,))
+    return added
+
+
+def replace_short_day(prompts_dir, date_str, events, last_id=None):
+    """整体替换某一天的事件；last_id 为 None 时保留原值。"""
+    with memory_conn(prompts_dir) as conn:
+        conn.execute("DELETE FROM events WHERE date = ?", (date_str,))
+        _insert_events(conn, date_str, events)
+        if last_id is None:
+            conn.execute("INSERT OR IGNORE INTO days (date, last_id) VALUES (?, 0)", (date_str,))
+        else:
+            conn.execute("INSERT OR REPLACE INTO days (date, last_id) VALUES (?, ?)", (date_str, int(last_id)))
+
+
+# ---------------------- 中期 / 长期记忆 ----------------------
+
+def get_daily_summaries(prompts_dir, dates=None) -> dict:
+    """{date: 日记}；dates 为空时返回全部（按日期升序）。"""
+    db_path = _ensure_ready(prompts_dir, create=False)
+    if db_path is None:
+        return {}
+    with pooled_conn(db_path) as conn:
+        if dates is None:
+            rows = conn.execute("SELECT date, content FROM daily_summaries ORDER BY date").fetchall()
+        else:
+            dates = list(dates)
+            if not dates:
+                return {}
+            marks = ",".join("?" * len(dates))
+            rows = conn.execute(f"SELECT date, content FROM daily_summaries WHERE date IN ({marks}) ORDER BY date",
+                                dates).fetchall()
+    return {d: c for d, c in rows}
+
+
+def set_daily_summary(prompts_dir, date_str, content):
+    with memory_conn(prompts_dir) as conn:
+        conn.execute("INSERT OR REPLACE INTO daily_summaries (date, content, updated_at) VALUES (?, ?, ?)",
+                     (date_str, str(content), _now()))
+
+
+def get_weekly_summaries(prompts_dir) -> dict:
+    """{week_key: 周报}，按写入 / 导入顺序。"""
+    db_path = _ensure_ready(prompts_dir, create=False)
+    if db_path is None:
+        return {}
+    with pooled_conn(db_path) as conn:
+        rows = conn.execute("SELECT week_key, content FROM weekly_summaries ORDER BY rowid").fetchall()
+    return {k: c for k, c in rows}
+
+
+def set_weekly_summary(prompts_dir, week_key, content):
+    with memory_conn(prompts_dir) as conn:
+        conn.execute("INSERT INTO weekly_summaries (week_key, content, updated_at) VALUES (?, ?, ?) "
+                     "ON CONFLICT(week_key) DO UPDATE SET content = excluded.content, updated_at = excluded.updated_at",
+                     (week_key, str(content), _now()))
+        _bump_weekly_rev(conn)
+
+
+def weekly_signature(prompts_dir):
+    """长期记忆的版本标识（库 id + 写入次数），没有记忆库时返回 None。"""
+    db_path = _ensure_ready(prompts_dir, create=False)
+    if db_path is None:
+        return None
+    with pooled_conn(db_path) as conn:
+        meta = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('db_id', 'weekly_rev')").fetchall())
+    return f"{meta.get('db_id', '')}:{meta.get('weekly_rev', '0')}"
+
+
+# ---------------------- 记忆面板：整体导出 / 导入 ----------------------
+
+def export_tier(prompts_dir, tier) -> dict:
+    """按原 JSON 结构导出一个层级（short 为 {date: {"events", "last_id"}}，medium / long 为 {key: text}）。"""
+    if tier == TIER_MEDIUM:
+        return get_daily_summaries(prompts_dir)
+    if tier == TIER_LONG:
+        return get_weekly_summaries(prompts_dir)
+    if tier != TIER_SHORT:
+        raise ValueError(f"未知记忆层级: {tier}")
+    db_path = _ensure_ready(prompts_dir, create=False)
+    if db_path is None:
+        return {}
+    out = {}
+    with pooled_conn(db_path) as conn:
+        last_ids = dict(conn.execute("SELECT date, last_id FROM days").fetchall())
+        rows = conn.execute("SELECT date, time, text, extra FROM events ORDER BY date, time, id").fetchall()
+    for d in sorted(set(last_ids) | {r[0] for r in rows}):
+        out[d] = {"events": [], "last_id": last_ids.get(d, 0)}
+    for d, t, text, extra in rows:
+        out[d]["events"].extend(_rows_to_events([(t, text, extra)]))
+    return out
+
+
+def import_tier(prompts_dir, tier, data):
+    """用原 JSON 结构整体替换一个层级（记忆面板保存）。"""
+    with memory_conn(prompts_dir) as conn:
+        _import(conn, tier, data, replace=True)
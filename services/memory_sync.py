@@ -0,0 +1,235 @@
+"""
+短期记忆后台同步：把 "聊天前先总结群聊 / 单聊短期记忆" 从请求线程挪到后台 worker。
+
+- 每个 (user, kind, 角色/群, 日期) 是一个同步 key；kind="group" 调 update_group_short_memory，
+  kind="single" 调 update_short_memory_for_date；
+- request_sync 只把 key 标脏并入队：已在队列里的 key 直接合并，正在跑的 key 跑完后再补一轮；
+- 同一用户的任务串行执行（它们会写同一批角色的短期记忆），不同用户之间并行：每个用户一条 FIFO 队列，
+  全局队列里放的是"有待办的用户"，worker 每次只取该用户的一个 key，跑完再把用户排回队尾，
+  不会有 worker 卡在等某个用户的锁上；
+- 已完成且闲置超过 _STATE_TTL 秒的 key 状态会被清理，_states 不随 用户×目标×日期 无限增长；
+- 有界陈旧：聊天请求只在某个 key 上次同步完成的数据早于 MEMORY_SYNC_MAX_STALENESS 秒时才等待它，
+  否则直接读取已同步好的短期记忆，本轮新增内容由后台补上。
+"""
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from core.config import (
+    MEMORY_SYNC_ASYNC, MEMORY_SYNC_MAX_STALENESS, MEMORY_SYNC_WAIT_TIMEOUT, MEMORY_SYNC_WORKERS,
+)
+from core.context import set_background_user
+from services.event_bus import notify_memory
+from services.llm_scheduler import llm_lane, LANE_BACKGROUND
+
+KIND_SINGLE = "single"
+KIND_GROUP = "group"
+
+
+class _KeyState:
+    __slots__ = ("requested", "done", "queued", "running", "synced_at", "finished_at", "last_error")
+
+    def __init__(self):
+        self.requested = 0     # 已请求的轮次
+        self.done = 0          # 已完成的轮次（done >= requested 表示没有待同步内容）
+        self.queued = False
+        self.running = False
+        self.synced_at = 0.0   # 最近一次完成的同步开始的时间（即已覆盖到的数据时间点）
+        self.finished_at = 0.0
+        self.last_error = None
+
+    def idle(self) -> bool:
+        return not self.queued and not self.running and self.done >= self.requested
+
+
+# 闲置 key 状态的保留时间：超过陈旧上限后状态本身已无意义，再留出等待方拿结果的时间
+_STATE_TTL = max(MEMORY_SYNC_MAX_STALENESS, MEMORY_SYNC_WAIT_TIMEOUT) * 2
+_PRUNE_INTERVAL = 60
+
+_states: dict = {}
+_cond = threading.Condition()
+_queue: "queue.Queue" = queue.Queue()   # 有待办 key 的 user_id（每个用户同时最多出现一次）
+_user_queues: dict = {}                 # {user_id: deque(key)}
+_active_users: set = set()              # 已在 _queue 中或正在执行的用户
+_workers: list = []
+_last_prune = 0.0
+_stats = {"requests": 0, "coalesced": 0, "runs": 0, "errors": 0, "waits": 0, "timeouts": 0, "evicted": 0}
+
+
+def sync_dates(now=None) -> list:
+    """需要同步的日期：今天；凌晨 4 点前额外带上昨天（与日结口径一致）。"""
+    now = now or datetime.now()
+    dates = [now.strftime("%Y-%m-%d")]
+    if now.hour < 4:
+        dates.insert(0, (now - timedelta(days=1)).strftime("%Y-%m-%d"))
+    return dates
+
+
+def _run_key(key):
+    user_id, kind, target_id, date_str = key
+    if kind == KIND_GROUP:
+        from app import update_group_short_memory
+        update_group_short_memory(target_id, date_str)
+    else:
+        from services.memory import update_short_memory_for_date
+        update_short_memory_for_date(target_id, date_str, user_id=user_id)
+
+
+def _enqueue_locked(key):
+    """把 key 排进其用户的队列（调用方持有 _cond）；该用户当前空闲时把用户放进全局队列。"""
+    user_id = key[0]
+    _states[key].queued = True
+    _user_queues.setdefault(user_id, deque()).append(key)
+    if user_id not in _active_users:
+        _active_users.add(user_id)
+        _queue.put(user_id)
+
+
+def _prune_locked(now):
+    """清理闲置超过 _STATE_TTL 的 key 状态（调用方持有 _cond）。"""
+    global _last_prune
+    if now - _last_prune < _PRUNE_INTERVAL:
+        return
+    _last_prune = now
+    stale = [k for k, st in _states.items() if st.idle() and now - st.finished_at > _STATE_TTL]
+    for k in stale:
+        del _states[k]
+    _stats["evicted"] += len(stale)
+
+
+def _worker_loop():
+    while True:
+        user_id = _queue.get()
+        with _cond:
+            key = _user_queues[user_id].popleft()
+            state = _states[key]
+            state.queued = False
+            state.running = True
+            target = state.requested
+        started = time.time()
+        error = None
+        try:
+            set_background_user(user_id)
+            # 聊天请求可能在等它：排在日结 / 周结（bulk）之前
+            with llm_lane(LANE_BACKGROUND):
+                _run_key(key)
+        except Exception as e:
+            error = str(e)
+            print(f"   [Memory Sync] {key[1]} {key[2]} 日期 {key[3]} 同步失败: {e}")
+        finally:
+            set_background_user(None)
+        with _cond:
+            state.running = False
+            state.done = target
+            state.last_error = error
+            state.finished_at = time.time()
+            if error is None:
+                state.synced_at = started
+            _stats["runs"] += 1
+            if error:
+                _stats["errors"] += 1
+            if state.requested > state.done and not state.queued:
+                _enqueue_locked(key)
+            # 该用户还有待办就排回全局队尾，让其他用户先跑
+            if _user_queues.get(user_id):
+                _queue.put(user_id)
+            else:
+                _user_queues.pop(user_id, None)
+                _active_users.discard(user_id)
+            _cond.notify_all()
+        if error is None:
+            notify_memory(key[1], key[2], user_id=key[0], date=key[3])
+
+
+def _ensure_workers():
+    if _workers:
+        return
+    with _cond:
+        while len(_workers) < max(1, MEMORY_SYNC_WORKERS):
+            t = threading.Thread(target=_worker_loop, daemon=True, name=f"memory-sync-{len(_workers)}")
+            t.start()
+            _workers.append(t)
+
+
+def request_sync(user_id, kind, target_id, date_str):
+    """标记一个 key 需要同步并入队，返回 (key, 本次请求的轮次)。"""
+    _ensure_workers()
+    key = (user_id, kind, target_id, date_str)
+    with _cond:
+        _prune_locked(time.time())
+        state = _states.get(key)
+        if state is None:
+            state = _states[key] = _KeyState()
+        state.requested += 1
+        _stats["requests"] += 1
+        if state.queued or state.running:
+            _stats["coalesced"] += 1
+        else:
+            _enqueue_locked(key)
+        return key, state.requested
+
+
+def wait_synced(tickets, max_staleness=None, timeout=None):
+    """按有界陈旧约定等待：只等待已同步数据早于 max_staleness 秒、且本轮请求尚未完成的 key。
+
+    max_staleness=0 表示等待全部完成（与原来同步调用的语义一致）。返回 (success, error_msg)。
+    """
+    if max_staleness is None:
+        max_staleness = MEMORY_SYNC_MAX_STALENESS
+    if timeout is None:
+        timeout = MEMORY_SYNC_WAIT_TIMEOUT
+    deadline = time.time() + timeout
+    waited = False
+    with _cond:
+        while True:
+            now = time.time()
+            # 状态已被清理的 key 早已完成
+            pending = [
+                (key, gen) for key, gen in tickets
+                if key in _states and _states[key].done < gen and now - _states[key].synced_at > max_staleness
+            ]
+            if not pending:
+                break
+            waited = True
+            remaining = deadline - now
+            if remaining <= 0:
+                _stats["timeouts"] += 1
+                return False, f"记忆同步超时（{len(pending)} 项仍在后台进行）"
+            _cond.wait(remaining)
+        if waited:
+            _stats["waits"] += 1
+            for key, gen in tickets:
+                state = _states.get(key)
+                if state and state.done >= gen and state.last_error:
+                    return False, state.last_error
+    return True, None
+
+
+def sync_memory(keys, user_id, wait=True):
+    """同步一批 (kind, target_id, date) 记忆。
+
+    wait=True 时等到全部完成（后台任务、发朋友圈等不在乎延迟的场景）；
+    wait=False 时只保证有界陈旧，聊天请求用它避免排队等 LLM 总结。
+    MEMORY_SYNC_ASYNC 关闭时退回原来的请求线程内逐个同步。
+    """
+    if not keys:
+        return True, None
+    if not MEMORY_SYNC_ASYNC:
+        for kind, target_id, date_str in keys:
+            try:
+                _run_key((user_id, kind, target_id, date_str))
+            except Exception as e:
+                print(f"   [Sync] {kind} {target_id} 日期 {date_str} 同步失败: {e}")
+                return False, f"记忆同步失败: {e}"
+        return True, None
+    tickets = [request_sync(user_id, kind, target_id, date_str) for kind, target_id, date_str in keys]
+    return wait_synced(tickets, max_staleness=0 if wait else None)
+
+
+def get_memory_sync_stats() -> dict:
+    with _cond:
+        pending = sum(1 for s in _states.values() if s.done < s.requested)
+        return {"keys": len(_states), "pending": pending, "workers": len(_workers),
+                "busy_users": len(_active_users), **_stats}
@@ -0,0 +1,155 @@
+"""
+聊天记录全文检索：每个 chat.db 一张 FTS5 外部内容表 messages_fts（trigram 分词）。
+
+- trigram 按 3 字切分，不依赖分词词典，中文 / 日文 / 英文都能做任意子串匹配，
+  结果与原来的 `content LIKE '%kw%'` 一致，但走倒排索引而不是全表扫描；
+- messages 上的 INSERT / UPDATE / DELETE 触发器自动同步索引；
+- 首次搜索（或启动时的 backfill_search_indexes）发现没有索引时建表并 rebuild 已有消息；
+- 少于 3 个字的关键词 trigram 无法命中，退回 LIKE（仍带分页）。
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from core.config import MESSAGE_SEARCH_MAX_PAGE_SIZE
+from core.chat_schema import iter_chat_dbs
+from core.db import pooled_conn
+
+FTS_TABLE = "messages_fts"
+SNIPPET_TOKENS = 32
+
+_FTS_STATEMENTS = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "content, content='messages', content_rowid='id', tokenize='trigram')",
+    f"""CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END""",
+)
+
+_build_lock = threading.Lock()
+
+
+def _has_table(conn, name) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+
+
+def ensure_search_index(conn) -> bool:
+    """确保连接所在的 chat.db 有 FTS 索引与同步触发器；新建时回填已有消息。没有 messages 表返回 False。"""
+    if _has_table(conn, FTS_TABLE):
+        return True
+    if not _has_table(conn, "messages"):
+        return False
+    with _build_lock:
+        if _has_table(conn, FTS_TABLE):
+            return True
+        t0 = time.time()
+        for stmt in _FTS_STATEMENTS:
+            conn.execute(stmt)
+        conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        conn.commit()
+        n = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        print(f"[Search] 已为 {n} 条消息建立全文索引，用时 {time.time() - t0:.2f}s")
+    return True
+
+
+def _fts_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like_snippet(content: str, terms, width=SNIPPET_TOKENS) -> str:
+    low = content.lower()
+    pos = min((p for p in (low.find(t.lower()) for t in terms) if p >= 0), default=0)
+    start = max(0, pos - width // 2)
+    end = start + width
+    return ("…" if start > 0 else "") + content[start:end] + ("…" if end < len(content) else "")
+
+
+def _split_terms(keyword, match) -> list:
+    """match="all" 时按空白拆成多个词（引号里的内容仍算一个短语），否则整个关键词作为一个短语（与原来的 LIKE 一致）。"""
+    keyword = (keyword or "").strip()
+    if not keyword:
+        return []
+    if match != "all":
+        return [keyword]
+    return [q or w for q, w in re.findall(r'"([^"]+)"|(\S+)', keyword)]
+
+
+def search_messages_in_db(db_path, keyword, limit=None, offset=0, order="time", match="phrase") -> list:
+    """在一个 chat.db 里搜索消息，返回 [{id, role, content, timestamp, snippet}]。
+
+    默认整个关键词作为一个短语匹配；match="all" 时拆成多个词，全部命中才算匹配。
+    不传 limit 时返回全部结果，传了则按 MESSAGE_SEARCH_MAX_PAGE_SIZE 封顶分页。
+    order="time" 按时间倒序，"rank" 按 bm25 相关度。
+    """
+    terms = _split_terms(keyword, match)
+    if not terms or not os.path.exists(db_path):
+        return []
+    try:
+        limit = max(1, min(int(limit), MESSAGE_SEARCH_MAX_PAGE_SIZE)) if limit is not None else -1
+    except (TypeError, ValueError):
+        limit = -1
+    try:
+        offset = max(0, int(offset or 0))
+    except (TypeError, ValueError):
+        offset = 0
+
+    fts_terms = [t for t in terms if len(t) >= 3]
+    like_terms = [t for t in terms if len(t) < 3]
+
+    with pooled_conn(db_path, row_factory=sqlite3.Row) as conn:
+        use_fts = bool(fts_terms) and ensure_search_index(conn)
+        where, params = [], []
+        if use_fts:
+            sql = (f"SELECT m.id, m.role, m.content, m.timestamp, "
+                   f"snippet({FTS_TABLE}, 0, '', '', '…', {SNIPPET_TOKENS}) AS snippet "
+                   f"FROM {FTS_TABLE} JOIN messages m ON m.id = {FTS_TABLE}.rowid")
+            where.append(f"{FTS_TABLE} MATCH ?")
+            params.append(" AND ".join(_fts_phrase(t) for t in fts_terms))
+        else:
+            sql = "SELECT m.id, m.role, m.content, m.timestamp FROM messages m"
+            like_terms = terms
+        for t in like_terms:
+            where.append("m.content LIKE ?")
+            params.append(f"%{t}%")
+        sql += " WHERE " + " AND ".join(where)
+        if use_fts and order == "rank":
+            sql += f" ORDER BY {FTS_TABLE}.rank, m.timestamp DESC"
+        else:
+            sql += " ORDER BY m.timestamp DESC, m.id DESC"
+        sql += " LIMIT ? OFFSET ?"
+        rows = [dict(r) for r in conn.execute(sql, params + [limit, offset]).fetchall()]
+
+    for r in rows:
+        if not r.get("snippet"):
+            r["snippet"] = _like_snippet(r.get("content") or "", terms)
+    return rows
+
+
+def backfill_search_indexes(background=True):
+    """为所有已有 chat.db 建立全文索引（已有索引的库直接跳过）。"""
+    def _run():
+        t0 = time.time()
+        built = 0
+        for db_path in iter_chat_dbs():
+            try:
+                with pooled_conn(db_path) as conn:
+                    if not _has_table(conn, FTS_TABLE) and ensure_search_index(conn):
+                        built += 1
+            except Exception as e:
+                print(f"[Search] 建立全文索引失败 {db_path}: {e}")
+        if built:
+            print(f"[Search] 回填完成：新建 {built} 个聊天库索引，用时 {time.time() - t0:.2f}s")
+
+    if background:
+        threading.Thread(target=_run, daemon=True, name="search-backfill").start()
+    else:
+        _run()
@@ -0,0 +1,355 @@
+"""
+朋友圈存储：每个用户一个 SQLite（users/<uid>/configs/moments.db），替代整文件读写的 moments_data.json。
+
+表结构：
+- posts(id, char_id, timestamp, content, extra)：(char_id, timestamp) 唯一，即原来定位帖子的方式；
+  extra 存 instruction 等其余字段（JSON）。
+- likes(post_id, liker_id, timestamp)：timestamp 为 NULL 表示旧版 liker_ids（无时间，一直可见）。
+- comments(id, post_id, idx, commenter_id, content, timestamp, extra)：idx 即前端使用的 comment_index。
+
+列表按 (timestamp DESC, id ASC) 排序，与原来 "按时间倒序、同一时间保持写入顺序" 一致；
+支持 offset 分页（兼容 page 参数）和 before_id 游标分页，可按 char_id 过滤。
+首次访问时自动把 moments_data.json 导入数据库，原文件改名为 moments_data.json.migrated 备份。
+"""
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+from core.config import BASE_DIR, USERS_ROOT
+from core.db import pooled_conn
+from services.event_bus import notify_moment
+
+MOMENTS_DB_NAME = "moments.db"
+MOMENTS_JSON_NAME = "moments_data.json"
+
+_POST_KEYS = ("char_id", "content", "timestamp", "likers", "liker_ids", "comments", "id")
+_COMMENT_KEYS = ("commenter_id", "content", "timestamp")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    char_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    content TEXT NOT NULL DEFAULT '',
+    extra TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_posts_char_ts ON posts(char_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_posts_ts ON posts(timestamp DESC, id);
+CREATE INDEX IF NOT EXISTS idx_posts_char_feed ON posts(char_id, timestamp DESC, id);
+
+CREATE TABLE IF NOT EXISTS likes (
+    post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+    liker_id TEXT NOT NULL,
+    timestamp TEXT,
+    seq INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (post_id, liker_id)
+);
+
+CREATE TABLE IF NOT EXISTS comments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    commenter_id TEXT NOT NULL DEFAULT '',
+    content TEXT NOT NULL DEFAULT '',
+    timestamp TEXT NOT NULL DEFAULT '',
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_comments_post ON comments(post_id, idx);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_ready_paths = set()
+_ready_lock = threading.Lock()
+
+
+def get_moments_dir(user_id=None) -> str:
+    if user_id is None:
+        from core.context import get_current_user_id
+        user_id = get_current_user_id()
+    if user_id:
+        base = os.path.join(USERS_ROOT, str(user_id), "configs")
+    else:
+        base = os.path.join(BASE_DIR, "configs")
+    os.makedirs(base, exist_ok=True)
+    return base
+
+
+def get_moments_db_path(user_id=None) -> str:
+    return os.path.join(get_moments_dir(user_id), MOMENTS_DB_NAME)
+
+
+def _dumps_extra(d: dict, skip) -> str | None:
+    extra = {k: v for k, v in d.items() if k not in skip}
+    return json.dumps(extra, ensure_ascii=False) if extra else None
+
+
+def _loads_extra(s) -> dict:
+    if not s:
+        return {}
+    try:
+        return json.loads(s)
+    except Exception:
+        return {}
+
+
+def _insert_children(conn, post_id, post: dict):
+    seq = 0
+    for lid in post.get("liker_ids") or []:
+        conn.execute("INSERT OR IGNORE INTO likes (post_id, liker_id, timestamp, seq) VALUES (?, ?, NULL, ?)",
+                     (post_id, str(lid), seq))
+        seq += 1
+    for like in post.get("likers") or []:
+        if not isinstance(like, dict) or not like.get("liker_id"):
+            continue
+        conn.execute("INSERT OR REPLACE INTO likes (post_id, liker_id, timestamp, seq) VALUES (?, ?, ?, ?)",
+                     (post_id, str(like["liker_id"]), like.get("timestamp") or "", seq))
+        seq += 1
+    for i, c in enumerate(post.get("comments") or []):
+        if not isinstance(c, dict):
+            continue
+        conn.execute(
+            "INSERT INTO comments (post_id, idx, commenter_id, content, timestamp, extra) VALUES (?, ?, ?, ?, ?, ?)",
+            (post_id, i, c.get("commenter_id", ""), c.get("content", ""), c.get("timestamp", ""),
+             _dumps_extra(c, _COMMENT_KEYS)),
+        )
+
+
+def _insert_post(conn, post: dict) -> int:
+    cur = conn.execute(
+        "INSERT INTO posts (char_id, timestamp, content, extra) VALUES (?, ?, ?, ?)",
+        (post.get("char_id", ""), post.get("timestamp", ""), post.get("content", ""), _dumps_extra(post, _POST_KEYS)),
+    )
+    post_id = cur.lastrowid
+    _insert_children(conn, post_id, post)
+    return post_id
+
+
+def _migrate_json(conn, json_path) -> int:
+    with open(json_path, "r", encoding="utf-8-sig") as f:
+        raw = json.load(f) or []
+    n = 0
+    for post in raw:
+        if not isinstance(post, dict):
+            continue
+        try:
+            _insert_post(conn, post)
+            n += 1
+        except sqlite3.IntegrityError:
+            # 同一角色同一秒的重复帖子：保留第一条
+            print(f"[Moments Store] 跳过重复帖子 {post.get('char_id')} @ {post.get('timestamp')}")
+    return n
+
+
+def _ensure_ready(db_path) -> None:
+    if db_path in _ready_paths and os.path.exists(db_path):
+        return
+    with _ready_lock:
+        if db_path in _ready_paths and os.path.exists(db_path):
+            return
+        json_path = os.path.join(os.path.dirname(db_path), MOMENTS_JSON_NAME)
+        with pooled_conn(db_path) as conn:
+            conn.executescript(_SCHEMA)
+            migrated = conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+            if not migrated and os.path.exists(json_path):
+                n = _migrate_json(conn, json_path)
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)", (str(n),))
+                conn.commit()
+                os.replace(json_path, json_path + ".migrated")
+                print(f"[Moments Store] 已从 {json_path} 导入 {n} 条朋友圈")
+            elif not migrated:
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', '0')")
+        _ready_paths.add(db_path)
+
+
+def moments_conn(user_id=None, row_factory=sqlite3.Row):
+    """获取用户朋友圈库的连接（首次调用时建表并迁移 JSON）。"""
+    db_path = get_moments_db_path(user_id)
+    _ensure_ready(db_path)
+    return pooled_conn(db_path, row_factory=row_factory)
+
+
+def _is_visible(ts, cutoff) -> bool:
+    """定时生成的互动是否已到时间（与旧版一致用 strptime 解析比较）：没有时间的视为可见，无法解析的不显示。"""
+    if not ts:
+        return True
+    try:
+        return datetime.strptime(ts, "%Y-%m-%d %H:%M:%S") <= cutoff
+    except (TypeError, ValueError):
+        return False
+
+
+def _assemble(conn, post_rows, visible_before=None) -> list:
+    """把 posts 行组装成旧 JSON 结构（char_id, content, timestamp, likers, comments, ... + id）。
+
+    visible_before 不为空时只保留已到时间的点赞/评论（定时生成的互动还没到时间），
+    且帖子有带时间的 likers 时不再返回旧版 liker_ids（与旧版列表一致：有 likers 就忽略 liker_ids）；
+    comment 额外带 comment_index（在该帖子评论列表中的原始位置）。
+    """
+    if not post_rows:
+        return []
+    ids = [r["id"] for r in post_rows]
+    marks = ",".join("?" * len(ids))
+    likes, comments = {}, {}
+    for r in conn.execute(f"SELECT post_id, liker_id, timestamp FROM likes WHERE post_id IN ({marks}) "
+                          "ORDER BY post_id, seq", ids):
+        likes.setdefault(r["post_id"], []).append(r)
+    for r in conn.execute(f"SELECT post_id, idx, commenter_id, content, timestamp, extra FROM comments "
+                          f"WHERE post_id IN ({marks}) ORDER BY post_id, idx", ids):
+        comments.setdefault(r["post_id"], []).append(r)
+    cutoff = None
+    if visible_before is not None:
+        cutoff = datetime.strptime(visible_before, "%Y-%m-%d %H:%M:%S")
+
+    out = []
+    for r in post_rows:
+        post = _loads_extra(r["extra"])
+        post.update({"id": r["id"], "char_id": r["char_id"], "content": r["content"], "timestamp": r["timestamp"]})
+        plikes = likes.get(r["id"], [])
+        timed = [l for l in plikes if l["timestamp"] is not None]
+        post["likers"] = [{"liker_id": l["liker_id"], "timestamp": l["timestamp"]} for l in timed
+                          if cutoff is None or _is_visible(l["timestamp"], cutoff)]
+        legacy = [l["liker_id"] for l in plikes if l["timestamp"] is None]
+        if legacy and (cutoff is None or not timed):
+            post["liker_ids"] = legacy
+        clist = []
+        for c in comments.get(r["id"], []):
+            if cutoff is not None and not _is_visible(c["timestamp"], cutoff):
+                continue
+            cd = _loads_extra(c["extra"])
+            cd.update({"commenter_id": c["commenter_id"], "content": c["content"], "timestamp": c["timestamp"]})
+            if visible_before is not None:
+                cd["comment_index"] = c["idx"]
+            clist.append(cd)
+        post["comments"] = clist
+        out.append(post)
+    return out
+
+
+def list_moments(user_id=None, limit=10, offset=0, before_id=None, char_id=None, visible_before=None) -> list:
+    """按时间倒序分页列出朋友圈。before_id 为上一页最后一条的 id（游标分页），char_id 为按发帖者过滤。"""
+    where, params = [], []
+    if char_id:
+        where.append("char_id = ?")
+        params.append(char_id)
+    with moments_conn(user_id) as conn:
+        if before_id is not None:
+            anchor = conn.execute("SELECT timestamp, id FROM posts WHERE id = ?", (before_id,)).fetchone()
+            if anchor is None:
+                return []
+            where.append("(timestamp < ? OR (timestamp = ? AND id > ?))")
+            params += [anchor["timestamp"], anchor["timestamp"], anchor["id"]]
+            offset = 0
+        sql = "SELECT id, char_id, timestamp, content, extra FROM posts"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY timestamp DESC, id ASC LIMIT ? OFFSET ?"
+        rows = conn.execute(sql, params + [int(limit), int(offset)]).fetchall()
+        return _assemble(conn, rows, visible_before=visible_before)
+
+
+def iter_all_moments(user_id=None) -> list:
+    """全部朋友圈（旧 JSON 结构，按写入顺序），供统计等低频场景使用。"""
+    with moments_conn(user_id) as conn:
+        rows = conn.execute("SELECT id, char_id, timestamp, content, extra FROM posts ORDER BY id").fetchall()
+        return _assemble(conn, rows)
+
+
+def get_moment(char_id, timestamp, user_id=None):
+    """按 (char_id, timestamp) 取一条完整朋友圈（旧 JSON 结构 + id），不存在返回 None。"""
+    with moments_conn(user_id) as conn:
+        rows = conn.execute("SELECT id, char_id, timestamp, content, extra FROM posts WHERE char_id = ? AND timestamp = ?",
+                            (char_id, timestamp)).fetchall()
+        posts = _assemble(conn, rows)
+    return posts[0] if posts else None
+
+
+def add_moment(post: dict, user_id=None) -> int:
+    """新增一条朋友圈（含初始点赞/评论），返回 id；同一角色同一秒已有帖子时返回 None。"""
+    try:
+        with moments_conn(user_id) as conn:
+            post_id = _insert_post(conn, post)
+    except sqlite3.IntegrityError:
+        print(f"[Moments Store] 重复帖子未写入 {post.get('char_id')} @ {post.get('timestamp')}")
+        return None
+    notify_moment("post", user_id=user_id, moment_id=post_id, char_id=post.get("char_id"))
+    return post_id
+
+
+def save_moment(post: dict, user_id=None) -> bool:
+    """整条写回一条朋友圈（只重写这一条的点赞/评论）。post 需带 get_moment 返回的 id。"""
+    post_id = post.get("id")
+    with moments_conn(user_id) as conn:
+        if post_id is None:
+            row = conn.execute("SELECT id FROM posts WHERE char_id = ? AND timestamp = ?",
+                               (post.get("char_id", ""), post.get("timestamp", ""))).fetchone()
+            if row is None:
+                return False
+            post_id = row["id"]
+        cur = conn.execute("UPDATE posts SET char_id = ?, timestamp = ?, content = ?, extra = ? WHERE id = ?",
+                           (post.get("char_id", ""), post.get("timestamp", ""), post.get("content", ""),
+                            _dumps_extra(post, _POST_KEYS), post_id))
+        if cur.rowcount == 0:
+            return False
+        conn.execute("DELETE FROM likes WHERE post_id = ?", (post_id,))
+        conn.execute("DELETE FROM comments WHERE post_id = ?", (post_id,))
+        _insert_children(conn, post_id, post)
+    notify_moment("update", user_id=user_id, moment_id=post_id, char_id=post.get("char_id"))
+    return True
+
+
+def delete_moment(char_id, timestamp, user_id=None) -> bool:
+    with moments_conn(user_id) as conn:
+        row = conn.execute("SELECT id FROM posts WHERE char_id = ? AND timestamp = ?", (char_id, timestamp)).fetchone()
+        if row is None:
+            return False
+        conn.execute("DELETE FROM likes WHERE post_id = ?", (row["id"],))
+        conn.execute("DELETE FROM comments WHERE post_id = ?", (row["id"],))
+        conn.execute("DELETE FROM posts WHERE id = ?", (row["id"],))
+    notify_moment("delete", user_id=user_id, moment_id=row["id"], char_id=char_id)
+    return True
+
+
+def add_reactions(char_id, timestamp, likers=None, comments=None, user_id=None) -> bool:
+    """给一条朋友圈追加点赞和评论（已点过赞的人不重复添加）。帖子不存在返回 False。"""
+    with moments_conn(user_id) as conn:
+        row = conn.execute("SELECT id FROM posts WHERE char_id = ? AND timestamp = ?", (char_id, timestamp)).fetchone()
+        if row is None:
+            return False
+        post_id = row["id"]
+        if likers:
+            seq = conn.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM likes WHERE post_id = ?", (post_id,)).fetchone()[0]
+            for like in likers:
+                cur = conn.execute("INSERT OR IGNORE INTO likes (post_id, liker_id, timestamp, seq) VALUES (?, ?, ?, ?)",
+                                   (post_id, like["liker_id"], like.get("timestamp") or "", seq))
+                seq += cur.rowcount
+        if comments:
+            idx = conn.execute("SELECT COALESCE(MAX(idx), -1) + 1 FROM comments WHERE post_id = ?", (post_id,)).fetchone()[0]
+            for c in comments:
+                conn.execute(
+                    "INSERT INTO comments (post_id, idx, commenter_id, content, timestamp, extra) VALUES (?, ?, ?, ?, ?, ?)",
+                    (post_id, idx, c.get("commenter_id", ""), c.get("content", ""), c.get("timestamp", ""),
+                     _dumps_extra(c, _COMMENT_KEYS)),
+                )
+                idx += 1
+    if likers or comments:
+        notify_moment("reactions", user_id=user_id, moment_id=post_id, char_id=char_id)
+    return True
+
+
+def remove_like(char_id, timestamp, liker_id, user_id=None):
+    """取消点赞。返回 None（帖子不存在）/ True（有变化）/ False（本来就没赞）。"""
+    with moments_conn(user_id) as conn:
+        row = conn.execute("SELECT id FROM posts WHERE char_id = ? AND timestamp = ?", (char_id, timestamp)).fetchone()
+        if row is None:
+            return None
+        cur = conn.execute("DELETE FROM likes WHERE post_id = ? AND liker_id = ?", (row["id"], liker_id))
+        changed = cur.rowcount > 0
+    if changed:
+        notify_moment("update", user_id=user_id, moment_id=row["id"], char_id=char_id)
+    return changed
@@ -1,23 +1,33 @@
 import os
 import re
 import json
+import time
 import sqlite3
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, time as dt_time, date
 
 import weather_api
 
 from core.config import (
-    BASE_DIR, USERS_ROOT, CONFIG_FILE, GROUPS_CONFIG_FILE, STICKER_DESCRIPTIONS_FILE,
+    BASE_DIR, USERS_ROOT, CONFIG_FILE, GROUPS_CONFIG_FILE, STICKER_DESCRIPTIONS_FILE, LONG_MEMORY_QUERY_ASYNC,
+    PROMPT_PARALLEL, PROMPT_ASSEMBLY_WORKERS,
     get_global_system_rules, get_mode_context,
     GLOBAL_SYSTEM_RULES_JA_AGENT_BRIEF, GLOBAL_SYSTEM_RULES_EN_AGENT_BRIEF, GLOBAL_SYSTEM_RULES_ZH_AGENT_BRIEF,
 )
-from core.context import get_current_user_id
+from core.context import get_current_user_id, set_background_user
+from core.tracing import traced, annotate, record_span
 from core.utils import (
     _add_furigana_to_japanese, get_paths, get_current_username,
-    _get_characters_config_file, _get_groups_config_file, _load_user_settings,
+    _get_characters_config_file, _get_groups_config_file, _load_user_settings, load_json_cached,
     load_character_positions, load_user_position, load_locations,
     calc_distance, get_location_by_id, get_group_dir,
 )
+from services.tokenizer import cached_keywords, janome_tokenize, jieba_posseg_cut
+from services.memory_index import LongMemoryIndex, get_long_memory_index
+from services.memory_store import get_short_events, get_daily_summaries, get_weekly_summaries
+from services import memory_query as _memory_query
 
 
 def get_ai_language(target_id=None, group_id=None, user_id=None):
@@ -28,81 +38,57 @@ def get_ai_language(target_id=None, group_id=None, user_id=None):
 
     try:
         if group_id:
-            groups_cfg = _get_groups_config_file(user_id=user_id)
-            if os.path.exists(groups_cfg):
-                with open(groups_cfg, "r", encoding="utf-8") as f:
-                    all_groups = json.load(f)
-                group_lang = all_groups.get(group_id, {}).get("language")
-                if group_lang:
-                    return group_lang
+            all_groups = load_json_cached(_get_groups_config_file(user_id=user_id), {})
+            group_lang = all_groups.get(group_id, {}).get("language")
+            if group_lang:
+                return group_lang
 
         if target_id:
-            cfg_file = _get_characters_config_file(user_id=user_id)
-            if os.path.exists(cfg_file):
-                with open(cfg_file, "r", encoding="utf-8") as f:
-                    all_config = json.load(f)
-                char_lang = all_config.get(target_id, {}).get("language")
-                if char_lang:
-                    return char_lang
+            all_config = load_json_cached(_get_characters_config_file(user_id=user_id), {})
+            char_lang = all_config.get(target_id, {}).get("language")
+            if char_lang:
+                return char_lang
 
             if not group_id:
-                groups_cfg = _get_groups_config_file(user_id=user_id)
-                if os.path.exists(groups_cfg):
-                    with open(groups_cfg, "r", encoding="utf-8") as f:
-                        all_groups = json.load(f)
-                    group_lang = all_groups.get(target_id, {}).get("language")
-                    if group_lang:
-                        return group_lang
+                all_groups = load_json_cached(_get_groups_config_file(user_id=user_id), {})
+                group_lang = all_groups.get(target_id, {}).get("language")
+                if group_lang:
+                    return group_lang
     except Exception as e:
         print(f"[get_ai_language] Error reading config for {target_id}: {e}")
 
     if user_id:
         path = os.path.join(USERS_ROOT, str(user_id), "configs", "user_settings.json")
-        if os.path.exists(path):
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                lang = data.get("ai_language")
-                if lang:
-                    return lang
-            except Exception:
-                pass
+        lang = load_json_cached(path, {}).get("ai_language")
+        if lang:
+            return lang
     data = _load_user_settings()
     return data.get("ai_language", default_lang)
 
 
 def get_char_name(char_id):
-    config_file = _get_characters_config_file()
-    if not os.path.exists(config_file):
-        return char_id
     try:
-        with open(config_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return data.get(char_id, {}).get("name", char_id)
+        data = load_json_cached(_get_characters_config_file(), None)
+        if data is None:
+            return char_id
+        return data.get(char_id, {}).get("name", char_id)
     except:
         return char_id
 
 
 def get_char_age(char_id):
-    config_file = _get_characters_config_file()
-    if not os.path.exists(config_file):
-        return None
     try:
-        with open(config_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            age = data.get(char_id, {}).get("age")
-            return int(age) if age is not None else None
+        data = load_json_cached(_get_characters_config_file(), {})
+        age = data.get(char_id, {}).get("age")
+        return int(age) if age is not None else None
     except:
         return None
 
 
 def _get_char_chat_mode(char_id, user_id=None):
     try:
-        cfg_file = _get_characters_config_file(user_id=user_id)
-        if os.path.exists(cfg_file):
-            with open(cfg_file, "r", encoding="utf-8") as f:
-                all_config = json.load(f)
-            return all_config.get(char_id, {}).get("chat_mode", "online")
+        all_config = load_json_cached(_get_characters_config_file(user_id=user_id), {})
+        return all_config.get(char_id, {}).get("chat_mode", "online")
     except:
         pass
     return "online"
@@ -170,9 +156,13 @@ def _is_mainly_chinese(text):
 
 
 def _extract_keywords_jieba(text, stop, max_tokens=8, nouns_only=False):
+    return cached_keywords("jieba", text, stop, max_tokens, nouns_only,
+                           lambda: _extract_keywords_jieba_uncached(text, stop, max_tokens, nouns_only))
+
+
+def _extract_keywords_jieba_uncached(text, stop, max_tokens=8, nouns_only=False):
     try:
-        import jieba.posseg as pseg
-        words = pseg.cut(text)
+        words = jieba_posseg_cut(text)
     except Exception:
         return {}
     freq = {}
@@ -195,10 +185,13 @@ def _extract_keywords_jieba(text, stop, max_tokens=8, nouns_only=False):
 
 
 def _extract_keywords_janome(text, stop, max_tokens=8, nouns_only=False):
+    return cached_keywords("janome", text, stop, max_tokens, nouns_only,
+                           lambda: _extract_keywords_janome_uncached(text, stop, max_tokens, nouns_only))
+
+
+def _extract_keywords_janome_uncached(text, stop, max_tokens=8, nouns_only=False):
     try:
-        from janome.tokenizer import Tokenizer
-        tokenizer = Tokenizer()
-        tokens = list(tokenizer.tokenize(text))
+        tokens = janome_tokenize(text)
     except Exception:
         return {}
     freq = {}
@@ -223,143 +216,72 @@ def _extract_keywords_janome(text, stop, max_tokens=8, nouns_only=False):
     return freq
 
 
-def _call_ai_for_long_memory_query(text: str, char_id: str = None):
-    """
-    调用 AI 模型分析用户输入，提取用于搜索长期记忆的关键词和时间参考。
-    返回: (keywords: list[str], time_refs: list[str])，失败时返回 ([], [])
-    """
-    if not text or not text.strip():
-        return [], []
-
-    try:
-        from services.ai_client import call_gemini, call_openrouter, get_model_config
-        route, model = get_model_config("summary")
-
-        # 获取用户全局语言
-        user_lang = get_ai_language(target_id=char_id) or "zh"
-
-        if user_lang == "ja":
-            prompt = (
-                "あなたは記憶検索アシスタントです。ユーザーの最新のメッセージから、長期記憶を検索するためのキーワードと時間参照を抽出してください。\n"
-                "必ず日本語で返答してください。\n\n"
-                "【ルール】\n"
-                "1. keywords と time_refs を含むJSONオブジェクトを出力してください。\n"
-                "2. keywords: 文字列配列。人物名、場所、重要な出来事、感情のテーマを3〜6個抽出。\n"
-                "3. time_refs: 文字列配列。メッセージ内の時間参照を標準形式で出力：\n"
-                "   - 年のみ: \"2025\"\n"
-                "   - 年-月: \"2025-03\"（月は2桁）\n"
-                "   - 月のみ: \"03\"（2桁）\n"
-                "   - 例: \"去年の夏\" → \"2025-06\" / \"先週\" → 該当なしの場合は空\n"
-                "4. JSONのみを出力し、説明やmarkdownブロック記号は不要。\n"
-                "5. 明確な指示がない場合は {\"keywords\": [], \"time_refs\": []} を出力。\n\n"
-                f"ユーザーメッセージ：\n{text[:500]}\n\nJSON："
-            )
-        elif user_lang == "en":
-            prompt = (
-                "You are a memory retrieval assistant. Extract keywords and time references from the user's latest message to search long-term memory.\n"
-                "You MUST reply in English.\n\n"
-                "【Rules】\n"
-                "1. Output a JSON object with keywords and time_refs fields.\n"
-                "2. keywords: string array. Extract 3-6 person names, places, key events, emotional themes.\n"
-                "3. time_refs: string array. Output time references in standard format:\n"
-                "   - Year only: \"2025\"\n"
-                "   - Year-Month: \"2025-03\" (month as 2 digits)\n"
-                "   - Month only: \"03\" (2 digits)\n"
-                "   - Example: \"last summer\" → \"2025-06\" / \"last week\" → empty if no specific date\n"
-                "4. Output ONLY the JSON, no explanation or markdown block markers.\n"
-                "5. If no clear direction, output {\"keywords\": [], \"time_refs\": []}.\n\n"
-                f"User message:\n{text[:500]}\n\nJSON:"
-            )
-        else:
-            prompt = (
-                "你是一个记忆检索助手。根据用户最新的消息，提取出可能需要从长期记忆中回顾的关键词和时间范围。\n"
-                "你必须用中文回复。\n\n"
-                "【规则】\n"
-                "1. 输出一个JSON对象，包含 keywords 和 time_refs 两个字段。\n"
-                "2. keywords: 字符串数组，提取人物名称、地点、重要事件、情感主题。3~6个关键词。\n"
-                "3. time_refs: 字符串数组，提取消息中的时间参考，统一为标准格式：\n"
-                "   - 仅年份: \"2025\"\n"
-                "   - 年-月: \"2025-03\"（月份必须两位数）\n"
-                "   - 仅月份: \"03\"（两位数）\n"
-                "   - 例如: \"去年夏天\" → \"2024-07\" / \"上周\" → 无法确定具体日期则不输出\n"
-                "4. 只输出JSON，不要有任何解释或markdown代码块标记。\n"
-                "5. 如果消息没有明确指向，输出 {\"keywords\": [], \"time_refs\": []}。\n\n"
-                f"用户消息：\n{text[:500]}\n\nJSON："
-            )
-
-        messages = [{"role": "user", "content": prompt}]
-        if route == "relay":
-            result = call_openrouter(messages, char_id=char_id or "system", model_name=model, max_tokens=200)
-        else:
-            result = call_gemini(messages, char_id=char_id or "system", model_name=model)
-
-        if not result:
-            return [], []
-
-        result = result.strip()
-        if result.startswith("```"):
-            result = re.sub(r'^```\w*\s*', '', result)
-            result = re.sub(r'\s*```$', '', result)
-
+LONG_MEMORY_STOPWORDS = {
+    "今天", "明天", "昨天", "然后", "但是", "所以", "而且", "可以", "已经", "还是", "就是", "感觉", "真的", "有点", "什么", "怎么", "为什么", "这个", "那个",
+    "的", "了", "吗", "呢", "啊", "哦", "嗯", "好", "对", "是", "有", "在", "不", "没", "很", "都", "也", "就", "还", "会", "能", "要", "说", "想", "看", "做",
+    "は", "が", "を", "に", "で", "へ", "と", "も", "の", "や", "から", "まで", "より",
+    "について", "として", "によって",
+    "です", "ます", "だ", "だった", "でした", "である", "いる", "ある", "なる", "する", "できる",
+    "これ", "それ", "あれ", "どれ", "ここ", "そこ", "あそこ", "どこ", "この", "その", "あの", "どの",
+    "私", "僕", "俺", "あなた", "彼", "彼女", "自分",
+    "君", "きみ", "お前", "おまえ", "あんた", "貴方", "てめえ", "貴様", "お宅", "そちら", "あちら",
+    "何", "なに", "なん", "誰", "だれ", "いつ", "なぜ", "どう", "どうして", "どんな", "どのくらい", "いくつ", "いくら", "何で", "どちら", "どっち",
+    "こと", "もの", "ところ", "よう", "ため", "場合", "中", "前", "後", "時", "人", "方",
+    "とても", "少し", "あまり", "かなり", "もう", "まだ", "よく", "すぐ", "すごく", "ちょっと", "なんて",
+    "そして", "しかし", "だから", "また", "さらに", "それに", "それで",
+    "うん", "はい", "そう", "そうだ", "そうか", "わかった", "わかりました", "まあ", "ね", "よ", "さ", "な", "か",
+    "って", "でも", "でもいい", "いいって", "いい", "ない",
+    "思う", "言う", "見る", "行く", "来る",
+}
+
+
+def _user_input_keywords(text_user, stop=LONG_MEMORY_STOPWORDS) -> list:
+    """用户最新消息的名词关键词（分词失败时按规则切分）。"""
+    text_user = str(text_user or "").replace("/", " ")
+    freq_user = {}
+    if _is_mainly_japanese(text_user):
         try:
-            data = json.loads(result)
-        except json.JSONDecodeError:
-            import re as _re
-            match = _re.search(r'\{[^{}]*"keywords"[^{}]*\}', result, _re.DOTALL)
-            if match:
-                try:
-                    data = json.loads(match.group())
-                except json.JSONDecodeError:
-                    return [], []
-            else:
-                return [], []
-
-        if not isinstance(data, dict):
-            return [], []
-
-        kw_list = data.get("keywords", [])
-        time_list = data.get("time_refs", [])
-        if not isinstance(kw_list, list):
-            kw_list = [str(kw_list)]
-        if not isinstance(time_list, list):
-            time_list = [str(time_list)]
-
-        keywords = [str(k).strip() for k in kw_list if k and str(k).strip()]
-
-        # 标准化 time_refs：统一为数字格式（YYYY-MM / YYYY / MM）
-        import re as _re
-        time_refs = []
-        for t in time_list:
-            if not t:
-                continue
-            t = str(t).strip()
-            # "2025-03" 或 "2025-3"
-            m = _re.match(r'^(\d{4})-(\d{1,2})$', t)
-            if m:
-                time_refs.append(f"{m.group(1)}-{int(m.group(2)):02d}")
-                continue
-            # "2025"
-            m = _re.match(r'^(\d{4})$', t)
-            if m:
-                time_refs.append(m.group(1))
-                continue
-            # "3" 或 "03" (纯月份)
-            m = _re.match(r'^(\d{1,2})$', t)
-            if m:
-                time_refs.append(f"{int(m.group(1)):02d}")
+            freq_user = _extract_keywords_janome(text_user, stop, max_tokens=8, nouns_only=True)
+        except Exception:
+            pass
+    elif _is_mainly_chinese(text_user):
+        try:
+            freq_user = _extract_keywords_jieba(text_user, stop, max_tokens=8, nouns_only=True)
+        except Exception:
+            pass
+    if not freq_user:
+        for t in re.split(r"[ \t\r\n，。？！、；：]+", text_user):
+            t = t.strip()
+            if not t or len(t) < 2 or t in stop or t.isdigit() or re.match(r"^[\d\-:～]+$", t):
                 continue
-            # 兜底：原始值
-            time_refs.append(t)
-        time_refs = time_refs[:5]
-
-        print(f"  [AI Memory Query] keywords={keywords}, time_refs={time_refs}")
-        return keywords[:10], time_refs
+            if len(t) <= 8:
+                freq_user[t] = freq_user.get(t, 0) + 1
+            else:
+                for s in re.split(r"[のではにをとがもからってずにけれど]+", t):
+                    s = s.strip()
+                    if 2 <= len(s) <= 8 and s not in stop:
+                        freq_user[s] = freq_user.get(s, 0) + 1
+    return list(freq_user.keys())
+
+
+def prefetch_long_memory_query(char_id, user_latest_input, user_id=None):
+    """提前在后台分析用户最新消息（关键词 + 时间参考），与 prompt 其余部分的组装并发。"""
+    text = str(user_latest_input or "").strip()[:800]
+    if not text or not LONG_MEMORY_QUERY_ASYNC:
+        return
+    try:
+        if user_id is None:
+            user_id = get_current_user_id()
+        lang = get_ai_language(target_id=char_id, user_id=user_id) or "zh"
+        _memory_query.prefetch_long_memory_query(text, char_id=char_id, user_id=user_id, lang=lang,
+                                                 local_keywords=_user_input_keywords(text))
     except Exception as e:
-        print(f"  [AI Memory Query] 调用失败: {e}")
-        return [], []
+        print(f"  [Memory Query] 预取失败: {e}")
 
 
-def select_relevant_long_memory(long_mem, recent_messages=None, user_latest_input=None, char_id=None):
+@traced("memory.long_select")
+def select_relevant_long_memory(long_mem, recent_messages=None, user_latest_input=None, char_id=None, index=None, user_id=None):
+    """index 为该角色的 LongMemoryIndex（见 services/memory_index.py），未传入时按 long_mem 临时构建。"""
     if not long_mem:
         return []
     if not recent_messages:
@@ -370,23 +292,7 @@ def select_relevant_long_memory(long_mem, recent_messages=None, user_latest_inpu
 
     text = " ".join(str(s) for s in recent_messages if s)
     text = text.replace("/", " ")
-    stop = {
-        "今天", "明天", "昨天", "然后", "但是", "所以", "而且", "可以", "已经", "还是", "就是", "感觉", "真的", "有点", "什么", "怎么", "为什么", "这个", "那个",
-        "的", "了", "吗", "呢", "啊", "哦", "嗯", "好", "对", "是", "有", "在", "不", "没", "很", "都", "也", "就", "还", "会", "能", "要", "说", "想", "看", "做",
-        "は", "が", "を", "に", "で", "へ", "と", "も", "の", "や", "から", "まで", "より",
-        "について", "として", "によって",
-        "です", "ます", "だ", "だった", "でした", "である", "いる", "ある", "なる", "する", "できる",
-        "これ", "それ", "あれ", "どれ", "ここ", "そこ", "あそこ", "どこ", "この", "その", "あの", "どの",
-        "私", "僕", "俺", "あなた", "彼", "彼女", "自分",
-        "君", "きみ", "お前", "おまえ", "あんた", "貴方", "てめえ", "貴様", "お宅", "そちら", "あちら",
-        "何", "なに", "なん", "誰", "だれ", "いつ", "なぜ", "どう", "どうして", "どんな", "どのくらい", "いくつ", "いくら", "何で", "どちら", "どっち",
-        "こと", "もの", "ところ", "よう", "ため", "場合", "中", "前", "後", "時", "人", "方",
-        "とても", "少し", "あまり", "かなり", "もう", "まだ", "よく", "すぐ", "すごく", "ちょっと", "なんて",
-        "そして", "しかし", "だから", "また", "さらに", "それに", "それで",
-        "うん", "はい", "そう", "そうだ", "そうか", "わかった", "わかりました", "まあ", "ね", "よ", "さ", "な", "か",
-        "って", "でも", "でもいい", "いいって", "いい", "ない",
-        "思う", "言う", "見る", "行く", "来る",
-    }
+    stop = LONG_MEMORY_STOPWORDS
     now = datetime.now()
     current_year, current_month = now.year, now.month
     TOP_K = 3
@@ -394,51 +300,17 @@ def select_relevant_long_memory(long_mem, recent_messages=None, user_latest_inpu
     MAX_EVENTS_PER_KEY = 4
     GLOBAL_TOP_EVENTS = 12
 
-    def parse_key_to_month(key):
-        key = (key or "").strip()
-        if not key:
-            return None
-        if "-Week" in key:
-            part = key.split("-Week")[0]
-        else:
-            part = key
-        parts = part.split("-")
-        if len(parts) >= 2:
-            try:
-                y, m = int(parts[0]), int(parts[1])
-                if 1 <= m <= 12:
-                    return (y, m)
-            except (ValueError, IndexError):
-                pass
-        return None
+    if index is None:
+        index = LongMemoryIndex.from_memory(long_mem)
 
     def recency_score(key):
-        parsed = parse_key_to_month(key)
+        parsed = index.month_of(key)
         if not parsed:
             return 0
         y, m = parsed
         delta = (current_year - y) * 12 + (current_month - m)
         return max(0, 6 - delta)
 
-    def split_events(text_block):
-        if not text_block:
-            return []
-        lines = text_block.splitlines()
-        has_bullets = any(ln.strip().startswith("- ") for ln in lines)
-        if has_bullets:
-            events = []
-            for ln in lines:
-                s = ln.strip()
-                if not s:
-                    continue
-                if s.startswith("- "):
-                    s = s[2:].strip()
-                if len(s) >= 2:
-                    events.append(s)
-            return events
-        candidates = re.split(r"[。！？!?\n]+", text_block)
-        return [c.strip() for c in candidates if len(c.strip()) >= 4]
-
     freq = {}
     if _is_mainly_japanese(text):
         try:
@@ -479,13 +351,18 @@ def select_relevant_long_memory(long_mem, recent_messages=None, user_latest_inpu
     else:
         print(f"  关键词(规则提取): {keywords}")
 
-    # AI 辅助记忆检索：用 AI 理解语义，提取更准确的关键词和时间参考
+    # 记忆检索 query 分析：本地规则优先，不确定时才调用记忆模型（结果有缓存，可能已被预取）
     ai_keywords = []
     ai_time_refs = []
     try:
         query_text = str(user_latest_input or "").strip()[:800]
         if query_text:
-            ai_keywords, ai_time_refs = _call_ai_for_long_memory_query(query_text, char_id=char_id)
+            if user_id is None:
+                user_id = get_current_user_id()
+            lang = get_ai_language(target_id=char_id, user_id=user_id) or "zh"
+            ai_keywords, ai_time_refs = _memory_query.analyze_long_memory_query(
+                query_text, char_id=char_id, user_id=user_id, lang=lang,
+                local_keywords=_user_input_keywords(query_text, stop))
     except Exception as e:
         print(f"  [AI Memory Query] 外层异常: {e}")
 
@@ -511,42 +388,14 @@ def select_relevant_long_memory(long_mem, recent_messages=None, user_latest_inpu
         return score
 
     if user_latest_input and str(user_latest_input).strip():
-        text_user = str(user_latest_input).replace("/", " ")
-        freq_user = {}
-        if _is_mainly_japanese(text_user):
-            try:
-                freq_user = _extract_keywords_janome(text_user, stop, max_tokens=8, nouns_only=True)
-            except Exception:
-                pass
-        elif _is_mainly_chinese(text_user):
-            try:
-                freq_user = _extract_keywords_jieba(text_user, stop, max_tokens=8, nouns_only=True)
-            except Exception:
-                pass
-        if not freq_user:
-            for t in re.split(r"[ \t\r\n，。？！、；：]+", text_user):
-                t = t.strip()
-                if not t or len(t) < 2 or t in stop or t.isdigit() or re.match(r"^[\d\-:～]+$", t):
-                    continue
-                if len(t) <= 8:
-                    freq_user[t] = freq_user.get(t, 0) + 1
-                else:
-                    for s in re.split(r"[のではにをとがもからってずにけれど]+", t):
-                        s = s.strip()
-                        if 2 <= len(s) <= 8 and s not in stop:
-                            freq_user[s] = freq_user.get(s, 0) + 1
-        user_kw_list = list(freq_user.keys())
+        user_kw_list = _user_input_keywords(user_latest_input, stop)
         if user_kw_list:
             print(f"  用户最新消息关键词(名词): {user_kw_list}")
 
-        user_matched = set()
-        for k, v in long_mem.items():
-            for ev in split_events(v):
-                if user_kw_list and any(kw in ev for kw in user_kw_list):
-                    user_matched.add((k, ev))
-
-        all_events = [(k, ev) for k, v in long_mem.items() for ev in split_events(v)]
-        remaining_events = [x for x in all_events if x not in user_matched]
+        # 倒排索引：命中用户关键词的事件下标
+        user_matched_ids = set(index.match_counts(user_kw_list)) if user_kw_list else set()
+        user_matched = {index.events[i] for i in user_matched_ids}
+        remaining_events = [x for x in index.events if x not in user_matched]
 
         text_ctx = " ".join(str(s) for s in recent_messages if s).replace("/", " ")
         freq_ctx = {}
@@ -576,15 +425,20 @@ def select_relevant_long_memory(long_mem, recent_messages=None, user_latest_inpu
         if context_keywords:
             print(f"  上下文关键词(名词): {context_keywords}")
 
-        def keyword_score_ctx(block):
-            return sum(1 for kw in context_keywords if kw in block) if block and context_keywords else 0
+        ctx_counts = {}
+        for i, n in index.match_counts(context_keywords).items():
+            ev_key = index.events[i]
+            ctx_counts[ev_key] = max(ctx_counts.get(ev_key, 0), n)
+
+        def keyword_score_ctx(k, ev):
+            return ctx_counts.get((k, ev), 0)
 
         selected_by_key = {}
         for k, ev in user_matched:
             selected_by_key.setdefault(k, []).append(ev)
         selected_count = sum(len(evs) for evs in selected_by_key.values())
 
-        remaining_scored = [(A * keyword_score_ctx(ev) + B * recency_score(k) + time_ref_score(k), k, ev) for k, ev in remaining_events]
+        remaining_scored = [(A * keyword_score_ctx(k, ev) + B * recency_score(k) + time_ref_score(k), k, ev) for k, ev in remaining_events]
         remaining_scored.sort(key=lambda x: -x[0])
 
         for sc, k, ev in remaining_scored:
@@ -606,21 +460,16 @@ def select_relevant_long_memory(long_mem, recent_messages=None, user_latest_inpu
         print("--- [Long Memory RAI] 筛选结束（用户消息优先+上下文筛选）---")
         return result
 
-    def keyword_score(text_block):
-        if not text_block or not keywords:
-            return 0
-        return sum(1 for kw in keywords if kw in text_block)
-
+    kw_counts = index.match_counts(keywords)
+    key_scores = {}
     event_scored = []
-    for k, v in long_mem.items():
-        r_score = recency_score(k)
-        events = split_events(v)
-        if not events:
-            continue
-        for ev in events:
-            kw_score = keyword_score(ev)
-            total = A * kw_score + B * r_score + time_ref_score(k)
-            event_scored.append((total, k, ev, kw_score, r_score))
+    for i, (k, ev) in enumerate(index.events):
+        if k not in key_scores:
+            key_scores[k] = (recency_score(k), time_ref_score(k))
+        r_score, t_score = key_scores[k]
+        kw_score = kw_counts.get(i, 0)
+        total = A * kw_score + B * r_score + t_score
+        event_scored.append((total, k, ev, kw_score, r_score))
 
     if not event_scored:
         print("  无可用事件，退回按时间选择 key。")
@@ -708,25 +557,20 @@ def parse_week_key_to_dates(week_key: str) -> tuple:
 
 def extract_long_memory_with_timeline_ts(char_id, recent_messages=None, user_latest_input=None, user_id=None) -> list:
     _, prompts_dir = get_paths(char_id, user_id=user_id)
-    long_mem_path = os.path.join(prompts_dir, "4_memory_long.json")
-
-    print(f"[DEBUG] extract_long_memory: 文件路径 = {long_mem_path}")
-    print(f"[DEBUG] extract_long_memory: 文件存在 = {os.path.exists(long_mem_path)}")
 
     result = []
-    if not os.path.exists(long_mem_path):
-        print(f"[DEBUG] extract_long_memory: 4_memory_long.json 不存在")
-        return result
-
     try:
-        with open(long_mem_path, "r", encoding="utf-8-sig") as f:
-            long_mem = json.load(f) or {}
+        long_mem = get_weekly_summaries(prompts_dir)
         print(f"[DEBUG] extract_long_memory: 读取到 {len(long_mem)} 条原始长期记忆")
     except Exception as e:
-        print(f"[DEBUG] extract_long_memory: 读取文件失败 - {e}")
+        print(f"[DEBUG] extract_long_memory: 读取失败 - {e}")
+        return result
+    if not long_mem:
         return result
 
-    selected = select_relevant_long_memory(long_mem, recent_messages, user_latest_input=user_latest_input)
+    selected = select_relevant_long_memory(long_mem, recent_messages, user_latest_input=user_latest_input,
+                                           char_id=char_id, user_id=user_id,
+                                           index=get_long_memory_index(prompts_dir, long_mem))
     print(f"[DEBUG] extract_long_memory: 筛选后得到 {len(selected)} 条有效记忆")
     if not selected:
         print(f"[DEBUG] extract_long_memory: 筛选结果为空")
@@ -747,25 +591,16 @@ def extract_long_memory_with_timeline_ts(char_id, recent_messages=None, user_lat
 
 def extract_medium_memory_with_timeline_ts(char_id, user_id=None) -> list:
     _, prompts_dir = get_paths(char_id, user_id=user_id)
-    medium_mem_path = os.path.join(prompts_dir, "5_memory_medium.json")
-
-    print(f"[DEBUG] extract_medium_memory: 文件路径 = {medium_mem_path}")
-    print(f"[DEBUG] extract_medium_memory: 文件存在 = {os.path.exists(medium_mem_path)}")
 
     result = []
-    if not os.path.exists(medium_mem_path):
-        print(f"[DEBUG] extract_medium_memory: 5_memory_medium.json 不存在")
-        return result
-
+    now = datetime.now()
     try:
-        with open(medium_mem_path, "r", encoding="utf-8-sig") as f:
-            med_mem = json.load(f) or {}
-        print(f"[DEBUG] extract_medium_memory: 读取到 {len(med_mem)} 条原始中期记忆")
+        med_mem = get_daily_summaries(prompts_dir, [(now - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(7, 0, -1)])
+        print(f"[DEBUG] extract_medium_memory: 读取到 {len(med_mem)} 条近 7 天中期记忆")
     except Exception as e:
-        print(f"[DEBUG] extract_medium_memory: 读取文件失败 - {e}")
+        print(f"[DEBUG] extract_medium_memory: 读取失败 - {e}")
         return result
 
-    now = datetime.now()
     for i in range(7, 0, -1):
         day_date = (now - timedelta(days=i)).date()
         day_key = day_date.strftime("%Y-%m-%d")
@@ -785,21 +620,8 @@ def extract_medium_memory_with_timeline_ts(char_id, user_id=None) -> list:
 
 def extract_short_memory_with_timeline_ts(char_id, user_id=None) -> list:
     _, prompts_dir = get_paths(char_id, user_id=user_id)
-    short_mem_path = os.path.join(prompts_dir, "6_memory_short.json")
-
-    print(f"[DEBUG] extract_short_memory: 文件路径 = {short_mem_path}")
 
     result = []
-    if not os.path.exists(short_mem_path):
-        return result
-
-    try:
-        with open(short_mem_path, "r", encoding="utf-8-sig") as f:
-            short_mem = json.load(f) or {}
-    except Exception as e:
-        print(f"[DEBUG] extract_short_memory: 读取失败 - {e}")
-        return result
-
     now = datetime.now()
     today_str = now.strftime("%Y-%m-%d")
 
@@ -808,17 +630,13 @@ def extract_short_memory_with_timeline_ts(char_id, user_id=None) -> list:
         yesterday_str = (now - timedelta(days=1)).strftime("%Y-%m-%d")
         dates_to_load.insert(0, yesterday_str)
 
-    for date_key in dates_to_load:
-        day_data = short_mem.get(date_key)
-        if not day_data:
-            continue
-
-        events = []
-        if isinstance(day_data, list):
-            events = day_data
-        elif isinstance(day_data, dict):
-            events = day_data.get("events", [])
+    try:
+        short_mem = get_short_events(prompts_dir, dates_to_load)
+    except Exception as e:
+        print(f"[DEBUG] extract_short_memory: 读取失败 - {e}")
+        return result
 
+    for date_key, events in short_mem.items():
         if events:
             date_obj = datetime.strptime(date_key, "%Y-%m-%d").date()
             for e in events:
@@ -942,18 +760,26 @@ def build_timeline_section(timeline_events) -> str:
     return "【时间线 / Timeline】\n" + "\n".join(lines)
 
 
-def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=None, user_latest_input=None, target_char_id=None, group_id=None, include_long_memory=True, include_recent_messages=True, user_id=None):
-    if user_id is None:
-        from core.context import get_current_user_id
-        user_id = get_current_user_id()
-    prompt_parts = []
+# ==================== System Prompt v2：分段并发组装 ====================
+# 每个分段是一个 provider(ctx) -> list，彼此只读各自的文件，互不依赖；
+# 在线程池中并发执行（文件读取、天气查询互相重叠；长期记忆 RAI 在调用方线程里同时进行），最后按固定顺序拼接。
 
-    _, prompts_dir = get_paths(char_id, user_id=user_id)
-    now = datetime.now()
-    today_str = now.strftime("%Y-%m-%d")
+_prompt_executor = None
+_prompt_executor_lock = threading.Lock()
 
-    char_name = get_char_name(char_id)
-    char_age = get_char_age(char_id)
+
+def _get_prompt_executor() -> ThreadPoolExecutor:
+    global _prompt_executor
+    if _prompt_executor is None:
+        with _prompt_executor_lock:
+            if _prompt_executor is None:
+                _prompt_executor = ThreadPoolExecutor(max_workers=PROMPT_ASSEMBLY_WORKERS, thread_name_prefix="prompt-section")
+    return _prompt_executor
+
+
+def _section_persona(ctx) -> list:
+    char_name = ctx["char_name"]
+    char_age = get_char_age(ctx["char_id"])
     name_age_prefix = ""
     if char_name or char_age is not None:
         parts = []
@@ -963,8 +789,8 @@ def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=
             parts.append(f"年齢：{char_age}歳")
         name_age_prefix = "\n".join(parts) + "\n\n"
 
-    path_json = os.path.join(prompts_dir, "1_base_persona.json")
-    path_md = os.path.join(prompts_dir, "1_base_persona.md")
+    path_json = os.path.join(ctx["prompts_dir"], "1_base_persona.json")
+    path_md = os.path.join(ctx["prompts_dir"], "1_base_persona.md")
 
     content = ""
     if os.path.exists(path_json):
@@ -984,8 +810,12 @@ def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=
     if content:
         if name_age_prefix:
             content = name_age_prefix + content
-        prompt_parts.append(f"【キャラクター / 角色人设】\n{content}")
+        return [f"【キャラクター / 角色人设】\n{content}"]
+    return []
 
+
+def _section_user_persona(ctx) -> list:
+    out = []
     try:
         user_name = get_current_username()
         user_age = get_user_age()
@@ -999,7 +829,7 @@ def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=
             user_prefix = "\n".join(parts) + "\n\n"
 
         persona_added = False
-        if include_global_format:
+        if ctx["include_global_format"]:
             user_persona_file = None
             uid = get_current_user_id()
             if uid:
@@ -1019,16 +849,20 @@ def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=
                     if user_prefix:
                         content = user_prefix + content
                     if content:
-                        prompt_parts.append(f"【ユーザー / 用户人设】\n{content}")
+                        out.append(f"【ユーザー / 用户人设】\n{content}")
                         persona_added = True
         if not persona_added and user_prefix.strip():
-            prompt_parts.append(f"【ユーザー / 用户人设】\n{user_prefix.strip()}")
+            out.append(f"【ユーザー / 用户人设】\n{user_prefix.strip()}")
     except:
         pass
+    return out
 
+
+def _section_relationship(ctx) -> list:
+    target_char_id = ctx["target_char_id"]
     try:
         current_user_name = get_current_username()
-        path = os.path.join(prompts_dir, "2_relationship.json")
+        path = os.path.join(ctx["prompts_dir"], "2_relationship.json")
         if os.path.exists(path):
             with open(path, "r", encoding="utf-8") as f:
                 rel_data = json.load(f) or {}
@@ -1053,7 +887,7 @@ def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=
                        f"関係性：{target_rel.get('role', '不明')}\n"
                        f"関係度：{target_rel.get('score', 1)}\n"
                        f"詳細：{target_rel.get('description', '')}")
-                prompt_parts.append(f"【関係 / 关系】\n{rel_str}")
+                return [f"【関係 / 关系】\n{rel_str}"]
             elif rel_data:
                 rel_lines = []
 
@@ -1073,17 +907,20 @@ def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=
                     rel_lines.append(f"- {disp_name}: {role} (关系度:{score}) {desc}")
                 if rel_lines:
                     rel_text = "\n".join(rel_lines)
-                    prompt_parts.append(f"【関係 / 关系】\n{rel_text}")
+                    return [f"【関係 / 关系】\n{rel_text}"]
     except Exception:
         pass
+    return []
 
-    path = os.path.join(prompts_dir, "7_schedule.json")
+
+def _section_schedule(ctx) -> list:
+    path = os.path.join(ctx["prompts_dir"], "7_schedule.json")
     if os.path.exists(path):
         try:
             with open(path, "r", encoding="utf-8-sig") as f:
                 schedule = json.load(f) or {}
             if schedule:
-                today = now.date()
+                today = ctx["now"].date()
                 future_end = today + timedelta(days=7)
                 filtered_schedule = {}
                 for date_str, event in sorted(schedule.items()):
@@ -1096,20 +933,24 @@ def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=
 
                 if filtered_schedule:
                     sched_text = "- " + "\n- ".join([f"{k}: {v}" for k, v in filtered_schedule.items()])
-                    prompt_parts.append(f"【スケジュール / 日程表】\n{sched_text}")
+                    return [f"【スケジュール / 日程表】\n{sched_text}"]
         except Exception:
             pass
+    return []
 
-    if include_global_format:
-        lang = get_ai_language(char_id, group_id=group_id, user_id=user_id)
-        chat_mode = _get_char_chat_mode(char_id, user_id=user_id)
+
+def _section_rules(ctx) -> list:
+    out = []
+    lang = ctx["lang"]
+    if ctx["include_global_format"]:
+        chat_mode = ctx["chat_mode"]
         content = get_global_system_rules(lang, chat_mode=chat_mode)
         if content:
-            prompt_parts.append(f"【システムルール / 系统规则】\n{content}")
+            out.append(f"【システムルール / 系统规则】\n{content}")
 
         if chat_mode != "offline":
             desc_list = "、".join(_get_sticker_allowed_descriptions())
-            prompt_parts.append(
+            out.append(
                 "【Sticker / 表情】\n"
                 "在分段回复中若要发送表情，请**仅使用**以下描述之一，格式为 [表情]描述：\n"
                 f"{desc_list}\n"
@@ -1123,25 +964,24 @@ def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=
                 "2. 搜图：当你提到现实存在的物品、景点、动漫角色或其他通用概念时，加入 `[SEARCH_IMG: 关键词]`。\n"
                 "注意：每次回复最多只使用一个媒体标签。"
             )
-            prompt_parts.append(media_instruction)
+            out.append(media_instruction)
 
-            lang = get_ai_language(char_id, group_id=group_id, user_id=user_id)
             if lang == "ja":
-                prompt_parts.append(
+                out.append(
                     "\n\n【Voice / 音声】\n"
                     "- 音声：[voice](テキスト)(トーン/感情の説明)。実際の音声を送信するために使用。トーンの説明はできるだけ詳細に自然に（例：「優しさの中に笑みを含めて」「声を潜めて、少し緊張気味に」）、モデルがそのトーンを再現する。\n"
                     "- 例：/こんにちは/[voice](お元気ですか)(明るく元気に)/元気だよ/\n"
                     "- ⚠️ 必ず半角の()を使用し、全角の（）は不可。テキストが先、トーンが後。"
                 )
             elif lang == "en":
-                prompt_parts.append(
+                out.append(
                     "\n\n【Voice / 语音】\n"
                     "- Voice: [voice](text)(tone/emotion description). Used to send real voice messages. The tone description can be as detailed and natural as possible (e.g. \"gently with a smile in your voice\", \"lowering your voice, a bit nervous\"), the model will reproduce that tone.\n"
                     "- Example: /Hello/[voice](How are you)(cheerfully)/I'm fine/\n"
                     "- ⚠️ Use half-width () only, NOT full-width （）. Text first, tone second."
                 )
             else:
-                prompt_parts.append(
+                out.append(
                     "\n\n【Voice / 语音】\n"
                     "- 语音：[voice](文本)(语气/情绪描述)。用于发送真实语音。语气描述可以尽可能详细自然（如\"温柔中带着笑意\"\"压低声音、有点紧张\"），模型会还原该语气。\n"
                     "- 示例：/你好/[voice](最近怎么样)(开心地)/我很好/\n"
@@ -1149,39 +989,37 @@ def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=
                 )
 
             if lang == "ja":
-                prompt_parts.append(
+                out.append(
                     "\n\n【Tickle / つつく】\n"
                     "- つつく：セグメント内で [tickle]（自分をつつく）または [tickle_user]（ユーザーをつつく）を使用。グループでは [tickle_キャラクターID] で特定メンバー指定可能、連続使用禁止。"
                 )
             elif lang == "en":
-                prompt_parts.append(
+                out.append(
                     "\n\n【Tickle / 拍一拍】\n"
                     "- Tickle: Use [tickle] (tickle yourself) or [tickle_user] (tickle the user) within segments. Group chat supports [tickle_CharacterID] to tickle specific members."
                 )
             else:
-                prompt_parts.append(
+                out.append(
                     "\n\n【Tickle / 拍一拍】\n"
                     "- 拍一拍：酌情在段落中使用 [tickle]（拍自己）或 [tickle_user]（拍用户）。群聊支持 [tickle_角色ID] 拍指定成员，禁止连续拍同一人。"
                 )
 
             if lang == "ja":
-                prompt_parts.append(
+                out.append(
                     "\n\n【Recall / 送信消去】\n"
                     "- 送信消去：最初のセグメント以外で `[recall]` を挿入し、直前のセグメントを消去したことを示す。リアリティを高めるために使用。"
                 )
             elif lang == "en":
-                prompt_parts.append(
+                out.append(
                     "\n\n【Recall / 撤回】\n"
                     "- Recall: You can include `[recall]` in segments after the first one to indicate recalling the previous segment (e.g., a typo or secret thought, then \"recall\" it for realism)."
                 )
             else:
-                prompt_parts.append(
+                out.append(
                     "\n\n【Recall / 撤回】\n"
                     "- 撤回：可在非首条分段中加入 `[recall]`，表示撤回上一段内容（如故意打错字后撤回，增加真实感）。"
                 )
-
-    if not include_global_format:
-        lang = get_ai_language(char_id, group_id=group_id, user_id=user_id)
+    else:
         if lang == "ja":
             agent_rules = GLOBAL_SYSTEM_RULES_JA_AGENT_BRIEF
         elif lang == "en":
@@ -1189,61 +1027,52 @@ def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=
         else:
             agent_rules = GLOBAL_SYSTEM_RULES_ZH_AGENT_BRIEF
         if agent_rules:
-            prompt_parts.append(f"【Agent Actions / 智能体动作】\n{agent_rules}")
+            out.append(f"【Agent Actions / 智能体动作】\n{agent_rules}")
+    return out
 
-    timeline_events = []
 
-    if include_long_memory:
-        long_mem_events = extract_long_memory_with_timeline_ts(char_id, recent_messages=recent_messages, user_latest_input=user_latest_input, user_id=user_id)
-        print(f"[DEBUG v2] extract_long_memory_with_timeline_ts() 返回 {len(long_mem_events)} 条事件")
-        for i, (content, _, ts) in enumerate(long_mem_events):
-            print(f"  [{i}] {ts.strftime('%Y-%m-%d %H:%M')} - 长期记忆: {content[:100]}")
-            timeline_events.append(("long_memory", content, ts))
+def _section_long_memory(ctx) -> list:
+    long_mem_events = extract_long_memory_with_timeline_ts(ctx["char_id"], recent_messages=ctx["recent_messages"], user_latest_input=ctx["user_latest_input"], user_id=ctx["user_id"])
+    print(f"[DEBUG v2] extract_long_memory_with_timeline_ts() 返回 {len(long_mem_events)} 条事件")
+    events = []
+    for i, (content, _, ts) in enumerate(long_mem_events):
+        print(f"  [{i}] {ts.strftime('%Y-%m-%d %H:%M')} - 长期记忆: {content[:100]}")
+        events.append(("long_memory", content, ts))
+    return events
 
-    med_mem_events = extract_medium_memory_with_timeline_ts(char_id, user_id=user_id)
+
+def _section_medium_memory(ctx) -> list:
+    med_mem_events = extract_medium_memory_with_timeline_ts(ctx["char_id"], user_id=ctx["user_id"])
     print(f"[DEBUG v2] extract_medium_memory_with_timeline_ts() 返回 {len(med_mem_events)} 条事件")
+    events = []
     for i, (content, _, ts) in enumerate(med_mem_events):
         print(f"  [{i}] {ts.strftime('%Y-%m-%d %H:%M')} - 中期记忆: {content[:100]}")
-        timeline_events.append(("medium_memory", content, ts))
+        events.append(("medium_memory", content, ts))
+    return events
+
 
-    short_mem_events = extract_short_memory_with_timeline_ts(char_id, user_id=user_id)
+def _section_short_memory(ctx) -> list:
+    short_mem_events = extract_short_memory_with_timeline_ts(ctx["char_id"], user_id=ctx["user_id"])
     print(f"[DEBUG v2] extract_short_memory_with_timeline_ts() 返回 {len(short_mem_events)} 条事件")
+    events = []
     for i, (content, _, ts) in enumerate(short_mem_events):
         print(f"  [{i}] {ts.strftime('%Y-%m-%d %H:%M')} - 短期记忆: {content[:100]}")
-        timeline_events.append(("short_memory", content, ts))
-
-    if include_recent_messages:
-        msg_events = extract_recent_messages_with_labels(char_id, limit=20, group_id=group_id, user_id=user_id)
-        print(f"[DEBUG v2] extract_recent_messages_with_labels() 返回 {len(msg_events)} 条事件")
-        for i, (_, content, ts) in enumerate(msg_events):
-            print(f"  [{i}] {ts.strftime('%Y-%m-%d %H:%M')} - 消息: {content[:100]}")
-            timeline_events.append(("message", content, ts))
-
-    print(f"[DEBUG v2] 时间线总计: {len(timeline_events)} 条事件")
+        events.append(("short_memory", content, ts))
+    return events
 
-    if timeline_events:
-        timeline_text = build_timeline_section(timeline_events)
-        prompt_parts.append(timeline_text)
-    else:
-        print(f"[DEBUG v2] WARNING: timeline_events 为空！")
 
-    now = datetime.now()
-    hour = now.hour
-    if 5 <= hour < 11:
-        period = "朝 (morning)"
-    elif 11 <= hour < 13:
-        period = "昼 (noon)"
-    elif 13 <= hour < 18:
-        period = "午後 (afternoon)"
-    elif 18 <= hour < 23:
-        period = "夜 (night)"
-    else:
-        period = "深夜 (late night)"
+def _section_recent_messages(ctx) -> list:
+    msg_events = extract_recent_messages_with_labels(ctx["char_id"], limit=20, group_id=ctx["group_id"], user_id=ctx["user_id"])
+    print(f"[DEBUG v2] extract_recent_messages_with_labels() 返回 {len(msg_events)} 条事件")
+    events = []
+    for i, (_, content, ts) in enumerate(msg_events):
+        print(f"  [{i}] {ts.strftime('%Y-%m-%d %H:%M')} - 消息: {content[:100]}")
+        events.append(("message", content, ts))
+    return events
 
-    time_info = f"現在は {now.strftime('%Y-%m-%d %H:%M')} （{period}）です。"
-    prompt_parts.append(f"【現在時刻】\n{time_info}")
 
-    # ===== location context / 地点感知 =====
+def _section_location(ctx) -> list:
+    char_id = ctx["char_id"]
     try:
         char_positions = load_character_positions()
         user_pos = load_user_position()
@@ -1305,11 +1134,14 @@ def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=
             else:
                 location_lines.append(f"- 附近可感知的地点：无")
 
-            prompt_parts.append(f"【現在の場所 / 当前环境与位置】\n" + "\n".join(location_lines))
+            return [f"【現在の場所 / 当前环境与位置】\n" + "\n".join(location_lines)]
     except Exception as e:
         print(f"[DEBUG] Location prompt injection error: {e}")
+    return []
+
 
-    # ===== weather / 天气感知 =====
+def _section_weather(ctx) -> list:
+    char_id = ctx["char_id"]
     try:
         char_positions = load_character_positions()
         if char_id in char_positions:
@@ -1320,21 +1152,44 @@ def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=
                 if loc:
                     weather = weather_api.get_weather_for_location(loc)
                     if weather:
-                        lang = get_ai_language(char_id, group_id=group_id, user_id=user_id)
+                        lang = ctx["lang"]
                         weather_text = weather_api.weather_to_prompt_text(weather, lang=lang)
                         if lang == "ja":
-                            prompt_parts.append(f"【気象情報】\n{weather_text}")
+                            return [f"【気象情報】\n{weather_text}"]
                         elif lang == "en":
-                            prompt_parts.append(f"【Weather】\n{weather_text}")
+                            return [f"【Weather】\n{weather_text}"]
                         else:
-                            prompt_parts.append(f"【天气感知】\n{weather_text}")
+                            return [f"【天气感知】\n{weather_text}"]
     except Exception as e:
         print(f"[DEBUG] Weather prompt injection error: {e}")
+    return []
+
 
-    # ===== location movement commands / 位置移动指令 =====
-    lang = get_ai_language(char_id, group_id=group_id, user_id=user_id)
+def _section_clock(ctx) -> list:
+    now = datetime.now()
+    hour = now.hour
+    if 5 <= hour < 11:
+        period = "朝 (morning)"
+    elif 11 <= hour < 13:
+        period = "昼 (noon)"
+    elif 13 <= hour < 18:
+        period = "午後 (afternoon)"
+    elif 18 <= hour < 23:
+        period = "夜 (night)"
+    else:
+        period = "深夜 (late night)"
+
+    time_info = f"現在は {now.strftime('%Y-%m-%d %H:%M')} （{period}）です。"
+    return [f"【現在時刻】\n{time_info}"]
+
+
+def _section_tail(ctx) -> list:
+    """位置移动指令 / 身份 / 语言控制 / 模式上下文 / Agent 输出要求。"""
+    out = []
+    lang = ctx["lang"]
+    char_name = ctx["char_name"]
     if lang == "ja":
-        prompt_parts.append(
+        out.append(
             "【位置移動コマンド / Location Movement Commands】\n"
             "距離<1の任意の地点/座標に移動できます。到着後その地点は「認知地点」に追加されます：\n"
             "- [MOVE_TO:地点ID] ※認知/知覚リストに**既に存在する地点**への移動にのみ使用可能\n"
@@ -1342,7 +1197,7 @@ def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=
             "- [EXPLORE:x,y,\"名称\",\"説明\"] 未探索の地点に移動して新地点を確立"
         )
     elif lang == "en":
-        prompt_parts.append(
+        out.append(
             "【Location Movement Commands / 位置移动指令】\n"
             "Move to any location/coordinate within distance<1. On arrival the location is added to your known list:\n"
             "- [MOVE_TO:location_id] ※ Only usable for locations that **already exist** in your known/perceived list\n"
@@ -1350,7 +1205,7 @@ def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=
             "- [EXPLORE:x,y,\"name\",\"desc\"] Move to an unknown coordinate and establish a new location"
         )
     else:
-        prompt_parts.append(
+        out.append(
             "【位置移动指令 / Location Movement Commands】\n"
             "距离<1格内的任意地点或坐标都可以移动过去，到达后该地点会自动加入你的认知列表：\n"
             "- [MOVE_TO:地点ID] ※只能在目标地点**已经存在**于你的认知/感知列表中时使用\n"
@@ -1359,25 +1214,24 @@ def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=
         )
 
     if char_name:
-        prompt_parts.append(f"【あなたの正体】\nあなたは {char_name} です。")
+        out.append(f"【あなたの正体】\nあなたは {char_name} です。")
 
-    lang = get_ai_language(char_id, group_id=group_id, user_id=user_id)
     if lang == "zh":
         lang_instruction = (
             "\n\n【Language Control / 语言控制】\n"
             "请注意：无论上述设定使用何种语言，你**必须使用中文**进行回复。\n"
             "在保留角色语气、口癖和性格特征的前提下，自然地转化为中文表达。"
         )
-        prompt_parts.append(lang_instruction)
+        out.append(lang_instruction)
     elif lang == "ja":
         lang_instruction = (
             "\n\n【Language Control / 言語制御】\n"
             "ご注意：設定やユーザーの入力に関わらず、あなたは**必ず日本語**で返答してください。\n"
             "キャラクターの性格や口調を維持したまま、自然な日本語で表現してください。"
         )
-        prompt_parts.append(lang_instruction)
+        out.append(lang_instruction)
     elif lang == "en":
-        prompt_parts.append(
+        out.append(
             "\n\n【Language Control / 语言控制】\n"
             "Please reply in English. Maintain the character's personality and tone."
         )
@@ -1385,22 +1239,21 @@ def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=
         lang_names = {"ko": "韩语", "fr": "法语", "de": "德语", "es": "西班牙语", "pt": "葡萄牙语",
                       "ru": "俄语", "ar": "阿拉伯语", "th": "泰语", "vi": "越南语", "it": "意大利语"}
         lang_display = lang_names.get(lang, lang)
-        prompt_parts.append(
+        out.append(
             f"\n\n【Language Control / 语言控制】\n"
             f"请注意：无论上述设定使用何种语言，你**必须使用{lang_display}**进行回复。\n"
             f"在保留角色语气、口癖和性格特征的前提下，自然地转化为{lang_display}表达。"
         )
 
-    chat_mode = _get_char_chat_mode(char_id)
+    chat_mode = ctx["chat_mode"]
     mode_context = get_mode_context(lang, chat_mode=chat_mode)
     if mode_context:
-        prompt_parts.append(f"【Mode Context / 模式上下文】\n{mode_context}")
+        out.append(f"【Mode Context / 模式上下文】\n{mode_context}")
 
     real_conversation_guide = _build_real_conversation_guide(lang, chat_mode=chat_mode)
     if real_conversation_guide:
-        prompt_parts.append(real_conversation_guide)
+        out.append(real_conversation_guide)
 
-    lang = get_ai_language(char_id, group_id=group_id, user_id=user_id)
     if lang == "ja":
         agent_enforce = (
             "\n\n【Agent Output Requirement / エージェント出力要件】\n"
@@ -1428,9 +1281,152 @@ def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=
             "不要在单个 `[]` 内用逗号分隔多条指令。\n"
             "如果当前轮次确实没有任何参数需要调整、没有任何动作需要执行，则输出 `[NONE]` 作为占位。"
         )
-    prompt_parts.append(agent_enforce)
+    out.append(agent_enforce)
+    return out
 
-    return "\n\n".join(prompt_parts)
+
+def _run_section(name, provider, ctx):
+    """在 worker 线程中执行单个分段：带上调用方的用户上下文，计时，异常时返回空。"""
+    t0 = time.perf_counter()
+    set_background_user(ctx["user_id"])
+    try:
+        result = provider(ctx)
+    except Exception as e:
+        print(f"[Prompt v2] 分段 {name} 构建失败: {e}")
+        result = []
+    ms = (time.perf_counter() - t0) * 1000
+    record_span(f"prompt.section.{name}", ms, t0=t0)
+    return result, ms
+
+
+# 可能阻塞一整次模型往返的分段（长期记忆 RAI 要等 query 分析）：在调用方线程里执行，
+# 不占共用线程池的 worker，其他请求的轻量分段不会排在它后面
+_INLINE_SECTIONS = ("long_memory",)
+
+
+def _run_sections(sections, ctx) -> dict:
+    """并发执行 [(name, provider)]，返回 {name: list}；并打印各分段耗时。"""
+    t0 = time.perf_counter()
+    results, timings = {}, {}
+    if PROMPT_PARALLEL and len(sections) > 1:
+        executor = _get_prompt_executor()
+        # 每个分段各自拷贝 contextvars（Flask 请求上下文 / 后台用户），worker 线程里 session 仍可用
+        futures = {name: executor.submit(contextvars.copy_context().run, _run_section, name, provider, ctx)
+                   for name, provider in sections if name not in _INLINE_SECTIONS}
+        # 调用方线程本来就要等，正好在这里跑阻塞分段，与线程池里的分段并发
+        for name, provider in sections:
+            if name in _INLINE_SECTIONS:
+                results[name], timings[name] = contextvars.copy_context().run(_run_section, name, provider, ctx)
+        for name, fut in futures.items():
+            results[name], timings[name] = fut.result()
+    else:
+        for name, provider in sections:
+            results[name], timings[name] = contextvars.copy_context().run(_run_section, name, provider, ctx)
+    total_ms = (time.perf_counter() - t0) * 1000
+    detail = ", ".join(f"{n}={timings[n]:.0f}ms" for n, _ in sections)
+    print(f"[Prompt v2] 组装完成 {total_ms:.0f}ms（{'并发' if PROMPT_PARALLEL else '串行'}）: {detail}")
+    ctx["timings"] = timings
+    return results
+
+
+# 依赖最新聊天记录 / 当前时间的分段：prepare 时可以延后，到 finish 时再读
+_LIVE_SECTIONS = ("recent_messages", "clock")
+
+
+def prepare_system_prompt_v2(char_id, include_global_format=True, recent_messages=None, user_latest_input=None, target_char_id=None, group_id=None, include_long_memory=True, include_recent_messages=True, user_id=None, defer_live_sections=True) -> dict:
+    """并发构建 v2 system prompt 的各分段，返回交给 finish_system_prompt_v2 拼接的中间结果。
+
+    defer_live_sections=True 时最近消息、时钟两段留到 finish 时再构建：群聊流水线据此提前为后面的
+    发言者准备人设 / 记忆 / 长期记忆 RAI，轮到他发言时只需补读最新聊天记录。
+    """
+    if user_id is None:
+        from core.context import get_current_user_id
+        user_id = get_current_user_id()
+
+    if include_long_memory and user_latest_input and recent_messages:
+        # 记忆检索的 query 分析可能要调用模型，先在后台启动，和其余分段并发
+        prefetch_long_memory_query(char_id, user_latest_input, user_id=user_id)
+
+    _, prompts_dir = get_paths(char_id, user_id=user_id)
+    ctx = {
+        "char_id": char_id,
+        "user_id": user_id,
+        "group_id": group_id,
+        "target_char_id": target_char_id,
+        "prompts_dir": prompts_dir,
+        "now": datetime.now(),
+        "include_global_format": include_global_format,
+        "recent_messages": recent_messages,
+        "user_latest_input": user_latest_input,
+        "char_name": get_char_name(char_id),
+        "lang": get_ai_language(char_id, group_id=group_id, user_id=user_id),
+        "chat_mode": _get_char_chat_mode(char_id, user_id=user_id),
+    }
+
+    sections = [
+        ("persona", _section_persona),
+        ("user_persona", _section_user_persona),
+        ("relationship", _section_relationship),
+        ("schedule", _section_schedule),
+        ("rules", _section_rules),
+    ]
+    if include_long_memory:
+        sections.append(("long_memory", _section_long_memory))
+    sections += [
+        ("medium_memory", _section_medium_memory),
+        ("short_memory", _section_short_memory),
+    ]
+    if include_recent_messages:
+        sections.append(("recent_messages", _section_recent_messages))
+    sections += [
+        ("clock", _section_clock),
+        ("location", _section_location),
+        ("weather", _section_weather),
+        ("tail", _section_tail),
+    ]
+    deferred = [(n, p) for n, p in sections if defer_live_sections and n in _LIVE_SECTIONS]
+    results = _run_sections([(n, p) for n, p in sections if (n, p) not in deferred], ctx)
+    return {"ctx": ctx, "results": results, "deferred": deferred}
+
+
+def finish_system_prompt_v2(prepared) -> str:
+    """补齐 prepare 时延后的分段（此刻的聊天记录与时间），按固定顺序拼接成 system prompt。"""
+    ctx = prepared["ctx"]
+    results = dict(prepared["results"])
+    if prepared["deferred"]:
+        ctx["now"] = datetime.now()
+        results.update(_run_sections(prepared["deferred"], ctx))
+
+    prompt_parts = []
+    for name in ("persona", "user_persona", "relationship", "schedule", "rules"):
+        prompt_parts.extend(results[name])
+
+    timeline_events = []
+    for name in ("long_memory", "medium_memory", "short_memory", "recent_messages"):
+        timeline_events.extend(results.get(name, []))
+    print(f"[DEBUG v2] 时间线总计: {len(timeline_events)} 条事件")
+
+    if timeline_events:
+        timeline_text = build_timeline_section(timeline_events)
+        prompt_parts.append(timeline_text)
+    else:
+        print(f"[DEBUG v2] WARNING: timeline_events 为空！")
+
+    for name in ("clock", "location", "weather", "tail"):
+        prompt_parts.extend(results[name])
+
+    prompt = "\n\n".join(prompt_parts)
+    annotate(prompt_chars=len(prompt), timeline_events=len(timeline_events))
+    return prompt
+
+
+@traced("prompt.build_v2")
+def build_system_prompt_v2(char_id, include_global_format=True, recent_messages=None, user_latest_input=None, target_char_id=None, group_id=None, include_long_memory=True, include_recent_messages=True, user_id=None):
+    prepared = prepare_system_prompt_v2(char_id, include_global_format=include_global_format, recent_messages=recent_messages,
+                                        user_latest_input=user_latest_input, target_char_id=target_char_id, group_id=group_id,
+                                        include_long_memory=include_long_memory, include_recent_messages=include_recent_messages,
+                                        user_id=user_id, defer_live_sections=False)
+    return finish_system_prompt_v2(prepared)
 
 
 def build_messages_for_chat_v2(char_id, user_input, recent_messages=None, user_id=None) -> list:
@@ -1574,64 +1570,43 @@ def build_system_prompt(char_id, include_global_format=True, recent_messages=Non
 
     if include_long_memory:
         try:
-            path = os.path.join(prompts_dir, "4_memory_long.json")
-            if os.path.exists(path):
-                with open(path, "r", encoding="utf-8-sig") as f:
-                    long_mem = json.load(f)
-                    if long_mem:
-                        selected = select_relevant_long_memory(long_mem, recent_messages, user_latest_input=user_latest_input, char_id=char_id)
-                        if selected:
-                            mem_list = [f"- {k}: {v}" for k, v in selected]
-                            prompt_parts.append(f"【Long-term Memory / 長期記憶】\n" + "\n".join(mem_list))
+            long_mem = get_weekly_summaries(prompts_dir)
+            if long_mem:
+                selected = select_relevant_long_memory(long_mem, recent_messages, user_latest_input=user_latest_input, char_id=char_id, user_id=user_id,
+                                                       index=get_long_memory_index(prompts_dir, long_mem))
+                if selected:
+                    mem_list = [f"- {k}: {v}" for k, v in selected]
+                    prompt_parts.append(f"【Long-term Memory / 長期記憶】\n" + "\n".join(mem_list))
         except Exception:
             pass
 
     try:
-        path = os.path.join(prompts_dir, "5_memory_medium.json")
-        if os.path.exists(path):
-            with open(path, "r", encoding="utf-8-sig") as f:
-                med_mem = json.load(f)
-                summary_texts = []
-                for i in range(7, 0, -1):
-                    day_key = (now - timedelta(days=i)).strftime("%Y-%m-%d")
-                    if day_key in med_mem:
-                        summary_texts.append(str(med_mem[day_key]))
-                if summary_texts:
-                    combined = " ".join(summary_texts)
-                    max_len = 200
-                    if len(combined) > max_len:
-                        combined = combined[:max_len] + "..."
-                    prompt_parts.append(f"【Medium-term Memory / 最近一週間の出来事】\n{combined}")
+        day_keys = [(now - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(7, 0, -1)]
+        med_mem = get_daily_summaries(prompts_dir, day_keys)
+        summary_texts = [str(med_mem[k]) for k in day_keys if k in med_mem]
+        if summary_texts:
+            combined = " ".join(summary_texts)
+            max_len = 200
+            if len(combined) > max_len:
+                combined = combined[:max_len] + "..."
+            prompt_parts.append(f"【Medium-term Memory / 最近一週間の出来事】\n{combined}")
     except Exception:
         pass
 
     try:
-        path = os.path.join(prompts_dir, "6_memory_short.json")
-        if os.path.exists(path):
-            with open(path, "r", encoding="utf-8-sig") as f:
-                short_mem = json.load(f)
-
-                dates_to_load = [today_str]
-
-                if now.hour < 4:
-                    yesterday_str = (now - timedelta(days=1)).strftime("%Y-%m-%d")
-                    dates_to_load.insert(0, yesterday_str)
+        dates_to_load = [today_str]
 
-                combined_events_str = ""
-                for date_key in dates_to_load:
-                    day_data = short_mem.get(date_key)
-                    today_events = []
-                    if isinstance(day_data, list):
-                        today_events = day_data
-                    elif isinstance(day_data, dict):
-                        today_events = day_data.get("events", [])
+        if now.hour < 4:
+            yesterday_str = (now - timedelta(days=1)).strftime("%Y-%m-%d")
+            dates_to_load.insert(0, yesterday_str)
 
-                    if today_events:
-                        combined_events_str += f"\n--- {date_key} ---\n"
-                        combined_events_str += "\n".join([f"- [{e.get('time')}] {e.get('event')}" for e in today_events])
+        combined_events_str = ""
+        for date_key, today_events in get_short_events(prompts_dir, dates_to_load).items():
+            combined_events_str += f"\n--- {date_key} ---\n"
+            combined_events_str += "\n".join([f"- [{e.get('time')}] {e.get('event')}" for e in today_events])
 
-                if combined_events_str:
-                    prompt_parts.append(f"【Short-term Memory / 最近の出来事】{combined_events_str}")
+        if combined_events_str:
+            prompt_parts.append(f"【Short-term Memory / 最近の出来事】{combined_events_str}")
     except Exception:
         pass
 
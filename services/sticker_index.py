@@ -0,0 +1,359 @@
+"""
+表情目录与名称解析。
+
+原来每次搜索 / 解析 [表情]名称 都要把所有官方表情包和用户上传目录从 COS 列一遍（一条带表情的回复几十次远程调用），
+表情包封面还要为找 cover 再列一遍。现在：
+- 官方目录（包列表、每包表情、封面）和名称索引常驻内存，首次使用时构建，之后由后台线程每 STICKER_INDEX_TTL 秒刷新，
+  /api/admin/refresh_stickers 可立即刷新；上传表情包时增量加入，不必等刷新；
+- 每个用户的上传表情单独一份索引，按需列一次 COS，上传时增量追加；
+- 名称按字符 1/2-gram 建倒排，包含匹配先取候选再校验，不再线性扫全部表情；
+- LLM 回复里的 [表情]名称 在入库前由 resolve_sticker_tags 一次性解析成 path，历史接口只读不写；
+  旧库里尚未解析的行由 migrate_sticker_rows 在启动时后台一次性改写。
+"""
+import os
+import re
+import random
+import threading
+import time
+
+from core.config import USERS_ROOT, STICKER_IMAGE_EXT, STICKER_INDEX_TTL
+from core.context import get_current_user_id
+from core.db import pooled_conn
+
+STICKER_TAG_RE = re.compile(r"\[表情\](.*?)(?=\s*/\s*|$)")
+PATH_PREFIXES = ("official:", "user:")
+COVER_BASENAME = "cover"
+USER_PACK_NAME = "个人上传"
+MIGRATION_MARKER = ".sticker_rows_v1"
+_RETRY_AFTER_ERROR = 60
+
+_lock = threading.RLock()
+_refresher = None
+_stats = {"builds": 0, "build_errors": 0, "lookups": 0, "resolved": 0, "unresolved": 0, "migrated_rows": 0}
+
+
+class _NameIndex:
+    """表情条目 + 名称字符 n-gram 倒排，支持「名称包含关键词」查询，结果保持加入顺序。"""
+
+    def __init__(self):
+        self.items = []
+        self.keys = []
+        self.grams = {}
+
+    def add(self, item, key):
+        key = key.lower()
+        idx = len(self.items)
+        self.items.append(item)
+        self.keys.append(key)
+        for g in set(key) | {key[i:i + 2] for i in range(len(key) - 1)}:
+            self.grams.setdefault(g, set()).add(idx)
+
+    def search(self, q) -> list:
+        q = (q or "").strip().lower()
+        if not q:
+            return list(self.items)
+        if len(q) == 1:
+            ids = self.grams.get(q, ())
+        else:
+            postings = [self.grams.get(q[i:i + 2]) for i in range(len(q) - 1)]
+            if not all(postings):
+                return []
+            ids = set.intersection(*sorted(postings, key=len))
+        return [self.items[i] for i in sorted(ids) if q in self.keys[i]]
+
+
+class _OfficialCatalog:
+    def __init__(self, packs=(), stickers=None, covers=None):
+        self.packs = []
+        self.stickers = {}
+        self.covers = dict(covers or {})
+        self.index = _NameIndex()
+        for pack_id in packs:
+            self.add_pack(pack_id)
+            for s in (stickers or {}).get(pack_id, []):
+                self.add_sticker(pack_id, s)
+
+    def add_pack(self, pack_id):
+        if pack_id not in self.stickers:
+            self.packs.append(pack_id)
+            self.stickers[pack_id] = []
+
+    def add_sticker(self, pack_id, sticker):
+        self.add_pack(pack_id)
+        self.stickers[pack_id].append(sticker)
+        self.index.add(dict(sticker, pack_name=pack_id), sticker["name"])
+
+
+# 官方目录：{"catalog": _OfficialCatalog, "built_at": 时间戳（0 表示尚未构建）, "ok": 上次构建是否成功}
+_official = {"catalog": _OfficialCatalog(), "built_at": 0.0, "ok": False}
+# 用户上传：{user_id: {"index": _NameIndex, "built_at": 时间戳}}
+_user_indexes: dict = {}
+
+
+def _official_sticker(pack_id, filename, url):
+    """COS 文件 → 表情条目；封面和非图片返回 None。"""
+    name_no_ext, ext = os.path.splitext(filename)
+    if COVER_BASENAME in name_no_ext.lower() or ext.lower() not in STICKER_IMAGE_EXT:
+        return None
+    return {"path": f"official:{pack_id}:{filename}", "name": name_no_ext, "url": url}
+
+
+def _user_sticker(filename, url):
+    return {"path": f"user:{filename}", "name": os.path.splitext(filename)[0], "url": url, "pack_name": USER_PACK_NAME}
+
+
+def _load_official_catalog() -> _OfficialCatalog:
+    from cos_utils import get_cos_list
+    packs = get_cos_list("stickers/", get_folders=True)
+    stickers, covers = {}, {}
+    for pack_id in packs:
+        stickers[pack_id] = []
+        for f in get_cos_list(f"stickers/{pack_id}/"):
+            if os.path.splitext(f["name"])[0].lower() == COVER_BASENAME:
+                covers[pack_id] = f["url"]
+            item = _official_sticker(pack_id, f["name"], f["url"])
+            if item:
+                stickers[pack_id].append(item)
+    return _OfficialCatalog(packs, stickers, covers)
+
+
+def _load_user_stickers(user_id) -> list:
+    from cos_utils import get_cos_list
+    return [_user_sticker(f["name"], f["url"]) for f in get_cos_list(f"users/{user_id}/sticker_uploads/")]
+
+
+def refresh_sticker_catalog(background=False):
+    """重新从 COS 拉取官方表情目录；失败时保留旧目录。"""
+    if background:
+        threading.Thread(target=refresh_sticker_catalog, daemon=True, name="sticker-refresh").start()
+        return True
+    state = _official
+    t0 = time.time()
+    try:
+        catalog = _load_official_catalog()
+    except Exception as e:
+        with _lock:
+            state["built_at"] = time.time()
+            state["ok"] = False
+        _stats["build_errors"] += 1
+        print(f"   [Sticker] 构建官方表情目录失败: {e}")
+        return False
+    with _lock:
+        state.update(catalog=catalog, built_at=time.time(), ok=True)
+    _stats["builds"] += 1
+    print(f"   [Sticker] 官方表情目录已刷新：{len(catalog.packs)} 个表情包，{len(catalog.index.items)} 个表情，"
+          f"用时 {time.time() - t0:.2f}s")
+    return True
+
+
+def _refresher_loop():
+    while True:
+        time.sleep(STICKER_INDEX_TTL if _official["ok"] else _RETRY_AFTER_ERROR)
+        refresh_sticker_catalog()
+
+
+def _catalog() -> _OfficialCatalog:
+    global _refresher
+    if not _official["built_at"]:
+        with _lock:
+            if not _official["built_at"]:
+                refresh_sticker_catalog()
+            if _refresher is None:
+                _refresher = threading.Thread(target=_refresher_loop, daemon=True, name="sticker-refresher")
+                _refresher.start()
+    return _official["catalog"]
+
+
+def _user_index(user_id):
+    if not user_id:
+        return None
+    key = str(user_id)
+    entry = _user_indexes.get(key)
+    if entry is not None and time.time() - entry["built_at"] < STICKER_INDEX_TTL:
+        return entry["index"]
+    with _lock:
+        entry = _user_indexes.get(key)
+        if entry is not None and time.time() - entry["built_at"] < STICKER_INDEX_TTL:
+            return entry["index"]
+        index = _NameIndex()
+        try:
+            for s in _load_user_stickers(key):
+                index.add(s, s["path"][5:])
+            built_at = time.time()
+            _stats["builds"] += 1
+        except Exception as e:
+            # 保留旧索引，稍后再试，避免 COS 故障时每条回复都去重试
+            if entry is not None:
+                index = entry["index"]
+            built_at = time.time() - STICKER_INDEX_TTL + _RETRY_AFTER_ERROR
+            _stats["build_errors"] += 1
+            print(f"   [Sticker] 构建个人上传表情索引失败: {e}")
+        _user_indexes[key] = {"index": index, "built_at": built_at}
+        return index
+
+
+def list_official_packs() -> list:
+    """官方表情包 ID 列表。"""
+    return list(_catalog().packs)
+
+
+def list_pack_stickers(pack_id) -> list:
+    """某表情包下的表情 [{path, name, url}]（不含封面），未知表情包返回 []。"""
+    return [dict(s) for s in _catalog().stickers.get(pack_id, [])]
+
+
+def get_pack_cover(pack_id):
+    """表情包封面 URL，没有封面返回 None。"""
+    return _catalog().covers.get(pack_id)
+
+
+def search_stickers(q, user_id=None) -> list:
+    """按名称包含匹配搜索：官方库在前，个人上传在后。返回 [{path, name, url, pack_name}]。"""
+    if user_id is None:
+        user_id = get_current_user_id()
+    _stats["lookups"] += 1
+    catalog = _catalog()
+    user_index = _user_index(user_id)
+    with _lock:
+        out = catalog.index.search(q)
+        if user_index is not None:
+            out += user_index.search(q)
+    return [dict(s) for s in out]
+
+
+def find_sticker_paths(name, user_id=None) -> list:
+    """名称包含匹配（如「开心」匹配 开心、开心（1）、开心一），返回候选 path 列表：官方在前，个人上传在后。"""
+    return [s["path"] for s in search_stickers(name, user_id)]
+
+
+def add_user_sticker(user_id, filename, url):
+    """用户上传表情后增量加入其索引（索引尚未建立时等首次使用再整体拉取）。"""
+    with _lock:
+        entry = _user_indexes.get(str(user_id))
+        if entry is not None:
+            entry["index"].add(_user_sticker(filename, url), filename)
+
+
+def add_official_sticker(pack_id, filename, url):
+    """上传表情包后增量加入官方目录；封面文件记为该包封面。"""
+    with _lock:
+        catalog = _official["catalog"]
+        catalog.add_pack(pack_id)
+        if os.path.splitext(filename)[0].lower() == COVER_BASENAME:
+            catalog.covers[pack_id] = url
+        item = _official_sticker(pack_id, filename, url)
+        if item:
+            catalog.add_sticker(pack_id, item)
+
+
+def invalidate_sticker_index(user_id=None):
+    """user_id 为空时在后台刷新官方目录，否则丢弃该用户的上传索引（下次使用时重新拉取）。"""
+    if user_id:
+        with _lock:
+            _user_indexes.pop(str(user_id), None)
+    else:
+        refresh_sticker_catalog(background=True)
+
+
+def resolve_sticker_tags(texts, user_id=None) -> list:
+    """【写时随机】把一批文本里的 [表情]纯名称 替换为随机选中的 [表情]path；已是 path 或找不到的保持原样。
+
+    同一批里出现的每个名称只查一次索引。user_id 为空时取当前用户（请求 / 后台任务上下文）。
+    """
+    if user_id is None:
+        user_id = get_current_user_id()
+    candidates = {}
+
+    def repl(m):
+        name = (m.group(1) or "").strip()
+        if name.startswith(PATH_PREFIXES):
+            return m.group(0)
+        if name not in candidates:
+            candidates[name] = find_sticker_paths(name, user_id)
+        paths = candidates[name]
+        if not paths:
+            _stats["unresolved"] += 1
+            return m.group(0)
+        _stats["resolved"] += 1
+        return f"[表情]{random.choice(paths)}"
+
+    out = []
+    for text in texts:
+        if text and "[表情]" in text:
+            text = STICKER_TAG_RE.sub(repl, text)
+        out.append(text)
+    return out
+
+
+def resolve_sticker_content(content, user_id=None):
+    """单条文本版本的 resolve_sticker_tags。"""
+    if not content or "[表情]" not in content:
+        return content
+    return resolve_sticker_tags([content], user_id)[0]
+
+
+def _needs_resolve(content) -> bool:
+    return any(not (m.group(1) or "").strip().startswith(PATH_PREFIXES) for m in STICKER_TAG_RE.finditer(content))
+
+
+def normalize_sticker_rows(db_path, user_id=None) -> int:
+    """把一个 chat.db 里仍是 [表情]名称 的消息改写为 path，返回改写的行数。"""
+    with pooled_conn(db_path) as conn:
+        rows = [(mid, content) for mid, content in conn.execute(
+            "SELECT id, content FROM messages WHERE content LIKE '%[表情]%'"
+        ).fetchall() if content and _needs_resolve(content)]
+        if not rows:
+            return 0
+        resolved = resolve_sticker_tags([c for _, c in rows], user_id)
+        updates = [(new, mid) for (mid, old), new in zip(rows, resolved) if new != old]
+        if updates:
+            conn.executemany("UPDATE messages SET content = ? WHERE id = ?", updates)
+    _stats["migrated_rows"] += len(updates)
+    return len(updates)
+
+
+def _owner_of(db_path):
+    rel = os.path.relpath(db_path, USERS_ROOT)
+    if rel.startswith(".."):
+        return None
+    return rel.split(os.sep, 1)[0]
+
+
+def migrate_sticker_rows(background=True):
+    """一次性迁移：为所有已有 chat.db 解析旧的 [表情]名称（完成后在库旁写标记文件，之后跳过）。"""
+    def _run():
+        from core.chat_schema import iter_chat_dbs
+        t0 = time.time()
+        _catalog()
+        if not _official["ok"]:
+            print("   [Sticker] 官方表情索引不可用，跳过旧消息表情迁移（下次启动重试）")
+            return
+        total = 0
+        for db_path in iter_chat_dbs():
+            marker = os.path.join(os.path.dirname(db_path), MIGRATION_MARKER)
+            if os.path.exists(marker):
+                continue
+            try:
+                total += normalize_sticker_rows(db_path, user_id=_owner_of(db_path) or "")
+                with open(marker, "w", encoding="utf-8") as f:
+                    f.write(time.strftime("%Y-%m-%d %H:%M:%S"))
+            except Exception as e:
+                print(f"   [Sticker] 迁移表情消息失败 {db_path}: {e}")
+        if total:
+            print(f"   [Sticker] 旧消息表情解析完成：改写 {total} 行，用时 {time.time() - t0:.2f}s")
+
+    if background:
+        threading.Thread(target=_run, daemon=True, name="sticker-migration").start()
+    else:
+        _run()
+
+
+def get_sticker_index_stats() -> dict:
+    catalog = _official["catalog"]
+    return {
+        "packs": len(catalog.packs),
+        "official_stickers": len(catalog.index.items),
+        "built_at": _official["built_at"],
+        "user_indexes": len(_user_indexes),
+        **_stats,
+    }
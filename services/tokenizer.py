@@ -0,0 +1,113 @@
+"""
+分词器服务：进程内只加载一次 Janome / jieba，并缓存每段文本的关键词结果。
+
+Janome 每次 Tokenizer() 都会重新加载词典（数百毫秒），jieba 词典则在首次 cut 时懒加载。
+这里统一持有单例，启动时可在后台线程预热，长期记忆 RAI 直接复用。
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from core.config import KEYWORD_CACHE_SIZE
+from core.tracing import record_cache
+
+_janome_tokenizer = None
+_janome_init_lock = threading.Lock()
+# Janome 的 Tokenizer 内部复用 lattice 等结构，跨线程共享时串行调用更稳妥
+_janome_call_lock = threading.Lock()
+
+_jieba_ready = False
+_jieba_init_lock = threading.Lock()
+
+_kw_cache: OrderedDict = OrderedDict()
+_kw_cache_lock = threading.Lock()
+_kw_stats = {"hits": 0, "misses": 0}
+
+
+def get_janome_tokenizer():
+    """返回进程内共享的 Janome Tokenizer（首次调用时加载词典）。"""
+    global _janome_tokenizer
+    if _janome_tokenizer is None:
+        with _janome_init_lock:
+            if _janome_tokenizer is None:
+                from janome.tokenizer import Tokenizer
+                _janome_tokenizer = Tokenizer()
+    return _janome_tokenizer
+
+
+def janome_tokenize(text) -> list:
+    tokenizer = get_janome_tokenizer()
+    with _janome_call_lock:
+        return list(tokenizer.tokenize(text))
+
+
+def ensure_jieba():
+    """确保 jieba 词典已加载（jieba.initialize 自身带锁，这里只避免重复调用）。"""
+    global _jieba_ready
+    if _jieba_ready:
+        return
+    with _jieba_init_lock:
+        if not _jieba_ready:
+            import jieba
+            jieba.setLogLevel(60)
+            jieba.initialize()
+            _jieba_ready = True
+
+
+def jieba_posseg_cut(text) -> list:
+    ensure_jieba()
+    import jieba.posseg as pseg
+    return list(pseg.cut(text))
+
+
+def warm_up_tokenizers(background=True):
+    """预加载 Janome / jieba 词典。background=True 时在守护线程中执行，不阻塞启动。"""
+    def _warm():
+        t0 = time.time()
+        try:
+            janome_tokenize("予熱")
+            jieba_posseg_cut("预热")
+            print(f"[Tokenizer] Janome / jieba 预热完成，用时 {time.time() - t0:.2f}s")
+        except Exception as e:
+            print(f"[Tokenizer] 预热失败: {e}")
+
+    if background:
+        threading.Thread(target=_warm, daemon=True, name="tokenizer-warmup").start()
+    else:
+        _warm()
+
+
+def cached_keywords(engine, text, stop, max_tokens, nouns_only, compute):
+    """按 (分词器, 文本, 参数) 缓存关键词词频；compute 为未命中时的实际计算函数。
+
+    返回副本，调用方可以放心修改。
+    """
+    key = (engine, text, frozenset(stop) if stop else frozenset(), max_tokens, nouns_only)
+    with _kw_cache_lock:
+        hit = _kw_cache.get(key)
+        if hit is not None:
+            _kw_cache.move_to_end(key)
+            _kw_stats["hits"] += 1
+            record_cache("keywords", True)
+            return dict(hit)
+        _kw_stats["misses"] += 1
+    record_cache("keywords", False)
+    result = compute()
+    if result:
+        with _kw_cache_lock:
+            _kw_cache[key] = dict(result)
+            while len(_kw_cache) > KEYWORD_CACHE_SIZE:
+                _kw_cache.popitem(last=False)
+    return result
+
+
+def get_keyword_cache_stats() -> dict:
+    with _kw_cache_lock:
+        return {"size": len(_kw_cache), **_kw_stats}
+
+
+def clear_keyword_cache():
+    with _kw_cache_lock:
+        _kw_cache.clear()
+        _kw_stats["hits"] = 0
+        _kw_stats["misses"] = 0
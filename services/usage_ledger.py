@@ -0,0 +1,221 @@
+"""
+Token 用量账本：所有用户的 LLM 调用用量记在 configs/usage.db 一张表里，替代每次整文件重写的 usage_history.json。
+
+- record_usage 只把一行放进内存队列，后台线程每 USAGE_FLUSH_INTERVAL 秒 executemany 批量写入；
+- (user_id, ts)、(user_id, char_id)、(user_id, model)、(user_id, task) 上建索引，
+  usage_rollup 可按天 / 角色 / 模型 / 任务类型汇总；
+- task 取自 get_model_config(task_type) 设置的上下文（chat / summary / moments / forum / vision …）；
+- 旧的 usage_history.json 在首次查询该用户账本时导入，原文件改名为 .migrated。
+"""
+import os
+import json
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from core.config import USAGE_DB, USERS_ROOT, BASE_DIR, USAGE_FLUSH_INTERVAL, USAGE_BATCH_SIZE
+from core.db import pooled_conn
+
+TASK_TYPES = ("chat", "summary", "moments", "forum", "vision")
+ROLLUP_COLUMNS = {
+    "day": "substr(ts, 1, 10)",
+    "char": "char_id",
+    "model": "model",
+    "task": "task",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL DEFAULT '',
+    ts TEXT NOT NULL,
+    char_id TEXT,
+    model TEXT,
+    task TEXT NOT NULL DEFAULT 'chat',
+    input INTEGER NOT NULL DEFAULT 0,
+    output INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_usage_user_ts ON usage(user_id, ts);
+CREATE INDEX IF NOT EXISTS idx_usage_user_char ON usage(user_id, char_id);
+CREATE INDEX IF NOT EXISTS idx_usage_user_model ON usage(user_id, model);
+CREATE INDEX IF NOT EXISTS idx_usage_user_task ON usage(user_id, task);
+"""
+
+_queue: "queue.Queue" = queue.Queue()
+_flusher = None
+_flusher_lock = threading.Lock()
+_ready_paths = set()
+_migrated_users = set()
+_stats = {"recorded": 0, "flushed": 0, "batches": 0, "errors": 0}
+
+
+def _user_key(user_id) -> str:
+    return str(user_id) if user_id else ""
+
+
+def _conn(row_factory=None):
+    db_path = USAGE_DB
+    if db_path not in _ready_paths:
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with pooled_conn(db_path) as conn:
+            conn.executescript(_SCHEMA)
+        _ready_paths.add(db_path)
+    return pooled_conn(db_path, row_factory=row_factory)
+
+
+def _insert_rows(rows):
+    with _conn() as conn:
+        conn.executemany(
+            "INSERT INTO usage (user_id, ts, char_id, model, task, input, output, total) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+
+def _drain(max_rows):
+    rows = []
+    while len(rows) < max_rows:
+        try:
+            rows.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return rows
+
+
+def _flush_once() -> int:
+    rows = _drain(USAGE_BATCH_SIZE)
+    if not rows:
+        return 0
+    try:
+        _insert_rows(rows)
+        _stats["flushed"] += len(rows)
+        _stats["batches"] += 1
+    except Exception as e:
+        _stats["errors"] += 1
+        print(f"[Usage] 写入用量失败（{len(rows)} 条）: {e}")
+    finally:
+        for _ in rows:
+            _queue.task_done()
+    return len(rows)
+
+
+def _flusher_loop():
+    while True:
+        time.sleep(USAGE_FLUSH_INTERVAL)
+        while _flush_once() >= USAGE_BATCH_SIZE:
+            pass
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flusher_loop, daemon=True, name="usage-flusher")
+            _flusher.start()
+
+
+def record_usage(user_id, char_id, model, input_tokens, output_tokens, total_tokens, task="chat"):
+    """记一笔用量（异步批量落库）。"""
+    _ensure_flusher()
+    _queue.put((
+        _user_key(user_id), datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        char_id, model, task or "chat",
+        int(input_tokens or 0), int(output_tokens or 0), int(total_tokens or 0),
+    ))
+    _stats["recorded"] += 1
+
+
+def flush_usage(timeout=5.0) -> bool:
+    """立即把队列里的用量写入数据库（查询前 / 测试用）。"""
+    deadline = time.time() + timeout
+    while _queue.unfinished_tasks:
+        if not _flush_once():
+            if time.time() > deadline:
+                return False
+            time.sleep(0.01)
+    return True
+
+
+def _legacy_json_path(user_id) -> str:
+    if user_id:
+        return os.path.join(USERS_ROOT, str(user_id), "logs", "usage_history.json")
+    return os.path.join(BASE_DIR, "logs", "usage_history.json")
+
+
+def _migrate_legacy(user_id):
+    key = _user_key(user_id)
+    if key in _migrated_users:
+        return
+    _migrated_users.add(key)
+    path = _legacy_json_path(user_id)
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            logs = json.load(f) or []
+        now = datetime.now()
+        rows = []
+        for e in logs:
+            # 旧格式只有 "MM-DD HH:MM:SS"：补上年份，晚于今天的算去年
+            try:
+                ts = datetime.strptime(f"{now.year}-{e.get('time', '')}", "%Y-%m-%d %H:%M:%S")
+                if ts > now:
+                    ts = ts.replace(year=now.year - 1)
+            except ValueError:
+                continue
+            rows.append((key, ts.strftime("%Y-%m-%d %H:%M:%S"), e.get("char_id"), e.get("model"), "chat",
+                         int(e.get("input") or 0), int(e.get("output") or 0), int(e.get("total") or 0)))
+        if rows:
+            _insert_rows(rows)
+        os.replace(path, path + ".migrated")
+        print(f"[Usage] 已导入 {len(rows)} 条旧用量记录: {path}")
+    except Exception as e:
+        print(f"[Usage] 导入旧用量记录失败 {path}: {e}")
+
+
+def recent_usage(user_id, limit=50, offset=0) -> list:
+    """最近的调用记录（新→旧），字段与旧 usage_history.json 一致（time 为 "MM-DD HH:MM:SS"），另加 task。"""
+    flush_usage()
+    _migrate_legacy(user_id)
+    with _conn(row_factory=sqlite3.Row) as conn:
+        rows = conn.execute(
+            "SELECT ts, char_id, model, task, input, output, total FROM usage WHERE user_id = ? "
+            "ORDER BY ts DESC, id DESC LIMIT ? OFFSET ?",
+            (_user_key(user_id), int(limit), int(offset)),
+        ).fetchall()
+    return [{
+        "time": r["ts"][5:], "char_id": r["char_id"], "model": r["model"], "task": r["task"],
+        "input": r["input"], "output": r["output"], "total": r["total"],
+    } for r in rows]
+
+
+def usage_rollup(user_id, group_by="day", days=30) -> dict:
+    """按 day / char / model / task 汇总最近 days 天的用量，返回 {"totals": {...}, "rows": [...]}（按 total 降序，day 按日期倒序）。"""
+    if group_by not in ROLLUP_COLUMNS:
+        raise ValueError(f"group_by 只能是 {', '.join(ROLLUP_COLUMNS)}")
+    flush_usage()
+    _migrate_legacy(user_id)
+    since = (datetime.now() - timedelta(days=max(1, int(days)))).strftime("%Y-%m-%d %H:%M:%S")
+    col = ROLLUP_COLUMNS[group_by]
+    order = "key DESC" if group_by == "day" else "total DESC"
+    params = (_user_key(user_id), since)
+    with _conn(row_factory=sqlite3.Row) as conn:
+        rows = conn.execute(
+            f"SELECT {col} AS key, COUNT(*) AS calls, SUM(input) AS input, SUM(output) AS output, SUM(total) AS total "
+            f"FROM usage WHERE user_id = ? AND ts >= ? GROUP BY key ORDER BY {order}",
+            params,
+        ).fetchall()
+        totals = conn.execute(
+            "SELECT COUNT(*) AS calls, COALESCE(SUM(input), 0) AS input, COALESCE(SUM(output), 0) AS output, "
+            "COALESCE(SUM(total), 0) AS total FROM usage WHERE user_id = ? AND ts >= ?",
+            params,
+        ).fetchone()
+    return {"group_by": group_by, "days": int(days), "totals": dict(totals), "rows": [dict(r) for r in rows]}
+
+
+def get_usage_stats() -> dict:
+    return {"queued": _queue.qsize(), **_stats}
@@ -0,0 +1,50 @@
+"""测试 services/api_log.py：追加写入、prompt 去重与按大小轮转。"""
+
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _read_lines(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class TestApiLog:
+    def test_appends_and_dedups_prompts(self, monkeypatch, tmp_path):
+        from services import api_log
+        monkeypatch.setattr(api_log, "USERS_ROOT", str(tmp_path))
+        system_prompt = "你是凛。" * 300
+        for i in range(3):
+            api_log.submit(7, {"type": "call", "service": "test", "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"第{i}句"},
+            ], "reply": "好"})
+        assert api_log.flush_api_logs()
+
+        log_dir = tmp_path / "7" / "logs"
+        records = _read_lines(log_dir / "api.log")
+        assert len(records) == 3
+        sys_msg = records[0]["messages"][0]
+        assert "content" not in sys_msg and sys_msg["chars"] == len(system_prompt)
+        assert records[2]["messages"][1] == {"role": "user", "content": "第2句"}
+        assert {r["messages"][0]["sha1"] for r in records} == {sys_msg["sha1"]}
+        assert os.listdir(log_dir / "prompt_blobs") == [sys_msg["sha1"] + ".txt"]
+        assert api_log.load_blob(7, sys_msg["sha1"]) == system_prompt
+
+    def test_rotates_by_size(self, monkeypatch, tmp_path):
+        from services import api_log
+        monkeypatch.setattr(api_log, "USERS_ROOT", str(tmp_path))
+        monkeypatch.setattr(api_log, "API_LOG_MAX_BYTES", 400)
+        monkeypatch.setattr(api_log, "API_LOG_BACKUPS", 2)
+        for i in range(20):
+            api_log.submit(8, {"type": "error", "service": "test", "response": "x" * 100, "n": i})
+        assert api_log.flush_api_logs()
+
+        log_dir = tmp_path / "8" / "logs"
+        names = sorted(os.listdir(log_dir))
+        assert names == ["api.log", "api.log.1", "api.log.2"]
+        assert _read_lines(log_dir / "api.log.1")[-1]["n"] < 20
+        assert all(os.path.getsize(log_dir / n) < 600 for n in names)
@@ -0,0 +1,29 @@
+"""测试 benchmarks/ 的基础部件：百分位统计与 LLM 桩的替换 / 还原。"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestBenchmarkHelpers:
+    def test_percentile_and_summary(self):
+        from benchmarks.stages import percentile, summarize
+        xs = list(range(1, 101))
+        assert percentile(xs, 50) == 50.5
+        assert percentile(xs, 99) == 99.01
+        assert percentile([], 95) == 0.0
+        s = summarize([10.0, 30.0, 20.0])
+        assert s["count"] == 3 and s["p50"] == 20.0 and s["max"] == 30.0
+
+    def test_fake_llm_patches_every_reference(self):
+        from services import ai_client
+        import services
+        from benchmarks.fake_llm import FakeLLM
+        original = ai_client.call_openrouter
+        fake = FakeLLM(latency_ms=0, jitter_ms=0, reply="桩回复")
+        with fake:
+            assert ai_client.call_openrouter is fake and services.call_openrouter is fake
+            assert ai_client.call_gemini([{"role": "user", "content": "hi"}]) == "桩回复"
+        assert ai_client.call_openrouter is original and services.call_openrouter is original
+        assert fake.calls == 1
@@ -0,0 +1,92 @@
+"""测试 services/chat_history.py：聊天记录 v2 的 keyset 分页、列式返回与 ETag。"""
+
+import os
+import sys
+import sqlite3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _make_db(path, n):
+    conn = sqlite3.connect(path)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.executemany("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)",
+                     [("user" if i % 2 else "assistant", f"msg {i}", f"2026-10-01 10:{i:02d}:00") for i in range(1, n + 1)])
+    conn.commit()
+    conn.close()
+
+
+def _age_files(db_path, seconds=10):
+    for p in (db_path, db_path + "-wal"):
+        if os.path.exists(p):
+            st = os.stat(p)
+            os.utime(p, (st.st_atime - seconds, st.st_mtime - seconds))
+
+
+class TestHistoryV2:
+    def test_keyset_pages_and_columns(self, tmp_path):
+        from services.chat_history import build_history_v2
+        db = str(tmp_path / "chat.db")
+        _make_db(db, 25)
+
+        status, body, _ = build_history_v2(db, {"limit": "10"})
+        assert status == 200
+        assert body["columns"]["id"] == list(range(16, 26))
+        assert body["has_more"] and "total" not in body
+        assert body["cursor"] == {"before": 16, "after": 25}
+
+        _, older, _ = build_history_v2(db, {"before": "16", "limit": "10", "total": "1"})
+        assert older["columns"]["id"] == list(range(6, 16)) and older["has_more"] and older["total"] == 25
+        _, oldest, _ = build_history_v2(db, {"before": "6", "limit": "10"})
+        assert oldest["columns"]["id"] == [1, 2, 3, 4, 5] and not oldest["has_more"]
+
+        _, newer, _ = build_history_v2(db, {"after": "20"})
+        assert newer["columns"]["content"] == ["msg 21", "msg 22", "msg 23", "msg 24", "msg 25"]
+        assert not newer["has_more"]
+
+    def test_etag_returns_304_until_db_changes(self, tmp_path):
+        from services.chat_history import build_history_v2
+        db = str(tmp_path / "chat.db")
+        _make_db(db, 3)
+        build_history_v2(db, {})  # 首次打开连接会切换到 WAL 并生成 -wal 文件
+        _age_files(db)
+
+        status, body, etag = build_history_v2(db, {"after": "3"})
+        assert status == 200 and body["count"] == 0 and etag
+        status, body, _ = build_history_v2(db, {"after": "3"}, if_none_match=etag)
+        assert status == 304 and body is None
+
+        conn = sqlite3.connect(db)
+        conn.execute("INSERT INTO messages (role, content) VALUES ('assistant', 'new')")
+        conn.commit()
+        conn.close()
+        # 刚写入：库文件仍在 HISTORY_ETAG_SETTLE 窗口内，不能 304
+        status, body, fresh_etag = build_history_v2(db, {"after": "3"}, if_none_match=etag)
+        assert status == 200 and body["columns"]["content"] == ["new"]
+        assert fresh_etag is None
+
+    def test_long_poll_returns_new_rows(self, tmp_path):
+        import threading
+        from services.chat_history import build_history_v2
+        db = str(tmp_path / "chat.db")
+        _make_db(db, 2)
+        _age_files(db)
+
+        def writer():
+            conn = sqlite3.connect(db)
+            conn.execute("INSERT INTO messages (role, content) VALUES ('assistant', 'pushed')")
+            conn.commit()
+            conn.close()
+
+        timer = threading.Timer(0.3, writer)
+        timer.start()
+        status, body, _ = build_history_v2(db, {"after": "2", "wait": "5"})
+        timer.join()
+        assert status == 200 and body["columns"]["content"] == ["pushed"]
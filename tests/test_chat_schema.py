@@ -0,0 +1,74 @@
+"""测试 core/chat_schema.py：chat.db 版本化迁移。"""
+
+import os
+import sys
+import sqlite3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _make_db(path, with_table=True):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    if with_table:
+        conn.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, role TEXT NOT NULL, "
+                     "content TEXT NOT NULL, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)")
+        conn.execute("INSERT INTO messages (role, content, timestamp) VALUES ('user', 'hi', '2026-01-01 10:00:00')")
+    conn.commit()
+    conn.close()
+
+
+def _indexes(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    finally:
+        conn.close()
+
+
+class TestChatSchema:
+    def test_pool_open_migrates_and_uses_index(self, tmp_path):
+        from core.chat_schema import LATEST_VERSION, get_schema_version
+        from core.db import get_db, close_db
+        path = str(tmp_path / "c1" / "chat.db")
+        _make_db(path)
+        conn = get_db(path)
+        try:
+            assert get_schema_version(conn) == LATEST_VERSION
+            plan = " ".join(r[-1] for r in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT id FROM messages WHERE timestamp >= ? AND timestamp <= ?",
+                ("2026-01-01 00:00:00", "2026-01-01 23:59:59")))
+            assert "idx_messages_timestamp" in plan
+            assert conn.execute("SELECT content FROM messages").fetchone()[0] == "hi"
+        finally:
+            close_db(path)
+
+    def test_migrate_all_and_skip_empty(self, tmp_path):
+        from core.chat_schema import LATEST_VERSION, iter_chat_dbs, migrate_all, migrate_conn
+        users = tmp_path / "users"
+        char_db = str(users / "1" / "characters" / "c1" / "chat.db")
+        group_db = str(users / "1" / "groups" / "g1" / "chat.db")
+        empty_db = str(users / "2" / "characters" / "c2" / "chat.db")
+        _make_db(char_db)
+        _make_db(group_db)
+        _make_db(empty_db, with_table=False)
+
+        paths = list(iter_chat_dbs(users_root=str(users), base_dir=str(tmp_path)))
+        assert sorted(paths) == sorted([char_db, group_db, empty_db])
+
+        dry = migrate_all(paths, dry_run=True)
+        assert (dry["migrated"], dry["skipped"]) == (2, 1)
+        assert "idx_messages_timestamp" not in _indexes(char_db)
+
+        result = migrate_all(paths)
+        assert (result["migrated"], result["skipped"], result["failed"]) == (2, 1, [])
+        assert {"idx_messages_timestamp", "idx_messages_role_ts"} <= _indexes(group_db)
+        assert migrate_all(paths)["up_to_date"] == 2
+
+        # messages 表建好之后再打开即可迁移
+        _make_db(empty_db)
+        conn = sqlite3.connect(empty_db)
+        try:
+            assert migrate_conn(conn)[-1] == LATEST_VERSION
+        finally:
+            conn.close()
@@ -0,0 +1,57 @@
+"""测试 blueprints/chat.py 中流式聊天的气泡切分。"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestStreamBubbles:
+    def test_split_across_chunks(self):
+        from blueprints.chat import _iter_stream_bubbles
+        chunks = ["你好", "呀/今天", "天气不错/", "出去走走"]
+        assert list(_iter_stream_bubbles(chunks)) == ["你好呀", "今天天气不错", "出去走走"]
+
+    def test_slash_inside_brackets_kept(self):
+        from blueprints.chat import _iter_stream_bubbles
+        chunks = ["看这个[GOTO:https://", "example.com/a]/好的"]
+        assert list(_iter_stream_bubbles(chunks)) == ["看这个[GOTO:https://example.com/a]", "好的"]
+
+    def test_fullwidth_brackets(self):
+        from blueprints.chat import _iter_stream_bubbles
+        assert list(_iter_stream_bubbles(["【SEARCH_IMG: a/b】/嗯"])) == ["【SEARCH_IMG: a/b】", "嗯"]
+
+    def test_empty_stream(self):
+        from blueprints.chat import _iter_stream_bubbles
+        assert list(_iter_stream_bubbles([])) == []
+
+
+class TestStreamUsage:
+    def test_relay_final_chunk_usage(self, monkeypatch):
+        import blueprints.forum as forum
+        sent = {}
+
+        class _Resp:
+            def raise_for_status(self):
+                pass
+
+            def iter_lines(self):
+                yield b'data: {"choices": [{"delta": {"content": "\xe4\xbd\xa0\xe5\xa5\xbd"}}]}'
+                yield b'data: {"choices": [], "usage": {"prompt_tokens": 12, "completion_tokens": 3, "total_tokens": 15}}'
+                yield b'data: [DONE]'
+
+        def fake_post(url, **kwargs):
+            sent.update(kwargs["json"])
+            return _Resp()
+
+        monkeypatch.setattr(forum, "http_post", fake_post)
+        usage = {}
+        assert list(forum.stream_openrouter_chunks([{"role": "user", "content": "hi"}], "m", usage=usage)) == ["你好"]
+        assert sent["stream_options"] == {"include_usage": True}
+        assert usage == {"input_tokens": 12, "output_tokens": 3, "total_tokens": 15}
+
+    def test_estimate_tokens(self):
+        from blueprints.chat import _estimate_tokens
+        assert _estimate_tokens("") == 0
+        assert _estimate_tokens("你好呀") == 3
+        assert _estimate_tokens("hello world!") == 3
@@ -99,10 +99,6 @@ class TestConfigConstants:
         assert isinstance(MAX_CONTEXT_LINES, int)
         assert MAX_CONTEXT_LINES > 0
 
-    def test_cached_official_packs(self):
-        from core.config import CACHED_OFFICIAL_PACKS
-        assert CACHED_OFFICIAL_PACKS is None
-
     def test_env_keys_present(self):
         from core.config import (
             GEMINI_KEY, OPENROUTER_KEY, OPENROUTER_BASE_URL,
@@ -0,0 +1,56 @@
+"""测试 core/utils.py 中的 JSON 配置文件读缓存。"""
+
+import os
+import sys
+import json
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestJsonCache:
+    def test_cached_until_file_changes(self):
+        from core.utils import load_json_cached, get_json_cache_stats
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "characters.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"c1": {"name": "凛"}}, f, ensure_ascii=False)
+            first = load_json_cached(path)
+            hits = get_json_cache_stats()["hits"]
+            assert load_json_cached(path) is first
+            assert get_json_cache_stats()["hits"] == hits + 1
+
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"c1": {"name": "洁"}, "c2": {}}, f, ensure_ascii=False)
+            assert load_json_cached(path)["c1"]["name"] == "洁"
+
+    def test_missing_and_broken_files(self):
+        from core.utils import load_json_cached
+        with tempfile.TemporaryDirectory() as d:
+            assert load_json_cached(os.path.join(d, "nope.json"), {}) == {}
+            path = os.path.join(d, "broken.json")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("{not json")
+            assert load_json_cached(path, "default") == "default"
+
+    def test_safe_save_json_writes_through(self):
+        from core.utils import load_json_cached, safe_save_json
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "user_settings.json")
+            data = {"ai_language": "ja"}
+            safe_save_json(path, data)
+            data["ai_language"] = "en"  # 保存后继续修改不应污染缓存
+            cached = load_json_cached(path)
+            assert cached == {"ai_language": "ja"}
+            with open(path, "r", encoding="utf-8") as f:
+                assert json.load(f) == {"ai_language": "ja"}
+
+    def test_copy_dict_protects_cache(self):
+        from core.utils import load_json_cached, _copy_dict
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "groups.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"g1": {}}, f)
+            copy = _copy_dict(load_json_cached(path, {}))
+            copy["g2"] = {}
+            assert "g2" not in load_json_cached(path)
@@ -0,0 +1,82 @@
+"""测试 services/conversation_summary.py：联系人列表用的会话摘要表。"""
+
+import os
+import sys
+import json
+import sqlite3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _make_chat_db(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, role TEXT NOT NULL, "
+                 "content TEXT NOT NULL, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)")
+    conn.executemany("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def _insert(path, role, content, ts):
+    from core.db import pooled_conn
+    with pooled_conn(path) as conn:
+        conn.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", (role, content, ts))
+
+
+class TestConversationSummary:
+    def _use_tmp_root(self, monkeypatch, tmp_path):
+        from services import conversation_summary
+        monkeypatch.setattr(conversation_summary, "USERS_ROOT", str(tmp_path))
+        return conversation_summary
+
+    def test_legacy_read_status_and_touch(self, monkeypatch, tmp_path):
+        cs = self._use_tmp_root(monkeypatch, tmp_path)
+        db = cs.chat_db_path(cs.KIND_SINGLE, "c1", user_id=1)
+        _make_chat_db(db, [
+            ("user", "在吗", "2026-01-01 10:00:00"),
+            ("assistant", "在", "2026-01-01 10:01:00"),
+            ("assistant", "怎么了", "2026-01-01 10:02:00"),
+        ])
+        cfg = tmp_path / "1" / "configs"
+        cfg.mkdir(parents=True)
+        (cfg / "read_status.json").write_text(json.dumps({"c1": "2026-01-01 10:01:00"}), encoding="utf-8")
+
+        row = cs.get_conversation_summaries([(cs.KIND_SINGLE, "c1")], user_id=1)[(cs.KIND_SINGLE, "c1")]
+        assert row["last_content"] == "怎么了"
+        assert row["unread"] == 1
+
+        _insert(db, "assistant", "还在吗", "2026-01-01 10:03:00")
+        cs.touch_conversation(cs.KIND_SINGLE, "c1", user_id=1)
+        row = cs.get_conversation_summaries([(cs.KIND_SINGLE, "c1")], user_id=1)[(cs.KIND_SINGLE, "c1")]
+        assert (row["last_content"], row["unread"]) == ("还在吗", 2)
+
+        cs.mark_conversation_read(cs.KIND_SINGLE, "c1", user_id=1)
+        row = cs.get_conversation_summaries([(cs.KIND_SINGLE, "c1")], user_id=1)[(cs.KIND_SINGLE, "c1")]
+        assert row["unread"] == 0
+        # 已读位置记在摘要表里，之后不再参考 read_status.json
+        (cfg / "read_status.json").write_text(json.dumps({"c1": "2000-01-01 00:00:00"}), encoding="utf-8")
+        _insert(db, "user", "好的", "2026-01-01 10:04:00")
+        cs.touch_conversation(cs.KIND_SINGLE, "c1", user_id=1)
+        row = cs.get_conversation_summaries([(cs.KIND_SINGLE, "c1")], user_id=1)[(cs.KIND_SINGLE, "c1")]
+        assert (row["last_content"], row["unread"]) == ("好的", 0)
+
+    def test_unhooked_write_is_detected(self, monkeypatch, tmp_path):
+        cs = self._use_tmp_root(monkeypatch, tmp_path)
+        db = cs.chat_db_path(cs.KIND_GROUP, "g1", user_id=2)
+        _make_chat_db(db, [("user", "大家好", "2026-01-01 09:00:00")])
+        targets = [(cs.KIND_GROUP, "g1"), (cs.KIND_SINGLE, "missing")]
+
+        first = cs.get_conversation_summaries(targets, user_id=2)
+        assert first[(cs.KIND_GROUP, "g1")]["unread"] == 0
+        assert first[(cs.KIND_SINGLE, "missing")]["last_content"] == ""
+
+        # 后台任务直接写库、没有调用 touch_conversation
+        conn = sqlite3.connect(db)
+        conn.execute("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)",
+                     ("c2", "早上好", "2026-01-01 09:05:00"))
+        conn.commit()
+        conn.close()
+
+        row = cs.get_conversation_summaries(targets, user_id=2)[(cs.KIND_GROUP, "g1")]
+        assert (row["last_content"], row["last_role"], row["unread"]) == ("早上好", "c2", 1)
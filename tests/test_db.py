@@ -0,0 +1,153 @@
+"""测试 core/db.py 中的 SQLite 连接池。"""
+
+import os
+import sys
+import sqlite3
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _make_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, role TEXT NOT NULL, content TEXT NOT NULL, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)")
+    conn.commit()
+    conn.close()
+
+
+class TestConnectionPool:
+    def test_reuse_after_return(self):
+        from core.db import get_db, put_db, close_db
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "chat.db")
+            _make_db(path)
+            c1 = get_db(path)
+            # 借出期间再借是另一个连接
+            c2 = get_db(path)
+            assert c1 is not c2
+            put_db(path, c1)
+            assert get_db(path) is c1
+            close_db(path)
+
+    def test_wal_enabled(self):
+        from core.db import pooled_conn, close_db
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "chat.db")
+            _make_db(path)
+            with pooled_conn(path) as conn:
+                assert conn.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal"
+                assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+            close_db(path)
+
+    def test_reused_across_threads(self):
+        from core.db import pooled_conn, close_db
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "chat.db")
+            _make_db(path)
+            with pooled_conn(path) as main_conn:
+                pass
+            other = []
+
+            def work():
+                with pooled_conn(path) as conn:
+                    other.append(conn)
+
+            t = threading.Thread(target=work)
+            t.start()
+            t.join()
+            assert other[0] is main_conn
+            close_db(path)
+
+    def test_pooled_conn_commits_and_resets_row_factory(self):
+        from core.db import pooled_conn, close_db
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "chat.db")
+            _make_db(path)
+            with pooled_conn(path, row_factory=sqlite3.Row) as conn:
+                conn.execute("INSERT INTO messages (role, content) VALUES ('user', 'hi')")
+                row = conn.execute("SELECT role FROM messages").fetchone()
+                assert row["role"] == "user"
+            assert conn.row_factory is None
+            check = sqlite3.connect(path)
+            assert check.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 1
+            check.close()
+            close_db(path)
+
+    def test_nested_commits_only_at_outermost(self):
+        from core.db import pooled_conn, close_db
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "chat.db")
+            _make_db(path)
+            check = sqlite3.connect(path)
+            try:
+                with pooled_conn(path, row_factory=sqlite3.Row) as outer:
+                    outer.execute("INSERT INTO messages (role, content) VALUES ('user', 'a')")
+                    with pooled_conn(path) as inner:
+                        assert inner is outer
+                        assert inner.row_factory is None
+                    # 内层退出不提交外层的写入，也不清掉外层的 row_factory
+                    assert outer.row_factory is sqlite3.Row
+                    assert check.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 0
+                assert check.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 1
+
+                try:
+                    with pooled_conn(path) as outer:
+                        outer.execute("INSERT INTO messages (role, content) VALUES ('user', 'b')")
+                        with pooled_conn(path):
+                            raise RuntimeError("boom")
+                except RuntimeError:
+                    pass
+                assert check.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 1
+            finally:
+                check.close()
+                close_db(path)
+
+    def test_lru_bound(self, monkeypatch):
+        import core.db as db
+        monkeypatch.setattr(db, "SQLITE_POOL_SIZE", 2)
+        with tempfile.TemporaryDirectory() as d:
+            paths = [os.path.join(d, f"{i}.db") for i in range(3)]
+            for p in paths:
+                _make_db(p)
+                with db.pooled_conn(p):
+                    pass
+            assert os.path.abspath(paths[0]) not in db._idle
+            assert os.path.abspath(paths[2]) in db._idle
+            assert db.get_pool_stats()["idle"] <= 2
+            db.close_dir(d)
+
+    def test_close_dir_drops_connections(self):
+        from core.db import pooled_conn, close_dir
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "chat.db")
+            _make_db(path)
+            with pooled_conn(path) as c1:
+                pass
+            close_dir(d)
+            with pooled_conn(path) as c2:
+                pass
+            assert c1 is not c2
+            close_dir(d)
+
+    def test_connections_bounded_across_threads(self):
+        from core.db import pooled_conn, get_pool_stats, close_db
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "chat.db")
+            _make_db(path)
+            before = get_pool_stats()
+
+            def work():
+                with pooled_conn(path) as conn:
+                    conn.execute("INSERT INTO messages (role, content) VALUES ('user', 'hi')")
+
+            # 模拟每个请求一个线程：连接在请求之间复用，不随线程数增长
+            for _ in range(50):
+                t = threading.Thread(target=work)
+                t.start()
+                t.join()
+            stats = get_pool_stats()
+            assert stats["open"] - before["open"] <= 1
+            assert stats["opened"] - before["opened"] <= 1
+            assert stats["reused"] - before["reused"] >= 49
+            close_db(path)
@@ -0,0 +1,53 @@
+"""测试 services/event_bus.py：按用户发布 / 订阅、断线补发与溢出后的 resync。"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestEventBus:
+    def test_publish_reaches_only_same_user(self):
+        from services import event_bus
+        a = event_bus.subscribe("bus_user_a")
+        b = event_bus.subscribe("bus_user_b")
+        try:
+            event_bus.notify_message("single", "char_1", user_id="bus_user_a", role="assistant")
+            event = a.get(timeout=1)
+            assert event["type"] == "message" and event["target"] == "char_1" and event["kind"] == "single"
+            assert b.get(timeout=0.05) is None
+            assert "event: message" in event_bus.format_sse(event)
+        finally:
+            event_bus.unsubscribe(a)
+            event_bus.unsubscribe(b)
+
+    def test_replay_after_last_event_id(self):
+        from services import event_bus
+        first = event_bus.publish("bus_user_replay", "moment", action="post")
+        event_bus.publish("bus_user_replay", "moment", action="update")
+        event_bus.publish("bus_user_replay", "memory", kind="single")
+        sub = event_bus.subscribe("bus_user_replay", last_event_id=first["id"])
+        try:
+            got = [sub.get(timeout=0.5), sub.get(timeout=0.5)]
+            assert [e["type"] for e in got] == ["moment", "memory"]
+            assert sub.get(timeout=0.05) is None
+        finally:
+            event_bus.unsubscribe(sub)
+
+    def test_overflow_and_unknown_id_trigger_resync(self):
+        from services import event_bus
+        sub = event_bus.subscribe("bus_user_overflow")
+        try:
+            for i in range(event_bus.EVENT_BUS_QUEUE_SIZE + 5):
+                event_bus.publish("bus_user_overflow", "message", kind="single", target=str(i))
+            assert sub.get(timeout=0.5)["type"] == "resync"
+            assert sub.get(timeout=0.05) is None
+        finally:
+            event_bus.unsubscribe(sub)
+
+        # 进程重启后客户端带着更大的 Last-Event-ID 重连：无法补发，直接 resync
+        stale = event_bus.subscribe("bus_user_overflow", last_event_id=10 ** 9)
+        try:
+            assert stale.get(timeout=0.5)["type"] == "resync"
+        finally:
+            event_bus.unsubscribe(stale)
@@ -0,0 +1,89 @@
+"""测试群聊多人回复流水线：提前并发准备、按顺序消费，以及 v2 prompt 的延后分段。"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestIterPipelined:
+    def test_prepare_overlaps_and_order_kept(self, monkeypatch):
+        import blueprints.group as g
+        monkeypatch.setattr(g, "GROUP_PIPELINE", True)
+
+        def prepare(sid):
+            time.sleep(0.2)
+            return f"prompt-{sid}"
+
+        t0 = time.perf_counter()
+        seen = []
+        for sid, prepared in g._iter_pipelined(["a", "b", "c", "d"], prepare):
+            time.sleep(0.1)  # 模拟当前发言者的模型调用
+            seen.append((sid, prepared))
+        elapsed = time.perf_counter() - t0
+        assert seen == [("a", "prompt-a"), ("b", "prompt-b"), ("c", "prompt-c"), ("d", "prompt-d")]
+        # 串行需要 4 * (0.2 + 0.1) = 1.2s
+        assert elapsed < 0.9
+
+    def test_failure_and_disabled_fall_back(self, monkeypatch):
+        import blueprints.group as g
+        from core.context import get_current_user_id, set_background_user
+        monkeypatch.setattr(g, "GROUP_PIPELINE", True)
+
+        def prepare(sid):
+            if sid == "bad":
+                raise RuntimeError("boom")
+            return get_current_user_id()
+
+        set_background_user(7)
+        try:
+            assert list(g._iter_pipelined(["ok", "bad"], prepare)) == [("ok", 7), ("bad", None)]
+        finally:
+            set_background_user(None)
+
+        monkeypatch.setattr(g, "GROUP_PIPELINE", False)
+        assert list(g._iter_pipelined(["ok"], prepare)) == [("ok", None)]
+
+    def test_first_inline_and_ahead_capped(self, monkeypatch):
+        import threading
+        import blueprints.group as g
+        monkeypatch.setattr(g, "GROUP_PIPELINE", True)
+        monkeypatch.setattr(g, "GROUP_PIPELINE_AHEAD", 1)
+        caller = threading.current_thread().name
+        started = []
+
+        def prepare(sid):
+            started.append(sid)
+            return threading.current_thread().name
+
+        seen = []
+        for sid, prepared in g._iter_pipelined(["a", "b", "c", "d"], prepare):
+            time.sleep(0.05)
+            # 消费第 n 项时最多只提前提交了第 n+1 项
+            assert len(started) <= len(seen) + 2
+            seen.append((sid, prepared))
+        assert seen[0] == ("a", caller)
+        assert all(name.startswith("group-pipeline") for _, name in seen[1:])
+
+
+class TestDeferredSections:
+    def test_finish_builds_live_sections_late(self, monkeypatch):
+        import services.prompt_builder as pb
+        calls = []
+
+        def recent(ctx):
+            calls.append("recent")
+            return [("message", "最新一条", ctx["now"])]
+
+        results = {name: [] for name in ("persona", "user_persona", "relationship", "schedule", "rules",
+                                         "location", "weather", "tail")}
+        results["persona"] = ["我是国神"]
+        prepared = {"ctx": {"user_id": None, "now": None}, "results": results,
+                    "deferred": [("recent_messages", recent), ("clock", lambda ctx: ["现在时间"])]}
+        assert calls == []
+        prompt = pb.finish_system_prompt_v2(prepared)
+        assert calls == ["recent"]
+        assert prompt.startswith("我是国神")
+        assert "最新一条" in prompt and prompt.index("最新一条") < prompt.index("现在时间")
+        assert prepared["ctx"]["now"] is not None
@@ -0,0 +1,67 @@
+"""测试 core/http_client.py 中的出站连接池。"""
+
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _OkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self):
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        self._reply()
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _OkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class TestHttpClient:
+    def test_session_shared_per_host(self):
+        from core.http_client import get_session
+        a = get_session("https://example.com/a")
+        b = get_session("https://EXAMPLE.com/b?x=1")
+        c = get_session("https://example.org/")
+        assert a is b
+        assert a is not c
+
+    def test_connection_reuse_counted(self):
+        from core.http_client import http_get, http_post, get_http_stats, reset_http_stats
+        server = _start_server()
+        try:
+            url = f"http://127.0.0.1:{server.server_port}/"
+            reset_http_stats()
+            for _ in range(3):
+                assert http_get(url, route="weather").text == "ok"
+            assert http_post(url, route="llm", json={"a": 1}).status_code == 200
+            st = get_http_stats()["127.0.0.1"]
+            assert st["requests"] == 4
+            assert st["handshakes"] == 1
+            assert st["reuse_rate"] == 0.75
+        finally:
+            server.shutdown()
+
+    def test_route_timeouts_configured(self):
+        from core.config import HTTP_ROUTE_TIMEOUTS
+        assert HTTP_ROUTE_TIMEOUTS["llm"] == 300
+        assert "default" in HTTP_ROUTE_TIMEOUTS
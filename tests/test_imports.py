@@ -13,7 +13,7 @@ def test_import_core_config():
         BASE_DIR, USERS_DB, SQUARE_DB, USERS_ROOT, CHARACTERS_DIR,
         GEMINI_KEY, USE_OPENROUTER, OPENROUTER_KEY,
         get_global_system_rules, get_mode_context,
-        COS_BASE_URL, CACHED_OFFICIAL_PACKS,
+        COS_BASE_URL,
     )
     assert BASE_DIR is not None
     assert USERS_DB is not None
@@ -0,0 +1,111 @@
+"""测试 services/llm_scheduler.py：按服务商排队、优先级通道、令牌桶与 429 冷却。"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _wait_until(cond, timeout=2.0):
+    t0 = time.monotonic()
+    while not cond():
+        assert time.monotonic() - t0 < timeout
+        time.sleep(0.01)
+
+
+class TestLLMScheduler:
+    def test_interactive_dequeued_before_bulk(self):
+        from services.llm_scheduler import LLMScheduler, LANE_INTERACTIVE, LANE_BULK
+        s = LLMScheduler(max_concurrency=1, reserved=0)
+        s.acquire("relay", lane=LANE_INTERACTIVE)
+        order = []
+
+        def worker(lane, user):
+            s.acquire("relay", user_key=user, lane=lane, timeout=5)
+            order.append(lane)
+            s.release("relay")
+
+        bulk = threading.Thread(target=worker, args=(LANE_BULK, "1"))
+        bulk.start()
+        _wait_until(lambda: s.get_stats()["lanes"][LANE_BULK]["queued"] == 1)
+        inter = threading.Thread(target=worker, args=(LANE_INTERACTIVE, "2"))
+        inter.start()
+        _wait_until(lambda: s.get_stats()["lanes"][LANE_INTERACTIVE]["queued"] == 1)
+        s.release("relay")
+        bulk.join(5)
+        inter.join(5)
+        assert order == [LANE_INTERACTIVE, LANE_BULK]
+        stats = s.get_stats()
+        assert stats["lanes"][LANE_BULK]["acquired"] == 1
+        assert stats["lanes"][LANE_BULK]["max_wait_ms"] > 0
+        assert stats["providers"]["relay"]["in_flight"] == 0
+
+    def test_user_bucket_wait_does_not_block_lower_lanes(self):
+        from services.llm_scheduler import LLMScheduler, TokenBucket, LANE_INTERACTIVE, LANE_BACKGROUND
+        s = LLMScheduler(max_concurrency=4, reserved=0)
+        s._users["1"] = TokenBucket(rate=0.5, burst=1)
+        s._users["1"].take()
+        done = []
+
+        def worker():
+            s.acquire("relay", user_key="1", lane=LANE_INTERACTIVE, timeout=5)
+            done.append(LANE_INTERACTIVE)
+
+        inter = threading.Thread(target=worker)
+        inter.start()
+        _wait_until(lambda: s.get_stats()["lanes"][LANE_INTERACTIVE]["queued"] == 1)
+        # 前台请求只是在等自己的用户令牌桶，后台请求照常出队
+        assert s.acquire("relay", user_key="2", lane=LANE_BACKGROUND, timeout=0.5) < 0.5
+        assert s.get_stats()["providers"]["relay"]["blocked"][LANE_INTERACTIVE] == 0
+        inter.join(5)
+        assert done == [LANE_INTERACTIVE]
+
+    def test_reserved_slots_and_throttle_cooldown(self):
+        from services.llm_scheduler import LLMScheduler, LLMQueueTimeout, LANE_INTERACTIVE, LANE_BACKGROUND
+        s = LLMScheduler(max_concurrency=2, reserved=1)
+        s.acquire("relay", lane=LANE_BACKGROUND)
+        with pytest.raises(LLMQueueTimeout):
+            s.acquire("relay", lane=LANE_BACKGROUND, timeout=0.05)
+        # 前台仍能用保留名额；其他服务商不受影响
+        s.acquire("relay", lane=LANE_INTERACTIVE, timeout=0.05)
+        s.acquire("gemini", lane=LANE_BACKGROUND, timeout=0.05)
+        assert s.get_stats()["lanes"][LANE_BACKGROUND]["timeouts"] == 1
+
+        s.report_throttled("gemini", cooldown=5)
+        s.release("gemini")
+        with pytest.raises(LLMQueueTimeout):
+            s.acquire("gemini", lane=LANE_BACKGROUND, timeout=0.05)
+        s.acquire("gemini", lane=LANE_INTERACTIVE, timeout=1)
+        assert s.get_stats()["providers"]["gemini"]["throttled"] == 1
+
+    def test_token_bucket(self):
+        from services.llm_scheduler import TokenBucket
+        b = TokenBucket(rate=10, burst=2)
+        now = time.monotonic()
+        assert b.wait_time(now) == 0
+        b.take(now)
+        b.take(now)
+        assert 0.09 < b.wait_time(now) <= 0.1
+        assert b.wait_time(now + 0.1) == 0
+        assert TokenBucket(rate=0, burst=1).wait_time() == 0
+
+    def test_lane_detection(self):
+        from flask import Flask
+        from core.context import set_usage_task
+        from services.llm_scheduler import current_lane, llm_lane, provider_key, LANE_INTERACTIVE, LANE_BACKGROUND, LANE_BULK
+        assert provider_key("https://API.example.com/v1") == "api.example.com"
+        set_usage_task("chat")
+        assert current_lane() == LANE_BACKGROUND
+        set_usage_task("summary")
+        try:
+            assert current_lane() == LANE_BULK
+            with Flask(__name__).test_request_context("/"):
+                assert current_lane() == LANE_INTERACTIVE
+                with llm_lane(LANE_BULK):
+                    assert current_lane() == LANE_BULK
+        finally:
+            set_usage_task("chat")
@@ -0,0 +1,68 @@
+"""测试 services/memory_index.py 中的长期记忆倒排索引。"""
+
+import os
+import sys
+import json
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LONG_MEM = {
+    "2025-03-Week1": "- 和用户一起去了图书馆\n- 在咖啡店聊到了足球比赛",
+    "2025-04-Week2": "一起看了樱花。晚上在居酒屋吃了烤鸡串！",
+    "2025-05-Week1": "- 東京の図書館で勉強した\n- a",
+}
+
+
+class TestLongMemoryIndex:
+    def test_events_and_months(self):
+        from services.memory_index import LongMemoryIndex
+        idx = LongMemoryIndex.from_memory(LONG_MEM)
+        assert ("2025-03-Week1", "和用户一起去了图书馆") in idx.events
+        assert ("2025-04-Week2", "一起看了樱花") in idx.events
+        assert idx.month_of("2025-04-Week2") == (2025, 4)
+        assert idx.month_of("bad") is None
+
+    def test_match_counts_equal_substring_scan(self):
+        from services.memory_index import LongMemoryIndex
+        idx = LongMemoryIndex.from_memory(LONG_MEM)
+        keywords = ["图书馆", "足球", "一起", "図書館", "不存在的词", "串"]
+        expected = {}
+        for i, (_, ev) in enumerate(idx.events):
+            n = sum(1 for kw in keywords if kw in ev)
+            if n:
+                expected[i] = n
+        assert idx.match_counts(keywords) == expected
+
+    def test_rebuild_persists_and_reuses_unchanged_weeks(self):
+        from services.memory_index import rebuild_long_memory_index, get_long_memory_index, INDEX_FILENAME
+        from services.memory_store import set_weekly_summary
+        from core.db import close_dir
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, "4_memory_long.json"), "w", encoding="utf-8") as f:
+                json.dump(LONG_MEM, f, ensure_ascii=False)
+            idx = rebuild_long_memory_index(d)
+            assert os.path.exists(os.path.join(d, INDEX_FILENAME))
+            assert get_long_memory_index(d) is idx
+
+            # 旧 JSON 已导入 memory.db，之后的写入走 memory_store
+            assert not os.path.exists(os.path.join(d, "4_memory_long.json"))
+            set_weekly_summary(d, "2025-06-Week1", "- 去海边看了烟花")
+            idx2 = get_long_memory_index(d)
+            assert idx2 is not idx
+            assert idx2.events_containing("烟花")
+            close_dir(d)
+
+    def test_select_uses_index(self, monkeypatch):
+        import services.prompt_builder as pb
+        import services.memory_query as mq
+        from services.memory_index import LongMemoryIndex
+        mq.clear_memory_query_cache()
+        monkeypatch.setattr(mq, "LONG_MEMORY_QUERY_MODE", "ai")
+        monkeypatch.setattr(mq, "call_ai_for_long_memory_query", lambda text, **kw: (["足球"], []))
+        result = pb.select_relevant_long_memory(
+            LONG_MEM, ["最近怎么样"], user_latest_input="还记得足球比赛吗",
+            index=LongMemoryIndex.from_memory(LONG_MEM),
+        )
+        blocks = dict(result)
+        assert "在咖啡店聊到了足球比赛" in blocks.get("2025-03-Week1", "")
@@ -0,0 +1,129 @@
+"""测试 services/memory_query.py 中的本地时间参考抽取与 query 分析缓存。"""
+
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+NOW = datetime(2026, 10, 18, 12, 0)
+
+
+class TestLocalTimeRefs:
+    def test_relative_year_and_season(self):
+        from services.memory_query import extract_local_time_refs
+        assert extract_local_time_refs("还记得去年夏天吗", now=NOW) == ["2025-06", "2025-07", "2025-08"]
+        assert extract_local_time_refs("去年の夏休みに行ったね", now=NOW) == ["2025-06", "2025-07", "2025-08"]
+        assert extract_local_time_refs("last summer we went hiking", now=NOW) == ["2026-06", "2026-07", "2026-08"]
+        assert extract_local_time_refs("last winter", now=NOW) == ["2025-12", "2026-01", "2026-02"]
+
+    def test_relative_week_and_month(self):
+        from services.memory_query import extract_local_time_refs
+        assert extract_local_time_refs("先週のこと覚えてる？", now=NOW) == ["2026-10"]
+        assert extract_local_time_refs("上个月我们吵架了", now=NOW) == ["2026-09"]
+        assert extract_local_time_refs("3个月前", now=NOW) == ["2026-07"]
+
+    def test_months(self):
+        from services.memory_query import extract_local_time_refs
+        assert extract_local_time_refs("remember last March?", now=NOW) == ["2026-03"]
+        assert extract_local_time_refs("2024年3月的旅行", now=NOW) == ["2024-03"]
+        assert extract_local_time_refs("三月的时候", now=NOW) == ["03"]
+        assert extract_local_time_refs("you may come", now=NOW) == []
+
+    def test_no_time(self):
+        from services.memory_query import extract_local_time_refs
+        assert extract_local_time_refs("今天吃什么", now=NOW) == []
+        assert extract_local_time_refs("", now=NOW) == []
+
+    def test_trivial(self):
+        from services.memory_query import is_trivial_query
+        assert is_trivial_query("嗯嗯")
+        assert is_trivial_query("OK!")
+        assert is_trivial_query("うん")
+        assert not is_trivial_query("你还记得那家咖啡店吗")
+
+
+class TestAnalyze:
+    def test_local_pass_skips_model(self, monkeypatch):
+        import services.memory_query as mq
+        mq.clear_memory_query_cache()
+        monkeypatch.setattr(mq, "LONG_MEMORY_QUERY_MODE", "auto")
+        calls = []
+        monkeypatch.setattr(mq, "call_ai_for_long_memory_query", lambda text, **kw: calls.append(text) or (["x"], []))
+        kws, refs = mq.analyze_long_memory_query("去年夏天的海边", user_id=1, local_keywords=["海边"])
+        assert kws == ["海边"]
+        assert refs
+        assert calls == []
+        assert mq.analyze_long_memory_query("嗯嗯", user_id=1) == ([], [])
+        assert calls == []
+
+    def test_model_result_cached_by_normalized_text(self, monkeypatch):
+        import services.memory_query as mq
+        mq.clear_memory_query_cache()
+        monkeypatch.setattr(mq, "LONG_MEMORY_QUERY_MODE", "auto")
+        calls = []
+        monkeypatch.setattr(mq, "call_ai_for_long_memory_query", lambda text, **kw: calls.append(text) or (["咖啡店"], []))
+        assert mq.analyze_long_memory_query("那家咖啡店", user_id=1)[0] == ["咖啡店"]
+        assert mq.analyze_long_memory_query("  那家咖啡店 ", user_id=1)[0] == ["咖啡店"]
+        assert len(calls) == 1
+        assert mq.get_memory_query_stats()["hits"] == 1
+
+    def test_model_failure_not_cached(self, monkeypatch):
+        import services.memory_query as mq
+        mq.clear_memory_query_cache()
+        monkeypatch.setattr(mq, "LONG_MEMORY_QUERY_MODE", "ai")
+        monkeypatch.setattr(mq, "call_ai_for_long_memory_query", lambda text, **kw: None)
+        assert mq.analyze_long_memory_query("那家咖啡店", user_id=1, local_keywords=["咖啡店"]) == (["咖啡店"], [])
+        assert mq.get_memory_query_stats()["size"] == 0
+
+    def test_prefetch(self, monkeypatch):
+        import services.memory_query as mq
+        mq.clear_memory_query_cache()
+        monkeypatch.setattr(mq, "LONG_MEMORY_QUERY_MODE", "ai")
+        calls = []
+        monkeypatch.setattr(mq, "call_ai_for_long_memory_query", lambda text, **kw: calls.append(text) or (["猫"], ["2026"]))
+        mq.prefetch_long_memory_query("我家的猫", user_id=2)
+        assert mq.analyze_long_memory_query("我家的猫", user_id=2) == (["猫"], ["2026"])
+        assert len(calls) == 1
+
+    def test_prefetch_in_flight_is_awaited(self, monkeypatch):
+        import threading
+        import services.memory_query as mq
+        mq.clear_memory_query_cache()
+        monkeypatch.setattr(mq, "LONG_MEMORY_QUERY_MODE", "ai")
+        calls = []
+        monkeypatch.setattr(mq, "call_ai_for_long_memory_query", lambda text, **kw: calls.append(text) or (["狗"], []))
+        jobs = []
+
+        class _Deferred:
+            def submit(self, fn, *args):
+                jobs.append((fn, args))
+
+        # 预取已登记但 worker 还没开始：analyze 应等待它而不是自己再调一次模型
+        monkeypatch.setattr(mq, "_get_executor", lambda: _Deferred())
+        mq.prefetch_long_memory_query("我家的狗", user_id=3)
+        out = []
+        t = threading.Thread(target=lambda: out.append(mq.analyze_long_memory_query("我家的狗", user_id=3)))
+        t.start()
+        t.join(0.2)
+        assert t.is_alive() and calls == []
+        fn, args = jobs[0]
+        fn(*args)
+        t.join(2)
+        assert out == [(["狗"], [])]
+        assert len(calls) == 1
+        assert mq.get_memory_query_stats()["pending"] == 0
+
+    def test_stale_run_keeps_newer_pending(self, monkeypatch):
+        from concurrent.futures import Future
+        import services.memory_query as mq
+        mq.clear_memory_query_cache()
+        monkeypatch.setattr(mq, "LONG_MEMORY_QUERY_MODE", "local")
+        key = mq._cache_key("天气", 4, "zh")
+        newer = Future()
+        mq._pending[key] = newer
+        try:
+            mq._run(key, Future(), "天气", None, 4, "zh", ["天气"])
+            assert mq._pending.get(key) is newer
+        finally:
+            mq._pending.pop(key, None)
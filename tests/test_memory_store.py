@@ -0,0 +1,99 @@
+"""测试 services/memory_store.py：分级记忆 SQLite 存储与 JSON 迁移。"""
+
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestMemoryStore:
+    def test_migrates_json_once(self, tmp_path):
+        from services import memory_store as ms
+        from core.db import close_dir
+        d = tmp_path / "prompts"
+        d.mkdir()
+        (d / "6_memory_short.json").write_text(json.dumps({
+            "2026-01-01": [{"time": "10:00", "event": "旧格式"}],
+            "2026-01-02": {"events": [{"time": "09:00", "event": "[群聊:社团] 开会", "mood": "好"},
+                                      {"time": "08:00", "event": "早饭"}], "last_id": 12},
+        }, ensure_ascii=False), encoding="utf-8")
+        (d / "5_memory_medium.json").write_text(json.dumps({"2026-01-01": "日记"}, ensure_ascii=False), encoding="utf-8")
+        (d / "4_memory_long.json").write_text("{}", encoding="utf-8")
+
+        events, last_id = ms.get_short_day(str(d), "2026-01-02")
+        assert [e["event"] for e in events] == ["早饭", "[群聊:社团] 开会"]
+        assert events[1]["mood"] == "好"
+        assert last_id == 12
+        assert ms.get_short_day(str(d), "2026-01-01") == ([{"time": "10:00", "event": "旧格式"}], 0)
+        assert ms.get_daily_summaries(str(d)) == {"2026-01-01": "日记"}
+        assert (d / "6_memory_short.json.migrated").exists()
+        assert not (d / "6_memory_short.json").exists()
+        assert not (d / "4_memory_long.json").exists()
+        assert not (d / "4_memory_long.json.migrated").exists()
+        close_dir(str(d))
+
+    def test_row_level_writes_and_export(self, tmp_path):
+        from services import memory_store as ms
+        from core.db import close_dir
+        d = str(tmp_path / "prompts")
+        assert ms.get_short_day(d, "2026-02-01") == ([], 0)
+        assert not os.path.exists(ms.get_memory_db_path(d))
+
+        ev = [{"time": "12:00", "event": "[群聊:社团] 午饭"}]
+        assert ms.append_short_events(d, "2026-02-01", ev, source=ms.SOURCE_GROUP) == 1
+        assert ms.append_short_events(d, "2026-02-01", ev, source=ms.SOURCE_GROUP) == 0
+        ms.append_short_events(d, "2026-02-01", [{"time": "08:30", "event": "起床"}])
+        assert ms.has_short_events(d, "2026-02-01")
+        assert not ms.has_short_events(d, "2026-02-02")
+
+        events, _ = ms.get_short_day(d, "2026-02-01")
+        ms.replace_short_day(d, "2026-02-01", events + [{"time": "20:00", "event": "晚安"}], last_id=7)
+        ms.append_short_events(d, "2026-02-01", [{"time": "21:00", "event": "朋友圈"}],
+                               source=ms.SOURCE_MOMENT, dedupe=False)
+
+        exported = ms.export_tier(d, ms.TIER_SHORT)
+        assert exported["2026-02-01"]["last_id"] == 7
+        assert [e["time"] for e in exported["2026-02-01"]["events"]] == ["08:30", "12:00", "20:00", "21:00"]
+
+        exported["2026-02-03"] = {"events": [], "last_id": 0}
+        del exported["2026-02-01"]
+        ms.import_tier(d, ms.TIER_SHORT, exported)
+        assert ms.export_tier(d, ms.TIER_SHORT) == {"2026-02-03": {"events": [], "last_id": 0}}
+
+        sig = ms.weekly_signature(d)
+        ms.set_weekly_summary(d, "2026-02-Week1", "- 第一周")
+        ms.set_weekly_summary(d, "2026-01-Week4", "- 上个月")
+        assert ms.weekly_signature(d) != sig
+        assert list(ms.get_weekly_summaries(d)) == ["2026-02-Week1", "2026-01-Week4"]
+
+        ms.set_daily_summary(d, "2026-02-01", "第一天")
+        ms.set_daily_summary(d, "2026-02-02", "第二天")
+        assert ms.get_daily_summaries(d, ["2026-02-02", "2026-03-01"]) == {"2026-02-02": "第二天"}
+        close_dir(d)
+
+    def test_template_copy_keeps_memory(self, tmp_path):
+        import shutil
+        from services import memory_store as ms
+        from core.db import close_dir
+        tpl = tmp_path / "tpl" / "prompts"
+        tpl.mkdir(parents=True)
+        (tpl / "5_memory_medium.json").write_text(json.dumps({"2026-03-01": "模板日记"}, ensure_ascii=False), encoding="utf-8")
+        assert ms.get_daily_summaries(str(tpl)) == {"2026-03-01": "模板日记"}
+        assert (tpl / "5_memory_medium.json.migrated").exists()
+
+        # 模板迁移后再复制：与 get_paths 一样跳过 memory.db*，再用 copy_memory_db 复制
+        new = tmp_path / "user" / "prompts"
+        shutil.copytree(tpl, new, ignore=shutil.ignore_patterns("memory.db*"))
+        assert ms.copy_memory_db(str(tpl), str(new))
+        assert not ms.copy_memory_db(str(tpl), str(new))
+        assert ms.get_daily_summaries(str(new)) == {"2026-03-01": "模板日记"}
+        assert ms.weekly_signature(str(new)) != ms.weekly_signature(str(tpl))
+
+        # 之前只复制到了 *.migrated、没有 memory.db 的目录：首次打开时从备份导入
+        old = tmp_path / "old" / "prompts"
+        shutil.copytree(tpl, old, ignore=shutil.ignore_patterns("memory.db*"))
+        assert ms.get_daily_summaries(str(old)) == {"2026-03-01": "模板日记"}
+        assert (old / "5_memory_medium.json.migrated").exists()
+        for d in (tpl, new, old):
+            close_dir(str(d))
@@ -0,0 +1,96 @@
+"""测试 services/memory_sync.py：后台短期记忆同步的合并与有界陈旧等待。"""
+
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestMemorySync:
+    def test_repeated_requests_are_coalesced(self, monkeypatch):
+        from services import memory_sync as ms
+        monkeypatch.setattr(ms, "MEMORY_SYNC_ASYNC", True)
+        gate = threading.Event()
+        calls = []
+
+        def fake_run(key):
+            calls.append(key)
+            gate.wait(5)
+
+        monkeypatch.setattr(ms, "_run_key", fake_run)
+        keys = [(ms.KIND_GROUP, "g_coalesce", "2026-10-01")]
+        first = ms.request_sync(901, *keys[0])
+        for _ in range(5):
+            ms.request_sync(901, *keys[0])
+        gate.set()
+        ok, err = ms.wait_synced([first], max_staleness=0, timeout=5)
+        assert ok and err is None
+        ok, _ = ms.sync_memory(keys, 901, wait=True)
+        assert ok
+        # 第一轮执行期间的 5 次请求只补跑一轮，最后一次 wait=True 再跑一轮
+        assert 2 <= len(calls) <= 3
+
+    def test_fresh_keys_do_not_block_chat(self, monkeypatch):
+        from services import memory_sync as ms
+        monkeypatch.setattr(ms, "MEMORY_SYNC_ASYNC", True)
+        gate = threading.Event()
+        monkeypatch.setattr(ms, "_run_key", lambda key: gate.wait(5))
+        keys = [(ms.KIND_SINGLE, "c_fresh", "2026-10-01")]
+
+        gate.set()
+        assert ms.sync_memory(keys, 902, wait=True) == (True, None)
+
+        gate.clear()
+        t0 = time.time()
+        assert ms.sync_memory(keys, 902, wait=False) == (True, None)  # 刚同步过：不等待
+        assert time.time() - t0 < 1
+        assert ms.get_memory_sync_stats()["pending"] >= 1
+        gate.set()
+
+    def test_errors_are_reported_to_waiters(self, monkeypatch):
+        from services import memory_sync as ms
+        monkeypatch.setattr(ms, "MEMORY_SYNC_ASYNC", True)
+
+        def boom(key):
+            raise RuntimeError("summarize failed")
+
+        monkeypatch.setattr(ms, "_run_key", boom)
+        ok, err = ms.sync_memory([(ms.KIND_GROUP, "g_err", "2026-10-01")], 903, wait=False)
+        assert not ok and "summarize failed" in err
+
+    def test_busy_user_does_not_hold_workers(self, monkeypatch):
+        from services import memory_sync as ms
+        monkeypatch.setattr(ms, "MEMORY_SYNC_ASYNC", True)
+        gate = threading.Event()
+        running = []
+
+        def fake_run(key):
+            running.append(key)
+            if key[0] == 904:
+                gate.wait(5)
+
+        monkeypatch.setattr(ms, "_run_key", fake_run)
+        # 同一用户的单聊 + 两个群：一次只跑一个，其余在该用户自己的队列里等
+        for target in ("c_busy", "g_busy1", "g_busy2"):
+            ms.request_sync(904, ms.KIND_GROUP, target, "2026-10-01")
+        t0 = time.time()
+        ok, _ = ms.sync_memory([(ms.KIND_SINGLE, "c_other", "2026-10-01")], 905, wait=True)
+        assert ok and time.time() - t0 < 2
+        assert sum(1 for k in running if k[0] == 904) == 1
+        gate.set()
+
+    def test_idle_states_are_evicted(self, monkeypatch):
+        from services import memory_sync as ms
+        monkeypatch.setattr(ms, "MEMORY_SYNC_ASYNC", True)
+        monkeypatch.setattr(ms, "_run_key", lambda key: None)
+        assert ms.sync_memory([(ms.KIND_GROUP, "g_evict", "2026-09-01")], 906, wait=True) == (True, None)
+        key = (906, ms.KIND_GROUP, "g_evict", "2026-09-01")
+        assert key in ms._states
+        monkeypatch.setattr(ms, "_STATE_TTL", 0)
+        monkeypatch.setattr(ms, "_PRUNE_INTERVAL", 0)
+        time.sleep(0.01)
+        ms.request_sync(906, ms.KIND_GROUP, "g_evict_next", "2026-09-01")
+        assert key not in ms._states
+        assert ms.get_memory_sync_stats()["evicted"] >= 1
@@ -0,0 +1,84 @@
+"""测试 services/message_search.py：FTS5 trigram 聊天记录检索。"""
+
+import os
+import sys
+import sqlite3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _make_db(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.executemany("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+class TestMessageSearch:
+    def test_backfill_and_match_like_substring(self, tmp_path):
+        from services.message_search import search_messages_in_db
+        db = str(tmp_path / "chat.db")
+        _make_db(db, [
+            ("user", "明日は東京タワーに行きたい", "2026-01-01 10:00:00"),
+            ("c1", "我们一起去看樱花吧", "2026-01-02 10:00:00"),
+            ("c1", "東京タワーの夜景がきれいだった", "2026-01-03 10:00:00"),
+            ("user", "Let's watch the Football match", "2026-01-04 10:00:00"),
+        ])
+        rows = search_messages_in_db(db, "東京タワー")
+        assert [r["id"] for r in rows] == [3, 1]
+        assert "東京タワー" in rows[0]["snippet"]
+        assert [r["id"] for r in search_messages_in_db(db, "football")] == [4]
+        assert [r["id"] for r in search_messages_in_db(db, "樱花")] == [2]  # 两个字走 LIKE
+        assert [r["id"] for r in search_messages_in_db(db, "東京 夜景", match="all")] == [3]
+
+    def test_phrase_by_default_and_quoted_terms(self, tmp_path):
+        from services.message_search import search_messages_in_db
+        db = str(tmp_path / "chat.db")
+        _make_db(db, [
+            ("user", "see you at the train station", "2026-01-01 10:00:00"),
+            ("c1", "the station near the train yard", "2026-01-02 10:00:00"),
+        ])
+        # 默认与原来的 LIKE '%kw%' 一致：整个关键词是一个短语
+        assert [r["id"] for r in search_messages_in_db(db, "train station")] == [1]
+        assert [r["id"] for r in search_messages_in_db(db, "train station", match="all")] == [2, 1]
+        assert [r["id"] for r in search_messages_in_db(db, '"train station" you', match="all")] == [1]
+
+    def test_triggers_keep_index_in_sync(self, tmp_path):
+        from services.message_search import search_messages_in_db
+        from core.db import pooled_conn
+        db = str(tmp_path / "chat.db")
+        _make_db(db, [("user", "今天的晚饭是咖喱饭", "2026-01-01 19:00:00")])
+        assert len(search_messages_in_db(db, "咖喱饭")) == 1
+
+        with pooled_conn(db) as conn:
+            conn.execute("INSERT INTO messages (role, content, timestamp) VALUES ('c1', '咖喱饭做好了', '2026-01-01 19:30:00')")
+            conn.execute("UPDATE messages SET content = '今天的晚饭是拉面' WHERE id = 1")
+        assert [r["id"] for r in search_messages_in_db(db, "咖喱饭")] == [2]
+        with pooled_conn(db) as conn:
+            conn.execute("DELETE FROM messages WHERE id = 2")
+        assert search_messages_in_db(db, "咖喱饭") == []
+        assert [r["id"] for r in search_messages_in_db(db, "拉面")] == [1]
+
+    def test_pagination_and_rank_order(self, tmp_path):
+        from services.message_search import search_messages_in_db
+        db = str(tmp_path / "chat.db")
+        _make_db(db, [("user", f"第{i}次提到冰淇淋", f"2026-01-{i + 1:02d} 10:00:00") for i in range(8)])
+        first = search_messages_in_db(db, "冰淇淋", limit=3)
+        second = search_messages_in_db(db, "冰淇淋", limit=3, offset=3)
+        assert [r["id"] for r in first] == [8, 7, 6]
+        assert [r["id"] for r in second] == [5, 4, 3]
+        assert len(search_messages_in_db(db, "冰淇淋", limit=100, order="rank")) == 8
+
+    def test_no_limit_returns_all(self, tmp_path):
+        from services.message_search import search_messages_in_db
+        db = str(tmp_path / "chat.db")
+        _make_db(db, [("user", f"第{i}次提到冰淇淋", "2026-01-01 10:00:00") for i in range(260)])
+        assert len(search_messages_in_db(db, "冰淇淋")) == 260
@@ -0,0 +1,115 @@
+"""测试 services/moments_store.py：朋友圈 SQLite 存储与 JSON 迁移。"""
+
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _post(char_id, ts, content="", likers=None, comments=None):
+    return {"char_id": char_id, "timestamp": ts, "content": content,
+            "likers": likers or [], "comments": comments or []}
+
+
+class TestMomentsStore:
+    def _use_tmp_root(self, monkeypatch, tmp_path):
+        from services import moments_store
+        monkeypatch.setattr(moments_store, "USERS_ROOT", str(tmp_path))
+        return moments_store
+
+    def test_migrates_json_once(self, monkeypatch, tmp_path):
+        ms = self._use_tmp_root(monkeypatch, tmp_path)
+        cfg = tmp_path / "1" / "configs"
+        cfg.mkdir(parents=True)
+        legacy = [
+            {"char_id": "c1", "timestamp": "2026-01-01 10:00:00", "content": "旧帖", "liker_ids": ["c2"],
+             "comments": [{"commenter_id": "c2", "content": "好", "timestamp": "2026-01-01 10:05:00", "reply_to": "user"}],
+             "instruction": "写点什么"},
+            _post("user", "2026-01-02 09:00:00", "我的帖子", likers=[{"liker_id": "c1", "timestamp": "2026-01-02 09:01:00"}]),
+        ]
+        (cfg / "moments_data.json").write_text(json.dumps(legacy, ensure_ascii=False), encoding="utf-8")
+
+        posts = ms.iter_all_moments(user_id=1)
+        assert [p["content"] for p in posts] == ["旧帖", "我的帖子"]
+        assert posts[0]["liker_ids"] == ["c2"]
+        assert posts[0]["instruction"] == "写点什么"
+        assert posts[0]["comments"][0]["reply_to"] == "user"
+        assert posts[1]["likers"] == [{"liker_id": "c1", "timestamp": "2026-01-02 09:01:00"}]
+        assert not (cfg / "moments_data.json").exists()
+        assert (cfg / "moments_data.json.migrated").exists()
+
+    def test_pagination_order_and_filters(self, monkeypatch, tmp_path):
+        ms = self._use_tmp_root(monkeypatch, tmp_path)
+        for i in range(5):
+            ms.add_moment(_post("c1" if i % 2 else "c2", f"2026-01-0{i + 1} 12:00:00", f"p{i}"), user_id=2)
+        ms.add_moment(_post("c3", "2026-01-05 12:00:00", "同一时间后写入"), user_id=2)
+        assert ms.add_moment(_post("c3", "2026-01-05 12:00:00", "重复"), user_id=2) is None
+
+        first = ms.list_moments(user_id=2, limit=3)
+        assert [p["content"] for p in first] == ["p4", "同一时间后写入", "p3"]
+        rest = ms.list_moments(user_id=2, limit=10, before_id=first[-1]["id"])
+        assert [p["content"] for p in rest] == ["p2", "p1", "p0"]
+        assert [p["content"] for p in ms.list_moments(user_id=2, limit=3, offset=3)] == ["p2", "p1", "p0"]
+        assert [p["content"] for p in ms.list_moments(user_id=2, char_id="c1")] == ["p3", "p1"]
+
+    def test_visible_before_hides_future_reactions(self, monkeypatch, tmp_path):
+        ms = self._use_tmp_root(monkeypatch, tmp_path)
+        ms.add_moment(_post("c1", "2026-01-01 10:00:00", likers=[
+            {"liker_id": "c2", "timestamp": "2026-01-01 10:01:00"},
+            {"liker_id": "c3", "timestamp": "2026-01-01 18:00:00"},
+        ], comments=[
+            {"commenter_id": "c3", "content": "晚点到", "timestamp": "2026-01-01 18:00:00"},
+            {"commenter_id": "c2", "content": "先到", "timestamp": "2026-01-01 10:02:00"},
+        ]), user_id=3)
+        post = ms.list_moments(user_id=3, visible_before="2026-01-01 12:00:00")[0]
+        assert [l["liker_id"] for l in post["likers"]] == ["c2"]
+        assert [(c["content"], c["comment_index"]) for c in post["comments"]] == [("先到", 1)]
+
+    def test_visible_parses_timestamps_and_keeps_missing(self, monkeypatch, tmp_path):
+        ms = self._use_tmp_root(monkeypatch, tmp_path)
+        ms.add_moment(_post("c1", "2026-01-01 10:00:00", likers=[
+            {"liker_id": "c2", "timestamp": ""},
+            {"liker_id": "c3", "timestamp": "2026-1-1 9:05:00"},
+        ], comments=[
+            {"commenter_id": "c2", "content": "没有时间", "timestamp": ""},
+            {"commenter_id": "c3", "content": "非标准格式", "timestamp": "2026-1-1 9:05:00"},
+            {"commenter_id": "c4", "content": "非标准但未到", "timestamp": "2026-1-1 13:00:00"},
+        ]), user_id=3)
+        post = ms.list_moments(user_id=3, visible_before="2026-01-01 12:00:00")[0]
+        assert [l["liker_id"] for l in post["likers"]] == ["c2", "c3"]
+        assert [c["content"] for c in post["comments"]] == ["没有时间", "非标准格式"]
+
+    def test_future_likers_do_not_fall_back_to_liker_ids(self, monkeypatch, tmp_path):
+        ms = self._use_tmp_root(monkeypatch, tmp_path)
+        post = _post("c1", "2026-01-01 10:00:00", likers=[{"liker_id": "c3", "timestamp": "2026-01-01 18:00:00"}])
+        post["liker_ids"] = ["c2"]
+        ms.add_moment(post, user_id=3)
+        shown = ms.list_moments(user_id=3, visible_before="2026-01-01 12:00:00")[0]
+        assert shown["likers"] == []
+        assert "liker_ids" not in shown
+        # 不带 visible_before（整条读写）时两种字段都原样保留
+        full = ms.get_moment("c1", "2026-01-01 10:00:00", user_id=3)
+        assert full["liker_ids"] == ["c2"]
+        assert [l["liker_id"] for l in full["likers"]] == ["c3"]
+
+    def test_reactions_save_and_delete(self, monkeypatch, tmp_path):
+        ms = self._use_tmp_root(monkeypatch, tmp_path)
+        ms.add_moment(_post("c1", "2026-01-01 10:00:00", "原文"), user_id=4)
+        like = {"liker_id": "c2", "timestamp": "2026-01-01 10:01:00"}
+        assert ms.add_reactions("c1", "2026-01-01 10:00:00", likers=[like, like],
+                                comments=[{"commenter_id": "c2", "content": "赞", "timestamp": "2026-01-01 10:02:00"}], user_id=4)
+        assert not ms.add_reactions("c1", "2099-01-01 00:00:00", likers=[like], user_id=4)
+
+        post = ms.get_moment("c1", "2026-01-01 10:00:00", user_id=4)
+        assert len(post["likers"]) == 1 and post["comments"][0]["content"] == "赞"
+        post["content"] = "改过"
+        post["comments"].append({"commenter_id": "user", "content": "回复", "timestamp": "2026-01-01 10:03:00"})
+        assert ms.save_moment(post, user_id=4)
+        post = ms.get_moment("c1", "2026-01-01 10:00:00", user_id=4)
+        assert post["content"] == "改过" and [c["content"] for c in post["comments"]] == ["赞", "回复"]
+
+        assert ms.remove_like("c1", "2026-01-01 10:00:00", "c2", user_id=4) is True
+        assert ms.remove_like("c1", "2026-01-01 10:00:00", "c2", user_id=4) is False
+        assert ms.delete_moment("c1", "2026-01-01 10:00:00", user_id=4)
+        assert ms.get_moment("c1", "2026-01-01 10:00:00", user_id=4) is None
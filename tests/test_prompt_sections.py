@@ -0,0 +1,56 @@
+"""测试 build_system_prompt_v2 的分段并发组装。"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestRunSections:
+    def test_sections_overlap_and_keep_order(self, monkeypatch):
+        import services.prompt_builder as pb
+        monkeypatch.setattr(pb, "PROMPT_PARALLEL", True)
+
+        def slow(tag):
+            def provider(ctx):
+                time.sleep(0.2)
+                return [tag]
+            return provider
+
+        sections = [(f"s{i}", slow(f"part{i}")) for i in range(4)]
+        ctx = {"user_id": None}
+        t0 = time.perf_counter()
+        results = pb._run_sections(sections, ctx)
+        elapsed = time.perf_counter() - t0
+        assert [results[f"s{i}"] for i in range(4)] == [["part0"], ["part1"], ["part2"], ["part3"]]
+        assert elapsed < 0.6
+        assert set(ctx["timings"]) == {"s0", "s1", "s2", "s3"}
+
+    def test_user_context_and_errors(self, monkeypatch):
+        import services.prompt_builder as pb
+        from core.context import get_current_user_id
+        monkeypatch.setattr(pb, "PROMPT_PARALLEL", True)
+
+        def boom(ctx):
+            raise RuntimeError("bad file")
+
+        results = pb._run_sections([("uid", lambda ctx: [get_current_user_id()]), ("boom", boom)], {"user_id": 42})
+        assert results["uid"] == [42]
+        assert results["boom"] == []
+        assert get_current_user_id() != 42
+
+    def test_long_memory_runs_in_caller_thread(self, monkeypatch):
+        import threading
+        import services.prompt_builder as pb
+        monkeypatch.setattr(pb, "PROMPT_PARALLEL", True)
+
+        def where(ctx):
+            time.sleep(0.1)
+            return [threading.current_thread().name]
+
+        t0 = time.perf_counter()
+        results = pb._run_sections([("persona", where), ("long_memory", where), ("short_memory", where)], {"user_id": None})
+        assert results["long_memory"] == [threading.current_thread().name]
+        assert results["persona"][0].startswith("prompt-section")
+        assert time.perf_counter() - t0 < 0.25
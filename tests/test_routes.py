@@ -12,6 +12,8 @@ BLUEPRINT_ROUTES = {
     "admin": [
         "/admin/dashboard",
         "/api/admin/stats",
+        "/api/admin/http_stats",
+        "/api/admin/trace_stats",
         "/api/admin/refresh_stickers",
         "/api/admin/impersonate",
         "/api/admin/impersonation/status",
@@ -31,8 +33,10 @@ BLUEPRINT_ROUTES = {
     "chat": [
         "/api/<char_id>/mark_read",
         "/api/<char_id>/history",
+        "/api/<char_id>/history/v2",
         "/api/<char_id>/chat",
         "/api/<char_id>/chat_v2",
+        "/api/<char_id>/chat_stream",
         "/api/<char_id>/regenerate",
         "/api/<char_id>/messages/<int:msg_id>",
         "/api/<char_id>/chat_background",
@@ -62,6 +66,7 @@ BLUEPRINT_ROUTES = {
     ],
     "group": [
         "/api/group/<group_id>/history",
+        "/api/group/<group_id>/history/v2",
         "/api/group/<group_id>/chat",
         "/api/group/<group_id>/messages/<int:msg_id>",
         "/api/group/<group_id>/chat_background",
@@ -120,6 +125,9 @@ BLUEPRINT_ROUTES = {
         "/api/<char_id>/tts",
         "/api/<char_id>/tts_voice",
     ],
+    "events": [
+        "/api/events",
+    ],
     "moments": [
         "/moments",
         "/api/moments",
@@ -217,6 +225,10 @@ class TestRouteRegistration:
         for route in BLUEPRINT_ROUTES["media"]:
             assert self._rule_exists(route), f"Media route missing: {route}"
 
+    def test_events_routes(self):
+        for route in BLUEPRINT_ROUTES["events"]:
+            assert self._rule_exists(route), f"Events route missing: {route}"
+
     def test_moments_routes(self):
         for route in BLUEPRINT_ROUTES["moments"]:
             assert self._rule_exists(route), f"Moments route missing: {route}"
@@ -227,7 +239,7 @@ class TestRouteRegistration:
 
     def test_total_route_count(self):
         count = sum(1 for _ in self.app.url_map.iter_rules())
-        assert count == 201, f"Expected 201 routes, got {count}"
+        assert count == 208, f"Expected 208 routes, got {count}"
 
 
 class TestRouteEndpoints:
@@ -0,0 +1,119 @@
+"""测试 services/sticker_index.py：表情名称内存索引、批量解析与旧消息迁移。"""
+
+import os
+import sys
+import sqlite3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _fake_index(monkeypatch, si, official, uploads=None):
+    """official: [(名称, path)]，path 形如 official:包:文件；uploads: [(文件名, path)]。"""
+    calls = {"official": 0, "user": 0}
+
+    def load_official():
+        calls["official"] += 1
+        packs, stickers = [], {}
+        for name, path in official:
+            _, pack_id, filename = path.split(":", 2)
+            if pack_id not in stickers:
+                packs.append(pack_id)
+                stickers[pack_id] = []
+            stickers[pack_id].append({"path": path, "name": name, "url": f"https://cos/{pack_id}/{filename}"})
+        return si._OfficialCatalog(packs, stickers, {p: f"https://cos/{p}/cover.png" for p in packs})
+
+    def load_user(user_id):
+        calls["user"] += 1
+        return [si._user_sticker(filename, f"https://cos/u/{filename}") for filename, _ in (uploads or [])]
+
+    monkeypatch.setattr(si, "_official", {"catalog": si._OfficialCatalog(), "built_at": 0.0, "ok": False})
+    monkeypatch.setattr(si, "_user_indexes", {})
+    monkeypatch.setattr(si, "_refresher", object())  # 不启动后台刷新线程
+    monkeypatch.setattr(si, "_load_official_catalog", load_official)
+    monkeypatch.setattr(si, "_load_user_stickers", load_user)
+    return calls
+
+
+class TestStickerIndex:
+    def test_batch_resolves_each_name_once(self, monkeypatch):
+        from services import sticker_index as si
+        calls = _fake_index(
+            monkeypatch, si,
+            [("开心", "official:dog:开心.gif"), ("开心（1）", "official:dog:开心（1）.png"), ("晚安", "official:cat:晚安.gif")],
+            [("我的开心.png", "user:我的开心.png")],
+        )
+        lookups = []
+        real_find = si.find_sticker_paths
+        monkeypatch.setattr(si, "find_sticker_paths", lambda name, uid=None: lookups.append(name) or real_find(name, uid))
+
+        out = si.resolve_sticker_tags(["[表情]开心 / 你好", "[表情]晚安", "[表情]开心", "[表情]不存在"], user_id=7)
+
+        assert out[0].startswith("[表情]") and out[0].endswith(" / 你好")
+        assert out[0].split(" / ")[0][4:] in ("official:dog:开心.gif", "official:dog:开心（1）.png", "user:我的开心.png")
+        assert out[1] == "[表情]official:cat:晚安.gif"
+        assert out[3] == "[表情]不存在"
+        assert sorted(lookups) == ["不存在", "开心", "晚安"]
+        assert calls == {"official": 1, "user": 1}
+
+        # 已是 path 的标签不再查索引
+        assert si.resolve_sticker_content("[表情]user:我的开心.png", user_id=7) == "[表情]user:我的开心.png"
+        assert len(lookups) == 3
+
+    def test_invalidate_rebuilds_only_that_index(self, monkeypatch):
+        from services import sticker_index as si
+        calls = _fake_index(monkeypatch, si, [("晚安", "official:cat:晚安.gif")], [])
+        si.find_sticker_paths("晚安", 8)
+        si.find_sticker_paths("晚安", 8)
+        assert calls == {"official": 1, "user": 1}
+        si.invalidate_sticker_index(8)
+        si.find_sticker_paths("晚安", 8)
+        assert calls == {"official": 1, "user": 2}
+        si.refresh_sticker_catalog()
+        si.find_sticker_paths("晚安", 8)
+        assert calls == {"official": 2, "user": 2}
+
+    def test_catalog_listing_and_incremental_adds(self, monkeypatch):
+        from services import sticker_index as si
+        calls = _fake_index(monkeypatch, si, [
+            ("开心小狗", "official:dog:开心小狗.gif"), ("小狗晚安", "official:dog:小狗晚安.gif"), ("晚安", "official:cat:晚安.gif"),
+        ], [])
+        assert si.list_official_packs() == ["dog", "cat"]
+        assert [s["name"] for s in si.list_pack_stickers("dog")] == ["开心小狗", "小狗晚安"]
+        assert si.get_pack_cover("cat") == "https://cos/cat/cover.png"
+        assert [s["path"] for s in si.search_stickers("小狗", user_id="")] == ["official:dog:开心小狗.gif", "official:dog:小狗晚安.gif"]
+        assert [s["pack_name"] for s in si.search_stickers("安", user_id="")] == ["dog", "cat"]
+        assert si.search_stickers("狗开", user_id="") == []
+        assert len(si.search_stickers("", user_id="")) == 3
+
+        si.add_official_sticker("bear", "cover.png", "https://cos/bear/cover.png")
+        si.add_official_sticker("bear", "熊晚安.png", "https://cos/bear/熊晚安.png")
+        assert "bear" in si.list_official_packs()
+        assert si.get_pack_cover("bear") == "https://cos/bear/cover.png"
+        assert si.list_pack_stickers("bear") == [{"path": "official:bear:熊晚安.png", "name": "熊晚安", "url": "https://cos/bear/熊晚安.png"}]
+
+        si.search_stickers("晚安", user_id=9)
+        si.add_user_sticker(9, "我的晚安.png", "https://cos/u/我的晚安.png")
+        found = si.search_stickers("晚安", user_id=9)
+        assert found[-1]["path"] == "user:我的晚安.png" and found[-1]["pack_name"] == "个人上传"
+        assert calls == {"official": 1, "user": 1}
+
+    def test_normalize_sticker_rows(self, monkeypatch, tmp_path):
+        from services import sticker_index as si
+        _fake_index(monkeypatch, si, [("晚安", "official:cat:晚安.gif")])
+        db_path = str(tmp_path / "chat.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY, role TEXT, content TEXT, timestamp TEXT)")
+        conn.executemany("INSERT INTO messages (role, content, timestamp) VALUES (?, ?, ?)", [
+            ("assistant", "[表情]晚安", "2026-10-01 22:00:00"),
+            ("assistant", "[表情]official:cat:晚安.gif", "2026-10-01 22:00:01"),
+            ("user", "普通消息", "2026-10-01 22:00:02"),
+        ])
+        conn.commit()
+        conn.close()
+
+        assert si.normalize_sticker_rows(db_path, user_id="") == 1
+        assert si.normalize_sticker_rows(db_path, user_id="") == 0
+        conn = sqlite3.connect(db_path)
+        contents = [r[0] for r in conn.execute("SELECT content FROM messages ORDER BY id")]
+        conn.close()
+        assert contents[:2] == ["[表情]official:cat:晚安.gif"] * 2
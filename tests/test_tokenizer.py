@@ -0,0 +1,39 @@
+"""测试 services/tokenizer.py 中的分词器单例与关键词缓存。"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestTokenizerService:
+    def test_janome_singleton(self):
+        from services.tokenizer import get_janome_tokenizer
+        assert get_janome_tokenizer() is get_janome_tokenizer()
+
+    def test_janome_keywords(self):
+        from services.prompt_builder import _extract_keywords_janome
+        freq = _extract_keywords_janome("東京の図書館で勉強した", set(), nouns_only=True)
+        assert "図書館" in freq
+
+    def test_jieba_keywords(self):
+        from services.prompt_builder import _extract_keywords_jieba
+        freq = _extract_keywords_jieba("我们昨天去图书馆学习", set(), nouns_only=True)
+        assert "图书馆" in freq
+
+    def test_cache_hit_and_copy(self):
+        from services.tokenizer import cached_keywords, clear_keyword_cache, get_keyword_cache_stats
+        clear_keyword_cache()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return {"a": 1}
+
+        r1 = cached_keywords("x", "text", {"s"}, 8, True, compute)
+        r1["b"] = 2
+        r2 = cached_keywords("x", "text", {"s"}, 8, True, compute)
+        assert len(calls) == 1
+        assert r2 == {"a": 1}
+        assert get_keyword_cache_stats()["hits"] == 1
+        clear_keyword_cache()
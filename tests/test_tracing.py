@@ -0,0 +1,75 @@
+"""测试 core/tracing.py：span 嵌套与属性、跨线程记录、缓存命中统计以及 Server-Timing 响应头。"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestTracing:
+    def test_spans_nest_and_aggregate(self):
+        from core import tracing
+        tracing.reset_trace_stats()
+
+        @tracing.traced("test.llm", attrs=lambda a, kw: {"prompt_chars": len(a[0])})
+        def fake_llm(prompt):
+            tracing.annotate(prompt_tokens=7)
+            return "ok"
+
+        trace = tracing.start_trace("POST test")
+        with tracing.span("test.build"):
+            fake_llm("hello")
+        tracing.record_cache("test_cache", True)
+        tracing.record_cache("test_cache", False)
+        assert tracing.finish_trace() is trace
+        assert tracing.current_trace() is None
+
+        spans = {s["name"]: s for s in trace.spans}
+        assert spans["test.llm"]["parent"] == "test.build"
+        assert spans["test.llm"]["attrs"] == {"prompt_chars": 5, "prompt_tokens": 7}
+        assert spans["test.build"]["parent"] is None
+
+        stats = tracing.get_trace_stats()
+        assert stats["stages"]["test.llm"]["count"] == 1
+        assert stats["stages"]["test.llm"]["avg_prompt_tokens"] == 7
+        assert stats["caches"]["test_cache"] == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+        assert stats["endpoints"]["POST test"]["count"] == 1
+        assert stats["recent"][0]["id"] == trace.id
+
+    def test_worker_thread_spans_join_request_trace(self):
+        import contextvars
+        from concurrent.futures import ThreadPoolExecutor
+        from core import tracing
+        trace = tracing.start_trace("GET worker")
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futs = [pool.submit(contextvars.copy_context().run, tracing.record_span, f"test.section.{i}", 1.0)
+                    for i in range(2)]
+            for f in futs:
+                f.result()
+        tracing.finish_trace()
+        assert sorted(s["name"] for s in trace.spans) == ["test.section.0", "test.section.1"]
+
+    def test_server_timing_header_in_debug(self):
+        from flask import Flask
+        from core import tracing
+        app = Flask(__name__)
+        app.debug = True
+        tracing.install_request_tracing(app)
+
+        @app.route("/api/ping")
+        def ping():
+            with tracing.span("test.stage"):
+                tracing.record_cache("json_config", True)
+            return "pong"
+
+        @app.route("/plain")
+        def plain():
+            return "plain"
+
+        client = app.test_client()
+        resp = client.get("/api/ping")
+        header = resp.headers["Server-Timing"]
+        assert "test.stage;dur=" in header and "total;dur=" in header
+        assert 'cache_json_config;desc="1/1"' in header
+        assert resp.headers["X-Trace-Id"]
+        assert "Server-Timing" not in client.get("/plain").headers
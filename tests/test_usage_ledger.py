@@ -0,0 +1,49 @@
+"""测试 services/usage_ledger.py：token 用量批量落库、汇总与旧 JSON 导入。"""
+
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestUsageLedger:
+    def _use_tmp_db(self, monkeypatch, tmp_path):
+        from services import usage_ledger
+        monkeypatch.setattr(usage_ledger, "USAGE_DB", str(tmp_path / "usage.db"))
+        monkeypatch.setattr(usage_ledger, "USERS_ROOT", str(tmp_path / "users"))
+        return usage_ledger
+
+    def test_record_and_recent(self, monkeypatch, tmp_path):
+        ul = self._use_tmp_db(monkeypatch, tmp_path)
+        ul.record_usage(11, "c1", "gpt-4o", 100, 20, 120, task="chat")
+        ul.record_usage(11, "system", "gemini-2.5-flash", 500, 50, 550, task="summary")
+        ul.record_usage(12, "c9", "gpt-4o", 1, 1, 2)
+        rows = ul.recent_usage(11)
+        assert [r["total"] for r in rows] == [550, 120]
+        assert rows[0]["task"] == "summary" and len(rows[0]["time"]) == len("10-18 12:00:00")
+        assert len(ul.recent_usage(12)) == 1
+
+    def test_rollups(self, monkeypatch, tmp_path):
+        ul = self._use_tmp_db(monkeypatch, tmp_path)
+        for char_id, model, task, total in [
+            ("c1", "gpt-4o", "chat", 100), ("c1", "gpt-4o", "moments", 300),
+            ("c2", "gpt-4o-mini", "chat", 50), ("system", "gpt-4o-mini", "summary", 1000),
+        ]:
+            ul.record_usage(13, char_id, model, total, 0, total, task=task)
+        by_char = ul.usage_rollup(13, "char")
+        assert [(r["key"], r["total"], r["calls"]) for r in by_char["rows"]] == [("system", 1000, 1), ("c1", 400, 2), ("c2", 50, 1)]
+        assert by_char["totals"]["total"] == 1450
+        assert {r["key"]: r["total"] for r in ul.usage_rollup(13, "task")["rows"]} == {"summary": 1000, "moments": 300, "chat": 150}
+        assert [r["key"] for r in ul.usage_rollup(13, "model")["rows"]] == ["gpt-4o-mini", "gpt-4o"]
+        assert len(ul.usage_rollup(13, "day")["rows"]) == 1
+
+    def test_imports_legacy_json(self, monkeypatch, tmp_path):
+        ul = self._use_tmp_db(monkeypatch, tmp_path)
+        log_dir = tmp_path / "users" / "14" / "logs"
+        log_dir.mkdir(parents=True)
+        legacy = [{"time": "01-02 03:04:05", "char_id": "c1", "model": "m", "input": 1, "output": 2, "total": 3}]
+        (log_dir / "usage_history.json").write_text(json.dumps(legacy), encoding="utf-8")
+        rows = ul.recent_usage(14)
+        assert rows[0]["time"] == "01-02 03:04:05" and rows[0]["total"] == 3
+        assert (log_dir / "usage_history.json.migrated").exists()
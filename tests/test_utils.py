@@ -36,6 +36,17 @@ class TestFurigana:
         assert "[表情]开心" in result
 
 
+    def test_cached_and_batch(self):
+        from core.utils import _add_furigana_to_japanese, add_furigana_batch, get_furigana_cache_stats
+        text = "今日は東京で雨が降った"
+        first = _add_furigana_to_japanese(text)
+        assert "<ruby>" in first
+        hits = get_furigana_cache_stats()["hits"]
+        assert _add_furigana_to_japanese(text) == first
+        assert get_furigana_cache_stats()["hits"] == hits + 1
+        assert add_furigana_batch([text, "", text]) == [first, "", first]
+
+
 class TestCalcDistance:
     def test_same_point(self):
         from core.utils import calc_distance
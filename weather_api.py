@@ -1,9 +1,10 @@
 import json
 import os
 import time as time_module
-import requests
 from datetime import datetime
 
+from core.http_client import http_get
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 WEATHER_CACHE_FILE = os.path.join(BASE_DIR, "configs", "weather_cache.json")
 GEOCODE_CACHE_FILE = os.path.join(BASE_DIR, "configs", "geocode_cache.json")
@@ -76,7 +77,7 @@ def fetch_weather(lat, lon):
         "forecast_days": 1,
     }
     try:
-        resp = requests.get(url, params=params, timeout=10)
+        resp = http_get(url, route="weather", params=params)
         resp.raise_for_status()
         data = resp.json()
         current = data.get("current", {})
@@ -154,7 +155,7 @@ def geocode(city, country=None):
     params = {"q": query, "format": "json", "limit": 1}
     headers = {"User-Agent": "KunigamiChat/1.0"}
     try:
-        resp = requests.get(url, params=params, headers=headers, timeout=10)
+        resp = http_get(url, route="geocode", params=params, headers=headers)
         resp.raise_for_status()
         data = resp.json()
         if data: